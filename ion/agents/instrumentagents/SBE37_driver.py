@@ -18,7 +18,7 @@ from twisted.internet.error import ConnectError
 import ion.util.ionlog
 import ion.util.procutils as pu
 from ion.core.process.process import ProcessFactory
-from ion.agents.instrumentagents.instrument_connection import InstrumentConnection
+from ion.agents.instrumentagents.instrument_connection import LineConnection
 from ion.agents.instrumentagents.instrument_driver import InstrumentDriver
 from ion.agents.instrumentagents.instrument_driver import InstrumentDriverClient
 from ion.agents.instrumentagents.instrument_fsm import InstrumentFSM
@@ -207,6 +207,40 @@ class DeviceIOParser:
             return self.getval(match)
         else:
             return None
+
+
+class DeviceIOParserDispatch:
+    """
+    A class for finding which of a set of DeviceIOParsers matches a line of
+    device output with one regular expression, rather than trying each
+    parser in turn. The expression alternates the parser patterns, each in a
+    named group, with their own groups made non-capturing.
+    """
+    def __init__(self,parsers):
+        """
+        @param parsers a list of (key,DeviceIOParser) pairs.
+        """
+        self.keys = []
+        alternatives = []
+        for (key,parser) in parsers:
+            alternatives.append('(?P<p%i>%s)' % (len(self.keys),
+                                self._non_capturing(parser.pattern)))
+            self.keys.append(key)
+        self.regex = re.compile('|'.join(alternatives))
+
+    @staticmethod
+    def _non_capturing(pattern):
+        return re.sub(r'(?<!\\)\((?!\?)','(?:',pattern)
+
+    def match(self,line):
+        """
+        @retval The key of the parser matching the line, or None.
+        """
+        match = self.regex.match(line)
+        if match:
+            return self.keys[int(match.lastgroup[1:])]
+        else:
+            return None
         
     
 ###############################################################################
@@ -253,18 +287,18 @@ class SBE37Driver(InstrumentDriver):
         """
         self._instrument_connection = None
                 
-        """
-        A string holding incomming line fragment not yet terminated by a
-        newline.
-        """
-        self._line_buffer = ''
-
         """
         The queue holding completed line strings for processing by state
         handlers. This holds command responses and may be of variable length
         depending on the command and state.
         """
         self._data_lines = []
+
+        """
+        The number of lines at the start of the data line queue already
+        scanned for samples.
+        """
+        self._sample_scan_pos = 0
                 
         """
         A queue of samples collected and parsed form the output buffer
@@ -639,6 +673,13 @@ class SBE37Driver(InstrumentDriver):
                     self._float_to_string)
                 }
         }
+
+        """
+        A single regular expression finding the parameter, if any, of a line
+        of device status output.
+        """
+        self._param_dispatch = DeviceIOParserDispatch(
+            [(key,val['parser']) for (key,val) in self.parameters.iteritems()])
         
         """
         Instrument state handlers
@@ -687,7 +728,8 @@ class SBE37Driver(InstrumentDriver):
             # Announce the state change to agent.                        
             content = {'type':DriverAnnouncement.STATE_CHANGE,
                        'transducer':SBE37Channel.INSTRUMENT,
-                       'value':SBE37State.UNCONFIGURED}
+                       'value':SBE37State.UNCONFIGURED,
+                       'observatory_state':self._get_observatory_state()}
             yield self.send(self.proc_supid,'driver_event_occurred',content)
             
             # Initialize driver configuration.
@@ -737,7 +779,8 @@ class SBE37Driver(InstrumentDriver):
             # Announce the state change to agent.            
             content = {'type':DriverAnnouncement.STATE_CHANGE,
                        'transducer':SBE37Channel.INSTRUMENT,
-                       'value':SBE37State.DISCONNECTED}
+                       'value':SBE37State.DISCONNECTED,
+                       'observatory_state':self._get_observatory_state()}
             yield self.send(self.proc_supid,'driver_event_occurred',content)
             
         elif event == SBE37Event.EXIT:
@@ -787,11 +830,14 @@ class SBE37Driver(InstrumentDriver):
             # Announce the state change to agent.            
             content = {'type':DriverAnnouncement.STATE_CHANGE,
                        'transducer':SBE37Channel.INSTRUMENT,
-                       'value':SBE37State.CONNECTING}
+                       'value':SBE37State.CONNECTING,
+                       'observatory_state':self._get_observatory_state()}
             yield self.send(self.proc_supid,'driver_event_occurred',content)
 
             # Attempt to set up a tcp connection to the serial server.
-            cc = ClientCreator(reactor, InstrumentConnection, self)
+            cc = ClientCreator(reactor, LineConnection, self,
+                               SBE37Prompt.NEWLINE,
+                               (SBE37Prompt.BAD_COMMAND, SBE37Prompt.PROMPT))
             try:
                 self._instrument_connection = yield cc.connectTCP(self._ipaddr,
                                                           int(self._ipport))
@@ -802,6 +848,8 @@ class SBE37Driver(InstrumentDriver):
 
             else:
                 self._instrument_connection.transport.setTcpNoDelay(True)
+                if IO_LOG:
+                    self._instrument_connection.logfile = self._logfile
 
 
         elif event == SBE37Event.EXIT:
@@ -846,7 +894,8 @@ class SBE37Driver(InstrumentDriver):
             # Announce the state change to agent.            
             content = {'type':DriverAnnouncement.STATE_CHANGE,
                        'transducer':SBE37Channel.INSTRUMENT,
-                       'value':SBE37State.DISCONNECTED}
+                       'value':SBE37State.DISCONNECTED,
+                       'observatory_state':self._get_observatory_state()}
             yield self.send(self.proc_supid,'driver_event_occurred',content)
             
             # Drop the driver connection.
@@ -900,7 +949,8 @@ class SBE37Driver(InstrumentDriver):
             # Announce the state change to agent.            
             content = {'type':DriverAnnouncement.STATE_CHANGE,
                        'transducer':SBE37Channel.INSTRUMENT,
-                       'value':SBE37State.CONNECTED}
+                       'value':SBE37State.CONNECTED,
+                       'observatory_state':self._get_observatory_state()}
             yield self.send(self.proc_supid,'driver_event_occurred',content)            
             
         elif event == SBE37Event.EXIT:
@@ -1011,11 +1061,12 @@ class SBE37Driver(InstrumentDriver):
             # Announce the state change to agent.            
             content = {'type':DriverAnnouncement.STATE_CHANGE,
                        'transducer':SBE37Channel.INSTRUMENT,
-                       'value':SBE37State.AUTOSAMPLE}
+                       'value':SBE37State.AUTOSAMPLE,
+                       'observatory_state':self._get_observatory_state()}
             yield self.send(self.proc_supid,'driver_event_occurred',content)                                    
 
             # Clear data lines and sample buffer.
-            self._data_lines = []
+            self._clear_data_lines()
             self._sample_buffer = []
             
             # Get the prompt and send start command without waiting for
@@ -1026,7 +1077,7 @@ class SBE37Driver(InstrumentDriver):
         elif event == SBE37Event.EXIT:            
 
             # Clear data lines and sample buffer.
-            self._data_lines = []
+            self._clear_data_lines()
             self._sample_buffer = []
                   
         elif event == SBE37Event.STOP_AUTOSAMPLE:
@@ -1167,72 +1218,36 @@ class SBE37Driver(InstrumentDriver):
 
 
     @defer.inlineCallbacks
-    def gotData(self, dataFrag):
+    def gotLines(self, lines, prompt):
         """
-        Called by the twisted framework when a data fragment is received.
-        Update line and data buffers. Send EVENT_DATA_RECEIVED and
-        EVENT_PROMPTED if a prompt is detected.
-        @param dataFrag a string data fragment received.
+        Called by the instrument connection with the lines completed by a
+        received data fragment. Update the data buffer. Send
+        EVENT_DATA_RECEIVED and fire the prompt deferreds if a prompt is
+        detected.
+        @param lines a list of the complete lines received.
+        @param prompt the prompt the output ends with or None.
         """
         
         yield
         
-        # Write the fragment to the IO log if it is enabled.
-        if IO_LOG:
-            self._logfile.write(dataFrag)
-
-        # Add the fragment to the line buffer.
-        self._line_buffer += dataFrag
-
-        new_lines = False
-   
-        # If the line buffer has newlines, extract complete lines and add
-        # to the data buffer. Keep the tail fragment if any in the line buffer
-        # to append further incomming data to.
-        if SBE37Prompt.NEWLINE in self._line_buffer:
-            lines = self._line_buffer.split(SBE37Prompt.NEWLINE)
-            self._line_buffer = lines[-1]
-            self._data_lines += lines[0:-1]
-            new_lines = True
-
-        # If the linebuffer ends with a prompt, extract and append the
-        # prefix data to the data buffer. Keep the prompt in the line buffer.
-        if self._line_buffer.endswith(SBE37Prompt.PROMPT):
-            self._data_lines.append(self._line_buffer.replace(SBE37Prompt.PROMPT,''))
-            self._line_buffer = SBE37Prompt.PROMPT
-            new_lines = True
-
-        # If the line buffer ends with a bad command prompt, extract and
-        # append the prefix data to the data buffer. Keep the prompt in the
-        # line buffer.
-        elif self._line_buffer.endswith(SBE37Prompt.BAD_COMMAND):
-            self._data_lines.append(self._line_buffer.
-                                    replace(SBE37Prompt.BAD_COMMAND,''))
-            self._line_buffer = SBE37Prompt.BAD_COMMAND
-            new_lines = True
+        # Add the complete lines to the data buffer.
+        if lines:
+            self._data_lines.extend(lines)
 
         # If new complete lines are detected, send an EVENT_DATA_RECEIVED.
-        if new_lines and self._fsm.get_current_state() == SBE37State.AUTOSAMPLE:
+        if lines and self._fsm.get_current_state() == SBE37State.AUTOSAMPLE:
             yield self._fsm.on_event_async(SBE37Event.DATA_RECEIVED)
         
         # If a normal or bad command prompt is detected, send an
         # EVENT_PROMPTED
-        if self._line_buffer == SBE37Prompt.PROMPT:
+        if prompt == SBE37Prompt.PROMPT or prompt == SBE37Prompt.BAD_COMMAND:
             if self._prompt_acquired_deferred:
                 d,self._prompt_acquired_deferred = \
                                     self._prompt_acquired_deferred, None
                 self._stop_wakeup()
-                d.callback(SBE37Prompt.PROMPT)
-            
-        elif self._line_buffer == SBE37Prompt.BAD_COMMAND:
-            if self._prompt_acquired_deferred:
-                d,self._prompt_acquired_deferred = \
-                                    self._prompt_acquired_deferred, None
-                self._stop_wakeup()
-                d.callback(SBE37Prompt.BAD_COMMAND)
+                d.callback(prompt)
         
-        elif self._line_buffer == '' and len(self._data_lines)>0 and \
-            self._data_lines[-1] == SBE37Prompt.PROMPT:
+        elif prompt == SBE37Prompt.STOP_AUTOSAMPLE:
             if self._autosample_prompt_acquired_deferred:
                 d,self._autosample_prompt_acquired_deferred = \
                                     self._autosample_prompt_acquired_deferred, None
@@ -2137,7 +2152,7 @@ class SBE37Driver(InstrumentDriver):
         reply = {'success':None,'result':None}        
 
         # Clear data lines.
-        self._data_lines = []
+        self._clear_data_lines()
         
         # Acquire prompt.
         yield self._get_prompt()
@@ -2156,7 +2171,7 @@ class SBE37Driver(InstrumentDriver):
             reply['result'] = samples
         
         # Clear data lines.    
-        self._data_lines = []
+        self._clear_data_lines()
         
         defer.returnValue(reply)
         
@@ -2170,7 +2185,7 @@ class SBE37Driver(InstrumentDriver):
         self._debug_print('updating parameters')
         
         # Clear data lines.
-        self._data_lines = []
+        self._clear_data_lines()
         
         # Get prompt, issue device status command, issue device calibration
         # status command. Await prompt for each.
@@ -2183,7 +2198,7 @@ class SBE37Driver(InstrumentDriver):
         self._read_param_values(self._data_lines)
         
         # Clear data lines.
-        self._data_lines = []
+        self._clear_data_lines()
         
         defer.returnValue(None)
 
@@ -2309,6 +2324,13 @@ class SBE37Driver(InstrumentDriver):
     ###########################################################################        
 
         
+    def _clear_data_lines(self):
+        """
+        Empty the data line queue.
+        """
+        self._data_lines = []
+        self._sample_scan_pos = 0
+
     def _parse_sample_output(self):
         """
         Parse data buffer and extract all sample output lines. Remove
@@ -2317,14 +2339,21 @@ class SBE37Driver(InstrumentDriver):
         @retval A list of data sample dictionaries.
         """
         samples = []
-        new_data_lines = []
-        for line in self._data_lines:
-            sample_data = self._sample_parser.parse(line)
+
+        # Only the lines received since the last call need to be scanned.
+        pos = self._sample_scan_pos
+        if pos == len(self._data_lines):
+            return samples
+        new_data_lines = self._data_lines[:pos]
+        parse = self._sample_parser.parse
+        for line in self._data_lines[pos:]:
+            sample_data = parse(line)
             if sample_data != None:
                 samples.append(sample_data)
             else:
                 new_data_lines.append(line)
         self._data_lines = new_data_lines
+        self._sample_scan_pos = len(new_data_lines)
         
         return samples
 
@@ -2338,13 +2367,18 @@ class SBE37Driver(InstrumentDriver):
         
         self._debug_print('reading parameter values')
 
-        for (key,val) in self.parameters.iteritems():
-            parser = val['parser']
-            new_val = None
-            for line in lines:
-                new_val = parser.parse(line)
+        # Find the parameter of each line with the dispatch parser, keeping
+        # the first value found for each parameter.
+        new_vals = {}
+        for line in lines:
+            key = self._param_dispatch.match(line)
+            if key != None and key not in new_vals:
+                new_val = self.parameters[key]['parser'].parse(line)
                 if new_val != None:
-                    break
+                    new_vals[key] = new_val
+
+        for (key,val) in self.parameters.iteritems():
+            new_val = new_vals.get(key,None)
             if new_val != None:
                 val['value'] = new_val
             else:
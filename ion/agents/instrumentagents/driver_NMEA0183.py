@@ -13,6 +13,7 @@ import ion.util.ionlog
 from ion.core.process.process import ProcessFactory
 from ion.agents.instrumentagents.instrument_driver import InstrumentDriver
 from ion.agents.instrumentagents.instrument_driver import InstrumentDriverClient
+from ion.agents.instrumentagents.instrument_connection import LineConnection
 from ion.agents.instrumentagents.instrument_fsm import InstrumentFSM
 from ion.agents.instrumentagents.instrument_constants \
     import DriverCommand, DriverCapability, DriverStatus,\
@@ -27,7 +28,6 @@ from ion.core.exception import ApplicationError
 import ion.util.procutils as pu
 import ion.agents.instrumentagents.helper_NMEA0183 as NMEA
 
-from twisted.protocols import basic
 from twisted.internet.serialport import SerialPort
 from serial import PARITY_NONE, PARITY_EVEN, PARITY_ODD
 from serial import STOPBITS_ONE, STOPBITS_TWO
@@ -1667,32 +1667,31 @@ class NMEADeviceDriver(InstrumentDriver):
                 self._data_lines.append(nmeaLine)
             yield self.fsm.on_event_async(NMEADeviceEvent.DATA_RECEIVED)
             
-class NMEA0183Protocol(basic.LineReceiver):
+class NMEA0183Protocol(LineConnection):
+    """
+    Frames the NMEA sentences read from the serial port with the line
+    framing shared with the other instrument drivers. NMEA devices have no
+    prompt.
+    """
 
     def __init__(self, parent):
-        self.parent = parent
+        LineConnection.__init__(self, parent, '\r\n')
 
-    def lineReceived(self, data):
-        """
-        Called by the twisted framework when a serial line is received.
-        Override of basic.LineReceiver method.
-        Takes serial line from serial port and sends it through
-        the parsing pipeline.
-        Sends EVENT_DATA_RECEIVED if a good NMEA line came in.
-        """
-        if len(data) > 1:
-            self.parent.gotData(data)
-        #nmeaLine = NMEA.NMEAString(data)
-        #lineStatus = nmeaLine.IsValid()
+    def connectionMade(self):
+        pass
 
-        #if NMEA.NMEAErrorCode.is_ok(lineStatus):
+    def connectionLost(self, reason):
+        pass
 
-            # If a valid sentence was received:
-            #       - Store the sentence
-            #       - send a data received event
-            #NMEADeviceDriver._data_lines.insert(0, nmeaLine)
-            #NMEADeviceDriver.fsm.on_event_async(NMEADeviceEvent.DATA_RECEIVED)
-            #log.debug("NMEA received: %s", nmeaLine)
+    def linesReceived(self, lines, prompt):
+        """
+        Called by the line framing with the serial lines received.
+        Sends each line through the parsing pipeline, which sends
+        EVENT_DATA_RECEIVED if a good NMEA line came in.
+        """
+        for data in lines:
+            if len(data) > 1:
+                self.parent.gotData(data)
 
 class NMEADeviceDriverClient(InstrumentDriverClient):
     """
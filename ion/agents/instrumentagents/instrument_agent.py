@@ -19,6 +19,8 @@ except:
 
 import ion.util.procutils as pu
 import ion.util.ionlog
+from ion.core import ioninit
+from ion.core.messaging.serialization import encode_data_block
 from ion.core.process.process import Process
 from ion.core.process.process import ProcessClient
 from ion.core.process.process import ProcessFactory
@@ -36,6 +38,7 @@ from ion.agents.instrumentagents.instrument_constants import AgentParameter, \
     AgentEvent, AgentStatus, ObservatoryCapability
 
 log = ion.util.ionlog.getLogger(__name__)
+CONF = ioninit.config(__name__)
 
 DEBUG_PRINT = True if os.environ.get('DEBUG_PRINT',None) == 'True' else False
 
@@ -259,6 +262,25 @@ class InstrumentAgent(Process):
         """
         self._data_buffer_limit = 0
 
+        """
+        The number of seconds a sample may wait in the data buffer before
+        the buffer is published, whatever its size. Zero disables the limit.
+        """
+        self._data_buffer_time_limit = 0
+
+        """
+        A twisted delayed function call that publishes the data buffer when
+        its time limit runs out.
+        """
+        self._data_buffer_flush_call = None
+
+        """
+        The observatory state of the driver, tracked from the state change
+        announcements of drivers that include it. None when unknown, in which
+        case the driver is asked for it on each data received announcement.
+        """
+        self._observatory_state = None
+
         """
         A dict of device capabilities that is read from the driver upon
         driver construction. The dict persists whether we are connected to
@@ -1257,6 +1279,11 @@ class InstrumentAgent(Process):
                     result[AgentParameter.BUFFER_SIZE] = \
                         (InstErrorCode.OK, self._data_buffer_limit)
 
+                if arg == AgentParameter.BUFFER_TIME or \
+                    arg == AgentParameter.ALL:
+                    result[AgentParameter.BUFFER_TIME] = \
+                        (InstErrorCode.OK, self._data_buffer_time_limit)
+
         # Unknown error.
         except:
             success = InstErrorCode.UNKNOWN_ERROR
@@ -1447,6 +1474,16 @@ class InstrumentAgent(Process):
                         set_errors = True
                         result[arg] = InstErrorCode.INVALID_PARAM_VALUE
 
+                elif arg == AgentParameter.BUFFER_TIME:
+                    if isinstance(val, (int, float)) and val >= 0:
+                        self._data_buffer_time_limit = val
+                        result[arg] = InstErrorCode.OK
+                        set_successes = True
+
+                    else:
+                        set_errors = True
+                        result[arg] = InstErrorCode.INVALID_PARAM_VALUE
+
         # Unknown error.
         except:
             success = InstErrorCode.UNKNOWN_ERROR
@@ -2384,34 +2421,46 @@ class InstrumentAgent(Process):
             # other than these events.
             self._prev_data_transducer = transducer
 
-            # Get the driver observatory state.
-            key = (DriverChannel.INSTRUMENT, DriverStatus.OBSERVATORY_STATE)
-            reply = yield self._driver_client.get_status([key])
-            success = reply['success']
-            result = reply['result']
-            obs_status = result.get(key, None)
-            json_val = None
+            # Get the driver observatory state. It is known without asking
+            # the driver if the driver announces it with its state changes.
+            obs_state = self._observatory_state
+            if obs_state == None:
+                key = (DriverChannel.INSTRUMENT, DriverStatus.OBSERVATORY_STATE)
+                reply = yield self._driver_client.get_status([key])
+                success = reply['success']
+                result = reply['result']
+                obs_status = result.get(key, None)
+                if InstErrorCode.is_ok(success) and obs_status != None:
+                    obs_state = obs_status[1]
+            samples = None
 
             # If in streaming mode, buffer data and publish at intervals.
-            if InstErrorCode.is_ok(success) and obs_status != None:
-                if obs_status[1] == ObservatoryState.STREAMING:
+            if obs_state != None:
+                if obs_state == ObservatoryState.STREAMING:
                     self._data_buffer.append(value)
                     if len(self._data_buffer) > self._data_buffer_limit:
                         # strval = self._get_data_string(self._data_buffer)
-                        json_val = json.dumps(self._data_buffer)
-                        self._data_buffer = []
+                        samples = self._take_data_buffer()
+
+                    # Publish the buffer after the time limit even if no
+                    # more data arrives.
+                    elif self._data_buffer_time_limit > 0 and \
+                        self._data_buffer_flush_call == None:
+                        self._data_buffer_flush_call = reactor.callLater(
+                            self._data_buffer_time_limit,
+                            self._data_buffer_timeout)
 
                 # If not in streaming mode, always publish data upon receipt.
                 else:
                     #strval = self._get_data_string(value)
-                    json_val = json.dumps([value])
+                    samples = [value]
 
             #if len(strval) > 0:
-            if json_val != None:
+            if samples != None:
                 origin = "%s.%s" % (transducer, self.event_publisher_origin)
-                log.debug("Instrument Agent publishing data: %s on origin: %s", json_val, origin)
+                log.debug("Instrument Agent publishing %i samples on origin: %s", len(samples), origin)
                 yield self._data_publisher.create_and_publish_event(\
-                    origin=origin, data_block=json_val)
+                    origin=origin, data_block=self._encode_data_block(samples))
                 
         # Driver configuration changed, publish config.
         elif type == DriverAnnouncement.CONFIG_CHANGE:
@@ -2436,16 +2485,19 @@ class InstrumentAgent(Process):
 
         # If the driver state changed, publish any buffered data remaining.
         elif type == DriverAnnouncement.STATE_CHANGE:
-            json_val = None
+            # Drivers may announce the observatory state of the new state.
+            self._observatory_state = content.get('observatory_state', None)
+
+            data_block = None
             if len(self._data_buffer) > 0:
                 #strval = self._get_data_string(self._data_buffer)
-                json_val = json.dumps(self._data_buffer)
+                data_block = self._encode_data_block(self._take_data_buffer())
                 #if len(strval) > 0:
-                if json_val != None:
+                if data_block != None:
                     origin = "%s.%s" % (self._prev_data_transducer,
                                         self.event_publisher_origin)
                     yield self._log_publisher.create_and_publish_event(origin=\
-                                                origin, description=json_val)
+                                                origin, description=data_block)
 
         elif type == DriverAnnouncement.EVENT_OCCURRED:
             pass
@@ -2483,6 +2535,7 @@ class InstrumentAgent(Process):
             try:
                 proc_desc = ProcessDesc(**(self._driver_desc))
                 self.temp_proc_desc = proc_desc
+                self._observatory_state = None
                 self._driver_pid = yield self.spawn_child(proc_desc)
 
             # If the process desc is bad, trap the error and proceed.
@@ -2562,6 +2615,13 @@ class InstrumentAgent(Process):
 
             self._driver_pid = None
             self._driver_client = None
+            self._observatory_state = None
+
+        # A stopped driver sends no more data to publish on time.
+        if self._data_buffer_flush_call != None:
+            if self._data_buffer_flush_call.active():
+                self._data_buffer_flush_call.cancel()
+            self._data_buffer_flush_call = None
 
     ###########################################################################
     #   Other.
@@ -2612,6 +2672,46 @@ class InstrumentAgent(Process):
                 break
         return found
 
+    def _take_data_buffer(self):
+        """
+        Empty the data buffer and cancel its pending time limit.
+        @retval The list of buffered samples.
+        """
+        samples = self._data_buffer
+        self._data_buffer = []
+        if self._data_buffer_flush_call != None:
+            if self._data_buffer_flush_call.active():
+                self._data_buffer_flush_call.cancel()
+            self._data_buffer_flush_call = None
+        return samples
+
+    def _encode_data_block(self, samples):
+        """
+        Encode samples for publication in a data block event, in the
+        configured data_block_encoding: 'json' (the default) for a json list
+        of sample dicts or 'sample_block' for the compact columnar encoding.
+        @param samples a list of sample dicts.
+        @retval The data block string.
+        """
+        if CONF.getValue('data_block_encoding', 'json') == 'sample_block':
+            return encode_data_block(samples)
+        return json.dumps(samples)
+
+    def _data_buffer_timeout(self):
+        """
+        Publish the data buffer when its time limit runs out.
+        """
+        self._data_buffer_flush_call = None
+        if len(self._data_buffer) > 0:
+            samples = self._take_data_buffer()
+            origin = "%s.%s" % (self._prev_data_transducer,
+                                self.event_publisher_origin)
+            log.debug("Instrument Agent publishing %i samples on buffer timeout on origin: %s", len(samples), origin)
+            d = self._data_publisher.create_and_publish_event(origin=origin,
+                data_block=self._encode_data_block(samples))
+            d.addErrback(lambda failure: log.error(
+                'Instrument Agent could not publish buffered data: %s' % failure.getErrorMessage()))
+
     def _get_buffer_size(self):
         """
         Return the total size in characters of the data buffer.
@@ -2660,6 +2760,7 @@ class InstrumentAgent(Process):
         params[AgentParameter.DRIVER_CLIENT_DESC] = self._client_desc
         params[AgentParameter.DRIVER_CONFIG] = self._driver_config
         params[AgentParameter.BUFFER_SIZE] = self._data_buffer_limit
+        params[AgentParameter.BUFFER_TIME] = self._data_buffer_time_limit
         return params
 
     def _debug_print_driver_event(self, type, transducer, value):
@@ -40,3 +40,105 @@ class InstrumentConnection(Protocol):
         self.parent.gotData(data)
 
 
+
+
+class LineConnection(InstrumentConnection):
+    """
+    An InstrumentConnection that frames the device output into lines as it
+    arrives, as a twisted LineReceiver does, and recognizes the device
+    prompts, which are not terminated by a delimiter.
+
+    Only the unterminated tail of the output is kept between fragments, so
+    each fragment is scanned once. The lines completed by a fragment are
+    passed to the parent together with gotLines(lines, prompt), where prompt
+    is:
+      - a prompt the output now ends with; the text before it on its line is
+        passed as a line and the prompt is kept as the tail,
+      - a prompt followed by the delimiter (e.g. 'S>\\r\\n') if the last line
+        completed is a prompt and nothing follows it,
+      - otherwise None.
+    """
+
+    delimiter = '\r\n'
+
+    """
+    The device prompts, longest first where one ends with another.
+    """
+    prompts = ()
+
+    """
+    The unterminated tail is passed as a line if it grows above this length.
+    """
+    MAX_LENGTH = 16384
+
+    def __init__(self, parent, delimiter=None, prompts=None):
+        InstrumentConnection.__init__(self, parent)
+        if delimiter != None:
+            self.delimiter = delimiter
+        if prompts != None:
+            self.prompts = tuple(prompts)
+
+        # The unterminated tail of the output.
+        self._buffer = ''
+
+        # The prompt the tail holds, if any.
+        self._prompt = None
+
+        # A file the raw output is written to if set.
+        self.logfile = None
+
+    def dataReceived(self, data):
+        if self.logfile:
+            self.logfile.write(data)
+
+        # Only the new data and the end of the tail can hold a new delimiter.
+        delimiter = self.delimiter
+        start = max(0, len(self._buffer) - len(delimiter) + 1)
+        buf = self._buffer + data
+        held = self._prompt
+        lines = []
+        if buf.find(delimiter, start) != -1:
+            end = buf.rfind(delimiter)
+            lines = buf[:end].split(delimiter)
+            buf = buf[end + len(delimiter):]
+            held = None
+
+        prompt = None
+        if buf:
+            for p in self.prompts:
+                if buf.endswith(p):
+                    prefix = buf[:-len(p)]
+                    # A prompt answering a prompt is not a line.
+                    if held and prefix.startswith(held):
+                        prefix = prefix[len(held):]
+                    if prefix:
+                        lines.append(prefix)
+                    buf = prompt = p
+                    break
+            else:
+                if len(buf) > self.MAX_LENGTH:
+                    log.warn('Device output line longer than %d, passing it on unterminated.', self.MAX_LENGTH)
+                    lines.append(buf)
+                    buf = ''
+        elif lines and lines[-1] in self.prompts:
+            prompt = lines[-1] + delimiter
+        self._buffer = buf
+        self._prompt = buf and prompt or None
+
+        if lines or prompt:
+            self.linesReceived(lines, prompt)
+
+    def linesReceived(self, lines, prompt):
+        """
+        Called with the lines and prompt completed by a fragment of output.
+        """
+        self.parent.gotLines(lines, prompt)
+
+    def clearLineBuffer(self):
+        """
+        Drop the unterminated tail of the output.
+        @retval The dropped tail.
+        """
+        buf, self._buffer = self._buffer, ''
+        self._prompt = None
+        return buf
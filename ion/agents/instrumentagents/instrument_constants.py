@@ -241,6 +241,7 @@ class AgentParameter(BaseEnum):
     DRIVER_CLIENT_DESC = 'AGENT_PARAM_DRIVER_CLIENT_DESC'
     DRIVER_CONFIG = 'AGENT_PARAM_DRIVER_CONFIG'
     BUFFER_SIZE = 'AGENT_PARAM_BUFFER_SIZE'
+    BUFFER_TIME = 'AGENT_PARAM_BUFFER_TIME'
     ALL = 'AGENT_PARAM_ALL'
 
 """
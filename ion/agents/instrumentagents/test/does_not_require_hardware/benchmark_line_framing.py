@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""
+@file ion/agents/instrumentagents/test/does_not_require_hardware/benchmark_line_framing.py
+@brief Benchmark the lines per second the instrument connection line framing
+    and the SBE37 sample parsing keep up with, streaming from a simulator.
+@test Line framing benchmark - not run as part of the unit tests
+"""
+
+import re
+import time
+
+from twisted.internet import defer, reactor
+from twisted.internet.protocol import ClientCreator
+from twisted.trial import unittest
+
+import ion.util.ionlog
+from ion.agents.instrumentagents.instrument_connection import InstrumentConnection
+from ion.agents.instrumentagents.instrument_connection import LineConnection
+from ion.agents.instrumentagents.simulators.sim_SBE49 import Instrument
+from ion.agents.instrumentagents.simulators.sim_SBE49 import Simulator
+
+log = ion.util.ionlog.getLogger(__name__)
+
+PROMPT = 'S>'
+NEWLINE = '\r\n'
+BAD_COMMAND = '?cmd S>'
+
+# The SBE37 driver sample pattern.
+SAMPLE_PATTERN = r'^#? *(-?\d+\.\d+), *(-?\d+\.\d+), *(-?\d+\.\d+)' + \
+    r'(, *(-?\d+\.\d+))?(, *(-?\d+\.\d+))?' + \
+    r'(, *(\d+) +([a-zA-Z]+) +(\d+), *(\d+):(\d+):(\d+))?' + \
+    r'(, *(\d+)-(\d+)-(\d+), *(\d+):(\d+):(\d+))?'
+
+
+class BurstInstrument(Instrument):
+    """
+    A simulated instrument streaming bursts of samples, each burst followed
+    by a line that is not a sample as the prompt answering a wakeup.
+    """
+    burst = 200
+
+    def __init__(self):
+        Instrument.__init__(self)
+        self.autoInterval = 0.001
+
+    def autoSampler(self):
+        self.transport.write(''.join([self.get_next_sample()
+                                      for i in range(self.burst)]) +
+                             PROMPT + NEWLINE)
+
+    def connectionLost(self, reason):
+        if self.lc_autoSampler.running:
+            self.lc_autoSampler.stop()
+        Instrument.connectionLost(self, reason)
+
+
+class SampleCounter(object):
+    """
+    Stands in for the driver, parsing the lines of the connection for
+    samples as the driver does in autosample mode.
+    """
+    def __init__(self):
+        self.regex = re.compile(SAMPLE_PATTERN)
+        self.samples = 0
+        self.data_lines = []
+        self.connected = defer.Deferred()
+        # CPU seconds spent framing and parsing.
+        self.cpu = 0.0
+
+    def gotConnected(self, connection):
+        self.connected.callback(connection)
+
+    def gotDisconnected(self, connection):
+        pass
+
+    def gotLines(self, lines, prompt):
+        # Only the new lines are scanned for samples.
+        match = self.regex.match
+        for line in lines:
+            if match(line):
+                self.samples += 1
+            else:
+                self.data_lines.append(line)
+
+
+class LegacySampleCounter(SampleCounter):
+    """
+    Frames and parses the lines as the SBE37 driver did before the line
+    framing connection: the fragments are added to a line buffer which is
+    split and scanned for prompts, and all lines not parsed as samples are
+    scanned again with every fragment.
+    """
+    def __init__(self):
+        SampleCounter.__init__(self)
+        self.line_buffer = ''
+
+    def gotData(self, dataFrag):
+        self.line_buffer += dataFrag
+        if NEWLINE in self.line_buffer:
+            lines = self.line_buffer.split(NEWLINE)
+            self.line_buffer = lines[-1]
+            self.data_lines += lines[0:-1]
+        if self.line_buffer.endswith(PROMPT):
+            self.data_lines.append(self.line_buffer.replace(PROMPT, ''))
+            self.line_buffer = PROMPT
+        elif self.line_buffer.endswith(BAD_COMMAND):
+            self.data_lines.append(self.line_buffer.replace(BAD_COMMAND, ''))
+            self.line_buffer = BAD_COMMAND
+
+        new_data_lines = []
+        for line in self.data_lines:
+            if self.regex.match(line):
+                self.samples += 1
+            else:
+                new_data_lines.append(line)
+        self.data_lines = new_data_lines
+
+
+class TimedConnection(InstrumentConnection):
+    """
+    Keeps the CPU time spent handling the received data.
+    """
+    def dataReceived(self, data):
+        t = time.clock()
+        self.parent.gotData(data)
+        self.parent.cpu += time.clock() - t
+
+
+class TimedLineConnection(LineConnection):
+    """
+    Keeps the CPU time spent handling the received data.
+    """
+    def dataReceived(self, data):
+        t = time.clock()
+        LineConnection.dataReceived(self, data)
+        self.parent.cpu += time.clock() - t
+
+
+class LineFramingBenchmark(unittest.TestCase):
+
+    duration = 5
+
+    timeout = 60
+
+    def setUp(self):
+        self.simulator = Simulator('benchmark', 9100)
+        self.simulator.factory.protocol = BurstInstrument
+        self.port = self.simulator.start()[0]
+
+    def tearDown(self):
+        return self.simulator.stop()
+
+    @defer.inlineCallbacks
+    def _stream(self, counter, protocol, *args):
+        cc = ClientCreator(reactor, protocol, counter, *args)
+        connection = yield cc.connectTCP('localhost', self.port)
+        yield counter.connected
+        connection.transport.write('startnow' + NEWLINE)
+
+        t1 = time.time()
+        d = defer.Deferred()
+        reactor.callLater(self.duration, d.callback, None)
+        yield d
+        t2 = time.time()
+
+        connection.transport.write('stop' + NEWLINE)
+        connection.transport.loseConnection()
+        defer.returnValue((counter.samples / (t2 - t1),
+                           counter.cpu / max(counter.samples, 1) * 1e6))
+
+    @defer.inlineCallbacks
+    def test_samples_per_second(self):
+        legacy = yield self._stream(LegacySampleCounter(), TimedConnection)
+        framed = yield self._stream(SampleCounter(), TimedLineConnection,
+                                    NEWLINE, (BAD_COMMAND, PROMPT))
+
+        output = '\nFraming | Samples/s | CPU us/sample\n'
+        output += 'legacy  | %9.0f | %13.2f\n' % legacy
+        output += 'framed  | %9.0f | %13.2f\n' % framed
+
+        log.info(output)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""
+@file ion/agents/instrumentagents/test/does_not_require_hardware/test_instrument_connection.py
+@brief Test cases for the line framing of instrument connections.
+"""
+
+from twisted.trial import unittest
+
+from ion.agents.instrumentagents.instrument_connection import LineConnection
+
+
+class LineCollector(object):
+    """
+    Stands in for a driver, keeping what the connection passes on.
+    """
+    def __init__(self):
+        self.lines = []
+        self.prompts = []
+
+    def gotLines(self, lines, prompt):
+        self.lines.extend(lines)
+        if prompt:
+            self.prompts.append(prompt)
+
+
+class TestLineConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.parent = LineCollector()
+        self.conn = LineConnection(self.parent, '\r\n', ('?cmd S>', 'S>'))
+
+    def feed(self, *fragments):
+        for fragment in fragments:
+            self.conn.dataReceived(fragment)
+
+    def test_fragmented_lines(self):
+        self.feed('20.1308, 0.115', '88,    0.718\r', '\n20.1282, 0.12386,',
+                  '    0.812\r\n\r\n', 'tail')
+        self.assertEqual(self.parent.lines,
+                         ['20.1308, 0.11588,    0.718',
+                          '20.1282, 0.12386,    0.812', ''])
+        self.assertEqual(self.parent.prompts, [])
+        self.assertEqual(self.conn.clearLineBuffer(), 'tail')
+
+    def test_prompts(self):
+        # A prompt ending the output, with output before it on its line.
+        self.feed('ds\r\nsample interval = 5 seconds\r\nS', '>')
+        self.assertEqual(self.parent.lines,
+                         ['ds', 'sample interval = 5 seconds'])
+        self.assertEqual(self.parent.prompts, ['S>'])
+
+        # A bad command prompt is not taken for a prompt.
+        self.feed('\r\nbad\r\n?cmd S>')
+        self.assertEqual(self.parent.lines[-1], 'bad')
+        self.assertEqual(self.parent.prompts, ['S>', '?cmd S>'])
+
+        # Prompts answering a wakeup.
+        self.feed('S>')
+        self.assertEqual(self.parent.prompts[-1], 'S>')
+        self.assertEqual(self.parent.lines[-1], 'bad')
+
+    def test_terminated_prompt(self):
+        # A prompt followed by a newline, as an instrument streaming samples
+        # answers a wakeup.
+        self.feed('20.1308, 0.11588,    0.718\r\nS>', '\r\n')
+        self.assertEqual(self.parent.prompts, ['S>', 'S>\r\n'])
+        self.assertEqual(self.parent.lines,
+                         ['20.1308, 0.11588,    0.718', 'S>'])
+
+        self.feed('S>\r\n20.1282, 0.12386,    0.812\r\n')
+        self.assertEqual(self.parent.prompts, ['S>', 'S>\r\n'])
+
+    def test_long_line(self):
+        self.conn.MAX_LENGTH = 10
+        self.feed('0123456789', 'abc')
+        self.assertEqual(self.parent.lines, ['0123456789abc'])
+        self.feed('d\r\n')
+        self.assertEqual(self.parent.lines, ['0123456789abc', 'd'])
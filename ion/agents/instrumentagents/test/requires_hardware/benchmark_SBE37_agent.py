@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+"""
+@file ion/agents/instrumentagents/test/requires_hardware/benchmark_SBE37_agent.py
+@brief Benchmark the samples per second published by instrument agents
+    streaming from SBE37 drivers connected to simulators.
+@test SBE37 agent benchmark - not run as part of the unit tests
+"""
+
+import os
+import time
+
+from twisted.internet import defer
+from twisted.trial import unittest
+from ion.test.iontest import IonTestCase
+
+import ion.util.ionlog
+import ion.util.procutils as pu
+from ion.core.messaging.serialization import decode_data_block
+from ion.services.dm.distribution.events import DataBlockEventSubscriber
+import ion.agents.instrumentagents.instrument_agent as instrument_agent
+from ion.agents.instrumentagents.instrument_constants import AgentCommand
+from ion.agents.instrumentagents.instrument_constants import AgentEvent
+from ion.agents.instrumentagents.instrument_constants import AgentParameter
+from ion.agents.instrumentagents.instrument_constants import DriverChannel
+from ion.agents.instrumentagents.instrument_constants import DriverCommand
+from ion.agents.instrumentagents.instrument_constants import InstErrorCode
+from ion.agents.instrumentagents.simulators.sim_SBE49 import Instrument
+from ion.agents.instrumentagents.simulators.sim_SBE49 import Simulator
+
+log = ion.util.ionlog.getLogger(__name__)
+
+"""
+Set RUN_BENCHMARK flag if the correct environment variable has been assigned.
+"""
+RUN_BENCHMARK = True if os.environ.get('SBE37_AGENT_BENCHMARK',None) \
+    == 'available' else False
+
+
+class StreamingInstrument(Instrument):
+    """
+    A simulated instrument sending samples as fast as the benchmark asks.
+    """
+    sample_interval = 0.01
+
+    def __init__(self):
+        Instrument.__init__(self)
+        self.autoInterval = self.sample_interval
+
+
+class DataCounter(DataBlockEventSubscriber):
+    """
+    Counts the samples published on the data topic of one agent.
+    """
+    def __init__(self, *args, **kwargs):
+        self.samples = 0
+        self.blocks = 0
+        DataBlockEventSubscriber.__init__(self, *args, **kwargs)
+
+    def ondata(self, data):
+        content = data['content']
+        self.samples += len(decode_data_block(
+            content.additional_data.data_block))
+        self.blocks += 1
+
+
+class SBE37AgentBenchmark(IonTestCase):
+
+    agent_counts = [1, 4]
+
+    # Seconds of streaming per run.
+    duration = 30
+
+    # Data buffer size and time limit of the agents.
+    buffer_size = 10
+    buffer_time = 1
+
+    timeout = 600
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        yield self._start_container()
+        self.simulators = []
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        for simulator in self.simulators:
+            yield simulator.stop()
+        yield self._stop_container()
+
+    @defer.inlineCallbacks
+    def _start_agent(self, index):
+        """
+        Start a simulator and an agent with its driver connected to it,
+        in observatory mode. Returns the agent client, an open transaction
+        and a counter of the published samples.
+        """
+        simulator = Simulator(str(index), 9000 + index)
+        simulator.factory.protocol = StreamingInstrument
+        simulator_port = simulator.start()[0]
+        self.assertNotEqual(simulator_port, 0)
+        self.simulators.append(simulator)
+
+        driver_config = {
+            'ipport':simulator_port,
+            'ipaddr':'localhost'
+        }
+        driver_desc = {
+            'name':'SBE37_driver_%d' % index,
+            'module':'ion.agents.instrumentagents.SBE37_driver',
+            'class':'SBE37Driver',
+            'spawnargs':{'config':driver_config}
+        }
+        driver_client_desc = {
+            'name':'SBE37_client_%d' % index,
+            'module':'ion.agents.instrumentagents.SBE37_driver',
+            'class':'SBE37DriverClient',
+            'spawnargs':{}
+        }
+        agent_desc = {
+            'name':'instrument_agent_%d' % index,
+            'module':'ion.agents.instrumentagents.instrument_agent',
+            'class':'InstrumentAgent',
+            'spawnargs':{
+                'driver-desc':driver_desc,
+                'client-desc':driver_client_desc,
+                'driver-config':driver_config,
+                'agent-config':{}
+            }
+        }
+
+        sup = yield self._spawn_processes([agent_desc])
+        svc_id = yield sup.get_child_id('instrument_agent_%d' % index)
+        ia_client = instrument_agent.InstrumentAgentClient(proc=sup,
+                                                           target=svc_id)
+
+        origin_str = DriverChannel.INSTRUMENT + '.' + str(svc_id)
+        counter = DataCounter(origin=origin_str, process=sup)
+        yield counter.initialize()
+        yield counter.activate()
+
+        reply = yield ia_client.start_transaction(0)
+        self.assert_(InstErrorCode.is_ok(reply['success']))
+        tid = reply['transaction_id']
+
+        for event in (AgentEvent.INITIALIZE, AgentEvent.GO_ACTIVE,
+                      AgentEvent.RUN):
+            reply = yield ia_client.execute_observatory(
+                [AgentCommand.TRANSITION, event], tid)
+            self.assert_(InstErrorCode.is_ok(reply['success']))
+
+        params = {
+            AgentParameter.BUFFER_SIZE:self.buffer_size,
+            AgentParameter.BUFFER_TIME:self.buffer_time
+        }
+        reply = yield ia_client.set_observatory(params, tid)
+        self.assert_(InstErrorCode.is_ok(reply['success']))
+
+        defer.returnValue((ia_client, tid, counter))
+
+    @defer.inlineCallbacks
+    def _stop_agent(self, ia_client, tid):
+        chans = [DriverChannel.INSTRUMENT]
+        yield ia_client.execute_device(chans,
+            [DriverCommand.STOP_AUTO_SAMPLING], tid)
+        yield ia_client.execute_observatory(
+            [AgentCommand.TRANSITION, AgentEvent.RESET], tid)
+        yield ia_client.end_transaction(tid)
+
+    @defer.inlineCallbacks
+    def test_samples_per_second(self):
+        if not RUN_BENCHMARK:
+            raise unittest.SkipTest("Do not run this benchmark automatically.")
+
+        results = []
+        index = 0
+        for count in self.agent_counts:
+            agents = []
+            for i in range(count):
+                agent = yield self._start_agent(index)
+                agents.append(agent)
+                index += 1
+
+            chans = [DriverChannel.INSTRUMENT]
+            for (ia_client, tid, counter) in agents:
+                reply = yield ia_client.execute_device(chans,
+                    [DriverCommand.START_AUTO_SAMPLING], tid)
+                self.assert_(InstErrorCode.is_ok(reply['success']))
+
+            t1 = time.time()
+            yield pu.asleep(self.duration)
+            t2 = time.time()
+            samples = [counter.samples for (ia_client, tid, counter) in agents]
+            blocks = sum([counter.blocks for (ia_client, tid, counter) in agents])
+
+            for (ia_client, tid, counter) in agents:
+                yield self._stop_agent(ia_client, tid)
+
+            rate = float(sum(samples)) / (t2 - t1) / count
+            results.append((count, rate, min(samples) / (t2 - t1),
+                            blocks))
+
+        output = '\nAgents | Samples/s per agent | Slowest agent | Data blocks\n'
+        for result in results:
+            output += '%6d | %19.1f | %13.1f | %11d\n' % result
+
+        log.info(output)
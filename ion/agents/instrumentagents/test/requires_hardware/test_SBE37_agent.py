@@ -15,6 +15,7 @@ from twisted.trial import unittest
 
 import ion.util.ionlog
 import ion.util.procutils as pu
+from ion.core.messaging.serialization import decode_data_block
 from ion.services.dm.distribution.events import DataBlockEventSubscriber
 from ion.services.dm.distribution.events import InfoLoggingEventSubscriber
 from ion.services.dm.distribution.events \
@@ -169,6 +170,8 @@ class TestSBE37Agent(IonTestCase):
 
             def ondata(self, data):
                 content = data['content'];
+                self.msgs.append(decode_data_block(
+                    content.additional_data.data_block))
                 if PRINT_PUBLICATIONS:
                     print 'data subscriber ondata:'
                     print content.additional_data.data_block
@@ -179,6 +182,7 @@ class TestSBE37Agent(IonTestCase):
         datasub = TestDataSubscriber(origin=origin_str,process=self.sup)
         yield datasub.initialize()
         yield datasub.activate()
+        self.datasub = datasub
 
         # Setup a subscriber to agent errors, transactions, config changes.
         class TestInfoSubscriber(InfoLoggingEventSubscriber):
@@ -544,6 +548,15 @@ class TestSBE37Agent(IonTestCase):
             self.assertIsInstance(sample.get('conductivity',None),float)
             self.assertIsInstance(sample.get('device_time',None),str)
             self.assertIsInstance(sample.get('driver_time',None),str)
+
+        # The published data blocks decode to the samples.
+        self.assert_(len(self.datasub.msgs) > 0)
+        for samples in self.datasub.msgs:
+            self.assert_(len(samples) > 0)
+            for sample in samples:
+                self.assertIsInstance(sample.get('temperature'),float)
+                self.assertIsInstance(sample.get('conductivity'),float)
+                self.assert_('device_time' in sample)
        
         """
         while True:
@@ -15,6 +15,7 @@ import os
 import time
 
 from twisted.internet import defer
+from twisted.internet import reactor
 
 from zope.interface import implements
 
@@ -141,6 +142,161 @@ class CassandraError(Exception):
     """
 
 
+class PooledCassandraClientFactory(ManagedCassandraClientFactory):
+    """
+    A managed client factory which is connected more than once. Each connection takes the next request from the
+    shared request queue of the factory when it is idle, so a slow request only holds up its own connection.
+    Requests are submitted through the pool which caps the number outstanding and records their latency.
+    """
+
+    def __init__(self, pool, *args, **kwargs):
+        ManagedCassandraClientFactory.__init__(self, *args, **kwargs)
+        self._pool = pool
+
+    def pushRequest(self, request, *args, **kwargs):
+        return self._pool.submit(ManagedCassandraClientFactory.pushRequest, self, request, *args, **kwargs)
+
+
+class CassandraConnectionPool(object):
+    """
+    A pool of connections to a Cassandra cluster for one keyspace. The pool is shared by all the stores in the
+    process which use the same persistent technology, persistent archive and credentials.
+
+    The connections are made round robin across the hosts of the persistent technology. Each connection carries
+    one request at a time. At most max_outstanding_requests requests are handed to the client factory - the rest
+    wait in the pool. Lost connections are retried by the factory.
+
+    When the last user disconnects the pool is closed and removed - a closed pool can not be connected again.
+    """
+
+    _pools = {}
+
+    stats_out = 10000
+
+    stats_string = 'Cassandra Connection Pool %s Stats(%d ops): time seconds (mean/max) %f/%f;'
+
+    wait_stats_string = 'Cassandra Connection Pool %s Wait Stats(%d ops): time seconds (mean/max) %f/%f;'
+
+    @classmethod
+    def get_pool(cls, persistent_technology, keyspace, credentials):
+        """
+        Get the shared pool for a persistent technology and keyspace - create it if it does not exist yet
+        @param persistent_technology is an ion resource which defines the hosts of the cluster
+        @param keyspace is the name of the persistent archive
+        @param credentials is the authorization dictionary for the connection
+        """
+        hosts = tuple([(host.host, host.port) for host in persistent_technology.hosts])
+        # Key on all of the credentials - a client with other credentials must not share an authenticated pool
+        pool_key = (hosts, keyspace, tuple(sorted((credentials or {}).items())))
+
+        pool = cls._pools.get(pool_key)
+        if pool is None:
+            pool = cls(hosts, keyspace, credentials)
+            pool._pool_key = pool_key
+            cls._pools[pool_key] = pool
+
+        return pool
+
+    def __init__(self, hosts, keyspace, credentials, pool_size=None, max_outstanding_requests=None, timeout=30):
+        """
+        @param hosts is a list of (host, port) tuples
+        @param keyspace is the keyspace used by all the connections
+        @param credentials is the authorization dictionary for the connection
+        """
+        if len(hosts) == 0:
+            raise CassandraError('Can not create a connection pool without any hosts!')
+
+        self.hosts = list(hosts)
+        self.keyspace = keyspace
+        self.pool_size = max(int(pool_size or CONF.getValue('pool_size', 4)), 1)
+        self.max_outstanding_requests = max(int(max_outstanding_requests or CONF.getValue('max_outstanding_requests', 32)), 1)
+        self.timeout = timeout
+
+        self.factory = PooledCassandraClientFactory(self, keyspace=keyspace, credentials=credentials)
+
+        self._limit = defer.DeferredSemaphore(self.max_outstanding_requests)
+        self._connectors = []
+        self._next_host = 0
+        self._users = 0
+        self._pool_key = None
+        self.closed = False
+
+        self.request_stats = SizeStats()
+        self.wait_stats = SizeStats()
+
+    def _next_address(self):
+        """
+        Round robin across the hosts
+        """
+        address = self.hosts[self._next_host % len(self.hosts)]
+        self._next_host += 1
+        return address
+
+    def connect(self):
+        """
+        Register a user of the pool. The connections are made for the first user.
+        """
+        if self.closed:
+            raise CassandraError('Can not connect a connection pool which has been closed!')
+
+        self._users += 1
+        if len(self._connectors) > 0:
+            return
+
+        for i in range(self.pool_size):
+            host, port = self._next_address()
+            log.info("Connection pool for keyspace %s connecting to %s on port %s" % (self.keyspace, host, port))
+            self._connectors.append(reactor.connectTCP(host, port, self.factory, self.timeout))
+
+    def disconnect(self):
+        """
+        Release a user of the pool. When the last user is gone the connections are closed and the pool is removed.
+        """
+        self._users -= 1
+        if self._users > 0:
+            return
+
+        self.closed = True
+        self.factory.shutdown()
+        for connector in self._connectors:
+            connector.disconnect()
+        self._connectors = []
+
+        if self._pools.get(self._pool_key) is self:
+            del self._pools[self._pool_key]
+
+        log.info('Connection pool for keyspace %s: Lose TCP Connections' % self.keyspace)
+
+    def submit(self, f, *args, **kwargs):
+        """
+        Call f, which submits a request to the client factory, once the number of outstanding requests is below the cap
+        """
+        tic = time.time()
+
+        def _run(_):
+            start = time.time()
+            self.wait_stats.add_stats(tic, start)
+
+            d = defer.maybeDeferred(f, *args, **kwargs)
+            d.addBoth(self._complete, start)
+            return d
+
+        return self._limit.acquire().addCallback(_run)
+
+    def _complete(self, result, start):
+        self._limit.release()
+
+        self.request_stats.add_stats(start, time.time())
+
+        if self.request_stats.t_count >= self.stats_out:
+            log.critical(self.stats_string % ((self.keyspace,) + self.request_stats.simple_stats()))
+            log.critical(self.wait_stats_string % ((self.keyspace,) + self.wait_stats.simple_stats()))
+            self.request_stats.__init__()
+            self.wait_stats.__init__()
+
+        return result
+
+
 class CassandraStore(TCPConnection):
     """
     An Adapter class that implements the IStore interface by way of a
@@ -162,7 +318,9 @@ class CassandraStore(TCPConnection):
     implements(store.IStore)
 
     put_stats = SizeStats()
+    put_many_stats = SizeStats()
     get_stats = SizeStats()
+    get_many_stats = SizeStats()
     has_stats = SizeStats()
 
     stats_out = 10000
@@ -186,12 +344,13 @@ class CassandraStore(TCPConnection):
         log.info("Connecting to %s on port %s " % (host,port))
         log.info("Using keyspace %s" % (self._keyspace,))
         log.info("authorization_dictionary; %s" % (str(authorization_dictionary),))
-        ### Create the twisted factory for the TCP connection  
-        self._manager = ManagedCassandraClientFactory(keyspace=self._keyspace, credentials=authorization_dictionary)
-        
+        self._persistent_technology = persistent_technology
+        self._authorization_dictionary = authorization_dictionary
+        self._pool_connected = False
+
         # Call the initialization of the Managed TCP connection base class
-        TCPConnection.__init__(self,host, port, self._manager)
-        self.client = CassandraClient(self._manager)    
+        TCPConnection.__init__(self,host, port, None)
+        self._get_pool()
         
         self._cache = cache # Cassandra Column Family maps to an ION Cache resource
         self._cache_name = cache.name
@@ -236,6 +395,45 @@ class CassandraStore(TCPConnection):
 
         defer.returnValue(value)
 
+    get_many_stats_string = 'Cassandra Store Get_Many Stats(%d ops): time seconds (mean/mean per Kb/max) %f/%f/%f; size (mean/max) %f/%f Kb, Not Found - %d;'
+    @timeout(cassandra_timeout)
+    @defer.inlineCallbacks
+    def get_many(self, keys):
+        """
+        @brief Return the values corresponding to a list of keys in one multiget_slice request
+        @param keys a list of keys
+        @retval Deferred that fires with a dictionary of key: value. The value is None if the key is not found.
+        """
+        keys = list(keys)
+
+        tic = time.time()
+        lval = 0
+
+        rows = yield self.client.multiget_slice(keys, self._cache_name, names=['value'])
+
+        result = {}
+        for key in keys:
+            columns = rows.get(key)
+            if columns:
+                value = columns[0].column.value
+                lval += len(value)
+            else:
+                value = None
+            result[key] = value
+
+        toc = time.time()
+
+        if toc - tic > 4.0:
+            log.warn('Cassandra get_many operation elapsed time %f; # of keys: %d; result size: %s' % (toc - tic, len(keys), lval))
+
+        self.get_many_stats.add_stats(tic,toc,lval)
+
+        if self.get_many_stats.t_count >= self.stats_out:
+            log.critical(self.get_many_stats_string % self.get_many_stats.get_stats())
+            self.get_many_stats.__init__()
+
+        defer.returnValue(result)
+
     @timeout(cassandra_timeout)
     @defer.inlineCallbacks
     def put(self, key, value):
@@ -265,6 +463,35 @@ class CassandraStore(TCPConnection):
             log.critical('Cassandra Store Put Stats(%d ops): time seconds (mean/mean per Kb/max) %f/%f/%f; size (mean/max) %f/%f Kb;' % self.put_stats.put_stats())
             self.put_stats.__init__()
 
+    @timeout(cassandra_timeout)
+    @defer.inlineCallbacks
+    def put_many(self, items):
+        """
+        @brief Write a batch of key/value pairs into cassandra with a single batch_mutate
+        @param items a list of (key, value) tuples
+        @retval Deferred for success
+        """
+        tic = time.time()
+
+        mutation_map = {}
+        lval = 0
+        for key, value in items:
+            mutation_map[key] = {self._cache_name: {"value": value, "has_key":"1"}}
+            lval += len(value)
+
+        yield self.client.batch_mutate(mutation_map)
+
+        toc = time.time()
+
+        if toc - tic > 4.0:
+            log.warn('Cassandra put_many operation elapsed time %f; # of rows: %d; size: %s' % (toc - tic, len(mutation_map), lval))
+
+        self.put_many_stats.add_stats(tic,toc,lval)
+
+        if self.put_many_stats.t_count >= self.stats_out:
+            log.critical('Cassandra Store Put_Many Stats(%d ops): time seconds (mean/mean per Kb/max) %f/%f/%f; size (mean/max) %f/%f Kb;' % self.put_many_stats.put_stats())
+            self.put_many_stats.__init__()
+
     has_key_stats_string = 'Cassandra Store Has_Key Stats(%d ops): time seconds (mean/max) %f/%f;'
     @timeout(cassandra_timeout)
     @defer.inlineCallbacks
@@ -306,28 +533,43 @@ class CassandraStore(TCPConnection):
         """
         yield self.client.remove(key, self._cache_name)
 
+    def _get_pool(self):
+        """
+        Get the shared connection pool for this keyspace - its factory is shared by all the stores which use it
+        """
+        self._pool = CassandraConnectionPool.get_pool(self._persistent_technology, self._keyspace, self._authorization_dictionary)
+        self._manager = self._pool.factory
+        self._factory = self._manager
+        self.client = CassandraClient(self._manager)
+
+    def _release_pool(self):
+        if self._pool_connected:
+            self._pool_connected = False
+            self._pool.disconnect()
+
     def on_deactivate(self, *args, **kwargs):
-        #self._connector.disconnect()
-        self._manager.shutdown()
-        log.info('on_deactivate: Lose TCP Connection')
+        self._release_pool()
+        log.info('on_deactivate: Release connection pool')
 
     def on_terminate(self, *args, **kwargs):
         log.info("Called CassandraStore.on_terminate")
-        self._connector.disconnect()
-        self._manager.shutdown()
-        log.info('on_terminate: Lose TCP Connection')
+        self._release_pool()
+        log.info('on_terminate: Release connection pool')
     
     def on_error(self, *args, **kwargs):
         log.info("Called CassandraStore.on_error")
-        self._connector.disconnect()
-        self._manager.shutdown()
-        log.info('on_error: Lose TCP Connection')
+        self._release_pool()
+        log.info('on_error: Release connection pool')
 
 
-    @defer.inlineCallbacks
     def on_activate(self, *args, **kwargs):
 
-        yield TCPConnection.on_activate(self)
+        if not self._pool_connected:
+            if self._pool.closed:
+                # The pool was closed by its last user - get the one which is live now
+                self._get_pool()
+            self._pool_connected = True
+            self._pool.connect()
 
 
 
@@ -342,7 +584,9 @@ class CassandraIndexedStore(CassandraStore):
 
 
     put_stats = SizeStats()
+    put_many_stats = SizeStats()
     get_stats = SizeStats()
+    get_many_stats = SizeStats()
     has_stats = SizeStats()
     update_stats = SizeStats()
 
@@ -352,6 +596,8 @@ class CassandraIndexedStore(CassandraStore):
 
     get_stats_string = 'Cassandra Index Store Get Stats(%d ops): time seconds (mean/mean per Kb/max) %f/%f/%f; size (mean/max) %f/%f Kb, Not Found - %d;'
 
+    get_many_stats_string = 'Cassandra Index Store Get_Many Stats(%d ops): time seconds (mean/mean per Kb/max) %f/%f/%f; size (mean/max) %f/%f Kb, Not Found - %d;'
+
 
     def __init__(self, persistent_technology, persistent_archive, credentials, cache):
         """
@@ -398,6 +644,43 @@ class CassandraIndexedStore(CassandraStore):
             log.critical('Cassandra Index Store Put Stats(%d ops): time seconds (mean/mean per Kb/max) %f/%f/%f; size (mean/max) %f/%f Kb;' % self.put_stats.put_stats())
             self.put_stats.__init__()
 
+    @timeout(cassandra_timeout)
+    @defer.inlineCallbacks
+    def put_many(self, items):
+        """
+        Istore put_many, plus a dictionary of indexed stuff for each row
+
+        @param items A list of (key, value, index_attributes) tuples. The rows are written with a single batch_mutate.
+        """
+        tic = time.time()
+
+        mutation_map = {}
+        lval = 0
+        for key, value, index_attributes in items:
+            if index_attributes is None:
+                index_cols = {}
+            else:
+                index_cols = dict(**index_attributes)
+
+            yield self._check_index(index_cols)
+            index_cols.update({"value":value, "has_key":"1"})
+
+            mutation_map[key] = {self._cache_name: index_cols}
+            lval += len(value)
+
+        yield self.client.batch_mutate(mutation_map)
+
+        toc = time.time()
+
+        if toc - tic > 4.0:
+            log.warn('Cassandra put_many operation elapsed time %f; # of rows: %d; size: %s' % (toc - tic, len(mutation_map), lval))
+
+        self.put_many_stats.add_stats(tic,toc,lval)
+
+        if self.put_many_stats.t_count >= self.stats_out:
+            log.critical('Cassandra Index Store Put_Many Stats(%d ops): time seconds (mean/mean per Kb/max) %f/%f/%f; size (mean/max) %f/%f Kb;' % self.put_many_stats.put_stats())
+            self.put_many_stats.__init__()
+
     @timeout(cassandra_timeout)
     @defer.inlineCallbacks
     def update_index(self, key, index_attributes):
@@ -460,7 +743,7 @@ class CassandraIndexedStore(CassandraStore):
 
     @timeout(cassandra_timeout)
     @defer.inlineCallbacks
-    def query(self, query_predicates, row_count=10000000):
+    def query(self, query_predicates, row_count=10000000, columns=None):
         """
         Search for rows in the Cassandra instance.
     
@@ -470,6 +753,8 @@ class CassandraIndexedStore(CassandraStore):
         (Setting this sys.maxint causes an internal error in Cassandra.)
         This can be set  to a lower value, if you want to limit the number of rows 
         to return.
+        @param columns is an optional list of the column names to return for each row - use it to avoid reading the
+        value column when only the index attributes are needed.
             
         @retVal a dictionary containing the keys and values which match the query.
         
@@ -479,42 +764,97 @@ class CassandraIndexedStore(CassandraStore):
 
         tic = time.time()
 
+        selection_predicates = self._selection_predicates(query_predicates)
+        #log.debug("Calling get_indexed_slices selection_predicate %s " % (selection_predicates,))
+        
+        rows = yield self.client.get_indexed_slices(self._cache_name, selection_predicates, count=row_count, names=columns)
+        #log.info("Got rows back")
+        result ={}
+        for row in rows:
+            row_vals = {}
+            for column in row.columns:
+                row_vals[column.column.name] = column.column.value
+            result[row.key] = row_vals
 
+        self._query_complete(tic, len(selection_predicates), len(rows))
+
+        defer.returnValue(result)
+
+    def query_iter(self, query_predicates, page_size=1000, columns=None):
+        """
+        @see IIndexStore.query_iter
+        Each page is a separate get_indexed_slices request which starts from the last key of the previous page.
+        Pages are returned in the order of the partitioner.
+
+        raises a CassandraError if the query_predicate object is malformed.
+        """
+        selection_predicates = self._selection_predicates(query_predicates)
+
+        def query_page(start_key, count):
+            return self._query_page(selection_predicates, start_key, count, columns)
+
+        return store.iter_query_pages(query_page, page_size)
+
+    @timeout(cassandra_timeout)
+    @defer.inlineCallbacks
+    def _query_page(self, selection_predicates, start_key, count, columns):
+        """
+        Get up to count rows which match the selection predicates after start_key as a list of (key, row) tuples
+        """
+        tic = time.time()
+
+        if start_key is None:
+            rows = yield self.client.get_indexed_slices(self._cache_name, selection_predicates, count=count, names=columns)
+        else:
+            # The start key is inclusive - ask for one more row and drop the start row
+            rows = yield self.client.get_indexed_slices(self._cache_name, selection_predicates, count=count+1, names=columns, start_key=start_key)
+            if rows and rows[0].key == start_key:
+                rows = rows[1:]
+            rows = rows[:count]
+
+        result = []
+        for row in rows:
+            row_vals = {}
+            for column in row.columns:
+                row_vals[column.column.name] = column.column.value
+            result.append((row.key, row_vals))
+
+        self._query_complete(tic, len(selection_predicates), len(rows))
+
+        defer.returnValue(result)
+
+    def _selection_predicates(self, query_predicates):
+        """
+        Convert the predicates of a store.Query to Cassandra index expressions
+        """
         predicates = query_predicates.get_predicates()
         def fix_preds(query_tuple):
             if query_tuple[2] == Query.EQ:
                 new_pred = IndexOperator.EQ
             elif query_tuple[2] == Query.GT:
                 new_pred = IndexOperator.GT
+            elif query_tuple[2] == Query.LT:
+                new_pred = IndexOperator.LT
             else:
                 raise CassandraError("Illegal predicate value")
             args = {'column_name':query_tuple[0], 'op':new_pred, 'value': query_tuple[1]}
             return IndexExpression(**args)
-        selection_predicates = map(fix_preds, predicates)
-        #log.debug("Calling get_indexed_slices selection_predicate %s " % (selection_predicates,))
-        
-        rows = yield self.client.get_indexed_slices(self._cache_name, selection_predicates, count=row_count)
-        #log.info("Got rows back")
-        result ={}
-        for row in rows:
-            row_vals = {}
-            for column in row.columns:
-                row_vals[column.column.name] = column.column.value
-            result[row.key] = row_vals
-
+        return map(fix_preds, predicates)
 
+    def _query_complete(self, tic, n_predicates, n_rows):
+        """
+        Record the stats for a query request
+        """
         toc = time.time()
 
         if toc - tic > 4.0:
-            log.warn('Cassandra Query operation elapsed time %f; # of rows returned: %d, # of predicates in request: %d' % (toc - tic, len(rows), len(predicates)))
+            log.warn('Cassandra Query operation elapsed time %f; # of rows returned: %d, # of predicates in request: %d' % (toc - tic, n_rows, n_predicates))
 
-        self.query_stats.add_stats(tic,toc,len(predicates), len(rows))
+        self.query_stats.add_stats(tic,toc,n_predicates, n_rows)
 
         if self.query_stats.t_count >= (self.stats_out/10):
             log.critical('Cassandra Index Store Query Stats per predicate (mean time(seconds)/max time(seconds)/mean # of rows/max # of rows/count): 1 - %f/%f/%f/%d/%d; 2 - %f/%f/%f/%d/%d; 3 - %f/%f/%f/%d/%d;' % self.query_stats.query_stats())
             self.query_stats.__init__()
-
-        defer.returnValue(result)
         
     @timeout(cassandra_timeout)
     @defer.inlineCallbacks
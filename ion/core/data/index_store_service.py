@@ -8,6 +8,8 @@
 @brief Service which fronts the index store capability through the messaging to a single back end.
 """
 
+import bisect
+
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 from twisted.internet import defer
@@ -18,7 +20,7 @@ from ion.core.object import object_utils
 
 from ion.core.data.store import Query
 
-from ion.core.data.store import IIndexStore, IndexStore, IndexStoreError
+from ion.core.data.store import IIndexStore, IndexStore, IndexStoreError, iter_query_pages
 from zope.interface import implements
 
 from ion.core import ioninit
@@ -112,9 +114,11 @@ class IndexStoreService(ServiceProcess):
             r.key = key
 
 
-            r.value = row.pop('value')
+            r.value = row['value']
 
             for name, val in row.items():
+                if name == 'value':
+                    continue
                 col = r.cols.add()
                 col.column_name = name
                 col.column_value = val
@@ -228,7 +232,10 @@ class IndexStoreServiceClient(ServiceClient):
     
       
     @defer.inlineCallbacks
-    def query(self, query_predicates):
+    def query(self, query_predicates, columns=None):
+        """
+        The service always returns every column - the projection is applied here
+        """
         log.info("Called Index Store Service client: Query")
         
         request = yield self.mc.create_instance(QUERY_ATTRIBUTES_TYPE)
@@ -250,9 +257,36 @@ class IndexStoreServiceClient(ServiceClient):
             for col in row.cols:
                 cols[col.column_name] = col.column_value
 
+            if columns is not None:
+                cols = dict([(name, cols[name]) for name in columns if cols.has_key(name)])
+
             results[row.key] = cols
 
         defer.returnValue(results)
+
+    def query_iter(self, query_predicates, page_size=1000, columns=None):
+        """
+        The service has no paged query operation - page through the result of a single query
+        """
+        log.info("Called Index Store Service client: query_iter")
+        rows = []
+        keys = []
+
+        def got_rows(result, count):
+            rows.extend(sorted(result.items()))
+            keys.extend([key for key, row in rows])
+            return rows[:count]
+
+        def query_page(start_key, count):
+            if start_key is None:
+                d = self.query(query_predicates, columns=columns)
+                d.addCallback(got_rows, count)
+                return d
+
+            start = bisect.bisect_right(keys, start_key)
+            return rows[start:start+count]
+
+        return iter_query_pages(query_page, page_size)
         
     @defer.inlineCallbacks
     def put(self, key, value, index_attributes=None):
@@ -275,6 +309,14 @@ class IndexStoreServiceClient(ServiceClient):
 
         defer.returnValue(content)
 
+    @defer.inlineCallbacks
+    def put_many(self, items):
+        """
+        The service has no batch put operation - issue the puts concurrently
+        """
+        log.info("Called Index Store Service client: put_many")
+        yield defer.gatherResults([self.put(key, value, index_attributes) for key, value, index_attributes in items])
+
     @defer.inlineCallbacks
     def update_index(self, key, index_attributes):
         """
@@ -312,6 +354,16 @@ class IndexStoreServiceClient(ServiceClient):
             defer.returnValue(result.value)
         else:
             defer.returnValue(None)
+
+    @defer.inlineCallbacks
+    def get_many(self, keys):
+        """
+        The service has no multi-get operation - issue the gets concurrently
+        """
+        log.info("Called Index Store Service client: get_many")
+        keys = list(keys)
+        values = yield defer.gatherResults([self.get(key) for key in keys])
+        defer.returnValue(dict(zip(keys, values)))
         
     @defer.inlineCallbacks
     def remove(self, key):
@@ -9,6 +9,7 @@
         in memory implementation
 """
 import os
+import bisect
 from zope.interface import Interface
 from zope.interface import implements
 
@@ -34,6 +35,12 @@ class IStore(Interface):
         @retval Deferred, for value associated with key, or None if not existing.
         """
 
+    def get_many(keys):
+        """
+        @param keys  an iterable of immutable keys
+        @retval Deferred, for a dictionary mapping each key to its value, or None if not existing.
+        """
+
     def put(key, value):
         """
         @param key  an immutable key to be associated with a value
@@ -42,6 +49,12 @@ class IStore(Interface):
         @retval Deferred, for success of this operation
         """
 
+    def put_many(items):
+        """
+        @param items  a list of (key, value) tuples to be written in a single batch
+        @retval Deferred, for success of this operation
+        """
+
     def remove(key):
         """
         @param key  an immutable key associated with a value
@@ -68,12 +81,27 @@ class Store(object):
         """
         return defer.maybeDeferred(self.kvs.get, key, None)
 
+    def get_many(self, keys):
+        """
+        @see IStore.get_many
+        """
+        result = {}
+        for key in keys:
+            result[key] = self.kvs.get(key, None)
+        return defer.succeed(result)
+
     def put(self, key, value):
         """
         @see IStore.put
         """
         return defer.maybeDeferred(self.kvs.update, {key:value})
 
+    def put_many(self, items):
+        """
+        @see IStore.put_many
+        """
+        return defer.maybeDeferred(self.kvs.update, items)
+
     def remove(self, key):
         """
         @see IStore.remove
@@ -115,6 +143,12 @@ class IIndexStore(IStore):
         @param index_attributes a dictionary of attributes by which to index this value of this key
         @retval Deferred, for success of this operation
         """
+
+    def put_many(items):
+        """
+        @param items  a list of (key, value, index_attributes) tuples to be written in a single batch
+        @retval Deferred, for success of this operation
+        """
     
     def remove(key):
         """
@@ -123,12 +157,23 @@ class IIndexStore(IStore):
      
         """
         
-    def query(query_predicates):
+    def query(query_predicates, columns=None):
         """
         Search for rows in the Cassandra instance.
         @param query_predicates is a store.Query object
+        @param columns is an optional list of the column names to return for each row - default is all columns
         @retVal a thrift representation of the rows returned by the query.
         """
+
+    def query_iter(query_predicates, page_size=1000, columns=None):
+        """
+        Search for rows page by page rather than building one result for every matching row.
+        @param query_predicates is a store.Query object
+        @param page_size is the maximum number of rows in each page
+        @param columns is an optional list of the column names to return for each row - default is all columns
+        @retVal a generator of Deferreds, each for a dictionary of the rows in the next page. The caller must wait
+        for each page before asking for the next one.
+        """
         
     def update_index(key, index_attributes):
         """
@@ -153,6 +198,95 @@ class IndexStoreError(Exception):
     An exception class for the index store
     """
 
+def iter_query_pages(query_page, page_size):
+    """
+    Generator which walks a query one page at a time using a start key cursor.
+    @param query_page is a callable (start_key, count) which returns a Deferred for a list of (key, row) tuples in
+    key order, beginning with the first key after start_key. start_key is None for the first page.
+    @param page_size is the maximum number of rows in each page
+    @retVal a generator of Deferreds, each for a dictionary of the rows in the next page
+    """
+    if page_size < 1:
+        raise IndexStoreError('Invalid page size for a query: %s' % page_size)
+
+    state = {'cursor':None, 'done':False, 'pending':False}
+
+    def got_page(rows):
+        state['pending'] = False
+        # Ask for one row more than the page to learn whether there is another page without an empty round trip
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            state['cursor'] = rows[-1][0]
+        else:
+            state['done'] = True
+        return dict(rows)
+
+    def failed(reason):
+        state['pending'] = False
+        state['done'] = True
+        return reason
+
+    while not state['done']:
+        if state['pending']:
+            raise IndexStoreError('The previous page of the query must complete before requesting the next page!')
+
+        state['pending'] = True
+        d = defer.maybeDeferred(query_page, state['cursor'], page_size + 1)
+        d.addCallbacks(got_page, failed)
+        yield d
+
+
+class ValueIndex(dict):
+    """
+    The index of one attribute of an IndexStore - a dictionary of attribute value to the set of keys with that value,
+    which also keeps the attribute values in a sorted list so that range predicates are found by bisection.
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        self.sorted_values = []
+        # key -> set of the values the key is indexed under
+        self.values_by_key = {}
+
+    def add(self, value, key):
+        keys = self.get(value)
+        if keys is None:
+            keys = set()
+            self[value] = keys
+            bisect.insort(self.sorted_values, value)
+        keys.add(key)
+        self.values_by_key.setdefault(key, set()).add(value)
+
+    def discard(self, value, key):
+        keys = self.get(value)
+        if keys is not None:
+            keys.discard(key)
+        values = self.values_by_key.get(key)
+        if values is not None:
+            values.discard(value)
+            if not values:
+                del self.values_by_key[key]
+
+    def range_values(self, lower=None, upper=None):
+        """
+        @retval the attribute values greater than lower and less than upper, in sorted order. None for no bound.
+        """
+        values = self.sorted_values
+        if len(values) != len(self):
+            # Values were put in the dictionary directly - sort them again
+            values = self.sorted_values = sorted(self.keys())
+
+        start = 0
+        if lower is not None:
+            start = bisect.bisect_right(values, lower)
+
+        end = len(values)
+        if upper is not None:
+            end = bisect.bisect_left(values, upper, start)
+
+        return values[start:end]
+
+
 class IndexStore(object):
     """
     Memory implementation of an asynchronous key/value store, using a dict.
@@ -170,6 +304,8 @@ class IndexStore(object):
     
     self.indices is an index to map attribute names to attribute values to keys
         {attr_names:{attr_value: set( keys)}}.
+    Each attribute index is a ValueIndex which also keeps the attribute values sorted, for range predicates.
+    The indices are the source of truth for queries - update_index changes the rows a query finds, not the rows.
     """
     implements(IIndexStore)
 
@@ -183,7 +319,7 @@ class IndexStore(object):
         if kwargs.has_key('indices'):
             for name in kwargs.get('indices'):
                 if not self.indices.has_key(name):
-                    self.indices[name]={}
+                    self.indices[name]=ValueIndex()
 
     def get(self, key):
         """
@@ -195,6 +331,19 @@ class IndexStore(object):
         else:
             return defer.maybeDeferred(row.get, "value")
 
+    def get_many(self, keys):
+        """
+        @see IStore.get_many
+        """
+        result = {}
+        for key in keys:
+            row = self.kvs.get(key, None)
+            if row is None:
+                result[key] = None
+            else:
+                result[key] = row.get("value")
+        return defer.succeed(result)
+
     def put(self, key, value, index_attributes=None):
         """
         @see IStore.put
@@ -207,6 +356,20 @@ class IndexStore(object):
         self._update_index(key, index_attributes)
                         
         return defer.maybeDeferred(self.kvs.update, {key: dict({"value":value},**index_attributes)})        
+
+    def put_many(self, items):
+        """
+        @see IIndexStore.put_many
+        """
+        def put_rows():
+            for key, value, index_attributes in items:
+                if index_attributes is None:
+                    index_attributes = {}
+
+                self._update_index(key, index_attributes)
+                self.kvs[key] = dict({"value":value},**index_attributes)
+
+        return defer.maybeDeferred(put_rows)
     
     def remove(self, key):
         """
@@ -217,57 +380,150 @@ class IndexStore(object):
             del self.kvs[key]            
         return defer.succeed(None)
         
-    def query(self, query_predicates):
+    def query(self, query_predicates, columns=None):
         """
         Search for rows in the Cassandra instance.
     
         @param indexed_attributes is a dictionary with column:value mappings.
         Rows are returned that have columns set to the value specified in 
         the dictionary
+        @param columns is an optional list of the column names to return for each row
         
         @retVal A data structure representing Cassandra rows. See the class
         docstring for the description of the data structure.
         """
         log.debug("In query: predicates %s" % query_predicates)
 
-        predicates = query_predicates.get_predicates()
-
-        eq_filter = lambda x: x[2] == Query.EQ
-        preds_eq = filter(eq_filter, predicates)
-        keys = set()
-        if len(preds_eq) == 0:
-            raise IndexStoreError('Invalid arguments to IndexStore - must provide at least one equal to operator for search!')
-        else:
-            k,v,pred = preds_eq.pop()
-            kindex = self.indices.get(k, None)
-            if kindex:
-                keys.update(kindex.get(v,set()))
-
-        for k,v,p in predicates:
-
-            kindex = self.indices.get(k,None)
-            if p == Query.EQ:
-                
-                if kindex:
-                    keys.intersection_update(kindex.get(v,set()))
-            elif p == Query.GT:
-                
-                matches = set()
-                for attr_val in kindex.keys():
-                    if attr_val > v:
-                        matches.update(kindex.get(attr_val,set()))
-                keys.intersection_update(matches)
+        keys = self._query_keys(query_predicates)
 
         #log.debug("keys: "+ str(keys))
         result = {}
         for k in keys:
             # This is stupid, but now remove effectively works - delete keys are no longer visible!
             if self.kvs.has_key(k):
-                result[k] = self.kvs.get(k).copy()
+                result[k] = self._project_row(self.kvs.get(k), columns)
 
         log.debug("Query Results: %s" % result)
 
-        return defer.succeed(result)                
+        return defer.succeed(result)
+
+    def query_iter(self, query_predicates, page_size=1000, columns=None):
+        """
+        @see IIndexStore.query_iter
+        Pages are returned in key order.
+        """
+        log.debug("In query_iter: predicates %s" % query_predicates)
+
+        keys = sorted(self._query_keys(query_predicates))
+
+        def query_page(start_key, count):
+            start = 0
+            if start_key is not None:
+                start = bisect.bisect_right(keys, start_key)
+
+            rows = []
+            for k in keys[start:]:
+                if len(rows) >= count:
+                    break
+                if self.kvs.has_key(k):
+                    rows.append((k, self._project_row(self.kvs.get(k), columns)))
+
+            return rows
+
+        return iter_query_pages(query_page, page_size)
+
+    def _query_keys(self, query_predicates):
+        """
+        Find the set of keys which match the query predicates using the indices.
+        The most selective equal to predicate gives the candidate keys and the others are intersected with them from
+        the smallest up. An equal to predicate on an attribute without an index is ignored, unless it is the last one,
+        which gives no keys. Range predicates either check the indexed values of each candidate key or, when the
+        candidates outnumber the keys in the range, are intersected with the keys of the values found by bisection of
+        the sorted index.
+        """
+        predicates = query_predicates.get_predicates()
+
+        preds_eq = []
+        ranges = {}
+        last_eq = None
+        for k,v,p in predicates:
+            if p == Query.EQ:
+                last_eq = k
+                kindex = self.indices.get(k, None)
+                if kindex is not None:
+                    keys = kindex.get(v, set())
+                    preds_eq.append((len(keys), keys))
+            else:
+                # Combine the bounds on each attribute into one range
+                bounds = ranges.setdefault(k, [None, None])
+                if p == Query.GT:
+                    if bounds[0] is None or v > bounds[0]:
+                        bounds[0] = v
+                elif p == Query.LT:
+                    if bounds[1] is None or v < bounds[1]:
+                        bounds[1] = v
+                else:
+                    raise IndexStoreError('Invalid predicate type for an IndexStore query: %s' % p)
+
+        if last_eq is None:
+            raise IndexStoreError('Invalid arguments to IndexStore - must provide at least one equal to operator for search!')
+
+        if last_eq not in self.indices:
+            return set()
+
+        preds_eq.sort(key=lambda pred: pred[0])
+        keys = set(preds_eq[0][1])
+        for n, eq_keys in preds_eq[1:]:
+            if not keys:
+                break
+            keys.intersection_update(eq_keys)
+
+        for k, (lower, upper) in ranges.items():
+            if not keys:
+                break
+
+            kindex = self.indices.get(k, None)
+            if kindex is None:
+                raise IndexStoreError('Invalid arguments to IndexStore - %s is not indexed for a range predicate!' % k)
+
+            if isinstance(kindex, ValueIndex):
+                values = kindex.range_values(lower, upper)
+            else:
+                values = [val for val in kindex.keys()
+                          if (lower is None or val > lower) and (upper is None or val < upper)]
+
+            # Count the keys in the range only as far as needed to know whether there are more than the candidates
+            range_count = 0
+            for val in values:
+                range_count += len(kindex.get(val))
+                if range_count >= len(keys):
+                    break
+
+            if isinstance(kindex, ValueIndex) and len(keys) <= range_count:
+                # Fewer candidates than keys in the range - check the values each candidate is indexed under
+                matches = set()
+                for key in keys:
+                    for val in kindex.values_by_key.get(key, ()):
+                        if (lower is None or val > lower) and (upper is None or val < upper):
+                            matches.add(key)
+                            break
+            else:
+                matches = set()
+                for val in values:
+                    matches.update(kindex.get(val))
+
+            keys.intersection_update(matches)
+
+        return keys
+
+    def _project_row(self, row, columns):
+        """
+        Copy a row - only the requested columns if a list of columns is given
+        """
+        if columns is None:
+            return row.copy()
+
+        return dict([(name, row[name]) for name in columns if row.has_key(name)])
     
     def _update_index(self, key, index_attributes):
         log.debug("In _update_index: key %s index_attributes %s" % (key,index_attributes))
@@ -290,8 +546,7 @@ class IndexStore(object):
 
             for k,v in changed_attrs.items():
                 kindex = self.indices.get(k)
-                # Create a set of keys if it does not already exist
-                kindex[v].discard(key)
+                kindex.discard(v, key)
 
 
         for k, v in index_attributes.items():
@@ -300,8 +555,7 @@ class IndexStore(object):
             #    kindex = {}
             #    self.indices[k] = kindex
             # Create a set of keys if it does not already exist
-            kindex[v] = kindex.get(v, set())
-            kindex[v].add(key)
+            kindex.add(v, key)
     
 
     def update_index(self, key, index_attributes):
@@ -339,6 +593,7 @@ class Query:
     
     EQ = "EQ"
     GT = "GT"
+    LT = "LT"
     def __init__(self):
         self._predicates = []
 
@@ -354,6 +609,9 @@ class Query:
     
     def add_predicate_gt(self, name, value):
         self._predicates.append((name,value,Query.GT))
+
+    def add_predicate_lt(self, name, value):
+        self._predicates.append((name,value,Query.LT))
         
     def get_predicates(self):
         return self._predicates    
@@ -175,6 +175,14 @@ class StoreServiceClient(ServiceClient):
 
         defer.returnValue(content)
 
+    @defer.inlineCallbacks
+    def put_many(self, items):
+        """
+        The service has no batch put operation - issue the puts concurrently
+        """
+        log.info("Called Store Service client: put_many")
+        yield defer.gatherResults([self.put(key, value) for key, value in items])
+
 
     @defer.inlineCallbacks
     def get(self, key):
@@ -188,6 +196,16 @@ class StoreServiceClient(ServiceClient):
             defer.returnValue(result.value)
         else:
             defer.returnValue(None)
+
+    @defer.inlineCallbacks
+    def get_many(self, keys):
+        """
+        The service has no multi-get operation - issue the gets concurrently
+        """
+        log.info("Called Store Service client: get_many")
+        keys = list(keys)
+        values = yield defer.gatherResults([self.get(key) for key in keys])
+        defer.returnValue(dict(zip(keys, values)))
         
     @defer.inlineCallbacks
     def remove(self, key):
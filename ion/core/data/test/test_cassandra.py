@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""
+@file ion/core/data/test/test_cassandra.py
+@test Test the Cassandra connection pool - these tests do not connect to a cluster
+"""
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from ion.core.data.cassandra import CassandraConnectionPool, CassandraError
+
+
+class Host(object):
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+
+class PersistentTechnology(object):
+
+    def __init__(self, *hosts):
+        self.hosts = [Host(host, port) for host, port in hosts]
+
+
+class FakeConnector(object):
+
+    def disconnect(self):
+        pass
+
+
+class CassandraConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.credentials = {'username':'ooiuser', 'password':'oceans11'}
+        self.technology = PersistentTechnology(('host1', 9160), ('host2', 9160), ('host3', 9161))
+
+    def tearDown(self):
+        CassandraConnectionPool._pools.clear()
+
+    def test_get_pool(self):
+
+        pool = CassandraConnectionPool.get_pool(self.technology, 'keyspace', self.credentials)
+
+        # The same cluster and keyspace share one pool
+        self.assertIdentical(CassandraConnectionPool.get_pool(self.technology, 'keyspace', self.credentials), pool)
+
+        other = CassandraConnectionPool.get_pool(self.technology, 'other_keyspace', self.credentials)
+        self.assertNotIdentical(other, pool)
+
+        # Other credentials for the same user do not share the authenticated pool
+        wrong = CassandraConnectionPool.get_pool(self.technology, 'keyspace', {'username':'ooiuser', 'password':'wrong'})
+        self.assertNotIdentical(wrong, pool)
+
+    def test_closed_pool(self):
+
+        pool = CassandraConnectionPool.get_pool(self.technology, 'keyspace', self.credentials)
+        self.patch(pool.factory, 'shutdown', lambda: None)
+
+        # No connections are made when there are already connectors
+        pool._connectors.append(FakeConnector())
+        pool.connect()
+        pool.connect()
+        pool.disconnect()
+        self.assertFalse(pool.closed)
+        self.assertIdentical(CassandraConnectionPool.get_pool(self.technology, 'keyspace', self.credentials), pool)
+
+        # The last user closes the pool - the next caller gets a new one
+        pool.disconnect()
+        self.assertTrue(pool.closed)
+        self.assertRaises(CassandraError, pool.connect)
+
+        new_pool = CassandraConnectionPool.get_pool(self.technology, 'keyspace', self.credentials)
+        self.assertNotIdentical(new_pool, pool)
+        self.assertFalse(new_pool.closed)
+
+    def test_round_robin(self):
+
+        pool = CassandraConnectionPool.get_pool(self.technology, 'keyspace', self.credentials)
+
+        addresses = [pool._next_address() for i in range(4)]
+        self.assertEqual(addresses, [('host1', 9160), ('host2', 9160), ('host3', 9161), ('host1', 9160)])
+
+    def test_no_hosts(self):
+        self.assertRaises(CassandraError, CassandraConnectionPool, [], 'keyspace', self.credentials)
+
+    def test_submit_cap(self):
+
+        pool = CassandraConnectionPool([('host1', 9160)], 'keyspace', self.credentials, pool_size=1, max_outstanding_requests=2)
+
+        requests = [defer.Deferred() for i in range(3)]
+        results = []
+        for d in requests:
+            pool.submit(lambda d=d: d).addCallback(results.append)
+
+        # Only two requests are handed to the factory - the third waits in the pool
+        self.assertEqual(pool.wait_stats.t_count, 2)
+
+        requests[0].callback('first')
+        self.assertEqual(results, ['first'])
+        self.assertEqual(pool.wait_stats.t_count, 3)
+        self.assertEqual(pool.request_stats.t_count, 1)
+
+        requests[2].callback('third')
+        requests[1].callback('second')
+        self.assertEqual(results, ['first', 'third', 'second'])
+        self.assertEqual(pool.request_stats.t_count, 3)
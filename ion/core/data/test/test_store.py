@@ -95,6 +95,35 @@ class IStoreTest(unittest.TestCase):
         defer.returnValue(None)
 
 
+    @defer.inlineCallbacks
+    def test_get_many(self):
+        key2 = object_utils.sha1bin(str(uuid4()))
+        value2 = object_utils.sha1bin(str(uuid4()))
+        missing = object_utils.sha1bin(str(uuid4()))
+
+        yield self.ds.put(self.key, self.value)
+        yield self.ds.put(key2, value2)
+
+        result = yield self.ds.get_many([self.key, key2, missing])
+        self.assertEqual(result, {self.key:self.value, key2:value2, missing:None})
+
+    @defer.inlineCallbacks
+    def test_put_many(self):
+        key2 = object_utils.sha1bin(str(uuid4()))
+        value2 = object_utils.sha1bin(str(uuid4()))
+
+        yield self.ds.put_many([(self.key, self.value), (key2, value2)])
+
+        b = yield self.ds.get(self.key)
+        self.failUnlessEqual(self.value, b)
+        b = yield self.ds.get(key2)
+        self.failUnlessEqual(value2, b)
+
+    @defer.inlineCallbacks
+    def test_get_many_empty(self):
+        result = yield self.ds.get_many([])
+        self.assertEqual(result, {})
+
     @defer.inlineCallbacks
     def test_has_key(self):
         yield self.ds.put(self.key, self.value)
@@ -293,8 +322,166 @@ class IndexStoreTest(IStoreTest):
             self.assertIn(key, rows['htayler'])
 
 
+    # Tests column projection
+    @defer.inlineCallbacks
+    def test_query_columns(self):
+
+        query = Query()
+        query.add_predicate_eq('state','UT')
+
+        rows = yield self.ds.query(query, columns=['full_name'])
+
+        log.info("Rows returned %s " % (rows,))
+        self.assertEqual(len(rows),3)
+        self.assertEqual(rows['bsanderson'], {'full_name':self.d1['full_name']})
+        self.assertEqual(rows['jstewart'], {'full_name':self.d4['full_name']})
+
+
+    # Tests paging through the results
+    @defer.inlineCallbacks
+    def test_query_iter(self):
+
+        query = Query()
+        query.add_predicate_eq('state','UT')
+
+        pages = []
+        for page in self.ds.query_iter(query, page_size=2):
+            rows = yield page
+            pages.append(rows)
+
+        log.info("Pages returned %s " % (pages,))
+        self.assertEqual([len(rows) for rows in pages], [2,1])
+
+        result = {}
+        for rows in pages:
+            result.update(rows)
+
+        self.assertEqual(sorted(result.keys()), ['bsanderson', 'htayler', 'jstewart'])
+        self.assertEqual(result['htayler']['value'], self.binary_value3)
+
+    # Tests paging with projection when everything fits in one page
+    @defer.inlineCallbacks
+    def test_query_iter_columns(self):
+
+        query = Query()
+        query.add_predicate_gt('birth_date','')
+        query.add_predicate_eq('state','UT')
+
+        pages = []
+        for page in self.ds.query_iter(query, columns=['birth_date']):
+            rows = yield page
+            pages.append(rows)
+
+        self.assertEqual(len(pages),1)
+        self.assertEqual(pages[0], {'bsanderson':{'birth_date':self.d1['birth_date']},
+                                    'htayler':{'birth_date':self.d3['birth_date']}})
+
+    # Tests less than and a range on one attribute
+    @defer.inlineCallbacks
+    def test_query_less_and_range(self):
+
+        query = Query()
+        query.add_predicate_lt('birth_date','1974')
+        query.add_predicate_eq('state','UT')
+        rows = yield self.ds.query(query)
+        self.assertEqual(rows.keys(), ['htayler'])
+
+        query = Query()
+        query.add_predicate_gt('birth_date','1968')
+        query.add_predicate_lt('birth_date','1976')
+        query.add_predicate_gt('full_name','')
+        query.add_predicate_eq('state','UT')
+        rows = yield self.ds.query(query)
+        self.assertEqual(rows.keys(), ['bsanderson'])
+
+    # Tests range predicates which match more rows than the equal to predicate
+    @defer.inlineCallbacks
+    def test_query_greater_many_values(self):
+
+        for i in range(50):
+            yield self.ds.put('reader%d' % i, 'BinaryValue for reader %d' % i,
+                              {'full_name':'Reader %d' % i, 'birth_date':str(1950 + i), 'state':'MD'})
+
+        query = Query()
+        query.add_predicate_gt('birth_date','1990')
+        query.add_predicate_eq('state','MD')
+        rows = yield self.ds.query(query)
+        self.assertEqual(sorted(rows.keys()), sorted(['reader%d' % i for i in range(41, 50)]))
+
+        # An updated row is found by its new value only
+        yield self.ds.update_index('reader45', {'birth_date':'1960'})
+        rows = yield self.ds.query(query)
+        self.assertEqual(len(rows), 8)
+        self.assertNotIn('reader45', rows)
+
+        query = Query()
+        query.add_predicate_gt('birth_date','1940')
+        query.add_predicate_lt('birth_date','1962')
+        query.add_predicate_eq('state','MD')
+        rows = yield self.ds.query(query)
+        self.assertEqual(len(rows), 13)
+
+    # Tests that range predicates use the indexed values whichever way the query is planned
+    @defer.inlineCallbacks
+    def test_query_range_stale_row(self):
+
+        for i in range(50):
+            yield self.ds.put('reader%d' % i, 'BinaryValue for reader %d' % i,
+                              {'full_name':'Reader %d' % i, 'birth_date':str(1950 + i), 'state':'MD'})
+
+        # The index now differs from the stored row
+        yield self.ds.update_index('htayler', {'birth_date':'1990'})
 
+        # Fewer candidates than keys in the range - the candidates are checked
+        query = Query()
+        query.add_predicate_gt('birth_date','1980')
+        query.add_predicate_eq('state','UT')
+        rows = yield self.ds.query(query)
+        self.assertEqual(rows.keys(), ['htayler'])
 
+        query = Query()
+        query.add_predicate_gt('birth_date','1960')
+        query.add_predicate_lt('birth_date','1970')
+        query.add_predicate_eq('state','UT')
+        rows = yield self.ds.query(query)
+        self.assertEqual(rows.keys(), [])
+
+        # More candidates than keys in the range - the keys of the range are used
+        query = Query()
+        query.add_predicate_gt('birth_date','1989')
+        query.add_predicate_lt('birth_date','1991')
+        query.add_predicate_eq('state','UT')
+        rows = yield self.ds.query(query)
+        self.assertEqual(rows.keys(), ['htayler'])
+
+    # Tests equal to predicates on an attribute without an index
+    @defer.inlineCallbacks
+    def test_query_not_indexed(self):
+
+        query = Query()
+        query.add_predicate_eq('nickname','Tayler')
+        query.add_predicate_eq('state','UT')
+        rows = yield self.ds.query(query)
+        self.assertEqual(sorted(rows.keys()), ['bsanderson', 'htayler', 'jstewart'])
+
+        query = Query()
+        query.add_predicate_eq('state','UT')
+        query.add_predicate_eq('nickname','Tayler')
+        rows = yield self.ds.query(query)
+        self.assertEqual(rows, {})
+
+    # Tests that query results are copies of the stored rows
+    @defer.inlineCallbacks
+    def test_query_copies(self):
+
+        query = Query()
+        query.add_predicate_eq('state','WI')
+        rows = yield self.ds.query(query)
+        self.assertEqual(rows['prothfuss'], dict(self.d2, value=self.binary_value2))
+
+        rows['prothfuss'].pop('value')
+        rows = yield self.ds.query(query)
+        self.assertEqual(rows['prothfuss']['value'], self.binary_value2)
 
     @defer.inlineCallbacks
     def put_stuff_for_tests(self):
@@ -340,6 +527,22 @@ class IndexStoreTest(IStoreTest):
 
 
 
+    @defer.inlineCallbacks
+    def test_put_many(self):
+
+        yield self.ds.put_many([('bsanderson', self.binary_value2, self.d2),
+                                ('prothfuss', self.binary_value1, self.d1)])
+
+        val1 = yield self.ds.get('bsanderson')
+        val2 = yield self.ds.get('prothfuss')
+        self.failUnlessEqual(val1, self.binary_value2)
+        self.failUnlessEqual(val2, self.binary_value1)
+
+        query = Query()
+        query.add_predicate_eq('full_name', self.d1['full_name'])
+        rows = yield self.ds.query(query)
+        self.assertEqual(rows.keys(), ['prothfuss'])
+
     @defer.inlineCallbacks
     def test_update_index_blank(self):
 
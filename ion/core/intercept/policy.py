@@ -20,14 +20,15 @@ from ion.core.messaging.message_client import MessageInstance
 from ion.core.process.cprocess import Invocation
 
 import time
+import weakref
+from collections import deque
 
 from ion.util.config import Config
+from ion.core.messaging.receiver import FanoutReceiver
 
 from ion.services.coi.datastore_bootstrap.ion_preload_config \
     import OWNED_BY_ID, HAS_ROLE_ID, ROLE_NAMES_BY_ID, ROLE_IDS_BY_NAME
-from ion.services.dm.inventory.association_service import AssociationServiceClient, ASSOCIATION_QUERY_MSG_TYPE
-from ion.services.dm.inventory.association_service import IDREF_TYPE
-from ion.core.messaging.message_client import MessageClient
+from ion.services.dm.inventory.association_service import AssociationServiceClient
 
 from google.protobuf.internal.containers import RepeatedScalarFieldContainer
 
@@ -69,8 +70,47 @@ def construct_policy_lists(policydb):
         raise ex
     return thedict
 
+class OperationPolicy(object):
+    """
+    The roles allowed to invoke one service operation. Split up when the policy
+    database is loaded so that matching a user costs one set lookup per role of
+    the user rather than a user_has_role call per role of the operation.
+    """
+    __slots__ = ('roles', 'anonymous', 'authenticated', 'owner', 'user_roles', 'resources')
+
+    def __init__(self, roles, resources):
+        self.roles = roles
+        self.anonymous = 'ANONYMOUS' in roles
+        self.authenticated = 'AUTHENTICATED' in roles
+        # Will be special handled within the policy flow
+        self.owner = 'OWNER' in roles
+        # The roles which are mapped to users by map_ooi_id_to_role
+        self.user_roles = frozenset(roles) - frozenset(['ANONYMOUS', 'AUTHENTICATED', 'OWNER'])
+        self.resources = resources
+
+    def match_role(self, ooi_id):
+        """
+        @retval the role of the user which allows the operation, or None
+        """
+        if self.anonymous:
+            return 'ANONYMOUS'
+        if self.authenticated and ooi_id != 'ANONYMOUS':
+            return 'AUTHENTICATED'
+        for role in user_role_dict.get(ooi_id, ()):
+            if role in self.user_roles:
+                return role
+        return None
+
+def construct_operation_policies(policy_dict):
+    policies = {}
+    for service, service_dict in policy_dict.iteritems():
+        for opname, op_dict in service_dict.iteritems():
+            policies[(service, opname)] = OperationPolicy(op_dict['roles'], op_dict['resources'])
+    return policies
+
 policydb_filename = ioninit.adjust_dir(CONF.getValue('policydecisionpointdb'))
 policy_dictionary = construct_policy_lists(Config(policydb_filename).getObject())
+operation_policies = construct_operation_policies(policy_dictionary)
 
 def construct_user_role_lists(userroledict):
     roles = userroledict['roles']
@@ -176,7 +216,111 @@ def load_roles_from_associations(asc):
     for user_id, role_id in role_map.iteritems():
         map_ooi_id_to_role(user_id, ROLE_NAMES_BY_ID[role_id])
 
+class DecisionCache(object):
+    """
+    Policy decisions keyed by (user id, resource id, predicate). At most max_size
+    decisions are kept, each for ttl seconds, and the decisions about a resource
+    are dropped as soon as its associations change.
+    """
+
+    def __init__(self, max_size=10000, ttl=60, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+
+        # (user_id, resource_id, predicate) -> (expiry time, decision)
+        self._decisions = {}
+        # Keys in the order they were cached - the oldest is evicted first
+        self._order = deque()
+        # resource_id -> set of keys
+        self._by_resource = {}
+        # Keys of invalidated decisions which are still in the order
+        self._invalidated = set()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, resource_id, predicate):
+        """
+        @retval the cached decision, or None if there is none or it expired
+        """
+        entry = self._decisions.get((user_id, resource_id, predicate))
+        if entry is None or entry[0] <= self._clock():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user_id, resource_id, predicate, decision):
+        if self.max_size <= 0:
+            return
+
+        key = (user_id, resource_id, predicate)
+        if key not in self._decisions:
+            if key in self._invalidated:
+                # Do not leave the key in the order twice - the old entry would evict the new decision early
+                self._invalidated.discard(key)
+                self._order.remove(key)
+            self._order.append(key)
+            self._by_resource.setdefault(resource_id, set()).add(key)
+        self._decisions[key] = (self._clock() + self.ttl, decision)
+
+        while len(self._decisions) > self.max_size:
+            self._forget(self._order.popleft())
+
+        # Keys of invalidated decisions stay in the order until they come up - compact it now and then
+        if len(self._order) > 2 * self.max_size:
+            self._order = deque([key for key in self._order if key in self._decisions])
+            self._invalidated.clear()
+
+    def invalidate_resource(self, resource_id):
+        for key in self._by_resource.pop(resource_id, ()):
+            del self._decisions[key]
+            self._invalidated.add(key)
+
+    def clear(self):
+        self._decisions.clear()
+        self._order.clear()
+        self._by_resource.clear()
+        self._invalidated.clear()
+
+    def __len__(self):
+        return len(self._decisions)
+
+    def _forget(self, key):
+        if self._decisions.pop(key, None) is None:
+            self._invalidated.discard(key)
+            return
+        keys = self._by_resource.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_resource[key[1]]
+
+decision_cache = DecisionCache(CONF.getValue('decision_cache_size', 10000), CONF.getValue('decision_cache_ttl', 60))
+
+# The identity registry broadcast which keeps the policy caches of all containers current
+broadcast_name = 'identity_registry_broadcast'
+
+def invalidate_owner_decisions(resource_ids):
+    for resource_id in resource_ids:
+        decision_cache.invalidate_resource(resource_id)
+
+def broadcast_owner_changes(process, resource_ids):
+    """
+    @brief Drop the cached ownership decisions about these resources in this and all other containers
+    @param process the process to send the broadcast from
+    """
+    invalidate_owner_decisions(resource_ids)
+    broadcast_target = process.get_scoped_name(FanoutReceiver.SCOPE_SYSTEM, broadcast_name)
+    return process.send(broadcast_target, 'broadcast', {'op': 'owner_changed', 'resource-ids': list(resource_ids)})
+
 class PolicyInterceptor(EnvelopeInterceptor):
+    def __init__(self, *args, **kwargs):
+        EnvelopeInterceptor.__init__(self, *args, **kwargs)
+        # Association service clients of the processes which received owner protected requests
+        self._asc_clients = weakref.WeakKeyDictionary()
+
     def before(self, invocation):
         msg = invocation.content
         return self.is_authorized(msg, invocation)
@@ -250,53 +394,42 @@ class PolicyInterceptor(EnvelopeInterceptor):
 
         operation = msg['op']
 
-        log.info('Policy Interceptor: Authorization request for service [%s] operation [%s] user_id [%s] expiry [%s]' % (service, operation, user_id, expiry))
-        if service in policy_dictionary:
-            service_list = policy_dictionary[service]
-            # TODO figure out how to handle non-wildcard resource ids
-            if operation in service_list:
-                role_entry = service_list[operation]['roles']
-                log.info('Policy Interceptor: Policy tuple [%s]' % str(role_entry))
-
-                role_match_found = False
-                for role in role_entry:
-                    if user_has_role(user_id, role):
-                        log.info('Policy Interceptor: Role <%s> authentication matches' % role)
-                        role_match_found = True
-                        break
-
-                if role_match_found == False:
-                    # Special handling for ownership role
-                    # ANONYMOUS can never own a resource, so return fail
-                    if user_id == 'ANONYMOUS':
-                        log.warn('Policy Interceptor: Authentication failed for service [%s] operation [%s] resource [%s] user_id [%s] expiry [%s] for roles [%s]. Returning Not Authorized.' % (service, operation, '*', user_id, expiry, str(role_entry)))
-                        invocation.drop(note='Not authorized', code=Invocation.CODE_UNAUTHORIZED)
+        log.info('Policy Interceptor: Authorization request for service [%s] operation [%s] user_id [%s] expiry [%s]', service, operation, user_id, expiry)
+        policy = operation_policies.get((service, operation), None)
+        # TODO figure out how to handle non-wildcard resource ids
+        if policy is not None:
+            role_entry = policy.roles
+            log.info('Policy Interceptor: Policy tuple [%s]', role_entry)
+
+            role = policy.match_role(user_id)
+            if role is not None:
+                log.info('Policy Interceptor: Role <%s> authentication matches', role)
+            else:
+                # Special handling for ownership role
+                # ANONYMOUS can never own a resource, so return fail
+                if user_id == 'ANONYMOUS':
+                    log.warn('Policy Interceptor: Authentication failed for service [%s] operation [%s] resource [%s] user_id [%s] expiry [%s] for roles [%s]. Returning Not Authorized.' % (service, operation, '*', user_id, expiry, str(role_entry)))
+                    invocation.drop(note='Not authorized', code=Invocation.CODE_UNAUTHORIZED)
+                    defer.returnValue(invocation)
+
+                if policy.owner:
+                    return_uuid_list = self.find_uuids(invocation, msg, user_id, policy.resources)
+                    if invocation.status != Invocation.STATUS_PROCESS:
+                        log.warn('Policy Interceptor: Authentication failed for service [%s] operation [%s] resource [%s] user_id [%s] expiry [%s] for role [OWNER].' % (service, operation, '*', user_id, expiry))
                         defer.returnValue(invocation)
 
-                    isOwnershipPolicy = False
-                    for role in role_entry:
-                        if role == 'OWNER':
-                            isOwnershipPolicy = True
-                            break
-
-                    if isOwnershipPolicy == True:
-                        return_uuid_list = self.find_uuids(invocation, msg, user_id, service_list[operation]['resources'])
-                        if invocation.status != Invocation.STATUS_PROCESS:
-                            log.warn('Policy Interceptor: Authentication failed for service [%s] operation [%s] resource [%s] user_id [%s] expiry [%s] for role [OWNER].' % (service, operation, '*', user_id, expiry))
-                            defer.returnValue(invocation)
-                            
-                        yield self.check_owner(user_id, return_uuid_list, invocation)
-                        if invocation.status != Invocation.STATUS_PROCESS:
-                            log.warn('Policy Interceptor: Authentication failed for service [%s] operation [%s] resource [%s] user_id [%s] expiry [%s] for role [OWNER].' % (service, operation, '*', user_id, expiry))
-                            defer.returnValue(invocation)
-                        else:
-                            log.info('Policy Interceptor: Role <OWNER> authentication matches')
-                    else:
-                        log.warn('Policy Interceptor: Authentication failed for service [%s] operation [%s] resource [%s] user_id [%s] expiry [%s] for roles [%s]. Returning Not Authorized.' % (service, operation, '*', user_id, expiry, str(role_entry)))
-                        invocation.drop(note='Not authorized', code=Invocation.CODE_UNAUTHORIZED)
+                    yield self.check_owner(user_id, return_uuid_list, invocation)
+                    if invocation.status != Invocation.STATUS_PROCESS:
+                        log.warn('Policy Interceptor: Authentication failed for service [%s] operation [%s] resource [%s] user_id [%s] expiry [%s] for role [OWNER].' % (service, operation, '*', user_id, expiry))
                         defer.returnValue(invocation)
-            else:
-                log.info('Policy Interceptor: operation not in policy dictionary.')
+                    else:
+                        log.info('Policy Interceptor: Role <OWNER> authentication matches')
+                else:
+                    log.warn('Policy Interceptor: Authentication failed for service [%s] operation [%s] resource [%s] user_id [%s] expiry [%s] for roles [%s]. Returning Not Authorized.' % (service, operation, '*', user_id, expiry, str(role_entry)))
+                    invocation.drop(note='Not authorized', code=Invocation.CODE_UNAUTHORIZED)
+                    defer.returnValue(invocation)
+        elif service in policy_dictionary:
+            log.info('Policy Interceptor: operation not in policy dictionary.')
         else:
             log.info('Policy Interceptor: service not in policy dictionary.')
 
@@ -314,31 +447,46 @@ class PolicyInterceptor(EnvelopeInterceptor):
 
     @defer.inlineCallbacks
     def check_owner(self, user_id, uuid_list, invocation):
-        self.mc = MessageClient(proc=invocation.process)
-        self.asc = AssociationServiceClient(proc=invocation.process)
-
-        for uuid in uuid_list:        
-            request = yield self.mc.create_instance(ASSOCIATION_QUERY_MSG_TYPE)
-
-            request.object = request.CreateObject(IDREF_TYPE)
-            request.object.key = user_id
-
-            request.predicate = request.CreateObject(IDREF_TYPE)
-            request.predicate.key = OWNED_BY_ID
-
-            request.subject = request.CreateObject(IDREF_TYPE)
-            request.subject.key = uuid
-
-            # make the request
-            log.warn('Calling association service for user id <%s> and uuid <%s>' % (user_id, uuid))
-            result = yield self.asc.association_exists(request)
-            log.warn('Return from association service call for user id <%s> and uuid <%s>' % (user_id, uuid))
-            if result.result == False:
+        """
+        Checks that the user owns all the resources. Decisions which are not
+        cached are made with one association query for all the resources.
+        """
+        unknown = []
+        for uuid in uuid_list:
+            owned = decision_cache.get(user_id, uuid, OWNED_BY_ID)
+            if owned is None:
+                if uuid not in unknown:
+                    unknown.append(uuid)
+            elif not owned:
                 log.warn('Policy Interceptor: Authentication failed. User <%s> does not own resource <%s>.' % (user_id, uuid))
                 invocation.drop(note='Not authorized', code=Invocation.CODE_UNAUTHORIZED)
                 return
-            else:
-                log.warn('Policy Interceptor: User <%s> owns resource <%s>.' % (user_id, uuid))
+
+        if not unknown:
+            return
+
+        asc = self._asc_clients.get(invocation.process, None)
+        if asc is None:
+            asc = AssociationServiceClient(proc=invocation.process)
+            self._asc_clients[invocation.process] = asc
+
+        # make the request
+        log.info('Calling association service for user id <%s> and uuids <%s>' % (user_id, unknown))
+        owned_uuids = yield asc.subjects_with_association({'subjects': unknown, 'predicate': OWNED_BY_ID, 'object': user_id})
+        owned_uuids = set(owned_uuids)
+
+        not_owned = None
+        for uuid in unknown:
+            owned = uuid in owned_uuids
+            decision_cache.put(user_id, uuid, OWNED_BY_ID, owned)
+            if not owned and not_owned is None:
+                not_owned = uuid
+
+        if not_owned is not None:
+            log.warn('Policy Interceptor: Authentication failed. User <%s> does not own resource <%s>.' % (user_id, not_owned))
+            invocation.drop(note='Not authorized', code=Invocation.CODE_UNAUTHORIZED)
+        else:
+            log.info('Policy Interceptor: User <%s> owns resources <%s>.' % (user_id, unknown))
 
     def find_uuids(self, invocation, msg, user_id, resources):
         """
@@ -348,7 +496,7 @@ class PolicyInterceptor(EnvelopeInterceptor):
         to see if user is an owner of the resource.
         """
 
-        log.info('Policy Interceptor: In check_resource_ownership. Resources: <%s>' % str(resources))
+        log.info('Policy Interceptor: In check_resource_ownership. Resources: <%s>', resources)
         
         content = msg.get('content','')
         if isinstance(content, MessageInstance):
@@ -380,12 +528,12 @@ class PolicyInterceptor(EnvelopeInterceptor):
             obj = repo.get_linked_object(link)
             type = obj.ObjectType
             typeId = type.object_id
-            log.info('Policy Interceptor: In check_resource_ownership_traverse_gpbs.  Child type: <%s>' % str(typeId))
+            log.info('Policy Interceptor: In check_resource_ownership_traverse_gpbs.  Child type: <%s>', typeId)
             if typeId in resources:
                 log.info('Policy Interceptor: In check_resource_ownership_traverse_gpbs.  Child type match found in resources')
                 gpbMessage = obj.GPBMessage
                 uuid = getattr(gpbMessage,resources[typeId])
-                log.info('Policy Interceptor: In check_resource_ownership_traverse_gpbs.  GPB type: %s UUID: %s' % (str(typeId),uuid))
+                log.info('Policy Interceptor: In check_resource_ownership_traverse_gpbs.  GPB type: %s UUID: %s', typeId, uuid)
                 if not uuid:
                     log.error("Policy Interceptor: Rejecting improperly defined message missing expected uuid [%s]." % str(msg))
                     invocation.drop(note='Error: Uuid missing from message payload!', code=Invocation.CODE_BAD_REQUEST)
@@ -404,7 +552,7 @@ class PolicyInterceptor(EnvelopeInterceptor):
                     log.error("Policy Interceptor: Rejecting improperly defined message with unexpected uuid variable type [%s]." % str(msg))
                     invocation.drop(note='Error: Uuid variable type not supported!', code=Invocation.CODE_BAD_REQUEST)
                     return
-                log.info('Policy Interceptor: In check_resource_ownership_traverse_gpbs.  Added UUID: %s to return list' % uuid)
+                log.info('Policy Interceptor: In check_resource_ownership_traverse_gpbs.  Added UUID: %s to return list', uuid)
 
             log.info('Policy Interceptor: Recursing.')
             self.find_uuids_traverse_gpbs(invocation, msg, obj, repo, user_id, resources, uuid_list)
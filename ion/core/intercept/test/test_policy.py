@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""
+@file ion/core/intercept/test/test_policy.py
+@brief Tests for the decision cache and the precomputed operation policies of the policy interceptor
+"""
+
+from twisted.trial import unittest
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from ion.core.intercept import policy
+from ion.core.intercept.policy import DecisionCache, OperationPolicy, construct_policy_lists, \
+                                      construct_operation_policies, map_ooi_id_to_role, unmap_ooi_id_from_role
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class DecisionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = DecisionCache(max_size=3, ttl=10, clock=self.clock)
+
+    def test_get_put(self):
+        self.assertEqual(self.cache.get('user', 'res1', 'owned_by'), None)
+
+        self.cache.put('user', 'res1', 'owned_by', True)
+        self.cache.put('user', 'res2', 'owned_by', False)
+
+        self.assertEqual(self.cache.get('user', 'res1', 'owned_by'), True)
+        self.assertEqual(self.cache.get('user', 'res2', 'owned_by'), False)
+        self.assertEqual(self.cache.get('other', 'res1', 'owned_by'), None)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+    def test_expiry(self):
+        self.cache.put('user', 'res1', 'owned_by', True)
+
+        self.clock.now += 9
+        self.assertEqual(self.cache.get('user', 'res1', 'owned_by'), True)
+
+        self.clock.now += 1
+        self.assertEqual(self.cache.get('user', 'res1', 'owned_by'), None)
+
+    def test_bounded(self):
+        for i in range(5):
+            self.cache.put('user', 'res%d' % i, 'owned_by', True)
+
+        self.assertEqual(len(self.cache), 3)
+        # The oldest decisions are evicted first
+        self.assertEqual(self.cache.get('user', 'res0', 'owned_by'), None)
+        self.assertEqual(self.cache.get('user', 'res1', 'owned_by'), None)
+        self.assertEqual(self.cache.get('user', 'res4', 'owned_by'), True)
+
+    def test_invalidate_resource(self):
+        self.cache.put('user1', 'res1', 'owned_by', True)
+        self.cache.put('user2', 'res1', 'owned_by', False)
+        self.cache.put('user1', 'res2', 'owned_by', True)
+
+        self.cache.invalidate_resource('res1')
+        self.assertEqual(self.cache.get('user1', 'res1', 'owned_by'), None)
+        self.assertEqual(self.cache.get('user2', 'res1', 'owned_by'), None)
+        self.assertEqual(self.cache.get('user1', 'res2', 'owned_by'), True)
+
+        # Invalidated keys are not counted against the size
+        for i in range(3, 10):
+            self.cache.put('user1', 'res1', 'owned_by', True)
+            self.cache.invalidate_resource('res1')
+        self.cache.put('user1', 'res3', 'owned_by', True)
+        self.assertEqual(self.cache.get('user1', 'res2', 'owned_by'), True)
+        self.assertEqual(len(self.cache), 2)
+
+    def test_put_after_invalidate(self):
+        self.cache.put('user', 'res1', 'owned_by', True)
+        self.cache.put('user', 'res2', 'owned_by', True)
+        self.cache.invalidate_resource('res1')
+        self.cache.put('user', 'res3', 'owned_by', True)
+        self.cache.put('user', 'res1', 'owned_by', False)
+
+        # The decision put again is the newest - the oldest one is evicted instead
+        self.cache.put('user', 'res4', 'owned_by', True)
+        self.assertEqual(self.cache.get('user', 'res1', 'owned_by'), False)
+        self.assertEqual(self.cache.get('user', 'res2', 'owned_by'), None)
+        self.assertEqual(len(self.cache._order), 3)
+
+
+class OperationPolicyTest(unittest.TestCase):
+
+    policydb = [
+        ('ANONYMOUS', 'svc.op_any', '*'),
+        ('AUTHENTICATED', 'svc.op_user', '*'),
+        ('DATA_PROVIDER', 'svc.op_provider', '*'),
+        ('OWNER', 'svc.op_owner', {1: 'resource_id'}),
+    ]
+
+    def setUp(self):
+        self.policies = construct_operation_policies(construct_policy_lists(self.policydb))
+
+    def tearDown(self):
+        unmap_ooi_id_from_role('provider_user', 'DATA_PROVIDER')
+        unmap_ooi_id_from_role('admin_user', 'ADMIN')
+
+    def test_roles(self):
+        map_ooi_id_to_role('provider_user', 'DATA_PROVIDER')
+        map_ooi_id_to_role('admin_user', 'ADMIN')
+
+        op_any = self.policies[('svc', 'op_any')]
+        self.assertEqual(op_any.match_role('ANONYMOUS'), 'ANONYMOUS')
+
+        op_user = self.policies[('svc', 'op_user')]
+        self.assertEqual(op_user.match_role('ANONYMOUS'), None)
+        self.assertEqual(op_user.match_role('some_user'), 'AUTHENTICATED')
+
+        op_provider = self.policies[('svc', 'op_provider')]
+        self.assertEqual(op_provider.match_role('some_user'), None)
+        self.assertEqual(op_provider.match_role('provider_user'), 'DATA_PROVIDER')
+        self.assertEqual(op_provider.match_role('admin_user'), 'ADMIN')
+
+        unmap_ooi_id_from_role('provider_user', 'DATA_PROVIDER')
+        self.assertEqual(op_provider.match_role('provider_user'), None)
+
+    def test_owner(self):
+        op_owner = self.policies[('svc', 'op_owner')]
+        self.assertTrue(op_owner.owner)
+        self.assertEqual(op_owner.resources, {1: 'resource_id'})
+        # Ownership is checked separately - only the ADMIN role matches here
+        self.assertEqual(op_owner.match_role('some_user'), None)
+
+        self.assertFalse(self.policies[('svc', 'op_provider')].owner)
+
+    def test_policy_db(self):
+        # Every operation in the policy database has an entry
+        for service, service_dict in policy.policy_dictionary.iteritems():
+            for opname in service_dict:
+                self.assertTrue(isinstance(policy.operation_policies[(service, opname)], OperationPolicy))
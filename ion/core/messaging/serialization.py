@@ -5,6 +5,9 @@ Requires a json library (`cjson`_, `simplejson`_, or `Python 2.6+`_).
 Optionally installs support for ``YAML`` if the necessary
 PyYAML is installed.
 
+Also provides the ``sample_block`` columnar encoding of instrument sample
+data blocks (lists of sample dicts) and its text form for data block events.
+
 .. _`cjson`: http://pypi.python.org/pypi/python-cjson/
 .. _`simplejson`: http://code.google.com/p/simplejson/
 .. _`Python 2.6+`: http://docs.python.org/library/json.html
@@ -13,14 +16,31 @@ PyYAML is installed.
 """
 
 import codecs
+import struct
+import sys
+import re
+import calendar
+import base64
+from array import array
+
+try:
+    import json
+except:
+    import simplejson as json
 
-__all__ = ['SerializerNotInstalled', 'registry']
+__all__ = ['SerializerNotInstalled', 'registry', 'SampleBlockError',
+           'sample_block_dumps', 'sample_block_loads',
+           'encode_data_block', 'decode_data_block']
 
 
 class SerializerNotInstalled(StandardError):
     """Support for the requested serialization type is not installed"""
 
 
+class SampleBlockError(ValueError):
+    """The data is not a valid sample block"""
+
+
 class SerializerRegistry(object):
     """The registry keeps track of serialization methods."""
 
@@ -244,6 +264,265 @@ def register_pickle():
                       content_encoding='binary')
 
 
+#
+# Columnar encoding of instrument sample data blocks.
+#
+# A data block is a list of sample dicts, e.g. the samples of an SBE37:
+# [{'temperature':10.1, 'conductivity':1.2, 'pressure':3.4,
+#   'driver_time':'2011-06-01T10:00:00.123456'}, ...]
+# The sample block stores it by column: each key once, followed by the values
+# of all samples as a typed array. ISO 8601 time strings are stored as epoch
+# seconds and decoded as floats.
+#
+# Layout, little endian:
+#   'ISB' version(B) samples(I) columns(H)
+#   per column: name length(B) name type(c) masked(B) [presence bitmap] values
+# The presence bitmap, one bit per sample, is only present if some samples lack
+# the column. The values of the present samples are by column type:
+#   'd' float64, 't' epoch seconds as float64, 'q' int64, '?' bool as a byte,
+#   's' uint32 lengths then the utf-8 strings, 'j' uint32 length then a json list
+#   for columns not of one of the other types.
+#
+
+SAMPLE_BLOCK_MAGIC = 'ISB\x01'
+
+# The text form of a sample block in a data block event.
+DATA_BLOCK_PREFIX = 'isb:'
+
+_SWAP = sys.byteorder == 'big'
+
+_iso_time = re.compile(r'^(\d{4})-(\d\d)-(\d\d)T:?(\d\d):(\d\d):(\d\d(?:\.\d+)?)$')
+
+# Epoch seconds of the minutes seen, samples of a block share very few minutes.
+_minute_epochs = {}
+
+
+def _iso_to_epoch(value):
+    """
+    @retval The epoch seconds of an ISO 8601 UTC time string as written by the
+        instrument drivers, or None if the value is not one.
+    """
+    m = _iso_time.match(value)
+    if m is None:
+        return None
+    minute = value[:m.start(6)]
+    epoch = _minute_epochs.get(minute)
+    if epoch is None:
+        if len(_minute_epochs) > 10000:
+            _minute_epochs.clear()
+        t = m.groups()
+        epoch = calendar.timegm((int(t[0]), int(t[1]), int(t[2]), int(t[3]), int(t[4]), 0, 0, 0, 0))
+        _minute_epochs[minute] = epoch
+    return epoch + float(m.group(6))
+
+
+def _column_type(values):
+    """
+    @retval The sample block type of a column of values.
+    """
+    first = type(values[0])
+    for v in values:
+        if type(v) is not first:
+            return 'j'
+    if first is float:
+        return 'd'
+    if first is bool:
+        return '?'
+    if first is int or first is long:
+        for v in values:
+            if not -0x8000000000000000 <= v <= 0x7fffffffffffffff:
+                return 'j'
+        return 'q'
+    if first is str or first is unicode:
+        return 's'
+    return 'j'
+
+
+def _float_array(values):
+    a = array('d', values)
+    if _SWAP:
+        a.byteswap()
+    return a.tostring()
+
+
+def sample_block_dumps(samples):
+    """
+    Encode a list of sample dicts into a sample block.
+    @param samples a list of dicts with string keys.
+    @retval The sample block, a binary string.
+    """
+    if isinstance(samples, dict):
+        samples = [samples]
+    n = len(samples)
+
+    names = set()
+    for sample in samples:
+        names.update(sample)
+
+    parts = [SAMPLE_BLOCK_MAGIC, struct.pack('<IH', n, len(names))]
+    for name in sorted(names):
+        try:
+            values = [sample[name] for sample in samples]
+            indices = None
+        except KeyError:
+            # Some samples lack the column, keep the indices of the others.
+            indices = [i for i in xrange(n) if name in samples[i]]
+            values = [samples[i][name] for i in indices]
+        ctype = _column_type(values)
+
+        if ctype == 's' and _iso_to_epoch(values[0]) is not None:
+            epochs = [_iso_to_epoch(v) for v in values]
+            if None not in epochs:
+                ctype = 't'
+                values = epochs
+
+        bname = name.encode('utf-8')
+        if len(bname) > 255:
+            raise SampleBlockError('Sample key too long: %r' % name)
+        parts.append(struct.pack('<B', len(bname)))
+        parts.append(bname)
+        parts.append(ctype)
+
+        if indices is None:
+            parts.append('\x00')
+        else:
+            mask = array('B', [0]) * ((n + 7) // 8)
+            for i in indices:
+                mask[i >> 3] |= 1 << (i & 7)
+            parts.append('\x01')
+            parts.append(mask.tostring())
+
+        if ctype == 'd' or ctype == 't':
+            parts.append(_float_array(values))
+        elif ctype == 'q':
+            parts.append(struct.pack('<%dq' % len(values), *values))
+        elif ctype == '?':
+            parts.append(array('B', values).tostring())
+        elif ctype == 's':
+            strings = [v.encode('utf-8') for v in values]
+            lengths = array('I', [len(v) for v in strings])
+            if _SWAP:
+                lengths.byteswap()
+            parts.append(lengths.tostring())
+            parts.append(''.join(strings))
+        else:
+            data = json.dumps(values)
+            parts.append(struct.pack('<I', len(data)))
+            parts.append(data)
+
+    return ''.join(parts)
+
+
+def sample_block_loads(data):
+    """
+    Decode a sample block into a list of sample dicts. Time columns are
+    decoded as epoch seconds.
+    @param data a sample block as made by sample_block_dumps.
+    @retval A list of dicts.
+    @raises SampleBlockError if the data is not a valid sample block.
+    """
+    if data[:4] != SAMPLE_BLOCK_MAGIC:
+        raise SampleBlockError('Not a sample block')
+    try:
+        n, ncolumns = struct.unpack_from('<IH', data, 4)
+        pos = 10
+        samples = [{} for i in xrange(n)]
+
+        for c in xrange(ncolumns):
+            size = ord(data[pos])
+            name = data[pos + 1:pos + 1 + size]
+            pos += 1 + size
+            ctype = data[pos]
+            masked = data[pos + 1] != '\x00'
+            pos += 2
+
+            if masked:
+                masksize = (n + 7) // 8
+                mask = array('B', data[pos:pos + masksize])
+                pos += masksize
+                indices = [i for i in xrange(n) if mask[i >> 3] & (1 << (i & 7))]
+            else:
+                indices = xrange(n)
+            m = len(indices)
+
+            if ctype == 'd' or ctype == 't':
+                values = array('d')
+                values.fromstring(data[pos:pos + 8 * m])
+                if _SWAP:
+                    values.byteswap()
+                pos += 8 * m
+            elif ctype == 'q':
+                values = struct.unpack_from('<%dq' % m, data, pos)
+                pos += 8 * m
+            elif ctype == '?':
+                values = [v != 0 for v in array('B', data[pos:pos + m])]
+                pos += m
+            elif ctype == 's':
+                lengths = array('I')
+                lengths.fromstring(data[pos:pos + 4 * m])
+                if _SWAP:
+                    lengths.byteswap()
+                pos += 4 * m
+                values = []
+                for length in lengths:
+                    values.append(data[pos:pos + length].decode('utf-8'))
+                    pos += length
+            elif ctype == 'j':
+                size, = struct.unpack_from('<I', data, pos)
+                values = json.loads(data[pos + 4:pos + 4 + size])
+                pos += 4 + size
+            else:
+                raise SampleBlockError('Unknown column type %r' % ctype)
+
+            if len(values) != m:
+                raise SampleBlockError('Sample block truncated')
+            for i, v in zip(indices, values):
+                samples[i][name] = v
+
+    except (struct.error, IndexError, UnicodeDecodeError, ValueError), ex:
+        if isinstance(ex, SampleBlockError):
+            raise
+        raise SampleBlockError('Invalid sample block: %s' % ex)
+
+    return samples
+
+
+def encode_data_block(samples):
+    """
+    Encode a list of samples for the data_block field of a data block event.
+    The field is text, so the sample block is base64 encoded.
+    @param samples a list of sample dicts.
+    @retval The data block string.
+    """
+    return DATA_BLOCK_PREFIX + base64.b64encode(sample_block_dumps(samples))
+
+
+def decode_data_block(data_block):
+    """
+    Decode the data_block field of a data block event, as encoded by
+    encode_data_block or, as older publishers do, a json list of samples.
+    @param data_block the data block string.
+    @retval A list of sample dicts.
+    """
+    if data_block.startswith(DATA_BLOCK_PREFIX):
+        try:
+            data = base64.b64decode(data_block[len(DATA_BLOCK_PREFIX):])
+        except TypeError, ex:
+            raise SampleBlockError('Invalid data block: %s' % ex)
+        return sample_block_loads(data)
+    return json.loads(data_block)
+
+
+def register_sample_block():
+    """Register the columnar encoder/decoder for lists of instrument
+    samples."""
+    registry.register('sample_block', sample_block_dumps, sample_block_loads,
+                      content_type='application/x-ion-sample-block',
+                      content_encoding='binary')
+
+
+register_sample_block()
+
 # Register the base serialization methods.
 #register_json()
 #register_pickle()
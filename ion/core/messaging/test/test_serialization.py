@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""
+@file ion/core/messaging/test/test_serialization.py
+@brief Tests for the columnar sample block encoding of instrument data blocks
+"""
+
+import calendar
+
+from twisted.trial import unittest
+
+try:
+    import json
+except:
+    import simplejson as json
+
+from ion.core.messaging import serialization
+from ion.core.messaging.serialization import SampleBlockError, sample_block_dumps, sample_block_loads, \
+                                             encode_data_block, decode_data_block
+
+
+def sbe37_samples(count):
+    samples = []
+    for i in range(count):
+        samples.append({'temperature':10.0 + i / 8.0,
+                        'conductivity':1.25 * i,
+                        'pressure':-0.5,
+                        'salinity':34.5,
+                        'sound_velocity':1500.25,
+                        'device_time':'2011-06-01T:10:%02i:%02i' % (i / 60, i % 60),
+                        'driver_time':'2011-06-01T10:%02i:%02i.250000' % (i / 60, i % 60)})
+    return samples
+
+
+class SampleBlockTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        samples = sbe37_samples(100)
+        block = sample_block_dumps(samples)
+        decoded = sample_block_loads(block)
+
+        # Much smaller than the json of the samples
+        self.assertTrue(len(block) * 3 < len(json.dumps(samples)))
+
+        self.assertEqual(len(decoded), 100)
+        epoch = calendar.timegm((2011, 6, 1, 10, 0, 0, 0, 0, 0))
+        for i in range(100):
+            decoded_sample = decoded[i]
+            self.assertEqual(decoded_sample.pop('device_time'), epoch + i)
+            self.assertAlmostEqual(decoded_sample.pop('driver_time'), epoch + i + 0.25, 5)
+            sample = samples[i]
+            del sample['device_time']
+            del sample['driver_time']
+            self.assertEqual(decoded_sample, sample)
+
+    def test_column_types(self):
+        samples = [
+            {'n':1, 'flag':True, 'name':u'caf\xe9', 'mixed':1, 'sparse':1.5},
+            {'n':-2**40, 'flag':False, 'name':'sbe', 'mixed':'a'},
+            {'n':3, 'flag':True, 'name':'', 'mixed':[1, 2], 'sparse':2.5},
+        ]
+        decoded = sample_block_loads(sample_block_dumps(samples))
+        self.assertEqual(decoded, samples)
+        self.assertFalse('sparse' in decoded[1])
+
+        self.assertEqual(sample_block_loads(sample_block_dumps([])), [])
+        self.assertEqual(sample_block_loads(sample_block_dumps({'x':1.0})), [{'x':1.0}])
+
+    def test_invalid(self):
+        block = sample_block_dumps(sbe37_samples(10))
+        self.assertRaises(SampleBlockError, sample_block_loads, 'not a sample block')
+        self.assertRaises(SampleBlockError, sample_block_loads, block[:60])
+
+    def test_registry(self):
+        samples = sbe37_samples(3)
+        content_type, content_encoding, payload = serialization.encode(samples, serializer='sample_block')
+        self.assertEqual(content_type, 'application/x-ion-sample-block')
+        self.assertEqual(content_encoding, 'binary')
+        self.assertEqual(serialization.decode(payload, content_type, content_encoding), sample_block_loads(payload))
+
+    def test_data_block(self):
+        samples = sbe37_samples(5)
+        data_block = encode_data_block(samples)
+        # Safe for the text field of a data block event
+        data_block.decode('ascii')
+        self.assertEqual(decode_data_block(data_block), sample_block_loads(sample_block_dumps(samples)))
+
+        # Data blocks of older publishers are json
+        self.assertEqual(decode_data_block(json.dumps(samples)), samples)
@@ -20,6 +20,9 @@ from net.ooici.core.container import container_pb2
 from ion.core.object import object_utils
 from ion.core.messaging import message_client
 
+from ion.core import ioninit
+CONF = ioninit.config(__name__)
+
 ION_MESSAGE_TYPE = object_utils.create_type_identifier(object_id=11, version=1)
 
 STRUCTURE_ELEMENT_TYPE = object_utils.create_type_identifier(object_id=1, version=1)
@@ -106,7 +109,7 @@ def pack_structure(content):
     # extract the excluded_object_types list if we have one!
     excluded_object_types = []
     if hasattr(content, 'excluded_object_types') and len(content.excluded_object_types) > 0:
-        log.debug("Codec pack_structure has %d excluded_object_types" % len(content.excluded_object_types))
+        log.debug("Codec pack_structure has %d excluded_object_types", len(content.excluded_object_types))
         excluded_object_types = [x.GPBMessage for x in content.excluded_object_types]
 
     # Recurse through the DAG and add the keys to a set - obj_set.
@@ -179,18 +182,27 @@ def _pack_container(head, objects):
     log.debug('_pack_container: Packed container!')
     return cs
 
-def unpack_structure(serialized_container):
+def unpack_structure(serialized_container, lazy=None):
     """
     Take a serialized container object and load a repository with its contents
+
+    In lazy mode the content is indexed by key but each object is only loaded when it is first accessed, and the
+    commit recording the state of the message is skipped - it is made when the content is modified and committed.
     """
     log.debug('unpack_structure: Unpacking Structure!')
-    head, obj_dict = _unpack_container(serialized_container)
+    if lazy is None:
+        lazy = CONF.getValue('lazy_decode', False)
 
-    assert len(obj_dict) > 0, 'There should be objects in the container!'
+    head, obj_dict = _unpack_container(serialized_container, lazy)
 
     repo = repository.Repository()
 
-    repo.index_hash.update(obj_dict)
+    if lazy:
+        repo.index_hash = repository.LazyIndexHash(obj_dict)
+        repo.index_hash[head.key] = head
+    else:
+        assert len(obj_dict) > 0, 'There should be objects in the container!'
+        repo.index_hash.update(obj_dict)
 
     # Load the object and set it as the workspace root
     root_obj = repo._load_element(head)
@@ -201,19 +213,20 @@ def unpack_structure(serialized_container):
     # attempt to extract a list of excluded objects, if the message contains the field 'excluded_object_types'
     excluded_types = []
     if hasattr(root_obj, 'message_object') and hasattr(root_obj.message_object, 'excluded_object_types'):
-        log.debug("Codec unpack_structure has %d excluded_object_types set in field" % len(root_obj.message_object.excluded_object_types))
+        log.debug("Codec unpack_structure has %d excluded_object_types set in field", len(root_obj.message_object.excluded_object_types))
         excluded_types = [x.GPBMessage for x in root_obj.message_object.excluded_object_types]
 
-    # Now load the rest of the linked objects - down to the leaf nodes.
-    repo.load_links(root_obj, excluded_types)
-
     # append the excluded object types in the repo (load links no longer does this)
     for extype in excluded_types:
         if extype not in repo.excluded_types:
             repo.excluded_types.append(extype)
 
-    # Create a commit to record the state when the message arrived
-    cref = repo.commit(comment='Message for you Sir!')
+    if not lazy:
+        # Now load the rest of the linked objects - down to the leaf nodes.
+        repo.load_links(root_obj, excluded_types)
+
+        # Create a commit to record the state when the message arrived
+        cref = repo.commit(comment='Message for you Sir!')
 
 
     log.debug('unpack_structure: returning root_obj')
@@ -222,10 +235,11 @@ def unpack_structure(serialized_container):
 
 
 
-def _unpack_container(serialized_container):
+def _unpack_container(serialized_container, lazy=False):
     """
     Helper for the receiver for unpacking message content
     Returns the head object and items as wrapped structure elements
+    In lazy mode the items are the raw gpb structure elements and the head is not included
     """
 
     log.debug('_unpack_container: Unpacking Container')
@@ -235,21 +249,26 @@ def _unpack_container(serialized_container):
     try:
         cs.ParseFromString(serialized_container)
     except decoder._DecodeError, de:
-        log.debug('Received invalid content - decode error: "%s"' % str(de))
+        log.debug('Received invalid content - decode error: "%s"', de)
         raise CodecError('Could not decode message content as a GPB container structure!')
 
     # Return arguments
     obj_dict={}
 
     head = gpb_wrapper.StructureElement(cs.head)
-    obj_dict[head.key] = head
 
+    if lazy:
+        for se in cs.items:
+            obj_dict[se.key] = se
+
+    else:
+        obj_dict[head.key] = head
 
-    for se in cs.items:
-        wse = gpb_wrapper.StructureElement(se)
+        for se in cs.items:
+            wse = gpb_wrapper.StructureElement(se)
 
-        obj_dict[wse.key] = wse
+            obj_dict[wse.key] = wse
 
-    log.debug('_unpack_container: returning head and dictionary of %d objects' % len(obj_dict))
+    log.debug('_unpack_container: returning head and dictionary of %d objects', len(obj_dict))
 
-    return head, obj_dict
\ No newline at end of file
+    return head, obj_dict
@@ -19,6 +19,7 @@ from ion.core.object.object_utils import CDM_GROUP_TYPE, CDM_DATASET_TYPE, CDM_A
 from ion.core.object.object_utils import _gpb_source, _gpb_source_root
 
 import struct
+import random
 
 from google.protobuf import message
 from google.protobuf.internal import containers
@@ -405,19 +406,24 @@ class WrapperType(type):
             # Special methods for certain object types:
             WrapperType._add_specializations(cls, obj_type, clsDict)
 
+            # The instance attributes are the slots of Wrapper - generated classes must not add an instance dict
+            clsDict['__slots__'] = ()
+
             VALIDATE_ATTRS = CONF.getValue('VALIDATE_ATTRS', True)
             if VALIDATE_ATTRS:
                 def obj_setter(self, k, v):
-                    if self._init and not hasattr(self, k):
+                    try:
+                        super(Wrapper, self).__setattr__(k, v)
+                    except AttributeError:
+                        if hasattr(type(self), k):
+                            # A read only property - not an unknown name
+                            raise
                         raise AttributeError(\
                             '''Cant add properties to the ION object wrapper for object Class "%s".\n'''
                             '''Unknown property name - "%s"; value - "%s"''' % (self._GPBClass, k, v))
-                    super(Wrapper, self).__setattr__(k, v)
 
                 clsDict['__setattr__'] = obj_setter
 
-            clsDict['_init'] = False
-
             clsType = WrapperType.__new__(WrapperType, clsName, (cls,), clsDict)
 
             WrapperType._type_cache[msgType] = clsType
@@ -455,6 +461,7 @@ class WrapperType(type):
                 self.GPBMessage.CopyFrom(link.GPBMessage)
 
                 self.ChildLinks.add(self)
+                self._mark_link_dirty()
 
                 try:
                     obj = self.Repository.get_linked_object(link)
@@ -589,6 +596,14 @@ class Wrapper(object):
     __metaclass__ = WrapperType
 
 
+    # Wrappers are created for every object in a checked out structure - keep them small. Every instance attribute
+    # must be declared here.
+    __slots__ = ('_gpbMessage', '_root', '_invalid', '_bytes', '_parent_links', '_child_links', '_dirty_links',
+                 '_derived_wrappers', '_myid', '_modified', '_read_only', '_repository', '_source', '__weakref__')
+
+    # Read the config when the class is created rather than in every instance
+    _str_gpbs = CONF.getValue('STR_GPBS', False)
+
     def __init__(self, gpbMessage):
         """
         Initialize the Wrapper class and set up it message type.
@@ -641,6 +656,11 @@ class Wrapper(object):
         A list of my child link wrappers
         """
 
+        self._dirty_links = None # only exists in the root object
+        """
+        The child link wrappers which have changed since the last commit
+        """
+
         self._derived_wrappers = None
         """
         A container for all the wrapper objects which are rewrapped, derived
@@ -674,10 +694,6 @@ class Wrapper(object):
         To avoid invalidating during when there is a hash conflict in the workspace - set the twin...
         """
 
-        self.__no_string = CONF.getValue('STR_GPBS', False)
-
-        # Hack to prevent setting properties in a class instance
-        self._init = True
 
         #frame = sys._getframe(2)
         #frames = []
@@ -706,6 +722,7 @@ class Wrapper(object):
         obj._root = obj
         obj._parent_links = set()
         obj._child_links = set()
+        obj._dirty_links = set()
         obj._derived_wrappers = {}
         obj._read_only = False
         obj._myid = '-1'
@@ -778,6 +795,7 @@ class Wrapper(object):
         self._gpbMessage = None
         self._parent_links = None
         self._child_links = None
+        self._dirty_links = None
         self._myid = None
         self._bytes = None
 
@@ -912,6 +930,22 @@ class Wrapper(object):
 
     ChildLinks = property(_get_child_links, _set_child_links)
 
+    @GPBSourceRoot
+    def _get_dirty_links(self):
+        """
+        The child link wrappers which have changed since the last commit
+        """
+        return self._dirty_links
+
+    @GPBSourceRoot
+    def _set_dirty_links(self, value):
+        """
+        The child link wrappers which have changed since the last commit
+        """
+        self._dirty_links = value
+
+    DirtyLinks = property(_get_dirty_links, _set_dirty_links)
+
     @GPBSourceRoot
     def _get_readonly(self):
         return self._read_only
@@ -1018,16 +1052,29 @@ class Wrapper(object):
         se = StructureElement()
         repo = self.Repository
 
+        # Without a record of the changed links (a wrapper created outside the repository) check all of them
+        dirty_links = self.DirtyLinks
+        check_all = dirty_links is None
+
         for link in  self.ChildLinks:
 
+            key = link.key
+
+            # A link which has not changed since the last commit points to an object which is already hashed - the
+            # link is complete and there is nothing to load or recurse into.
+            if not check_all and link not in dirty_links and (key in structure or repo.index_hash.has_key(key)):
+                se.ChildLinks.add(key)
+                continue
+
             if link.Invalid:
                 log.error('Link in child links is invalid!')
                 log.debug('Current Wrapper: %s' % self.Debug())
                 log.debug('Invalid Link %s' % link.Debug())
 
             # Test to see if it is already serialized!
-            child_se = repo.index_hash.get(link.key, structure.get(link.key, None))
-            #child_se = repo.index_hash.get(link.key, None)
+            child_se = structure.get(key, None)
+            if child_se is None:
+                child_se = repo.index_hash.get(key, None)
 
             #log.debug('Setting child Link: %s' % str(child_se))
             if  child_se is not None:
@@ -1036,8 +1083,8 @@ class Wrapper(object):
 
             else:
                 # if isleaf set, type set, and the key is an actual SHA1 - we don't need to recurse into it or do anything, really.
-                if link.IsFieldSet('isleaf') and link.IsFieldSet('type') and len(link.key) == 20:
-                    log.debug('Disregarding un-index-hashed link %s' % link.key)
+                if link.IsFieldSet('isleaf') and link.IsFieldSet('type') and len(key) == 20:
+                    log.debug('Disregarding un-index-hashed link %s' % key)
                     pass
                 else:
                     child = repo.get_linked_object(link)
@@ -1053,6 +1100,9 @@ class Wrapper(object):
             # Save the link info as a convience for sending!
             se.ChildLinks.add(link.key)
 
+        if not check_all:
+            dirty_links.clear()
+
         se.value = self.SerializeToString()
         #se.key = sha1hex(se.value)
 
@@ -1062,6 +1112,7 @@ class Wrapper(object):
         # Calculate the sha1 from the serialized value and type!
         # Sha1 is a property - not a method...
         se.key = se.sha1
+        se.verified = True
 
         # Determine whether I am a leaf
         if len(self.ChildLinks) is 0:
@@ -1209,6 +1260,8 @@ class Wrapper(object):
         This method recursively changes an objects parents to a modified state
         All links are reset as they are no longer hashed values
         """
+        if self.ObjectType == LINK_TYPE:
+            self._mark_link_dirty()
 
         if self.Modified:
             # Be clear about what we are doing here!
@@ -1240,6 +1293,15 @@ class Wrapper(object):
                     #link._set_parents_modified()
                     link._set_parents_modified()
 
+    @GPBSource
+    def _mark_link_dirty(self):
+        """
+        Record that this link has changed since the last commit of its root object
+        """
+        dirty_links = self.DirtyLinks
+        if dirty_links is not None:
+            dirty_links.add(self)
+
     @GPBSource
     def __eq__(self, other):
         if not isinstance(other, Wrapper):
@@ -1273,7 +1335,7 @@ class Wrapper(object):
             msg = '\n' +self._gpbMessage.__str__()
         '''
 
-        if not self.__no_string:
+        if not self._str_gpbs:
             return 'GPB NO STRING!'
 
         #log.critical('HOLY SHIT STILL HERE!')
@@ -1974,20 +2036,47 @@ class StructureElementError(Exception):
     """
 
 
+VERIFY_ALWAYS = 'always'
+VERIFY_ONCE = 'once'
+VERIFY_SAMPLE = 'sample'
+
 class StructureElement(object):
     """
     @brief Wrapper for the container structure element. These are the objects
     stored in the hashed elements table. Mostly convience methods are provided
     here. A set provides references to the child objects so that the content
     need not be decoded to find them.
+
+    The verified flag is set once the key has been checked against the sha1 of the content, or when the key was
+    calculated from the content. The integrity policy of the process decides whether a verified element is checked
+    again when it is loaded:
+        always - check the sha1 every time the element is loaded
+        once - check the sha1 the first time the element is loaded or parsed and trust it after that
+        sample - check a fraction (sha1_sample_rate) of the loads of elements which have not been verified yet
     """
 
+    __slots__ = ('_element', '_child_links', 'verified', '__weakref__')
+
+    verification_policy = CONF.getValue('sha1_verification', VERIFY_ONCE)
+
+    sample_rate = CONF.getValue('sha1_sample_rate', 0.01)
+
     def __init__(self, se=None):
         if se:
             self._element = se
         else:
             self._element = get_gpb_class_from_type_id(STRUCTURE_ELEMENT_TYPE)()
-        self.ChildLinks = set()
+        self._child_links = None
+        self.verified = False
+
+    @property
+    def ChildLinks(self):
+        """
+        The keys of the child objects - the set is only created for elements which have children
+        """
+        if self._child_links is None:
+            self._child_links = set()
+        return self._child_links
 
     @classmethod
     def parse_structure_element(cls, blob):
@@ -1996,13 +2085,37 @@ class StructureElement(object):
 
         instance = cls(se)
 
-        if instance.key != instance.sha1:
+        if not instance.verify():
             log.error('The sha1 key does not match the value. The data is corrupted! \n' +\
                       'Element key %s, Calculated key %s' % (sha1_to_hex(instance.key), sha1_to_hex(instance.sha1)))
             raise StructureElementError('Error reading serialized structure element. Sha1 value does not match.')
 
         return instance
 
+    def verify(self):
+        """
+        Check that the key matches the sha1 of the content and mark the element verified if it does
+        @retval True if the key matches
+        """
+        self.verified = self.key == self.sha1
+        return self.verified
+
+    def needs_verification(self):
+        """
+        Apply the integrity policy - should the sha1 be checked when this element is loaded?
+        """
+        policy = self.verification_policy
+        if policy == VERIFY_ALWAYS:
+            return True
+
+        if self.verified:
+            return False
+
+        if policy == VERIFY_SAMPLE:
+            return random.random() < self.sample_rate
+
+        return True
+
     @property
     def sha1(self):
         """
@@ -49,6 +49,9 @@ class IndexHash(dict):
     A dictionary class to contain the objects owned by a repository. All repository objects are accessible by other
     repositories via the workbench which maintains a cache of all the local objects. Clean up is the responsibility of
     each repository.
+
+    Behind the weak workbench cache there may be a strong, size limited blob cache which keeps hot elements alive
+    after the last repository referencing them is gone.
     """
     def __init__(self, *args, **kwargs):
         dict.__init__(self, *args, **kwargs)
@@ -56,6 +59,8 @@ class IndexHash(dict):
         self._workbench_cache = None
         self._has_cache = False
 
+        self.blob_cache = None
+
         self._size = 0
 
     def _set_cache(self,cache):
@@ -94,13 +99,29 @@ class IndexHash(dict):
 
         elif self.has_cache:
             # You get it - you own it!
-            val = self.cache[key]
+            val = self._get_from_cache(key)
+            if val is None:
+                raise KeyError('Key not found in index hash!')
             # If it does not raise a KeyError - add it
             dict.__setitem__(self, key, val)
             return val
         else:
             raise KeyError('Key not found in index hash!')
 
+    def _get_from_cache(self, key):
+        """
+        Look for an element in the workbench caches. The weak cache holds every live element while the strong blob
+        cache keeps hot elements alive after the repositories which referenced them are gone.
+        """
+        live = self.cache.get(key)
+        if self.blob_cache is None:
+            return live
+
+        val = self.blob_cache.lookup(key, live)
+        if live is None and val is not None:
+            self.cache[key] = val
+        return val
+
 
     def __setitem__(self, key, val):
 
@@ -111,6 +132,9 @@ class IndexHash(dict):
         if self.has_cache:
             self.cache[key]=val
 
+        if self.blob_cache is not None:
+            self.blob_cache[key]=val
+
 
 
     def copy(self):
@@ -133,10 +157,12 @@ class IndexHash(dict):
 
         elif self.has_cache:
             # You get it - you own it!
-            val = self.cache.get(key,d)
+            val = self._get_from_cache(key)
 
-            if val != d:
-                dict.__setitem__(self, key, val)
+            if val is None:
+                return d
+
+            dict.__setitem__(self, key, val)
 
             return val
         else:
@@ -159,9 +185,12 @@ class IndexHash(dict):
         if self.has_cache:
             self.cache.update(*args, **kwargs)
 
+        if self.blob_cache is not None:
+            self.blob_cache.update(dict(*args, **kwargs))
+
         # For now - don't bother parsing args just recount
         size = 0
-        for item in self.itervalues():
+        for item in dict.itervalues(self):
             size += item.__sizeof__()
         self._size = size
 
@@ -180,6 +209,109 @@ class IndexHash(dict):
 
 
 
+class LazyIndexHash(IndexHash):
+    """
+    An index hash for the content of a decoded message container. The raw gpb structure elements are indexed by key
+    and only wrapped as StructureElements when they are first accessed - the receiver of a message pays only for the
+    content it reads. Iterating over the index hash loads all the remaining elements.
+    """
+    def __init__(self, raw_elements=None):
+        IndexHash.__init__(self)
+
+        self._raw_elements = raw_elements or {}
+
+    def _load_raw(self, key):
+        se = self._raw_elements.pop(key, None)
+        if se is None:
+            return None
+
+        element = gpb_wrapper.StructureElement(se)
+        IndexHash.__setitem__(self, key, element)
+        return element
+
+    def _load_all_raw(self):
+        for key in self._raw_elements.keys():
+            self._load_raw(key)
+
+    def _set_has_cache(self, val):
+
+        assert isinstance(val, bool), 'Invalid or non boolen value passed to set has_cache property!'
+        self._has_cache = val
+        # add only the loaded elements to the cache - the rest are added when they are accessed
+        if val:
+            self._workbench_cache.update(dict.items(self))
+
+    has_cache = property(IndexHash._get_has_cache, _set_has_cache)
+
+    def __getitem__(self, key):
+        if key in self._raw_elements:
+            return self._load_raw(key)
+        return IndexHash.__getitem__(self, key)
+
+    def __setitem__(self, key, val):
+        self._raw_elements.pop(key, None)
+        IndexHash.__setitem__(self, key, val)
+
+    def get(self, key, d=None):
+        """ Get Item from the Index Hash"""
+        if key in self._raw_elements:
+            return self._load_raw(key)
+        return IndexHash.get(self, key, d)
+
+    def has_key(self, key):
+        """ Check to see if the Key exists """
+        return key in self._raw_elements or IndexHash.has_key(self, key)
+
+    def __contains__(self, key):
+        return key in self._raw_elements or dict.__contains__(self, key)
+
+    def __len__(self):
+        return dict.__len__(self) + len(self._raw_elements)
+
+    def __iter__(self):
+        self._load_all_raw()
+        return dict.__iter__(self)
+
+    def keys(self):
+        self._load_all_raw()
+        return dict.keys(self)
+
+    def values(self):
+        self._load_all_raw()
+        return dict.values(self)
+
+    def items(self):
+        self._load_all_raw()
+        return dict.items(self)
+
+    def iterkeys(self):
+        self._load_all_raw()
+        return dict.iterkeys(self)
+
+    def itervalues(self):
+        self._load_all_raw()
+        return dict.itervalues(self)
+
+    def iteritems(self):
+        self._load_all_raw()
+        return dict.iteritems(self)
+
+    def update(self, *args, **kwargs):
+        """
+        D.update(E, **F) -> None.  Update D from E and F: for k in E: D[k] = E[k]
+        (if E has keys else: for (k, v) in E: D[k] = v) then: for k in F: D[k] = F[k]
+        """
+        items = dict(*args, **kwargs)
+        for key in items.iterkeys():
+            self._raw_elements.pop(key, None)
+        IndexHash.update(self, items)
+
+    def clear(self):
+        self._raw_elements.clear()
+        IndexHash.clear(self)
+
+
+
 
 
 class ObjectContainer(object):
@@ -294,6 +426,7 @@ class ObjectContainer(object):
         obj._root = obj
         obj._parent_links = set()
         obj._child_links = set()
+        obj._dirty_links = set()
         obj._derived_wrappers={}
         obj._read_only = False
         obj._myid = obj_id
@@ -478,9 +611,9 @@ class ObjectContainer(object):
 
     def _load_element(self, element):
 
-        # check that the calculated value in element.sha1 matches the stored value
-        if not element.key == element.sha1:
-            #@TODO Consider removing this somewhat costly check - it is already done when an object is read from a message
+        # check that the calculated value in element.sha1 matches the stored value - the integrity policy decides
+        # whether an element which was already verified is checked again
+        if element.needs_verification() and not element.verify():
             raise RepositoryError('The sha1 key does not match the value. The data is corrupted! \n' +\
             'Element key %s, Calculated key %s' % (object_utils.sha1_to_hex(element.key), object_utils.sha1_to_hex(element.sha1)))
 
@@ -502,9 +635,9 @@ class ObjectContainer(object):
 
         obj.Modified = False
 
-        # Make a note in the element of the child links as well!
-        for child in obj.ChildLinks:
-            element.ChildLinks.add(child.key)
+        # Make a note in the element of the child links as well! Leaves do not need a set of links.
+        if obj.ChildLinks:
+            element.ChildLinks.update([child.key for child in obj.ChildLinks])
 
         return obj
 
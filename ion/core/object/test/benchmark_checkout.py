@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+@file ion/core/object/test/benchmark_checkout.py
+@brief Benchmark the time to check out a repository with large leaf objects under each sha1 verification policy
+@test Checkout benchmark - not run as part of the unit tests
+"""
+
+import time
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from ion.core.object import workbench
+from ion.core.object import gpb_wrapper
+from ion.core.object import object_utils
+
+PERSON_TYPE = object_utils.create_type_identifier(object_id=20001, version=1)
+ADDRESSLINK_TYPE = object_utils.create_type_identifier(object_id=20003, version=1)
+
+
+class CheckoutBenchmark(unittest.TestCase):
+
+    leaf_sizes = [1000, 100000, 1000000]
+
+    leaf_count = 10
+
+    checkouts = 20
+
+    policies = [gpb_wrapper.VERIFY_ALWAYS, gpb_wrapper.VERIFY_ONCE, gpb_wrapper.VERIFY_SAMPLE]
+
+    def setUp(self):
+        self.wb = workbench.WorkBench('No Process Test')
+        self._policy = gpb_wrapper.StructureElement.verification_policy
+
+    def tearDown(self):
+        gpb_wrapper.StructureElement.verification_policy = self._policy
+
+    def _create_structure(self, leaf_size):
+        repo, ab = self.wb.init_repository(ADDRESSLINK_TYPE)
+
+        for i in range(self.leaf_count):
+            p = repo.create_object(PERSON_TYPE)
+            p.name = ('Person %d ' % i) * (leaf_size / 10)
+            p.id = i
+
+            ab.person.add()
+            ab.person[i] = p
+
+        repo.commit(comment='Large leaves')
+
+        return repo
+
+    @defer.inlineCallbacks
+    def test_checkout_time(self):
+
+        results = []
+        for leaf_size in self.leaf_sizes:
+
+            for policy in self.policies:
+                gpb_wrapper.StructureElement.verification_policy = policy
+
+                # A new repository each time so that no element starts out verified by an earlier policy
+                repo = self._create_structure(leaf_size)
+                for element in repo.index_hash.itervalues():
+                    element.verified = False
+
+                t1 = time.time()
+                for i in range(self.checkouts):
+                    repo.purge_workspace()
+                    ab = yield repo.checkout('master')
+                    for person in ab.person:
+                        person.name
+                t2 = time.time()
+
+                results.append((leaf_size, policy, (t2 - t1) / self.checkouts))
+
+                repo.clear()
+
+        output = '\nLeaf size (bytes) | Policy | Checkout (s)\n'
+        for result in results:
+            output += '%17d | %6s | %12.4f\n' % result
+
+        log.info(output)
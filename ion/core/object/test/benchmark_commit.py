@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+@file ion/core/object/test/benchmark_commit.py
+@brief Benchmark the time to commit a repository as a function of the size of the structure and the size of the edit
+@test Commit benchmark - not run as part of the unit tests
+"""
+
+import time
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.trial import unittest
+
+from ion.core.object import workbench
+from ion.core.object import object_utils
+
+PERSON_TYPE = object_utils.create_type_identifier(object_id=20001, version=1)
+ADDRESSLINK_TYPE = object_utils.create_type_identifier(object_id=20003, version=1)
+
+
+class CommitBenchmark(unittest.TestCase):
+
+    structure_sizes = [10, 100, 1000, 5000]
+
+    edit_sizes = [1, 10, 100]
+
+    def setUp(self):
+        self.wb = workbench.WorkBench('No Process Test')
+
+    def _create_structure(self, size):
+        repo, ab = self.wb.init_repository(ADDRESSLINK_TYPE)
+
+        for i in range(size):
+            p = repo.create_object(PERSON_TYPE)
+            p.name = 'Person %d' % i
+            p.id = i
+
+            ab.person.add()
+            ab.person[i] = p
+
+        t1 = time.time()
+        repo.commit(comment='Initial commit')
+        t2 = time.time()
+
+        return repo, ab, t2 - t1
+
+    def test_commit_time(self):
+
+        results = []
+        for size in self.structure_sizes:
+            repo, ab, initial_time = self._create_structure(size)
+
+            for edit in self.edit_sizes:
+                if edit > size:
+                    continue
+
+                for i in range(edit):
+                    ab.person[i].email = 'edit_%d@ooici.net' % edit
+
+                t1 = time.time()
+                repo.commit(comment='Edit %d objects' % edit)
+                t2 = time.time()
+
+                results.append((size, edit, initial_time, t2 - t1))
+
+            repo.clear()
+
+        output = '\nStructure size | Edit size | Initial commit (s) | Edit commit (s)\n'
+        for result in results:
+            output += '%14d | %9d | %18.4f | %15.4f\n' % result
+
+        log.info(output)
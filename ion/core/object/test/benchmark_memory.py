@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+@file ion/core/object/test/benchmark_memory.py
+@brief Benchmark the memory held per loaded object when CDM datasets are checked out
+@test Memory benchmark - not run as part of the unit tests
+"""
+
+import sys
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from ion.core.object import workbench
+from ion.core.object import gpb_wrapper
+from ion.core.object.gpb_wrapper import CDM_DATASET_TYPE
+from ion.services.coi.datastore_bootstrap import dataset_bootstrap
+
+
+def _python_size(obj):
+    """
+    The bytes of the python objects which make up a wrapper or structure element - not the gpb message content
+    """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+
+    for name in ('_parent_links', '_child_links', '_dirty_links', '_derived_wrappers'):
+        value = getattr(obj, name, None)
+        if value is not None:
+            size += sys.getsizeof(value)
+
+    return size
+
+
+class MemoryBenchmark(unittest.TestCase):
+
+    dataset_counts = [1, 10, 100]
+
+    def setUp(self):
+        if not hasattr(sys, 'getsizeof'):
+            # sys.getsizeof is new in python 2.6
+            raise unittest.SkipTest('This python can not measure the size of an object')
+        self.wb = workbench.WorkBench('No Process Test')
+
+    @defer.inlineCallbacks
+    def _load_datasets(self, count):
+        repos = []
+        for i in range(count):
+            repo, dataset = self.wb.init_repository(CDM_DATASET_TYPE)
+            dataset_bootstrap.bootstrap_profile_dataset(dataset, supplement_number=i, random_initialization=True)
+            repo.commit(comment='Profile dataset %d' % i)
+
+            # Check it out again and load every object in the structure
+            repo.purge_workspace()
+            dataset = yield repo.checkout('master')
+            repo.load_links(dataset, [])
+
+            repos.append(repo)
+
+        defer.returnValue(repos)
+
+    @defer.inlineCallbacks
+    def test_bytes_per_object(self):
+
+        results = []
+        for count in self.dataset_counts:
+            repos = yield self._load_datasets(count)
+
+            wrappers = 0
+            wrapper_bytes = 0
+            elements = 0
+            element_bytes = 0
+            for repo in repos:
+                for obj in repo._workspace.itervalues():
+                    wrappers += 1
+                    wrapper_bytes += _python_size(obj)
+                    for derived in (obj._derived_wrappers or {}).itervalues():
+                        wrappers += 1
+                        wrapper_bytes += _python_size(derived)
+
+                for element in repo.index_hash.itervalues():
+                    if isinstance(element, gpb_wrapper.StructureElement):
+                        elements += 1
+                        element_bytes += _python_size(element)
+
+            results.append((count, wrappers, float(wrapper_bytes) / max(wrappers, 1),
+                            elements, float(element_bytes) / max(elements, 1)))
+
+            for repo in repos:
+                repo.clear()
+
+        output = '\nDatasets | Wrappers | Bytes per wrapper | Elements | Bytes per element\n'
+        for result in results:
+            output += '%8d | %8d | %17.1f | %8d | %17.1f\n' % result
+
+        log.info(output)
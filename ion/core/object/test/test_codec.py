@@ -128,3 +128,25 @@ class CodecTest(unittest.TestCase):
 
 
 
+
+    def test_lazy_unpack(self):
+
+        serialized = codec.pack_structure(self.ab)
+
+        res = codec.unpack_structure(serialized, lazy=True)
+
+        repo = res.Repository
+        # Only the root object is loaded - the rest are raw elements in the index hash
+        self.assertEqual(len(repo._workspace), 1)
+        self.assertEqual(dict.__len__(repo.index_hash), 1)
+        self.assertEqual(len(repo.index_hash), 3)
+
+        # No commit is made when the content is only read
+        self.assertEqual(repo.status, repo.UPTODATE)
+        self.assertEqual(len(repo._commit_index), 0)
+
+        self.assertEqual(res.owner, self.ab.owner)
+        self.assertEqual(dict.__len__(repo.index_hash), 2)
+
+        self.assertEqual(res,self.ab)
+        self.assertEqual(res.person[1],self.ab.person[1])
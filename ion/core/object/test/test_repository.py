@@ -616,6 +616,73 @@ class RepositoryTest(unittest.TestCase):
         self.assertEqual(repo.__sizeof__(), 0)
 
 
+    def _make_address_book(self, names):
+        repo, ab = self.wb.init_repository(ADDRESSLINK_TYPE)
+
+        for i, name in enumerate(names):
+            p = repo.create_object(PERSON_TYPE)
+            p.name = name
+            p.id = i
+
+            ab.person.add()
+            ab.person[i] = p
+
+        return repo, ab
+
+    def test_incremental_commit(self):
+
+        names = ['David', 'John', 'Michael', 'Matt', 'Dave']
+        repo, ab = self._make_address_book(names)
+
+        repo.commit(comment='first commit')
+        self.assertEqual(len(ab.DirtyLinks), 0)
+
+        ab.person[3].name = 'Roger'
+
+        # Only the link to the modified person has changed
+        self.assertEqual(len(ab.DirtyLinks), 1)
+
+        repo.commit(comment='second commit')
+        self.assertEqual(len(ab.DirtyLinks), 0)
+
+        # The incremental commit must produce the same structure as committing everything at once
+        names[3] = 'Roger'
+        repo2, ab2 = self._make_address_book(names)
+        repo2.commit(comment='only commit')
+
+        self.assertEqual(ab.MyId, ab2.MyId)
+        self.assertEqual(ab.person[3].MyId, ab2.person[3].MyId)
+
+    def test_sha1_verification_policy(self):
+
+        repo, ab = self._make_address_book(['David', 'John'])
+        repo.commit(comment='first commit')
+
+        element = repo.index_hash.get(ab.person[0].MyId)
+        # Elements created by a commit have a calculated key
+        self.assertEqual(element.verified, True)
+
+        # Corrupt the content behind the key
+        element.value = element.value + 'corrupted'
+
+        policy = gpb_wrapper.StructureElement.verification_policy
+        try:
+            gpb_wrapper.StructureElement.verification_policy = gpb_wrapper.VERIFY_ONCE
+            # A verified element is trusted
+            repo._load_element(element)
+
+            gpb_wrapper.StructureElement.verification_policy = gpb_wrapper.VERIFY_ALWAYS
+            self.assertRaises(RepositoryError, repo._load_element, element)
+            self.assertEqual(element.verified, False)
+
+            # Once the check failed it is never trusted again
+            gpb_wrapper.StructureElement.verification_policy = gpb_wrapper.VERIFY_ONCE
+            self.assertRaises(RepositoryError, repo._load_element, element)
+
+        finally:
+            gpb_wrapper.StructureElement.verification_policy = policy
+
+
 
     @defer.inlineCallbacks
     def test_lost_objects(self):
@@ -272,6 +272,58 @@ class WorkBenchTest(unittest.TestCase):
 
 
 
+    def test_blob_cache(self):
+
+        self.repo.commit('junk')
+
+        keys = self.repo.index_hash.keys()
+
+        # Clear the repository - the elements are now only held by the strong blob cache
+        self.wb.clear_repository(self.repo)
+        self.assertNotIn(self.repo.repository_key, self.wb._repos)
+
+        repo = self.wb.create_repository()
+
+        hits, misses, evictions, nitems, size = self.wb._blob_cache.stats()
+        for key in keys:
+            element = repo.index_hash.get(key)
+            self.assertEqual(element.key, key)
+
+        self.assertEqual(repo.index_hash.get('not a key'), None)
+
+        self.assertEqual(self.wb._blob_cache.hits, hits + len(keys))
+        self.assertEqual(self.wb._blob_cache.misses, misses + 1)
+
+        self.assertIn('Blob Cache hits/misses/evictions', self.wb.cache_info())
+
+    def test_blob_cache_limit(self):
+
+        class Blob(object):
+            def __init__(self, size):
+                self.size = size
+            def __sizeof__(self):
+                return self.size
+
+        cache = workbench.BlobCache(100)
+
+        cache['a'] = Blob(40)
+        cache['b'] = Blob(40)
+        self.assertEqual(cache.lookup('a').size, 40)
+
+        # b is now the least recently used
+        cache['c'] = Blob(40)
+        self.assertEqual(sorted(cache.keys()), ['a','c'])
+        self.assertEqual(cache.evictions, 1)
+
+        # Too big for the cache - it is not stored and nothing else is evicted
+        cache['d'] = Blob(101)
+        self.assertNotIn('d', cache)
+        self.assertEqual(len(cache), 2)
+
+        self.assertEqual(cache.lookup('b'), None)
+        self.assertEqual(cache.stats(), (1, 1, 1, 2, 80))
+
+
 class WorkBenchProcess(Process):
     """
     A test process which has the ops of the workbench
@@ -35,6 +35,9 @@ from ion.util.cache import LRUDict
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 
+from ion.core import ioninit
+CONF = ioninit.config(__name__)
+
 
 STRUCTURE_ELEMENT_TYPE = object_utils.create_type_identifier(object_id=1, version=1)
 STRUCTURE_TYPE = object_utils.create_type_identifier(object_id=2, version=1)
@@ -79,9 +82,50 @@ class WorkBenchError(ApplicationError):
     An exception class for errors that occur in the Object WorkBench class
     """
 
+class BlobCache(LRUDict):
+    """
+    A strong, size limited LRU cache of structure elements keyed by sha1. It sits behind the weak workbench cache so
+    that hot elements survive the repositories which loaded them.
+    """
+
+    def __init__(self, limit):
+        LRUDict.__init__(self, limit, use_size=True)
+
+        self.hits = 0
+        self.misses = 0
+
+    def __setitem__(self, key, val):
+        # An element larger than the whole cache would just flush everything else out
+        if val.__sizeof__() > self.limit:
+            return
+
+        LRUDict.__setitem__(self, key, val)
+
+    def lookup(self, key, live=None):
+        """
+        Get an element and count the hit or miss. A hit is any element which is still in memory.
+        @param live the element from the weak workbench cache if it is still referenced by a repository
+        """
+        if key in self.d:
+            self.hits += 1
+            # Move it to the most recently used end
+            return self[key]
+
+        if live is not None:
+            # Pushed out of the LRU but still in use - it is hot, put it back
+            self.hits += 1
+            self[key] = live
+            return live
+
+        self.misses += 1
+        return None
+
+    def stats(self):
+        return (self.hits, self.misses, self.evictions, len(self), self.total_size)
+
 class WorkBench(object):
     
-    def __init__(self, process, cache_size=10**7):
+    def __init__(self, process, cache_size=10**7, blob_cache_size=None):
     
         self._process = process
 
@@ -100,6 +144,13 @@ class WorkBench(object):
         """  
         self._workbench_cache = weakref.WeakValueDictionary()
 
+        """
+        A strong LRU cache behind the weak cache - keeps hot blobs after their repositories are gone
+        """
+        if blob_cache_size is None:
+            blob_cache_size = CONF.getValue('blob_cache_size', 10**7)
+        self._blob_cache = BlobCache(blob_cache_size)
+
         #@TODO Consider using an index store in the Workbench to keep a cache of associations and keep track of objects
 
     def __str__(self):
@@ -143,10 +194,12 @@ class WorkBench(object):
                 trouble = True
                 convids.add(repo.convid_context)
 
+        blob_stats = 'Blob Cache hits/misses/evictions: %d/%d/%d; items: %d; size: %d bytes' % self._blob_cache.stats()
+
         if trouble:
-            return str('Workbench Cache is holding %d repositories in %d conversations' % (len(self._repos), len(convids)) )
+            return str('Workbench Cache is holding %d repositories in %d conversations; %s' % (len(self._repos), len(convids), blob_stats) )
         else:
-            return 'Workbench Cache is clear!'
+            return 'Workbench Cache is clear! %s' % blob_stats
 
     def count_persistent(self):
         nrepos = len(self._repos)
@@ -274,7 +327,7 @@ class WorkBench(object):
                 repo = self._repo_cache.pop(rkey)
                 self.put_repository(repo)
             except KeyError, ke:
-                log.debug('Repository key "%s" not found in cache' % rkey)
+                log.debug('Repository key "%s" not found in cache', rkey)
 
         return repo
         
@@ -291,7 +344,7 @@ class WorkBench(object):
 
     def clear_repository(self, repo):
 
-        log.info('Clearing Repository: %s ' % str(repo.repository_key))
+        log.info('Clearing Repository: %s ', repo.repository_key)
 
         key = repo.repository_key
         repo.clear()
@@ -307,7 +360,7 @@ class WorkBench(object):
 
     def cache_repository(self, repo):
 
-        log.info('Caching Repository: %s ' % str(repo.repository_key))
+        log.info('Caching Repository: %s ', repo.repository_key)
 
         key = repo.repository_key
         # Get rid of the nick name - this is a PITA
@@ -373,6 +426,8 @@ class WorkBench(object):
         # This one is now safe to clear
         self._workbench_cache.clear()
 
+        self._blob_cache.clear()
+
 
 
     def put_repository(self,repo):
@@ -382,6 +437,7 @@ class WorkBench(object):
 
         self._repos[repo.repository_key] = repo
         repo.index_hash.cache = self._workbench_cache
+        repo.index_hash.blob_cache = self._blob_cache
         repo._process = self._process
 
         try:
@@ -508,7 +564,7 @@ class WorkBench(object):
         # Get the scoped name for the process to pull from
         targetname = self._process.get_scoped_name('system', origin)
 
-        log.info('Target Name "%s"' % str(targetname))
+        log.info('Target Name "%s"', targetname)
 
 
         if not isinstance(repo_name, (str, unicode)):
@@ -551,7 +607,7 @@ class WorkBench(object):
             ex_msg = re.msg_content
             msg_headers = re.msg_headers
 
-            log.info('ReceivedApplicationError:Response code - %s, Response Message - "%s"' % (ex_msg.MessageResponseCode, ex_msg.MessageResponseBody))
+            log.info('ReceivedApplicationError:Response code - %s, Response Message - "%s"', ex_msg.MessageResponseCode, ex_msg.MessageResponseBody)
 
             if cloning:
                 # Clear the repository that was created for the clone
@@ -626,7 +682,7 @@ class WorkBench(object):
         log.debug('Found repository to pull')
 
         if repo.status == repo.MODIFIED:
-            log.debug('Bad repo state for pulling - status: %s' % repo.status)
+            log.debug('Bad repo state for pulling - status: %s', repo.status)
             raise WorkBenchError('Invalid pull request. Requested Repository is in an invalid state.', request.ResponseCodes.BAD_REQUEST)
 
 
@@ -798,7 +854,7 @@ class WorkBench(object):
 
             commit_head = repo.commit_head
             if commit_head is None:
-                log.warning('No commits found in repository during push: \n' + str(repo))
+                log.warning('No commits found in repository during push: \n%s', repo)
                 raise WorkBenchError('Can not push a repository which has no commits!')
 
             repostate = pushmsg.repositories.add()
@@ -1071,11 +1127,11 @@ class WorkBench(object):
     def _merge_repo_heads(self, existing_head, new_head, existing_commits=None):
 
         log.debug('_merge_repo_heads: merging the state of repository heads!')
-        log.debug('existing repository head:\n' + existing_head.Debug())
-        log.debug('new head:\n' + new_head.Debug())
+        log.debug('existing repository head:\n%s', ion.util.ionlog.lazy(existing_head.Debug))
+        log.debug('new head:\n%s', ion.util.ionlog.lazy(new_head.Debug))
         repo = existing_head.Repository
-        log.debug('Number of commits: %d' % len(repo._commit_index))
-        log.debug('Number of hashed objects: %d' % len(repo.index_hash))
+        log.debug('Number of commits: %d', len(repo._commit_index))
+        log.debug('Number of hashed objects: %d', len(repo.index_hash))
 
 
         # examine all the branches in new and merge them into existing
@@ -1193,7 +1249,7 @@ class WorkBench(object):
             loaded = {}
 
 
-        log.debug('_load_commits - Key: %s' % sha1_to_hex(link.key))
+        log.debug('_load_commits - Key: %s', ion.util.ionlog.lazy(sha1_to_hex, link.key))
         repo = link.Repository
 
         try:
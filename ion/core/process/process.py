@@ -248,6 +248,13 @@ class Process(BasicLifecycleObject):
         return "Cached Structure Elements - %d, Cached Repositories - %d, Working Repositories - %d, Memory - %d kb" % \
             (len(self.workbench._workbench_cache), len(self.workbench._repo_cache),len(self.workbench._repos), self.workbench._repo_cache.total_size/1000)
 
+    def conversation_stats(self):
+        """
+        A debug method - the number of live, tombstoned and evicted conversations of this process
+        """
+        return "Conversations - live %(live)d, tombstoned %(tombstoned)d, evicted %(evicted)d, late messages %(late_messages)d" % \
+            self.conv_manager.get_stats()
+
     @defer.inlineCallbacks
     def spawn(self):
         """
@@ -607,7 +614,7 @@ class Process(BasicLifecycleObject):
                 self.context.user_id = payload.get('user-id')
                 _action = 'set user_id'
             else:
-                log.debug('[%s] receive(): payload anonymous request' % (self.proc_name))
+                log.debug('[%s] receive(): payload anonymous request', self.proc_name)
                 if self.context.get('user_id', 'Not set') == 'Not set':
                     self.context.user_id = 'ANONYMOUS'
                     _action = 'set ANONYMOUS user_id'
@@ -627,15 +634,15 @@ class Process(BasicLifecycleObject):
                     _action = _action + "/keep stashed expiry='%s'" % self.context.get('expiry')
             _post_exp = self.context.get('expiry')
 
-            log.debug("[%s] receive(): IN:user-id='%s',expiry='%s' ACTION:%s SET:user-id='%s',expiry='%s'" % (
-                self.proc_name, _pre_uid, _pre_exp, _action, _post_uid, _post_exp))
+            log.debug("[%s] receive(): IN:user-id='%s',expiry='%s' ACTION:%s SET:user-id='%s',expiry='%s'",
+                self.proc_name, _pre_uid, _pre_exp, _action, _post_uid, _post_exp)
 
             # Extract some headers and make log statement.
             fromname = payload['sender']
             if 'sender-name' in payload:
                 fromname = payload['sender-name']   # Legible sender alias
-            log.info('>>> [%s] receive(): Message from [%s] ... >>>' % (
-                     self.proc_name, fromname))
+            log.info('>>> [%s] receive(): Message from [%s] ... >>>',
+                     self.proc_name, fromname)
             convid = payload.get('conv-id', None)
             protocol = payload.get('protocol', None)
 
@@ -643,7 +650,11 @@ class Process(BasicLifecycleObject):
 
             # Conversation handling.
             conv = None
-            if convid and protocol != CONV_TYPE_NONE:
+            if convid and protocol != CONV_TYPE_NONE and self.conv_manager.is_tombstoned(convid):
+                # Late message for an ended conversation (e.g. reply after timeout)
+                self.conv_manager.drop_late_message(convid, payload)
+
+            elif convid and protocol != CONV_TYPE_NONE:
                 # Compose in memory message object for callbacks
                 message = dict(recipient=payload.get('receiver',None),
                                performative=payload.get('performative','request'),
@@ -877,8 +888,9 @@ class Process(BasicLifecycleObject):
             log.info('Timedout Message Operation: %s' % operation)
             log.info('Timedout Message Content: %s' % p_content)
 
-            # Remove RPC. Delayed result will go to catch operation
+            # Remove RPC. Delayed result will be dropped at the tombstone
             conv.timeout = str(pu.currenttime_ms())
+            self.conv_manager.end_conversation(conv.conv_id, 'TIMEOUT')
             conv.blocking_deferred.errback(defer.TimeoutError())
         if timeout:
             callto = reactor.callLater(timeout, _timeoutf)
@@ -14,6 +14,7 @@ input GPB validating must take place in the service code, not the python client.
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 import logging
+import time
 from twisted.internet import defer
 
 from ion.core.object import object_utils
@@ -23,7 +24,8 @@ from ion.services.coi.resource_registry.resource_client import ResourceClient
 from ion.core.messaging.message_client import MessageClient
 from ion.services.dm.inventory.association_service import AssociationServiceClient
 from ion.services.coi.identity_registry import IdentityRegistryClient, get_broadcast_receiver
-from ion.core.intercept.policy import load_roles_from_associations, map_ooi_id_to_role, unmap_ooi_id_from_role
+from ion.core.intercept.policy import load_roles_from_associations, map_ooi_id_to_role, unmap_ooi_id_from_role, \
+                                     invalidate_owner_decisions
 
 from ion.core.process.process import Process
 
@@ -101,8 +103,11 @@ class AppIntegrationService(ServiceProcess, AIS_Mixin):
         metadataCache = MetadataCache(data_resource_worker)
         data_resource_worker.metadataCache = metadataCache
         log.debug('Instantiated AIS Metadata Cache Object')
+        startTime = time.time()
         yield data_resource_worker.metadataCache.loadDataSets()
         yield data_resource_worker.metadataCache.loadDataSources()
+        log.info('AIS metadata cache warm-up: %d datasets, %d datasources in %.2f seconds' \
+                 %(metadataCache.getNumDatasets(), metadataCache.getNumDatasources(), time.time() - startTime))
 
         log.info('instantiating DatasetUpdateEventSubscriber')
         data_resource_worker.dataset_subscriber = DatasetUpdateEventSubscriber(process = data_resource_worker)
@@ -149,6 +154,8 @@ class AppIntegrationService(ServiceProcess, AIS_Mixin):
                 map_ooi_id_to_role(content['user-id'], content['role'])
             elif op == 'unset_user_role':
                 unmap_ooi_id_from_role(content['user-id'], content['role'])
+            elif op == 'owner_changed':
+                invalidate_owner_decisions(content['resource-ids'])
 
 
     @defer.inlineCallbacks
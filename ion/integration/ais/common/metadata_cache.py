@@ -13,6 +13,7 @@ resourceID.
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 import logging
+import time
 from twisted.internet import defer
 
 from decimal import Decimal
@@ -30,6 +31,10 @@ from ion.services.coi.datastore_bootstrap.ion_preload_config import TYPE_OF_ID,
     DATASET_RESOURCE_TYPE_ID, DATASOURCE_RESOURCE_TYPE_ID, HAS_A_ID, OWNED_BY_ID
 
 from ion.integration.ais.common.ais_utils import AIS_Mixin
+from ion.integration.ais.common.spatial_temporal_bounds import SpatialTemporalIndex
+
+from ion.core import ioninit
+CONF = ioninit.config(__name__)
 
 
 #
@@ -83,6 +88,11 @@ class MetadataCache(AIS_Mixin):
     Metadata cache inherits from mixin because it used to contain most of these methods.
 
     Most of the other AIS workers use an instance of the AIS worker process which is a proper mixin
+
+    Readers never wait: an entry is built outside of any lock and put in the
+    cache in one step. Updates of the same resource are serialized by a lock
+    for that resource only, and an update is skipped if the head commit of
+    the resource is the one already cached.
     """
     
     def __init__(self, ais):
@@ -98,12 +108,25 @@ class MetadataCache(AIS_Mixin):
 
         self.__metadata = {}
 
+        #
+        # The head commit of each cached resource when it was loaded
+        #
+        self.__versions = {}
+
+        #
+        # The spatial and temporal bounds of the cached datasets
+        #
+        self.__boundsIndex = SpatialTemporalIndex()
 
         #
-        # A lock to ensure exclusive access to cache when updating
+        # Locks to serialize the updates of each resource
         #
-        self.cacheLock = {}
-        self.cacheLock = defer.DeferredLock()
+        self.__resourceLocks = {}
+
+        #
+        # The number of resources loaded at once by loadDataSets and loadDataSources
+        #
+        self.loadConcurrency = max(int(CONF.getValue('load_concurrency', 8)), 1)
 
     def getNumDatasets(self):
         return self.numDSets
@@ -111,7 +134,17 @@ class MetadataCache(AIS_Mixin):
     def getNumDatasources(self):
         return self.numDSources
 
-    def getDatasets(self):
+    def getDatasets(self, bounds=None):
+        """
+        Get the metadata of the cached datasets.  If a SpatialTemporalBounds
+        object is given, only get the datasets which may be in the bounds;
+        these still need to be checked with bounds.isInBounds.
+        """
+        if bounds is not None:
+            dSetIDs = self.__boundsIndex.find(bounds.getIndexConditions())
+            if dSetIDs is not None:
+                return [self.__metadata[dSetID] for dSetID in dSetIDs]
+
         dSetList = []                
         for ds in self.__metadata.itervalues():
             if (ds[TYPE] is DSET):
@@ -131,7 +164,8 @@ class MetadataCache(AIS_Mixin):
         """
         Find all resources of type DATASET_RESOURCE_TYPE_ID and load their
         metadata.  The private __loadDSetMetadata method will only load
-        the metadata if the data set is in the Active.
+        the metadata if the data set is in the Active.  Up to loadConcurrency
+        data sets are loaded at once.
         """
 
         log.debug('loadDataSets()')
@@ -145,16 +179,11 @@ class MetadataCache(AIS_Mixin):
         numDSets =  len(dSetResults.idrefs)          
         log.debug('Found ' + str(numDSets) + ' datasets.')
 
-        try:
-            yield self.__lockCache()
-            
-            i = 0
-            while (i < numDSets):
-                yield self.__putDSetMetadata(dSetResults.idrefs[i].key)
-                i = i + 1
+        startTime = time.time()
+        yield self.__loadConcurrently(self.putDSetMetadata, [idref.key for idref in dSetResults.idrefs])
 
-        finally:
-            self.__unlockCache()
+        log.info('Loaded metadata for %d active of %d datasets in %.2f seconds' \
+                 %(self.numDSets, numDSets, time.time() - startTime))
             
         defer.returnValue(True)
 
@@ -164,7 +193,8 @@ class MetadataCache(AIS_Mixin):
         """
         Find all resources of type DATASOURCE_RESOURCE_TYPE_ID and load their
         metadata.  The private __loadDSetMetadata method will only load
-        the metadata if the data source is in the Active.
+        the metadata if the data source is in the Active.  Up to
+        loadConcurrency data sources are loaded at once.
         """
 
         log.debug('loadDataSources()')
@@ -178,21 +208,15 @@ class MetadataCache(AIS_Mixin):
         numDSources =  len(dSourceResults.idrefs)          
         log.debug('Found ' + str(numDSources) + ' datasources.')
 
-        try:
-            yield self.__lockCache()
-            
-            i = 0
-            while (i < numDSources):
-                yield self.__putDSourceMetadata(dSourceResults.idrefs[i].key)
-                i = i + 1
+        startTime = time.time()
+        yield self.__loadConcurrently(self.putDSourceMetadata, [idref.key for idref in dSourceResults.idrefs])
 
-        finally:
-            self.__unlockCache()
+        log.info('Loaded metadata for %d active of %d datasources in %.2f seconds' \
+                 %(self.numDSources, numDSources, time.time() - startTime))
             
         defer.returnValue(True)
 
 
-    @defer.inlineCallbacks
     def getDSet(self, dSetID):
         """
         Get the dictionary entry containing the metadata from the data set
@@ -207,22 +231,16 @@ class MetadataCache(AIS_Mixin):
             log.debug('getDSet for dSetID %s' %(dSetID))
 
             try:
-                yield self.__lockCache()
-                        
                 metadata = self.__metadata[dSetID]
                 log.debug('Metadata keys for ' + dSetID + ': ' + str(metadata.keys()))
                 returnValue = metadata[DSET]
             except KeyError:
                 log.error('Metadata not found for datasetID: %s'  %(dSetID))
                 returnValue = None
-    
-            finally:
-                self.__unlockCache()
         
-        defer.returnValue(returnValue)
+        return defer.succeed(returnValue)
 
 
-    @defer.inlineCallbacks
     def getDSetMetadata(self, dSetID):
         """
         Get the dictionary entry containing the metadata from the data set
@@ -236,19 +254,14 @@ class MetadataCache(AIS_Mixin):
             log.debug('getDSetMetadata for dSetID %s' %(dSetID))
 
             try:
-                yield self.__lockCache()
-                        
                 metadata = self.__metadata[dSetID]
                 log.debug('Metadata keys for ' + dSetID + ': ' + str(metadata.keys()))
                 returnValue = metadata
             except KeyError:
                 log.info('Metadata not found for datasetID: ' + dSetID)
                 returnValue = None
-                
-            finally:            
-                self.__unlockCache()
         
-        defer.returnValue(returnValue)
+        return defer.succeed(returnValue)
 
 
     @defer.inlineCallbacks
@@ -256,7 +269,8 @@ class MetadataCache(AIS_Mixin):
         """
         Get the instance of the data set represented by the given resource
         ID (dSetID) and call the private __loadDSetMetadata method with the
-        data set as an argument. 
+        data set as an argument.  The metadata is not loaded again if the
+        head commit of the data set is the one already cached.
         """
         
         if dSetID is None:
@@ -264,13 +278,12 @@ class MetadataCache(AIS_Mixin):
         else:            
             log.debug('putDSetMetadata for dSetID %s' %(dSetID))
 
+            lock = yield self.__lockResource(dSetID)
             try:
-                yield self.__lockCache()
-        
                 yield self.__putDSetMetadata(dSetID)
     
             finally:
-                self.__unlockCache()
+                self.__unlockResource(dSetID, lock)
                     
     
     @defer.inlineCallbacks
@@ -286,32 +299,18 @@ class MetadataCache(AIS_Mixin):
         else:            
             log.debug('deleteDSetMetadata: deleting %s' %(dSetID))
 
+            lock = yield self.__lockResource(dSetID)
             try:
-                yield self.__lockCache()
-    
-                #
-                # Set the persistent flag to False
-                #
-                dSetMetadata = self.__metadata.pop(dSetID)
-                dSet = dSetMetadata[DSET]
-                dSet.Repository.persistent = False
-    
-
-            except KeyError:
-                log.error('deleteDSetMetadata: datasetID ' + dSetID + ' not cached')
-                returnValue = False
-            else:
-                self.numDSets -= 1
-                returnValue = True
+                returnValue = self.__removeMetadata(dSetID, DSET)
+                if not returnValue:
+                    log.error('deleteDSetMetadata: datasetID ' + dSetID + ' not cached')
     
             finally:
-                
-                self.__unlockCache()
+                self.__unlockResource(dSetID, lock)
         
         defer.returnValue(returnValue)
 
     
-    @defer.inlineCallbacks
     def getDSource(self, dSourceID):
         """
         Get the dictionary entry containing the metadata from the data source
@@ -326,22 +325,16 @@ class MetadataCache(AIS_Mixin):
             log.debug('getDSource for %s' %(dSourceID))
     
             try:                    
-                yield self.__lockCache()
-    
                 metadata = self.__metadata[dSourceID]
                 log.debug('Metadata keys for ' + dSourceID + ': ' + str(metadata.keys()))
                 returnValue = metadata[DSOURCE]
             except KeyError:
                 log.info('Metadata not found for datasourceID: ' + dSourceID)
                 returnValue = None
-    
-            finally:
-                self.__unlockCache()
             
-        defer.returnValue(returnValue)            
+        return defer.succeed(returnValue)
         
 
-    @defer.inlineCallbacks
     def getDSourceMetadata(self, dSourceID):
         """
         Get the dictionary entry containing the metadata from the data source
@@ -355,28 +348,22 @@ class MetadataCache(AIS_Mixin):
             log.debug('getDSourceMetadata for %s' %(dSourceID))
             
             try:
-                yield self.__lockCache()
-        
-                log.debug('getDSourceMetadata')
-                        
                 metadata = self.__metadata[dSourceID]
                 log.debug('Metadata keys for ' + dSourceID + ': ' + str(metadata.keys()))
                 returnValue = metadata
             except KeyError:
                 log.info('Metadata not found for datasourceID: ' + dSourceID)
                 returnValue = None
-    
-            finally:
-                self.__unlockCache()
                 
-        defer.returnValue(returnValue)
+        return defer.succeed(returnValue)
     
     
     @defer.inlineCallbacks
     def putDSourceMetadata(self, dSourceID):
         """
         Put the instance of the data source represented by the given resource
-        ID (dSourceID). 
+        ID (dSourceID).  The metadata is not loaded again if the head commit
+        of the data source is the one already cached.
         """
 
         if dSourceID is None:
@@ -384,13 +371,12 @@ class MetadataCache(AIS_Mixin):
         else:            
             log.debug('putDSourceMetadata for dSourceID %s' %(dSourceID))
 
+            lock = yield self.__lockResource(dSourceID)
             try:
-                yield self.__lockCache()
-    
                 yield self.__putDSourceMetadata(dSourceID)
     
             finally:
-                self.__unlockCache()
+                self.__unlockResource(dSourceID, lock)
 
 
     @defer.inlineCallbacks
@@ -406,26 +392,14 @@ class MetadataCache(AIS_Mixin):
         else:            
             log.debug('deleteDSourceMetadata for %s' %(dSourceID))
 
+            lock = yield self.__lockResource(dSourceID)
             try:
-                yield self.__lockCache()
-            
-                #
-                # Set the persistent flag to False
-                #
-                dSourceMetadata = self.__metadata.pop(dSourceID)
-                dSource = dSourceMetadata[DSOURCE]
-                dSource.Repository.persistent = False
-    
-
-            except KeyError:
-                log.error('deleteDSourceMetadata: datasourceID ' + dSourceID + ' not cached')
-                returnValue = False
-            else:
-                self.numDSources -= 1
-                returnValue = True
+                returnValue = self.__removeMetadata(dSourceID, DSOURCE)
+                if not returnValue:
+                    log.error('deleteDSourceMetadata: datasourceID ' + dSourceID + ' not cached')
     
             finally:
-                self.__unlockCache()
+                self.__unlockResource(dSourceID, lock)
         
         defer.returnValue(returnValue)
 
@@ -433,23 +407,140 @@ class MetadataCache(AIS_Mixin):
 
 
     @defer.inlineCallbacks
-    def __lockCache(self):
+    def __lockResource(self, resID):
         """
-        Lock the cache to insure exclusive access while updating
+        Lock the given resource to serialize the updates of its metadata;
+        returns the lock to release with __unlockResource.
         """
         
-        log.debug('__lockCache requesting lock')
-        yield self.cacheLock.acquire()
-        log.debug('__lockCache lock acquired')
+        lock = self.__resourceLocks.get(resID)
+        if lock is None:
+            lock = defer.DeferredLock()
+            self.__resourceLocks[resID] = lock
 
+        log.debug('__lockResource requesting lock for %s' %(resID))
+        yield lock.acquire()
+        log.debug('__lockResource lock acquired for %s' %(resID))
 
-    def __unlockCache(self):
+        defer.returnValue(lock)
+
+
+    def __unlockResource(self, resID, lock):
         """
-        Unlock the cache to insure exclusive access while updating
+        Unlock the given resource; forget the lock if nothing is waiting on it.
+        Releasing the lock may run a waiting update to completion, which
+        forgets the lock itself or puts a new lock for the resource.
         """
         
-        log.debug('__unlockCache')
-        self.cacheLock.release()
+        log.debug('__unlockResource %s' %(resID))
+        lock.release()
+        if self.__resourceLocks.get(resID) is lock and not lock.locked and not lock.waiting:
+            del self.__resourceLocks[resID]
+
+
+    @defer.inlineCallbacks
+    def __loadConcurrently(self, put, resIDs):
+        """
+        Call put for each of the resource IDs, with at most loadConcurrency
+        of the calls outstanding at once.
+        """
+
+        semaphore = defer.DeferredSemaphore(self.loadConcurrency)
+        results = yield defer.DeferredList([semaphore.run(put, resID) for resID in resIDs],
+                                           consumeErrors=True)
+
+        for success, result in results:
+            if not success:
+                result.raiseException()
+
+
+    def __getVersion(self, res):
+        """
+        Get the head commit of the given resource, or None if it is not known.
+        """
+
+        try:
+            return res.Repository.commit_head.MyId
+        except Exception, ex:
+            log.debug('Could not get the head commit of %s: %s' %(res.ResourceIdentity, str(ex)))
+            return None
+
+
+    @defer.inlineCallbacks
+    def __getHeadVersion(self, resID):
+        """
+        Get the head commit of the given resource from the datastore without
+        fetching its content, or None if it is not known.  Only the commits
+        the workbench does not have yet are pulled.
+        """
+
+        try:
+            yield self.rc.workbench.pull(self.rc.datastore_service, resID, get_head_content=False)
+            branch = self.rc.workbench.get_repository(resID).get_branch('master')
+        except Exception, ex:
+            log.debug('Could not pull the head commit of %s: %s' %(resID, str(ex)))
+            defer.returnValue(None)
+
+        #
+        # A branch with more than one head commit is merged by get_instance
+        #
+        if branch is None or len(branch.commitrefs) != 1:
+            defer.returnValue(None)
+        defer.returnValue(branch.commitrefs[0].MyId)
+
+
+    def __isCurrent(self, resID, version):
+        """
+        Check whether the metadata cached for the given resource was loaded
+        from the given head commit.
+        """
+
+        return version is not None and resID in self.__metadata and \
+            self.__versions.get(resID) == version
+
+
+    def __removeMetadata(self, resID, resType):
+        """
+        Remove the dictionary entry for the given resource if it is cached
+        as the given type (DSET or DSOURCE); return whether it was removed.
+        """
+
+        metadata = self.__metadata.get(resID)
+        if metadata is None or metadata[TYPE] != resType:
+            return False
+
+        #
+        # Set the persistent flag to False
+        #
+        del self.__metadata[resID]
+        self.__versions.pop(resID, None)
+        metadata[resType].Repository.persistent = False
+
+        if resType == DSET:
+            self.__boundsIndex.remove(resID)
+            self.numDSets -= 1
+        else:
+            self.numDSources -= 1
+        return True
+
+
+    def __storeMetadata(self, resID, metadata, version):
+        """
+        Store a complete dictionary entry for the given resource, loaded from
+        the given head commit, replacing any entry for it.
+        """
+
+        if resID not in self.__metadata:
+            if metadata[TYPE] == DSET:
+                self.numDSets += 1
+            else:
+                self.numDSources += 1
+
+        self.__metadata[resID] = metadata
+        self.__versions[resID] = version
+
+        if metadata[TYPE] == DSET:
+            self.__boundsIndex.put(resID, metadata)
 
 
     @defer.inlineCallbacks
@@ -457,11 +548,21 @@ class MetadataCache(AIS_Mixin):
         """
         Get the instance of the data set represented by the given resource
         ID (dSetID) and call the private __loadDSetMetadata method with the
-        data set as an argument. 
+        data set as an argument, unless the head commit of the data set is
+        the one already cached.
         """
         
         log.debug('__putDSetMetadata')
 
+        #
+        # Check the head commit of a cached data set before getting the whole instance
+        #
+        if dSetID in self.__metadata:
+            version = yield self.__getHeadVersion(dSetID)
+            if self.__isCurrent(dSetID, version):
+                log.debug('data set %s is unchanged: not reloading.' %(dSetID))
+                return
+
         try:
             dSet = yield self.rc.get_instance(dSetID)
             yield self.__loadDSetMetadata(dSet)
@@ -474,11 +575,21 @@ class MetadataCache(AIS_Mixin):
         """
         Get the instance of the data source represented by the given resource
         ID (dSourceID) and call the private __loadDSourceMetadata method with the
-        data source as an argument. 
+        data source as an argument, unless the head commit of the data source
+        is the one already cached.
         """
         
         log.debug('__putDSourceMetadata')
 
+        #
+        # Check the head commit of a cached data source before getting the whole instance
+        #
+        if dSourceID in self.__metadata:
+            version = yield self.__getHeadVersion(dSourceID)
+            if self.__isCurrent(dSourceID, version):
+                log.debug('data source %s is unchanged: not reloading.' %(dSourceID))
+                return
+
         try:
             dSource = yield self.rc.get_instance(dSourceID)
             self.__loadDSourceMetadata(dSource)
@@ -491,17 +602,25 @@ class MetadataCache(AIS_Mixin):
         """
         Create and load a dictionary entry with the metadata from the given
         data set, and insert the entry into the __metadata dictionary (a
-        dictionary of dictionaries).  Only do this if the data set is Active.
+        dictionary of dictionaries).  Only do this if the data set is Active;
+        an entry cached for a data set that is no longer Active is removed.
+        The entry is built before it is inserted, so readers only ever see
+        complete entries.
         """
 
         log.debug('__loadDSetMetadata for dSet: %s' %(dSet.ResourceIdentity))
         
+        version = self.__getVersion(dSet)
+        
         #
         # Only cache the metadata if the data set is in the ACTIVE state.
         #
         if (dSet.ResourceLifeCycleState == dSet.ACTIVE):
+            if self.__isCurrent(dSet.ResourceIdentity, version):
+                log.debug('data set %s is unchanged: not reloading.' %(dSet.ResourceIdentity))
+                return
+                
             dSetMetadata = {}
-            self.numDSets += 1
             #
             # Store the entire dataset now; should be doing only that anyway.
             # Set persisence to true.  NOTE: remember to set this to false
@@ -551,29 +670,36 @@ class MetadataCache(AIS_Mixin):
             #
             # Store this dSetMetadata in the dictionary, indexed by the resourceID
             #
-            self.__metadata[dSet.ResourceIdentity] = dSetMetadata
+            self.__storeMetadata(dSet.ResourceIdentity, dSetMetadata, version)
     
             if log.getEffectiveLevel() <= logging.DEBUG:
                 self.__printMetadata('Dataset Metadata', dSet)
         else:
             log.info('data set %s is not ACTIVE: Not caching.' %(dSet.ResourceIdentity))
+            self.__removeMetadata(dSet.ResourceIdentity, DSET)
 
 
     def __loadDSourceMetadata(self, dSource):
         """
         Create and load a dictionary entry with the metadata from the given
         data source, and insert the entry into the __metadata dictionary (a
-        dictionary of dictionaries).  Only do this if the data source is Active.
+        dictionary of dictionaries).  Only do this if the data source is Active;
+        an entry cached for a data source that is no longer Active is removed.
         """
         
         log.debug('__loadDSourceMetadata for dSource: %s' %(dSource.ResourceIdentity))
         
+        version = self.__getVersion(dSource)
+        
         #
         # Only cache the metadata if the data source is in the ACTIVE state.
         #
         if (dSource.ResourceLifeCycleState == dSource.ACTIVE):
+            if self.__isCurrent(dSource.ResourceIdentity, version):
+                log.debug('data source %s is unchanged: not reloading.' %(dSource.ResourceIdentity))
+                return
+                
             dSourceMetadata = {}
-            self.numDSources += 1
             #
             # Store the entire datasource now; should be doing only that anyway
             # Set persisence to true.  NOTE: remember to set this to false
@@ -602,12 +728,13 @@ class MetadataCache(AIS_Mixin):
             #
             # Store this dSourceMetadata in the dictionary, indexed by the resourceID
             #
-            self.__metadata[dSource.ResourceIdentity] = dSourceMetadata
+            self.__storeMetadata(dSource.ResourceIdentity, dSourceMetadata, version)
     
             if log.getEffectiveLevel() <= logging.DEBUG:
                 self.__printMetadata('Datasource Metadata', dSource)
         else:
             log.info('data source %s is not ACTIVE: Not caching.' %(dSource.ResourceIdentity))
+            self.__removeMetadata(dSource.ResourceIdentity, DSOURCE)
 
 
 
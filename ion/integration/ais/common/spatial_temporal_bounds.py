@@ -12,6 +12,8 @@ log = ion.util.ionlog.getLogger(__name__)
 from ion.util.procutils import isnan
 
 import time, datetime
+import bisect
+import math
 from decimal import Decimal
 
 #
@@ -27,6 +29,25 @@ POS_VERTICAL  = 'posVertical'
 MIN_TIME      = 'minTime'
 MIN_TIME      = 'maxTime'
 
+#
+# Constants for the dataset metadata keys the index is built on
+#
+LAT_MIN    = 'ion_geospatial_lat_min'
+LAT_MAX    = 'ion_geospatial_lat_max'
+LON_MIN    = 'ion_geospatial_lon_min'
+LON_MAX    = 'ion_geospatial_lon_max'
+VERT_MIN   = 'ion_geospatial_vertical_min'
+VERT_MAX   = 'ion_geospatial_vertical_max'
+TIME_START = 'ion_time_coverage_start'
+TIME_END   = 'ion_time_coverage_end'
+
+#
+# Constants for the index conditions: the metadata value must be at most
+# or at least the bound
+#
+AT_MOST  = 'atMost'
+AT_LEAST = 'atLeast'
+
 class SpatialTemporalBounds(object):
 
     #
@@ -190,6 +211,45 @@ class SpatialTemporalBounds(object):
             log.debug('__isInBounds is %s' %(returnValue))
             return returnValue
 
+    def getIndexConditions(self):
+        """
+        Get the conditions on the indexed metadata which any dataset in
+        bounds meets, as (key, AT_MOST or AT_LEAST, bound) tuples.  These
+        select the candidates to check with isInBounds from a
+        SpatialTemporalIndex; an empty list means every dataset is a
+        candidate.
+        """
+        conditions = []
+
+        if self.filterByLatitude:
+            if self.bIsMinLatitudeSet:
+                conditions.append((LAT_MIN, AT_MOST, self.bounds[MAX_LATITUDE]))
+            if self.bIsMaxLatitudeSet:
+                conditions.append((LAT_MAX, AT_LEAST, self.bounds[MIN_LATITUDE]))
+
+        if self.filterByLongitude:
+            if self.bIsMinLongitudeSet:
+                conditions.append((LON_MAX, AT_LEAST, self.bounds[MIN_LONGITUDE]))
+            if self.bIsMaxLongitudeSet:
+                conditions.append((LON_MIN, AT_MOST, self.bounds[MAX_LONGITUDE]))
+
+        #
+        # The vertical bounds are checked the same way for depth and altitude
+        #
+        if self.filterByVertical:
+            conditions.append((VERT_MIN, AT_MOST, self.bounds[MAX_VERTICAL]))
+            conditions.append((VERT_MAX, AT_LEAST, self.bounds[MIN_VERTICAL]))
+
+        #
+        # Data covering any part of the time bounds ends after the min time;
+        # data whose time coverage can't be converted is always in bounds.
+        #
+        if self.filterByTime and self.bounds['minTime'] <= self.bounds['maxTime']:
+            conditions.append((TIME_END, AT_LEAST, self.bounds['minTime']))
+
+        return conditions
+
+
     def __isInLatitudeBounds(self, minMetaData, bounds):
         """
         Determine if dataset resource is in latitude bounds.
@@ -408,3 +468,291 @@ class SpatialTemporalBounds(object):
         for boundName in boundNames:
             log.debug('   %s = %s'  % (boundName, bounds[boundName]))
 
+
+class SortedBounds(object):
+    """
+    The values of the indexed datasets, kept sorted so the datasets with a
+    value in a range are found by bisection.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.resIDs = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value, resID):
+        i = bisect.bisect_right(self.values, value)
+        self.values.insert(i, value)
+        self.resIDs.insert(i, resID)
+
+    def discard(self, value, resID):
+        i = bisect.bisect_left(self.values, value)
+        j = bisect.bisect_right(self.values, value)
+        while i < j:
+            if self.resIDs[i] == resID:
+                del self.values[i]
+                del self.resIDs[i]
+                return
+            i += 1
+
+    def slice(self, lower, upper):
+        """
+        Get the slice of the values at least lower and at most upper; either
+        may be None for no limit.
+        """
+        i = 0
+        if lower is not None:
+            i = bisect.bisect_left(self.values, lower)
+        j = len(self.values)
+        if upper is not None:
+            j = bisect.bisect_right(self.values, upper)
+        return i, max(i, j)
+
+
+class IntervalBounds(object):
+    """
+    The [min, max] intervals of the indexed datasets along one dimension.
+    The intervals are grouped by width, each group sorted by min: an
+    interval of a group no wider than w reaches up to a bound b only if
+    its min is at least b - w, so the intervals meeting bounds on both min
+    and max are found by bisection in every group.  Intervals without both
+    a min and a max, or with a max below the min, are irregular and always
+    candidates.
+    """
+
+    # The narrowest group of intervals which are not points
+    MIN_WIDTH_EXPONENT = -20
+
+    def __init__(self):
+        self.groups = {}
+        self.irregular = set()
+
+    def __getWidth(self, minimum, maximum):
+        """
+        Get the width of the group of the given interval: 0 for points,
+        otherwise the smallest power of 2 at least the width of the interval.
+        """
+        width = maximum - minimum
+        if width == 0:
+            return 0.0
+
+        exponent = max(int(math.ceil(math.log(width, 2))), self.MIN_WIDTH_EXPONENT)
+        while 2.0 ** exponent < width:
+            exponent += 1
+        return 2.0 ** exponent
+
+    def add(self, resID, minimum, maximum):
+        if minimum is None or maximum is None or maximum < minimum:
+            self.irregular.add(resID)
+            return
+
+        width = self.__getWidth(minimum, maximum)
+        group = self.groups.get(width)
+        if group is None:
+            group = SortedBounds()
+            self.groups[width] = group
+        group.add(minimum, resID)
+
+    def discard(self, resID, minimum, maximum):
+        if minimum is None or maximum is None or maximum < minimum:
+            self.irregular.discard(resID)
+            return
+
+        width = self.__getWidth(minimum, maximum)
+        group = self.groups[width]
+        group.discard(minimum, resID)
+        if not group:
+            del self.groups[width]
+
+    def __getSlices(self, minLower, minUpper, maxLower):
+        for width, group in self.groups.iteritems():
+            lower = minLower
+            if maxLower is not None:
+                #
+                # Allow for the rounding of the bound and of the widths
+                #
+                reach = maxLower - width - 1e-9 * (abs(maxLower) + width + 1.0)
+                if lower is None or reach > lower:
+                    lower = reach
+            i, j = group.slice(lower, minUpper)
+            yield group, i, j
+
+    def count(self, minLower, minUpper, maxLower):
+        """
+        Count the candidate intervals with a min of at least minLower and at
+        most minUpper, and a max of at least maxLower; any may be None.
+        """
+        count = len(self.irregular)
+        for group, i, j in self.__getSlices(minLower, minUpper, maxLower):
+            count += j - i
+        return count
+
+    def find(self, minLower, minUpper, maxLower):
+        """
+        Get the candidate intervals counted by count.
+        """
+        resIDs = set(self.irregular)
+        for group, i, j in self.__getSlices(minLower, minUpper, maxLower):
+            resIDs.update(group.resIDs[i:j])
+        return resIDs
+
+
+class SpatialTemporalIndex(object):
+    """
+    An index of the spatial and temporal metadata of datasets, used to find
+    the candidate datasets for a set of bounds without checking every
+    dataset.  Each dimension is indexed by IntervalBounds; the candidates
+    are found along the dimension whose conditions select the fewest
+    datasets and are then filtered by all the conditions.  The values are
+    indexed as floats, which keeps their order, so the candidates are a
+    superset of the datasets in bounds: they must still be checked with
+    SpatialTemporalBounds.isInBounds.
+    """
+
+    DIMENSIONS = ((LAT_MIN, LAT_MAX), (LON_MIN, LON_MAX), (VERT_MIN, VERT_MAX), (TIME_START, TIME_END))
+
+    def __init__(self):
+        self.__intervals = {}
+        self.__dimensions = {}
+        for dimension in self.DIMENSIONS:
+            self.__intervals[dimension] = IntervalBounds()
+            for key in dimension:
+                self.__dimensions[key] = dimension
+
+        #
+        # The datasets whose time coverage is always in the time bounds:
+        # isInBounds can't check it, or can't check it by its end
+        #
+        self.__timeUnbounded = set()
+
+        #
+        # The indexed values of each dataset, by key
+        #
+        self.__values = {}
+
+    def __len__(self):
+        return len(self.__values)
+
+    def put(self, resID, metadata):
+        """
+        Index (or index again) the metadata of the given dataset.
+        """
+        self.remove(resID)
+
+        values = {}
+        for key in (LAT_MIN, LAT_MAX, LON_MIN, LON_MAX, VERT_MIN, VERT_MAX):
+            #
+            # A value that is not a number is never in bounds: don't index it
+            #
+            try:
+                if not isnan(metadata[key]):
+                    values[key] = float(metadata[key])
+            except (KeyError, TypeError, ValueError):
+                pass
+
+        timeStart = self.__getTime(metadata, TIME_START)
+        timeEnd = self.__getTime(metadata, TIME_END)
+        if timeStart is None or timeEnd is None or timeStart > timeEnd:
+            self.__timeUnbounded.add(resID)
+        else:
+            values[TIME_START] = timeStart
+            values[TIME_END] = timeEnd
+
+        for minKey, maxKey in self.DIMENSIONS:
+            self.__intervals[(minKey, maxKey)].add(resID, values.get(minKey), values.get(maxKey))
+        self.__values[resID] = values
+
+    def remove(self, resID):
+        """
+        Remove the given dataset from the index, if it is indexed.
+        """
+        values = self.__values.pop(resID, None)
+        if values is None:
+            return
+
+        for minKey, maxKey in self.DIMENSIONS:
+            self.__intervals[(minKey, maxKey)].discard(resID, values.get(minKey), values.get(maxKey))
+        self.__timeUnbounded.discard(resID)
+
+    def find(self, conditions):
+        """
+        Get the set of datasets which may meet all the given conditions (see
+        SpatialTemporalBounds.getIndexConditions), or None if there are no
+        conditions.
+        """
+        if not conditions:
+            return None
+
+        #
+        # Gather the limits on the min and the max of each dimension
+        #
+        limits = {}
+        for key, op, bound in conditions:
+            bound = float(bound)
+            dimension = self.__dimensions[key]
+            minLower, minUpper, maxLower = limits.get(dimension, (None, None, None))
+            if key == dimension[0]:
+                if op == AT_MOST:
+                    minUpper = self.__min(minUpper, bound)
+                else:
+                    minLower = self.__max(minLower, bound)
+            elif op == AT_MOST:
+                # A max of at most the bound has a min of at most the bound
+                minUpper = self.__min(minUpper, bound)
+            else:
+                maxLower = self.__max(maxLower, bound)
+            limits[dimension] = (minLower, minUpper, maxLower)
+
+        counted = []
+        for dimension, (minLower, minUpper, maxLower) in limits.iteritems():
+            count = self.__intervals[dimension].count(minLower, minUpper, maxLower)
+            counted.append((count, dimension))
+        counted.sort(key=lambda dimensionCount: dimensionCount[0])
+
+        dimension = counted[0][1]
+        minLower, minUpper, maxLower = limits[dimension]
+        resIDs = self.__intervals[dimension].find(minLower, minUpper, maxLower)
+
+        #
+        # Keep the candidates meeting all the conditions
+        #
+        checks = [(key, op == AT_MOST, float(bound)) for key, op, bound in conditions]
+        matched = []
+        for resID in resIDs:
+            values = self.__values[resID]
+            for key, atMost, bound in checks:
+                value = values.get(key)
+                if value is None:
+                    if not (key in (TIME_START, TIME_END) and resID in self.__timeUnbounded):
+                        break
+                elif atMost:
+                    if value > bound:
+                        break
+                elif value < bound:
+                    break
+            else:
+                matched.append(resID)
+
+        return set(matched)
+
+    def __min(self, a, b):
+        if a is None or b < a:
+            return b
+        return a
+
+    def __max(self, a, b):
+        if a is None or b > a:
+            return b
+        return a
+
+    def __getTime(self, metadata, key):
+        """
+        Convert a time coverage of the metadata as the time bounds are.
+        """
+        try:
+            tmpTime = datetime.datetime.strptime(metadata[key], '%Y-%m-%dT%H:%M:%SZ')
+            return time.mktime(tmpTime.timetuple())
+        except (KeyError, TypeError, ValueError):
+            return None
@@ -80,19 +80,11 @@ class DatasetUpdateEventSubscriber(DatasetChangeEventSubscriber):
         log.debug("DatasetUpdateEventSubscriber received event for dsetID: %s" %(dSetResID))
 
         #
-        # If the dataset is cached, delete it.  In any case, cache the dataset.
+        # Refresh the cached dataset: the metadata is reloaded only if the
+        # head commit of the dataset changed, and the cached entry stays
+        # readable while it is reloaded.
         #
-
-        #
-        # Delete the dataset
-        #
-        log.debug('DatasetUpdateEventSubscriber deleting %s' %(dSetResID))
-        yield self.metadataCache.deleteDSetMetadata(dSetResID)
-
-        #
-        # Now  reload the dataset and datasource metadata
-        #
-        log.debug('DatasetUpdateEventSubscriber putting new metadata in cache')
+        log.debug('DatasetUpdateEventSubscriber refreshing metadata in cache')
         yield self.metadataCache.putDSetMetadata(dSetResID)
 
         log.debug("DatasetUpdateEventSubscriber event for dsetID: %s exit" %(dSetResID))
@@ -116,17 +108,10 @@ class DatasourceUpdateEventSubscriber(DatasourceChangeEventSubscriber):
         log.debug(">>>----> DatasourceUpdateEventSubscriber received event for dsrcID: %s\n" %(dSourceResID))
 
         #
-        # If the datasource is cached, delete it.  In any case, cache the
-        # datasource.
+        # Refresh the cached datasource: the metadata is reloaded only if the
+        # head commit of the datasource changed.
         #
-
-        log.debug('DatasourceUpdateEventSubscriber deleting %s' %(dSourceResID))
-        yield self.metadataCache.deleteDSourceMetadata(dSourceResID)
-
-        #
-        # Now  reload the datasource metadata
-        #
-        log.debug('DatasourceUpdateEventSubscriber putting new metadata in cache')
+        log.debug('DatasourceUpdateEventSubscriber refreshing metadata in cache')
         yield self.metadataCache.putDSourceMetadata(dSourceResID)
 
         #
@@ -245,7 +230,14 @@ class FindDataResources(object):
         rspMsg.message_parameters_reference[0] = rspMsg.CreateObject(FIND_DATA_RESOURCES_RSP_MSG_TYPE)
 
         #
-        # Iterate through the cache getting the datasets
+        # Instantiate a bounds object, and load it up with the given bounds
+        # info
+        #
+        bounds = SpatialTemporalBounds()
+        bounds.loadBounds(msg.message_parameters_reference)
+
+        #
+        # Get the datasets from the cache which may be in the bounds
         # TODO: This next few sets of code build up a list of metadata -
         # not just datasetIDs, but the whole metadata.  This is not a huge
         # deal, but if it stays this way, it might be a good idea to take
@@ -253,8 +245,8 @@ class FindDataResources(object):
         # the private __getDataResources() method.  Or, just store the IDs
         # of the datasets here instead of the metadata.
         #
-        dSetList = self.metadataCache.getDatasets()
-        log.debug('findDataResources: cache contains %d datasets' %len(dSetList))
+        dSetList = self.metadataCache.getDatasets(bounds)
+        log.debug('findDataResources: cache contains %d candidate datasets' %len(dSetList))
         
         #
         # Iterate through this list getting those owned by the userID
@@ -314,13 +306,14 @@ class FindDataResources(object):
         #finalList = ownedByAndPrivateList + publicList
 
         finalList = publicList
+        publicIDs = set([ds['ResourceIdentity'] for ds in publicList])
         for item in ownedByList:
-            if item not in finalList:
+            if item['ResourceIdentity'] not in publicIDs:
                 finalList.append(item)
 
         log.debug('findDataResources: finalList has %d datasets' %len(finalList))
         
-        response = yield self.__getDataResources(msg, finalList, rspMsg, typeFlag = self.ALL)
+        response = yield self.__getDataResources(msg, bounds, finalList, rspMsg, typeFlag = self.ALL)
 
         defer.returnValue(response)
 
@@ -361,7 +354,14 @@ class FindDataResources(object):
         rspMsg.message_parameters_reference[0] = rspMsg.CreateObject(FIND_DATA_RESOURCES_BY_OWNER_RSP_MSG_TYPE)
 
         #
-        # Iterate through the cache getting the datasets
+        # Instantiate a bounds object, and load it up with the given bounds
+        # info
+        #
+        bounds = SpatialTemporalBounds()
+        bounds.loadBounds(msg.message_parameters_reference)
+
+        #
+        # Get the datasets from the cache which may be in the bounds
         # TODO: This next few sets of code build up a list of metadata -
         # not just datasetIDs, but the whole metadata.  This is not a huge
         # deal, but if it stays this way, it might be a good idea to take
@@ -369,8 +369,8 @@ class FindDataResources(object):
         # the private __getDataResources() method.  Or, just store the IDs
         # of the datasets here instead of the metadata.
         #
-        dSetList = self.metadataCache.getDatasets()
-        log.debug('findDataResourcesByUser: cache contains %d datasets' %len(dSetList))
+        dSetList = self.metadataCache.getDatasets(bounds)
+        log.debug('findDataResourcesByUser: cache contains %d candidate datasets' %len(dSetList))
         
         #
         # iterate through this list getting those owned by the userID
@@ -382,13 +382,13 @@ class FindDataResources(object):
                 
         log.debug('findDataResourcesByUser: ownedByList has %d datasets' %len(ownedByList))
 
-        response = yield self.__getDataResources(msg, ownedByList, rspMsg, typeFlag = self.BY_USER)
+        response = yield self.__getDataResources(msg, bounds, ownedByList, rspMsg, typeFlag = self.BY_USER)
         
         defer.returnValue(response)
 
 
     @defer.inlineCallbacks
-    def __getDataResources(self, msg, dSetList, rspMsg, typeFlag = ALL):
+    def __getDataResources(self, msg, bounds, dSetList, rspMsg, typeFlag = ALL):
         """
         Given the list of datasetIDs, determine in the data represented by
         the dataset is within the given spatial and temporal bounds, and
@@ -396,12 +396,6 @@ class FindDataResources(object):
         """
 
         log.debug('__getDataResources entry')        
-        #
-        # Instantiate a bounds object, and load it up with the given bounds
-        # info
-        #
-        bounds = SpatialTemporalBounds()
-        bounds.loadBounds(msg.message_parameters_reference)
         #userID = msg.message_parameters_reference.user_ooi_id       
         #
         # Now iterate through the list if dataset resource IDs and for each ID:
@@ -32,6 +32,7 @@ from ion.core.process.process import ProcessFactory
 from ion.core.data import cassandra_bootstrap
 
 from twisted.mail.smtp import SMTPSenderFactory, SMTPClientError
+from ion.util.smtp_pool import SMTPSenderPool
 from email.mime.text import MIMEText
 try:
     from cStringIO import StringIO
@@ -62,6 +63,50 @@ class NotificationAlertError(ApplicationError):
     A class for Notification exceptions 
     """
 
+class SubscriptionIndex(object):
+    """
+    The subscription rows of the index store grouped by data_src_id. The rows of a
+    data source are queried from the index store the first time they are needed and
+    again after ttl seconds, so that subscriptions added by another instance of the
+    service are noticed; add and remove keep the index current in between.
+    """
+
+    def __init__(self, index_store, ttl=300):
+        self.index_store = index_store
+        self.ttl = ttl
+        # data_src_id -> (time loaded, {key:row})
+        self._rows = {}
+
+    @defer.inlineCallbacks
+    def get(self, data_src_id):
+        """
+        @brief the subscriptions for a data source
+        @retval Deferred, called back with a dict of key:row like IndexStore.query
+        """
+        entry = self._rows.get(data_src_id)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            query = Query()
+            query.add_predicate_eq('data_src_id', data_src_id)
+            rows = yield self.index_store.query(query)
+            entry = (time.time(), dict(rows))
+            self._rows[data_src_id] = entry
+
+        defer.returnValue(entry[1])
+
+    def add(self, key, row):
+        entry = self._rows.get(row['data_src_id'])
+        if entry is not None:
+            entry[1][key] = row
+
+    def remove(self, key, data_src_id):
+        entry = self._rows.get(data_src_id)
+        if entry is not None:
+            entry[1].pop(key, None)
+
+    def clear(self):
+        self._rows.clear()
+
+
 class NotificationAlertService(ServiceProcess):
     """
     Service to provide clients access to backend data
@@ -89,6 +134,18 @@ class NotificationAlertService(ServiceProcess):
         self.MailServer = CONF.getValue('mail_server', default='mail.oceanobservatories.org')
         self.update_event_queue_name = CONF.getValue('update_event_queue_name', default='nas_update_event')
         self.offline_event_queue_name = CONF.getValue('offline_event_queue_name', default='nas_offline_event')
+
+        # Reused connections to the mail server - at most smtp_max_connections messages are sent at once
+        self.smtp_pool = SMTPSenderPool(self.MailServer,
+                                        port=CONF.getValue('mail_port', default=25),
+                                        max_connections=CONF.getValue('smtp_max_connections', default=4),
+                                        timeout=CONF.getValue('smtp_timeout', default=3),
+                                        idle_timeout=CONF.getValue('smtp_idle_timeout', default=30))
+
+        # user_ooi_id -> (time of the lookup, email address)
+        self.user_emails = {}
+        self.user_email_ttl = CONF.getValue('user_email_ttl', default=300)
+        self.subscription_index_ttl = CONF.getValue('subscription_index_ttl', default=300)
         
         self.index_store_class = pu.get_class(index_store_class_name)
         self._storage_conf = get_cassandra_configuration()
@@ -123,6 +180,8 @@ class NotificationAlertService(ServiceProcess):
             log.info("Instantiating Memory Store")
             self.index_store = self.index_store_class(self, indices=SUBSCRIPTION_INDEXED_COLUMNS )
 
+        self.subscription_index = SubscriptionIndex(self.index_store, ttl=self.subscription_index_ttl)
+
         # Create the subscribers for the event handlers
 
         self.sub = DatasetSupplementAddedEventSubscriber(process=self, queue_name=self.update_event_queue_name)
@@ -138,7 +197,10 @@ class NotificationAlertService(ServiceProcess):
         yield self.sub.activate()
         log.info('NotificationAlertService.slc_init DatasourceUnavailableEventSubscriber activation complete')     
 
-        
+    def slc_terminate(self):
+        # Close the connections to the mail server once the queued alerts are sent
+        return self.smtp_pool.stop()
+
     @defer.inlineCallbacks
     def handle_offline_event(self, content):
         log.info('NotificationAlertService.handle_offline_event notification event received ')
@@ -155,65 +217,14 @@ class NotificationAlertService(ServiceProcess):
                             "You received this notification from ION because you asked to be notified about changes to this data resource. ",
                             "To modify or remove notifications about this data resource, please access My Notifications Settings in the ION Web UI."  ), "\r\n")
 
-        # get the list of subscriptions for this datasource
-        query = Query()
-        ### Hack - uses dataset id in the data_src_id field because that is what AIS/UI use.
-        #query.add_predicate_eq('data_src_id', msg.additional_data.datasource_id)
-        query.add_predicate_eq('data_src_id', msg.additional_data.dataset_id)
-
-        rows = yield self.index_store.query(query)
-        log.info("NotificationAlertService.handle_offline_event  Rows returned %s " % (rows,))
-
         subscriptionInfo = yield self.mc.create_instance(SUBSCRIPTION_INFO_TYPE)
 
-        # send notification email to each user that is monitoring this dataset
-        for key, row in rows.iteritems():
-            log.info("NotificationAlertService.handle_offline_event  First row data set id %s", rows[key]['data_src_id'] )
-            if rows[key]['dispatcher_script_path'] == "AutomaticallyCreatedInitialIngestionSubscription":
-                InitialIngestion = True
-                SUBJECT = "(SysName " + self.sys_name + ") ION Initial Ingestion Data Alert for data set " +  msg.additional_data.dataset_id
-            else:
-                InitialIngestion = False
-                SUBJECT = "(SysName " + self.sys_name + ") ION Data Alert for data set " +  msg.additional_data.dataset_id
-            log.info('NotificationAlertService.handle_update_event: ' + SUBJECT)
-
-            tempTbl = {}
-            # get the user information from the Identity Registry
-            yield self.GetUserInformation(rows[key]['user_ooi_id'], tempTbl)
-            log.info('NotificationAlertService.handle_offline_event user email: %s', tempTbl['user_email'] )
-
-            subscription_type = int(row['subscription_type'])
-            email_alerts_filter = int (row['email_alerts_filter'])
-            if (subscription_type in (subscriptionInfo.SubscriptionType.EMAIL, subscriptionInfo.SubscriptionType.EMAILANDDISPATCHER) 
-                and (email_alerts_filter in (subscriptionInfo.AlertsFilter.DATASOURCEOFFLINE,subscriptionInfo.AlertsFilter.UPDATESANDDATASOURCEOFFLINE))) :
-                # Send the message via our own SMTP server, but don't include the envelope header.
-                # Create the container (outer) email message.
-                log.info('NotificationAlertService.handle_offline_event CREATE EMAIL')
-                FROM = ION_DATA_ALERTS_EMAIL_ADDRESS
-                TO = tempTbl['user_email']
-
-                msg = MIMEText(BODY)
-                msg['Subject'] = SUBJECT
-                msg['From'] = FROM
-                msg['To'] = ', '.join([TO])
-                    
-                try:
-                    log.debug("NotificationAlertService.handle_offline_event sending email to %s using the mail server at %s" %(TO, self.MailServer))
-                    yield self._sendmail(self.MailServer, FROM, [TO], msg)
-                    log.info('NotificationAlertService.handle_offline_event Successfully sent email' )
-                except SMTPClientError:
-                    log.info('NotificationAlertService.handle_offline_event Error: unable to send email')
-                except Exception, ex:
-                    log.warning('NotificationAlertService.handle_offline_event Error: unable to send email - %s' %str(ex))
-
-                ## Do not delete the initial notification for an unavailable!
-                # delete subscription if it was automatically created by the AIS for an initial ingestion at
-                # dataset creation
-                #if InitialIngestion == True:
-                #    yield self.index_store.remove(rows[key]['data_src_id'] + rows[key]['user_ooi_id'])
-                #    log.info('NotificationAlertService.handle_offline_event deleted InitialIngestionSubscription for ' + rows[key]['data_src_id'])
-
-                log.info('NotificationAlertService.handle_offline_event completed ')
+        ## Do not delete the initial notification for an unavailable!
+        yield self._send_alerts('handle_offline_event', msg.additional_data.dataset_id, BODY, subscriptionInfo,
+                                (subscriptionInfo.AlertsFilter.DATASOURCEOFFLINE,
+                                 subscriptionInfo.AlertsFilter.UPDATESANDDATASOURCEOFFLINE),
+                                remove_initial_ingestion=False)
+        log.info('NotificationAlertService.handle_offline_event completed ')
 
     
     @defer.inlineCallbacks
@@ -242,63 +253,88 @@ class NotificationAlertService(ServiceProcess):
                         "You received this notification from ION because you asked to be notified about changes to this data resource. ",
                         "To modify or remove notifications about this data resource, please access My Notifications Settings in the ION Web UI."  ), "\r\n")
 
-        # get the list of subscriptions for this datasource
-        query = Query()
+        subscriptionInfo = yield self.mc.create_instance(SUBSCRIPTION_INFO_TYPE)
+
+        # subscriptions automatically created by the AIS for an initial ingestion at dataset creation
+        # are deleted once the alert is sent
+        yield self._send_alerts('handle_update_event', msg.additional_data.dataset_id, BODY, subscriptionInfo,
+                                (subscriptionInfo.AlertsFilter.UPDATES,
+                                 subscriptionInfo.AlertsFilter.UPDATESANDDATASOURCEOFFLINE),
+                                remove_initial_ingestion=True)
+        log.info('NotificationAlertService.handle_update_event completed ')
+
+    @defer.inlineCallbacks
+    def _send_alerts(self, event_name, dataset_id, BODY, subscriptionInfo, email_alerts_filters, remove_initial_ingestion):
+        """
+        @brief Sends an email alert to each user with an email subscription to the data set
+        @param event_name the name of the handler, for logging
+        @param email_alerts_filters the email_alerts_filter values of the subscriptions to alert
+        @param remove_initial_ingestion delete the initial ingestion subscriptions after sending
+        """
         ### Hack - uses dataset id in the data_src_id field because that is what AIS/UI use.
-        #query.add_predicate_eq('data_src_id', msg.additional_data.datasource_id)
-        query.add_predicate_eq('data_src_id', msg.additional_data.dataset_id)
+        rows = yield self.subscription_index.get(dataset_id)
+        log.info("NotificationAlertService.%s  Rows returned %s " % (event_name, rows,))
 
-        rows = yield self.index_store.query(query)
-        log.info("NotificationAlertService.handle_update_event  Rows returned %s " % (rows,))
+        email_types = (subscriptionInfo.SubscriptionType.EMAIL, subscriptionInfo.SubscriptionType.EMAILANDDISPATCHER)
 
-        subscriptionInfo = yield self.mc.create_instance(SUBSCRIPTION_INFO_TYPE)
-        
-        # send notification email to each user that is monitoring this dataset
-        for key, row in rows.iteritems():
-            log.info("NotificationAlertService.handle_update_event  First row data set id %s", rows[key]['data_src_id'] )
-            if rows[key]['dispatcher_script_path'] == "AutomaticallyCreatedInitialIngestionSubscription":
+        alerts = []
+        for key, row in rows.items():
+            if int(row['subscription_type']) in email_types and int(row['email_alerts_filter']) in email_alerts_filters:
+                alerts.append((key, row))
+
+        # get the email addresses of all the users from the Identity Registry at once
+        emails = yield defer.DeferredList([self.get_user_email(row['user_ooi_id']) for key, row in alerts],
+                                          consumeErrors=True)
+
+        sends = []
+        for (key, row), (success, email) in zip(alerts, emails):
+            if row['dispatcher_script_path'] == "AutomaticallyCreatedInitialIngestionSubscription":
                 InitialIngestion = True
-                SUBJECT = "(SysName " + self.sys_name + ") ION Initial Ingestion Data Alert for data set " +  msg.additional_data.dataset_id
+                SUBJECT = "(SysName " + self.sys_name + ") ION Initial Ingestion Data Alert for data set " + dataset_id
             else:
                 InitialIngestion = False
-                SUBJECT = "(SysName " + self.sys_name + ") ION Data Alert for data set " +  msg.additional_data.dataset_id
-            log.info('NotificationAlertService.handle_update_event: ' + SUBJECT)
-
-            tempTbl = {}
-            # get the user information from the Identity Registry
-            yield self.GetUserInformation(rows[key]['user_ooi_id'], tempTbl)
-            log.info('NotificationAlertService.handle_update_event user email: %s', tempTbl['user_email'] )
-            subscription_type = int(row['subscription_type'])
-            email_alerts_filter = int (row['email_alerts_filter'])
-            if (subscription_type in (subscriptionInfo.SubscriptionType.EMAIL, subscriptionInfo.SubscriptionType.EMAILANDDISPATCHER) 
-                and (email_alerts_filter in (subscriptionInfo.AlertsFilter.UPDATES, subscriptionInfo.AlertsFilter.UPDATESANDDATASOURCEOFFLINE))) :
-                # Send the message via our own SMTP server, but don't include the envelope header.
-                # Create the container (outer) email message.
-                log.info('NotificationAlertService.handle_update_event CREATE EMAIL')
-                FROM = ION_DATA_ALERTS_EMAIL_ADDRESS
-                TO = tempTbl['user_email']
-
-                msg = MIMEText(BODY)
-                msg['Subject'] = SUBJECT
-                msg['From'] = FROM
-                msg['To'] = ', '.join([TO])
-
-                try:
-                    log.debug("NotificationAlertService.handle_update_event: sending email to %s using the mail server at %s" %(TO, self.MailServer))
-                    yield self._sendmail(self.MailServer, FROM, [TO], msg)
-                    log.info('NotificationAlertService.handle_update_event Successfully sent email' )
-                except SMTPClientError:
-                    log.info('NotificationAlertService.handle_update_event Error: unable to send email')
-                except Exception, ex:
-                    log.warning('NotificationAlertService.handle_update_event Error: unable to send email - %s'% str(ex))
-
-                # delete subscription if it was automatically created by the AIS for an initial ingestion at
-                # dataset creation
-                if InitialIngestion == True:
-                    yield self.index_store.remove(rows[key]['data_src_id'] + rows[key]['user_ooi_id'])
-                    log.info('NotificationAlertService.handle_update_event deleted InitialIngestionSubscription for ' + rows[key]['data_src_id'])
-
-                log.info('NotificationAlertService.handle_update_event completed ')
+                SUBJECT = "(SysName " + self.sys_name + ") ION Data Alert for data set " + dataset_id
+            log.info('NotificationAlertService.%s: %s', event_name, SUBJECT)
+
+            if not success or email is None:
+                log.warning('NotificationAlertService.%s Error: no email address for user %s', event_name, row['user_ooi_id'])
+                continue
+            log.info('NotificationAlertService.%s user email: %s', event_name, email)
+
+            # Send the message via our own SMTP server, but don't include the envelope header.
+            # Create the container (outer) email message.
+            FROM = ION_DATA_ALERTS_EMAIL_ADDRESS
+            TO = email
+
+            msg = MIMEText(BODY)
+            msg['Subject'] = SUBJECT
+            msg['From'] = FROM
+            msg['To'] = ', '.join([TO])
+
+            log.debug("NotificationAlertService.%s sending email to %s using the mail server at %s" % (event_name, TO, self.MailServer))
+            d = self.smtp_pool.send(FROM, [TO], msg)
+            d.addCallbacks(self._alert_sent, self._alert_failed, callbackArgs=(event_name,), errbackArgs=(event_name,))
+            sends.append(d)
+
+            if remove_initial_ingestion and InitialIngestion:
+                d.addBoth(self._remove_subscription, key, row['data_src_id'])
+
+        yield defer.DeferredList(sends, consumeErrors=True)
+
+    def _alert_sent(self, result, event_name):
+        log.info('NotificationAlertService.%s Successfully sent email', event_name)
+
+    def _alert_failed(self, reason, event_name):
+        if reason.check(SMTPClientError):
+            log.info('NotificationAlertService.%s Error: unable to send email', event_name)
+        else:
+            log.warning('NotificationAlertService.%s Error: unable to send email - %s' % (event_name, reason.getErrorMessage()))
+
+    @defer.inlineCallbacks
+    def _remove_subscription(self, result, key, data_src_id):
+        self.subscription_index.remove(key, data_src_id)
+        yield self.index_store.remove(key)
+        log.info('NotificationAlertService deleted InitialIngestionSubscription for ' + data_src_id)
 
 
     @defer.inlineCallbacks
@@ -392,6 +428,7 @@ class NotificationAlertService(ServiceProcess):
         self.keyval = content.message_parameters_reference.subscriptionInfo.data_src_id + content.message_parameters_reference.subscriptionInfo.user_ooi_id
         log.info('NotificationAlertService.op_addSubscription attributes keyval id: %s', self.keyval )
         yield self.index_store.put(self.keyval , self.keyval, self.attributes)
+        self.subscription_index.add(self.keyval, self.attributes)
 
         # create the AIS response GPBs
         log.info('NotificationAlertService.op_addSubscription construct response message')
@@ -438,6 +475,7 @@ class NotificationAlertService(ServiceProcess):
             raise NotificationAlertError('Invalid request, subscription does not exist, ignoring',
                                             content.ResponseCodes.BAD_REQUEST)
         yield self.index_store.remove(self.keyval)
+        self.subscription_index.remove(self.keyval, content.message_parameters_reference.subscriptionInfo.data_src_id)
 
         # create the AIS response GPB
         respMsg = yield self.mc.create_instance(AIS_RESPONSE_MSG_TYPE)
@@ -643,6 +681,24 @@ class NotificationAlertService(ServiceProcess):
 
         defer.returnValue(None)
 
+    @defer.inlineCallbacks
+    def get_user_email(self, user_ooi_id):
+        """
+        @brief the email address of a user, kept for user_email_ttl seconds
+        @retval Deferred, called back with the address or None if the Identity Registry did not return one
+        """
+        cached = self.user_emails.get(user_ooi_id)
+        if cached is not None and time.time() - cached[0] <= self.user_email_ttl:
+            defer.returnValue(cached[1])
+
+        tempTbl = {}
+        yield self.GetUserInformation(user_ooi_id, tempTbl)
+        email = tempTbl.get('user_email')
+        # Failed lookups are not cached - the next alert asks again
+        if email is not None:
+            self.user_emails[user_ooi_id] = (time.time(), email)
+        defer.returnValue(email)
+
 
     def _sendmail(self, smtphost, from_addr, to_addrs, msg, senderDomainName=None, port=25):
         # this is a clone of the helper method from twisted.mail.smtp
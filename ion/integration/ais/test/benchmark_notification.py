@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+@file ion/integration/ais/test/benchmark_notification.py
+@brief Benchmark the notification events per second which can be mailed against the number of subscribers - by
+    the SMTP connections alone and through the alert path of the service with its subscription index and email cache
+@test Notification benchmark - not run as part of the unit tests
+"""
+
+import time
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor, task
+from twisted.mail import smtp
+from email.mime.text import MIMEText
+
+from ion.core.data.store import IndexStore
+from ion.core.object import workbench
+from ion.integration.ais.ais_object_identifiers import SUBSCRIPTION_INFO_TYPE
+from ion.integration.ais.notification_alert_service import NotificationAlertService, SubscriptionIndex
+from ion.util.smtp_pool import SMTPSenderPool
+from ion.util.test.test_smtp_pool import LocalSMTPServer
+
+ION_DATA_ALERTS_EMAIL_ADDRESS = 'data_alerts@oceanobservatories.org'
+
+
+class CountingIndexStore(IndexStore):
+
+    queries = 0
+
+    def query(self, query_predicates, columns=None):
+        self.queries += 1
+        return IndexStore.query(self, query_predicates, columns=columns)
+
+
+class BenchmarkAlertService(NotificationAlertService):
+    """
+    The alert path of the notification alert service without a container. The identity registry answers each user
+    information request after a fixed latency.
+    """
+
+    def __init__(self, index_store, smtp_pool, registry_latency):
+        self.sys_name = 'benchmark'
+        self.MailServer = '127.0.0.1'
+        self.index_store = index_store
+        self.subscription_index = SubscriptionIndex(index_store, ttl=300)
+        self.smtp_pool = smtp_pool
+        self.user_emails = {}
+        self.user_email_ttl = 300
+        self.registry_latency = registry_latency
+        self.registry_lookups = 0
+
+    def GetUserInformation(self, user_ooi_id, tempTbl):
+        self.registry_lookups += 1
+
+        def answer():
+            tempTbl['user_email'] = '%s@example.org' % user_ooi_id
+        return task.deferLater(reactor, self.registry_latency, answer)
+
+
+class NotificationBenchmark(unittest.TestCase):
+
+    subscriber_counts = [1, 10, 100]
+
+    events = 10
+
+    max_connections = 4
+
+    # Seconds for the identity registry to answer a user information request
+    registry_latency = 0.005
+
+    timeout = 120
+
+    def setUp(self):
+        self.server = LocalSMTPServer()
+        self.index_store = CountingIndexStore(indices=['user_ooi_id', 'data_src_id', 'subscription_type',
+                                                       'email_alerts_filter', 'dispatcher_script_path'])
+        self.row_keys = []
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        for key in self.row_keys:
+            yield self.index_store.remove(key)
+        yield self.server.stop()
+
+    def _message(self, event, to):
+        msg = MIMEText('Additional data have been received.')
+        msg['Subject'] = 'ION Data Alert for data set %d' % event
+        msg['From'] = ION_DATA_ALERTS_EMAIL_ADDRESS
+        msg['To'] = to
+        return msg
+
+    @defer.inlineCallbacks
+    def _serial(self, subscribers):
+        # One connection per message, one message at a time - as the service used to send alerts
+        for event in range(self.events):
+            for to in subscribers:
+                yield smtp.sendmail('127.0.0.1', ION_DATA_ALERTS_EMAIL_ADDRESS, [to], self._message(event, to),
+                                    port=self.server.portnum)
+
+    @defer.inlineCallbacks
+    def _pooled(self, subscribers):
+        pool = SMTPSenderPool('127.0.0.1', self.server.portnum, max_connections=self.max_connections)
+        for event in range(self.events):
+            yield defer.gatherResults([pool.send(ION_DATA_ALERTS_EMAIL_ADDRESS, [to], self._message(event, to))
+                                       for to in subscribers])
+        yield pool.stop()
+
+    @defer.inlineCallbacks
+    def test_events_per_second(self):
+
+        results = []
+        for count in self.subscriber_counts:
+            subscribers = ['user%d@example.org' % i for i in range(count)]
+
+            rates = []
+            for send in (self._serial, self._pooled):
+                t1 = time.time()
+                yield send(subscribers)
+                t2 = time.time()
+                rates.append(self.events / (t2 - t1))
+
+            results.append((count, rates[0], rates[1]))
+
+        output = '\nSubscribers | Serial (events/s) | Pooled (events/s)\n'
+        for result in results:
+            output += '%11d | %17.1f | %17.1f\n' % result
+
+        log.info(output)
+
+    @defer.inlineCallbacks
+    def _add_subscriptions(self, dataset_id, subscribers, subscriptionInfo):
+        for user_ooi_id in subscribers:
+            key = '%s_%s' % (dataset_id, user_ooi_id)
+            yield self.index_store.put(key, key, {'data_src_id': dataset_id,
+                                                  'user_ooi_id': user_ooi_id,
+                                                  'subscription_type': str(subscriptionInfo.SubscriptionType.EMAIL),
+                                                  'email_alerts_filter': str(subscriptionInfo.AlertsFilter.UPDATES),
+                                                  'dispatcher_script_path': ''})
+            self.row_keys.append(key)
+
+    @defer.inlineCallbacks
+    def test_send_alerts(self):
+
+        wb = workbench.WorkBench('No Process Test')
+        repo, subscriptionInfo = wb.init_repository(SUBSCRIPTION_INFO_TYPE)
+        email_alerts_filters = (subscriptionInfo.AlertsFilter.UPDATES,
+                                subscriptionInfo.AlertsFilter.UPDATESANDDATASOURCEOFFLINE)
+
+        results = []
+        for count in self.subscriber_counts:
+            dataset_id = 'dataset_%d' % count
+            subscribers = ['user%d' % i for i in range(count)]
+            yield self._add_subscriptions(dataset_id, subscribers, subscriptionInfo)
+
+            pool = SMTPSenderPool('127.0.0.1', self.server.portnum, max_connections=self.max_connections)
+            service = BenchmarkAlertService(self.index_store, pool, self.registry_latency)
+            queries = self.index_store.queries
+
+            # The first event fills the subscription index and the email cache - the rest are served from them
+            t1 = time.time()
+            yield service._send_alerts('benchmark', dataset_id, 'Additional data have been received.',
+                                       subscriptionInfo, email_alerts_filters, False)
+            t2 = time.time()
+            for event in range(1, self.events):
+                yield service._send_alerts('benchmark', dataset_id, 'Additional data have been received.',
+                                           subscriptionInfo, email_alerts_filters, False)
+            t3 = time.time()
+            yield pool.stop()
+
+            results.append((count, 1.0 / (t2 - t1), (self.events - 1) / (t3 - t2),
+                            self.index_store.queries - queries, service.registry_lookups, pool.sent))
+
+        output = '\nSubscribers | First event (events/s) | Cached (events/s) | Index queries | Registry lookups | Sent\n'
+        for result in results:
+            output += '%11d | %22.1f | %17.1f | %13d | %16d | %4d\n' % result
+
+        log.info(output)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""
+@file ion/integration/ais/test/benchmark_spatial_temporal_index.py
+@brief Benchmark the bounds filtering of findDataResources against the number of datasets, checking every
+    dataset against the bounds and checking only the candidates from the spatial temporal index.
+@test Spatial temporal index benchmark - not run as part of the unit tests
+"""
+
+import random
+import time
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.trial import unittest
+
+from ion.integration.ais.common.spatial_temporal_bounds import SpatialTemporalBounds, SpatialTemporalIndex
+from ion.integration.ais.test.test_spatial_temporal_bounds import BoundsMessage, make_metadata
+
+
+class SpatialTemporalIndexBenchmark(unittest.TestCase):
+
+    dataset_counts = [10000, 50000, 100000]
+
+    # A regional search over a few years, as from the data catalog map
+    bounds_fields = {'minLatitude':30.0, 'maxLatitude':45.0,
+                     'minLongitude':-75.0, 'maxLongitude':-60.0,
+                     'minTime':'2008-01-01T00:00:00Z', 'maxTime':'2009-01-01T00:00:00Z'}
+
+    searches = 5
+
+    timeout = 600
+
+    def test_find_latency(self):
+        bounds = SpatialTemporalBounds()
+        bounds.loadBounds(BoundsMessage(**self.bounds_fields))
+
+        results = []
+        for count in self.dataset_counts:
+            rand = random.Random(count)
+            catalog = {}
+            for i in range(count):
+                metadata = make_metadata('dset-%d' % i, rand)
+                catalog[metadata['ResourceIdentity']] = metadata
+
+            t1 = time.time()
+            index = SpatialTemporalIndex()
+            for resID, metadata in catalog.iteritems():
+                index.put(resID, metadata)
+            t2 = time.time()
+
+            for i in range(self.searches):
+                found = [metadata for metadata in catalog.itervalues() if bounds.isInBounds(metadata)]
+            t3 = time.time()
+
+            for i in range(self.searches):
+                candidates = index.find(bounds.getIndexConditions())
+                indexed = [catalog[resID] for resID in candidates if bounds.isInBounds(catalog[resID])]
+            t4 = time.time()
+
+            self.assertEqual(len(indexed), len(found))
+            results.append((count, len(found), len(candidates), (t2 - t1) * 1000,
+                            (t3 - t2) / self.searches * 1000, (t4 - t3) / self.searches * 1000))
+
+        output = '\nDatasets | Found | Candidates | Index build ms | Scan search ms | Index search ms\n'
+        for result in results:
+            output += '%8d | %5d | %10d | %14.1f | %14.2f | %15.2f\n' % result
+
+        log.info(output)
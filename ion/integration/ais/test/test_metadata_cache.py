@@ -11,6 +11,7 @@ log = ion.util.ionlog.getLogger(__name__)
 import ion.util.procutils as pu
 
 from twisted.internet import defer
+from twisted.trial import unittest
 import time
 
 
@@ -415,4 +416,126 @@ class MetadataCacheTest(IonTestCase, AIS_Mixin):
             dSource = yield self.cache.getDSourceMetadata(dSourceID)
             self.failIfIdentical(dSource, None, 'There should be Data Source metadata')
 
-            
\ No newline at end of file
+            
+
+
+class FakeObject(object):
+    pass
+
+
+class FakeResourceClient(object):
+    """
+    Stands in for the resource client, answering get_instance when the test
+    fires the deferred.
+    """
+    def __init__(self):
+        self.resources = {}
+        self.pending = []
+
+    def get_instance(self, resID):
+        d = defer.Deferred()
+        self.pending.append((d, self.resources[resID]))
+        return d
+
+    def answer(self):
+        d, res = self.pending.pop(0)
+        d.callback(res)
+
+
+def fake_dataset(resID, head):
+    dSet = FakeObject()
+    dSet.ResourceIdentity = resID
+    dSet.ACTIVE = 'Active'
+    dSet.ResourceLifeCycleState = dSet.ACTIVE
+    dSet.Repository = FakeObject()
+    dSet.Repository.commit_head = FakeObject()
+    dSet.Repository.commit_head.MyId = head
+    dSet.root_group = FakeObject()
+    dSet.root_group.attributes = []
+    return dSet
+
+
+class MetadataCacheLockTest(unittest.TestCase):
+    """
+    Testing the interleaving of updates of the same resource in the
+    Metadata Cache.
+    """
+
+    def setUp(self):
+        self.cache = MetadataCache(Process())
+        self.cache.rc = FakeResourceClient()
+        self.cache.getAssociatedSource = lambda resID: defer.succeed('source')
+        self.cache.getAssociatedOwner = lambda resID: defer.succeed('owner')
+        self.cache.rc.resources['x'] = fake_dataset('x', 'commit-1')
+
+    def _locks(self):
+        return self.cache._MetadataCache__resourceLocks
+
+    @defer.inlineCallbacks
+    def test_put_then_delete(self):
+        put = self.cache.putDSetMetadata('x')
+        delete = self.cache.deleteDSetMetadata('x')
+        self.assertEqual(len(self._locks()), 1)
+
+        # Finishing the put runs the waiting delete to completion
+        self.cache.rc.answer()
+        yield put
+        deleted = yield delete
+
+        self.assertTrue(deleted)
+        self.assertEqual(self.cache.getNumDatasets(), 0)
+        metadata = yield self.cache.getDSetMetadata('x')
+        self.assertEqual(metadata, None)
+        self.assertEqual(self._locks(), {})
+
+    @defer.inlineCallbacks
+    def test_delete_then_put(self):
+        yield self._put('x')
+
+        # The delete holds the lock until the put waiting on it starts
+        delete = self.cache.deleteDSetMetadata('x')
+        put = self.cache.putDSetMetadata('x')
+        deleted = yield delete
+        self.assertTrue(deleted)
+        self.assertEqual(len(self._locks()), 1)
+
+        self.cache.rc.answer()
+        yield put
+        self.assertEqual(self.cache.getNumDatasets(), 1)
+        self.assertEqual(self._locks(), {})
+
+    @defer.inlineCallbacks
+    def test_puts_and_reads(self):
+        first = self.cache.putDSetMetadata('x')
+        self.cache.rc.resources['x'] = fake_dataset('x', 'commit-2')
+        second = self.cache.putDSetMetadata('x')
+
+        # Reads do not wait for the updates
+        metadata = yield self.cache.getDSetMetadata('x')
+        self.assertEqual(metadata, None)
+
+        self.cache.rc.answer()
+        yield first
+        metadata = yield self.cache.getDSetMetadata('x')
+        self.assertEqual(self.cache.getNumDatasets(), 1)
+
+        # The second put reloads the changed dataset
+        self.cache.rc.answer()
+        yield second
+        reloaded = yield self.cache.getDSetMetadata('x')
+        self.assertNotIdentical(reloaded, metadata)
+        self.assertEqual(self.cache.getNumDatasets(), 1)
+        self.assertEqual(self._locks(), {})
+
+        # An unchanged dataset is not reloaded
+        put = self.cache.putDSetMetadata('x')
+        self.cache.rc.answer()
+        yield put
+        unchanged = yield self.cache.getDSetMetadata('x')
+        self.assertIdentical(unchanged, reloaded)
+
+    @defer.inlineCallbacks
+    def _put(self, resID):
+        put = self.cache.putDSetMetadata(resID)
+        self.cache.rc.answer()
+        yield put
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""
+@file ion/integration/ais/test/test_spatial_temporal_bounds.py
+@brief Test cases for the spatial temporal index of the AIS metadata cache
+"""
+
+import random
+from decimal import Decimal
+
+from twisted.trial import unittest
+
+from ion.integration.ais.common.spatial_temporal_bounds import SpatialTemporalBounds, SpatialTemporalIndex
+
+
+class BoundsMessage(object):
+    """
+    Stands in for the bounds fields of a find data resources request.
+    """
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def IsFieldSet(self, name):
+        return name in self.__dict__
+
+
+def make_metadata(resID, rand):
+    lat = rand.uniform(-90, 75)
+    lon = rand.uniform(-180, 170)
+    vert = rand.uniform(0, 4000)
+    start = rand.randint(2005, 2010)
+    metadata = {'ResourceIdentity':resID,
+                'ion_geospatial_lat_min':Decimal('%.4f' % lat),
+                'ion_geospatial_lat_max':Decimal('%.4f' % (lat + rand.uniform(0, 10))),
+                'ion_geospatial_lon_min':Decimal('%.4f' % lon),
+                'ion_geospatial_lon_max':Decimal('%.4f' % (lon + rand.uniform(0, 10))),
+                'ion_geospatial_vertical_min':Decimal('%.1f' % vert),
+                'ion_geospatial_vertical_max':Decimal('%.1f' % (vert + rand.uniform(0, 500))),
+                'ion_time_coverage_start':'%d-01-01T00:00:00Z' % start,
+                'ion_time_coverage_end':'%d-06-30T00:00:00Z' % (start + rand.randint(0, 3))}
+    return metadata
+
+
+def make_bounds(rand):
+    fields = {}
+    if rand.random() < 0.7:
+        fields['minLatitude'] = rand.uniform(-90, 60)
+    if rand.random() < 0.7:
+        fields['maxLatitude'] = rand.uniform(-60, 90)
+    if rand.random() < 0.7:
+        fields['minLongitude'] = rand.uniform(-180, 150)
+    if rand.random() < 0.7:
+        fields['maxLongitude'] = rand.uniform(-150, 180)
+    if rand.random() < 0.5:
+        fields['minVertical'] = rand.uniform(0, 2000)
+        fields['maxVertical'] = fields['minVertical'] + rand.uniform(0, 2000)
+        fields['posVertical'] = rand.choice(['up', 'down'])
+    if rand.random() < 0.5:
+        start = rand.randint(2004, 2012)
+        fields['minTime'] = '%d-03-01T00:00:00Z' % start
+        fields['maxTime'] = '%d-03-01T00:00:00Z' % (start + rand.randint(0, 3))
+
+    bounds = SpatialTemporalBounds()
+    bounds.loadBounds(BoundsMessage(**fields))
+    return bounds
+
+
+class SpatialTemporalIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rand = random.Random(4)
+        self.index = SpatialTemporalIndex()
+        self.catalog = {}
+        for i in range(500):
+            metadata = make_metadata('dset-%d' % i, self.rand)
+            self.catalog[metadata['ResourceIdentity']] = metadata
+            self.index.put(metadata['ResourceIdentity'], metadata)
+
+    def _check(self, bounds):
+        expected = set([resID for resID, metadata in self.catalog.iteritems()
+                        if bounds.isInBounds(metadata)])
+        candidates = self.index.find(bounds.getIndexConditions())
+        if candidates is None:
+            candidates = set(self.catalog)
+        self.assertEqual(set([resID for resID in candidates if bounds.isInBounds(self.catalog[resID])]),
+                         expected)
+        return candidates, expected
+
+    def test_candidates(self):
+        pruned = 0
+        for i in range(200):
+            candidates, expected = self._check(make_bounds(self.rand))
+            if len(candidates) < len(self.catalog):
+                pruned += 1
+        self.assertTrue(pruned > 100)
+
+    def test_no_bounds(self):
+        bounds = make_bounds(random.Random())
+        bounds.loadBounds(BoundsMessage())
+        self.assertEqual(self.index.find(bounds.getIndexConditions()), None)
+
+    def test_put_remove(self):
+        bounds = SpatialTemporalBounds()
+        bounds.loadBounds(BoundsMessage(minLatitude=85.5, maxLatitude=89.5))
+        self.assertEqual(self._check(bounds), (set(), set()))
+
+        metadata = make_metadata('polar', self.rand)
+        metadata['ion_geospatial_lat_min'] = Decimal('86')
+        metadata['ion_geospatial_lat_max'] = Decimal('87')
+        self.catalog['polar'] = metadata
+        self.index.put('polar', metadata)
+        self.assertEqual(self._check(bounds), (set(['polar']), set(['polar'])))
+
+        # Indexing the dataset again replaces its bounds
+        metadata['ion_geospatial_lat_max'] = Decimal('NaN')
+        self.index.put('polar', metadata)
+        self.assertEqual(self._check(bounds), (set(), set()))
+
+        self.index.remove('polar')
+        del self.catalog['polar']
+        self.assertEqual(len(self.index), 500)
+        self.assertEqual(self._check(bounds), (set(), set()))
+
+    def test_unparsed_time(self):
+        metadata = make_metadata('no-time', self.rand)
+        metadata['ion_time_coverage_end'] = 'unknown'
+        self.catalog['no-time'] = metadata
+        self.index.put('no-time', metadata)
+
+        bounds = SpatialTemporalBounds()
+        bounds.loadBounds(BoundsMessage(minTime='2030-01-01T00:00:00Z', maxTime='2031-01-01T00:00:00Z'))
+        self.assertEqual(self._check(bounds), (set(['no-time']), set(['no-time'])))
@@ -7,6 +7,9 @@
     interaction patterns)
 """
 
+from collections import deque
+
+from twisted.internet import reactor
 from twisted.python import failure
 from twisted.python.reflect import namedAny
 from zope.interface import implements, Interface
@@ -21,6 +24,23 @@ import ion.util.procutils as pu
 
 CONF = ioninit.config(__name__)
 CF_basic_conv_types = CONF['basic_conv_types']
+# Conversation message logging is opt-in. When on, each conversation keeps
+# only the last conv_log_size messages
+CF_conv_log = CONF.getValue('conv_log', False)
+CF_conv_log_size = CONF.getValue('conv_log_size', 20)
+
+# Seconds without a message before a conversation that never reached a final
+# state is evicted
+CF_conv_idle_timeout = CONF.getValue('conv_idle_timeout', 600)
+# Minimum seconds between two garbage collections of the conversations of a process
+CF_conv_gc_interval = CONF.getValue('conv_gc_interval', 60)
+# Seconds the conv-id of an ended conversation is remembered, and the maximum
+# number of ended conversations remembered per process
+CF_tombstone_ttl = CONF.getValue('tombstone_ttl', 600)
+CF_tombstone_max = CONF.getValue('tombstone_max', 10000)
+
+# The message headers recorded in a conversation log
+CONV_LOG_HEADERS = ('sender', 'receiver', 'protocol', 'performative', 'op', 'user-id', 'status')
 
 # Conversation type id for no conversation use.
 CONV_TYPE_NONE = "none"
@@ -89,7 +109,10 @@ class Conversation(object):
         self.blocking_deferred = None
         # Marks a timeout in the conversation processing
         self.timeout = None
-        self.conv_log = []
+        # Time of the last message in this conversation, for garbage collection
+        self.last_active = None
+        # Ring buffer of message records, created on the first logged message
+        self.conv_log = None
 
     def bind_role_local(self, role_id, process):
         self.bind_role(role_id, process.id)
@@ -111,14 +134,12 @@ class Conversation(object):
         self.role_bindings[role_id] = process_id
 
     def get_conv_log_str(self):
+        conv_log = self.conv_log or ()
         res = "CONV_LOG[type=%s, id=%s, state=%s, @process=%s, #messages=%s:\n" % (
-            self.protocol, self.conv_id, self.local_fsm._get_state(), self.local_process.proc_name, len(self.conv_log))
-        for msg_rec in self.conv_log:
+            self.protocol, self.conv_id, self.local_fsm._get_state(), self.local_process.proc_name, len(conv_log))
+        for msg_rec in conv_log:
             (ts, mtype, cstate, mhdrs) = msg_rec
-            hstr = "%s -> %s %s:%s:%s; uid=%s, status=%s" % (mhdrs.get('sender',None),
-                    mhdrs.get('receiver',None), mhdrs.get('protocol',None),
-                    mhdrs.get('performative',None), mhdrs.get('op',None),
-                    mhdrs.get('user-id',None), mhdrs.get('status',None))
+            hstr = "%s -> %s %s:%s:%s; uid=%s, status=%s" % mhdrs
             mstr = " %d %s: %s >> %s\n" % (ts, mtype, hstr, cstate)
             res = res + mstr
         res = res + "]"
@@ -159,7 +180,7 @@ class ConversationRole(StateObject):
         self._so_set_fsm(fsm)
 
     def _so_process(self, event, *args, **kwargs):
-        log.debug("Processing Conversation event='%s' in state='%s'" % (event,self._get_state()))
+        log.debug("Processing Conversation event='%s' in state='%s'", event, self._get_state())
         d = StateObject._so_process(self, event, *args, **kwargs)
         return d
 
@@ -187,6 +208,8 @@ class ConversationTypeFSMFactory(FSMFactory):
     If there are only two participants to a conversation, the same FSM can be
     used (with different action behavior) for the state of the participant
     conversations.
+    The transition table of a conversation type is built once and shared by
+    all its conversation instances; see FSMFactory.get_transition_table.
     """
 
     def create_fsm(self, target, memory=None):
@@ -268,14 +291,30 @@ conv_mgr_instance = ConversationManager()
 
 class ProcessConversationManager(object):
     """
-    @brief Oversees a set of conversations, e.g. within a process instance
+    @brief Oversees a set of conversations, e.g. within a process instance.
+        Ended conversations leave a tombstone with their conv-id, so that late
+        messages (e.g. replies after a timeout) can be dropped without creating
+        a new conversation. Conversations that never end are evicted once idle.
     """
 
-    def __init__(self, process):
+    def __init__(self, process, clock=None):
         self.process = process
         self.conversations = {}
         self.conv_mgr = conv_mgr_instance
 
+        # Dict conv_id -> (time ended, final state) of ended conversations
+        self.tombstones = {}
+        # The tombstoned conv_ids as (time ended, conv_id), oldest first
+        self._tombstone_order = deque()
+
+        # Number of conversations evicted by garbage collection
+        self.evicted_count = 0
+        # Number of messages dropped because their conversation had ended
+        self.late_count = 0
+
+        self.clock = clock or reactor
+        self._last_gc = self.clock.seconds()
+
     def msg_send(self, message):
         """
         @brief Trigger the FSM for a to-be-sent message and delegate all checking
@@ -285,10 +324,11 @@ class ProcessConversationManager(object):
         conv = self.get_conversation(message['headers']['conv-id'])
         perf = message['performative']
         if conv and conv.local_fsm:
-            log.debug("msg_send(): Processing performative '%s'" % perf)
+            log.debug("msg_send(): Processing performative '%s'", perf)
+            conv.last_active = self.clock.seconds()
             return conv.local_fsm._so_process(perf, message)
         else:
-            log.debug("msg_send(): NO FSM. Ignoring performative '%s'" % perf)
+            log.debug("msg_send(): NO FSM. Ignoring performative '%s'", perf)
 
     def msg_received(self, message):
         """
@@ -300,14 +340,20 @@ class ProcessConversationManager(object):
         conv = message['conversation']
         perf = message['performative']
         #log.debug("msg_received(): Processing performative '%s'" % perf)
+        conv.last_active = self.clock.seconds()
         return conv.local_fsm._so_process(perf, message)
 
     def create_conversation_id(self):
         return self.conv_mgr.create_conversation_id(prefix=self.process.id.full)
 
     def new_conversation(self, conv_type_id, conv_id=None):
+        now = self.clock.seconds()
+        if now - self._last_gc >= CF_conv_gc_interval:
+            self.collect_garbage(now)
+
         conv_id = conv_id or self.create_conversation_id()
         conv_inst = self.conv_mgr.new_conversation(conv_type_id, conv_id)
+        conv_inst.last_active = now
         self.conversations[conv_inst.conv_id] = conv_inst
         return conv_inst
 
@@ -346,18 +392,25 @@ class ProcessConversationManager(object):
         return conv
 
     def log_conv_message(self, conv, message, msgtype):
-        # Tuple of Timestamp (MS), type, message
-        if conv is None:
+        """
+        @brief Records a message in the log of its conversation, if conversation
+            logging is enabled (config conv_log)
+        """
+        if conv is None or not CF_conv_log:
             return
+        # Tuple of Timestamp (MS), type, state, selected headers
         hdrs = message.get('headers',{})
         if hdrs and type(hdrs) is dict:
-            mhdrs = hdrs.copy()
-            if 'content' in mhdrs:
-                del mhdrs['content']
+            mhdrs = tuple([hdrs.get(name, None) for name in CONV_LOG_HEADERS])
         else:
-            mhdrs = {}
+            mhdrs = (None,) * len(CONV_LOG_HEADERS)
         msg_rec = (pu.currenttime_ms(), msgtype, conv.local_fsm._get_state(), mhdrs)
+        if conv.conv_log is None:
+            conv.conv_log = deque()
         conv.conv_log.append(msg_rec)
+        # Keep the last conv_log_size messages (no deque maxlen before python 2.6)
+        if len(conv.conv_log) > CF_conv_log_size:
+            conv.conv_log.popleft()
 
     def check_conversation_state(self, conv):
         """
@@ -369,13 +422,91 @@ class ProcessConversationManager(object):
         conv_id = conv.conv_id
         #log.debug("check_conversation_state(), conv=%s, conv_id=%s, state=%s" % (conv, conv_id, conv.local_fsm._get_state()))
         # Check for final state
-        if conv.local_fsm._get_state() in conv.conv_type.FINAL_STATES:
-            del self.conversations[conv_id]
-            log.info("Conversation FINAL: id=%s. Active conversations: %s" % (
-                conv_id, len(self.conversations)))
+        state = conv.local_fsm._get_state()
+        if state in conv.conv_type.FINAL_STATES:
+            self.end_conversation(conv_id, state)
+            log.info("Conversation FINAL: id=%s. Active conversations: %s",
+                conv_id, len(self.conversations))
             # Removed for OOIION-335 Logging message very confusing
             # log.info("Conversation FINAL log:\n%s" % (conv.get_conv_log_str()))
 
-        # Create a tombstone for later messages and timeouts with this conv_id
+    def end_conversation(self, conv_id, state, now=None):
+        """
+        @brief Removes a conversation and leaves a tombstone for later messages
+            and timeouts with its conv_id
+        @param state the final state, recorded in the tombstone
+        """
+        if now is None:
+            now = self.clock.seconds()
+        self.conversations.pop(conv_id, None)
+
+        self.tombstones[conv_id] = (now, state)
+        self._tombstone_order.append((now, conv_id))
 
-        # GC tombstones and conversations
+        # Bounded size - forget the oldest tombstones first
+        while len(self.tombstones) > CF_tombstone_max:
+            self._forget_oldest_tombstone()
+
+    def is_tombstoned(self, conv_id):
+        """
+        @retval True if the conversation with this conv_id has ended
+        """
+        return conv_id in self.tombstones
+
+    def drop_late_message(self, conv_id, headers):
+        """
+        @brief Accounts for a message received for an ended conversation
+        """
+        self.late_count += 1
+        state = self.tombstones[conv_id][1]
+        log.info("[%s] Dropped late message for ended conversation conv-id=%s (%s): %s:%s from %s",
+            self.process.proc_name, conv_id, state, headers.get('performative', None),
+            headers.get('op', None), headers.get('sender', None))
+
+    def collect_garbage(self, now=None):
+        """
+        @brief Evicts conversations without a message for conv_idle_timeout
+            seconds and forgets tombstones older than tombstone_ttl. Called
+            from new_conversation at most every conv_gc_interval seconds.
+        @retval the number of evicted conversations
+        """
+        if now is None:
+            now = self.clock.seconds()
+        self._last_gc = now
+
+        idle_deadline = now - CF_conv_idle_timeout
+        evicted = 0
+        for conv_id, conv in self.conversations.items():
+            if conv.last_active is not None and conv.last_active > idle_deadline:
+                continue
+            if conv.blocking_deferred is not None and not conv.blocking_deferred.called:
+                # Still waiting for a reply - the RPC timeout ends it
+                continue
+            self.end_conversation(conv_id, 'EVICTED', now)
+            evicted += 1
+
+        tombstone_deadline = now - CF_tombstone_ttl
+        while self._tombstone_order and self._tombstone_order[0][0] <= tombstone_deadline:
+            self._forget_oldest_tombstone()
+
+        if evicted:
+            self.evicted_count += evicted
+            log.info("[%s] Conversation GC evicted %d idle conversations. Live: %d, tombstoned: %d",
+                self.process.proc_name, evicted, len(self.conversations), len(self.tombstones))
+        return evicted
+
+    def _forget_oldest_tombstone(self):
+        ended, conv_id = self._tombstone_order.popleft()
+        # Only remove if the tombstone was not renewed since
+        if self.tombstones.get(conv_id, (None,))[0] == ended:
+            del self.tombstones[conv_id]
+
+    def get_stats(self):
+        """
+        @retval dict with the number of live, tombstoned and evicted
+            conversations and of dropped late messages
+        """
+        return {'live':len(self.conversations),
+                'tombstoned':len(self.tombstones),
+                'evicted':self.evicted_count,
+                'late_messages':self.late_count}
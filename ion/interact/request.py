@@ -47,39 +47,33 @@ class RequestFSMFactory(ConversationTypeFSMFactory):
 
     A_UNEXPECTED = "unexpected"
 
-    def create_fsm(self, target, memory=None):
-        fsm = ConversationTypeFSMFactory.create_fsm(self, target, memory)
-
-        actf = target._action
-
+    def define_transitions(self, table):
         # FSM definition
         # Notation STATE ^event --> NEW-STATE /callback-action-function
 
         # INIT ^request --> REQUESTED /request
-        actionfct = self._create_action_func(actf, self.E_REQUEST)
-        fsm.add_transition(self.E_REQUEST, self.S_INIT, actionfct, self.S_REQUESTED)
+        actionfct = self._create_shared_action(self.E_REQUEST)
+        table.add_transition(self.E_REQUEST, self.S_INIT, actionfct, self.S_REQUESTED)
 
         # REQUESTED ^refuse --> REFUSED /refuse
-        actionfct = self._create_action_func(actf, self.E_REFUSE)
-        fsm.add_transition(self.E_REFUSE, self.S_REQUESTED, actionfct, self.S_REFUSED)
+        actionfct = self._create_shared_action(self.E_REFUSE)
+        table.add_transition(self.E_REFUSE, self.S_REQUESTED, actionfct, self.S_REFUSED)
 
         # REQUESTED ^agree --> AGREED /agree
-        actionfct = self._create_action_func(actf, self.E_AGREE)
-        fsm.add_transition(self.E_AGREE, self.S_REQUESTED, actionfct, self.S_AGREED)
+        actionfct = self._create_shared_action(self.E_AGREE)
+        table.add_transition(self.E_AGREE, self.S_REQUESTED, actionfct, self.S_AGREED)
 
         # AGREED ^failure -->  FAILED /failure
-        actionfct = self._create_action_func(actf, self.E_FAILURE)
-        fsm.add_transition(self.E_FAILURE, self.S_AGREED, actionfct, self.S_FAILED)
+        actionfct = self._create_shared_action(self.E_FAILURE)
+        table.add_transition(self.E_FAILURE, self.S_AGREED, actionfct, self.S_FAILED)
 
         # AGREED ^inform_result -->  DONE /inform_result
-        actionfct = self._create_action_func(actf, self.E_RESULT)
-        fsm.add_transition(self.E_RESULT, self.S_AGREED, actionfct, self.S_DONE)
+        actionfct = self._create_shared_action(self.E_RESULT)
+        table.add_transition(self.E_RESULT, self.S_AGREED, actionfct, self.S_DONE)
 
         # ANY ^error -->  ERROR /error
-        actionfct = self._create_action_func(actf, self.E_ERROR)
-        fsm.set_default_transition(actionfct, self.S_ERROR)
-
-        return fsm
+        actionfct = self._create_shared_action(self.E_ERROR)
+        table.set_default_transition(actionfct, self.S_ERROR)
 
 class Request(Conversation):
     """
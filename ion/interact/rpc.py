@@ -44,39 +44,33 @@ class RpcFSMFactory(ConversationTypeFSMFactory):
 
     A_UNEXPECTED = "unexpected"
 
-    def create_fsm(self, target, memory=None):
-        fsm = ConversationTypeFSMFactory.create_fsm(self, target, memory)
-
-        actf = target._action
-
+    def define_transitions(self, table):
         # FSM definition
         # Notation STATE ^event --> NEW-STATE /callback-action-function
 
         # INIT ^request --> REQUESTED /request
-        actionfct = self._create_action_func(actf, self.E_REQUEST)
-        fsm.add_transition(self.E_REQUEST, self.S_INIT, actionfct, self.S_REQUESTED)
+        actionfct = self._create_shared_action(self.E_REQUEST)
+        table.add_transition(self.E_REQUEST, self.S_INIT, actionfct, self.S_REQUESTED)
 
         # REQUESTED ^failure -->  FAILED /failure
-        actionfct = self._create_action_func(actf, self.E_FAILURE)
-        fsm.add_transition(self.E_FAILURE, self.S_REQUESTED, actionfct, self.S_FAILED)
+        actionfct = self._create_shared_action(self.E_FAILURE)
+        table.add_transition(self.E_FAILURE, self.S_REQUESTED, actionfct, self.S_FAILED)
 
         # REQUESTED ^inform_result -->  DONE /inform_result
-        actionfct = self._create_action_func(actf, self.E_RESULT)
-        fsm.add_transition(self.E_RESULT, self.S_REQUESTED, actionfct, self.S_DONE)
+        actionfct = self._create_shared_action(self.E_RESULT)
+        table.add_transition(self.E_RESULT, self.S_REQUESTED, actionfct, self.S_DONE)
 
         # REQUESTED ^timeout -->  TIMEOUT /timeout
-        actionfct = self._create_action_func(actf, self.E_TIMEOUT)
-        fsm.add_transition(self.E_TIMEOUT, self.S_REQUESTED, actionfct, self.S_TIMEOUT)
+        actionfct = self._create_shared_action(self.E_TIMEOUT)
+        table.add_transition(self.E_TIMEOUT, self.S_REQUESTED, actionfct, self.S_TIMEOUT)
 
         # ANY ^error -->  ERROR /error
-        actionfct = self._create_action_func(actf, self.E_ERROR)
-        fsm.add_transition_catch(self.E_ERROR, actionfct, self.S_ERROR)
+        actionfct = self._create_shared_action(self.E_ERROR)
+        table.add_transition_catch(self.E_ERROR, actionfct, self.S_ERROR)
 
         # ANY ^(undefined) -->  UNEXPECTED /unexpected
-        actionfct = self._create_action_func(actf, self.A_UNEXPECTED)
-        fsm.set_default_transition(actionfct, self.S_UNEXPECTED)
-
-        return fsm
+        actionfct = self._create_shared_action(self.A_UNEXPECTED)
+        table.set_default_transition(actionfct, self.S_UNEXPECTED)
 
 class Rpc(Conversation):
     """
@@ -256,14 +250,10 @@ class GenericFSMFactory(ConversationTypeFSMFactory):
     S_INIT = BasicStates.S_INIT
     E_REQUEST = "request"
 
-    def create_fsm(self, target, memory=None):
-        fsm = ConversationTypeFSMFactory.create_fsm(self, target, memory)
-
-        actf = target._action
-        actionfct = self._create_action_func(actf, self.E_REQUEST)
-        fsm.add_transition(self.E_REQUEST, self.S_INIT, actionfct, self.S_INIT)
-        fsm.set_default_transition(actionfct, self.S_INIT)
-        return fsm
+    def define_transitions(self, table):
+        actionfct = self._create_shared_action(self.E_REQUEST)
+        table.add_transition(self.E_REQUEST, self.S_INIT, actionfct, self.S_INIT)
+        table.set_default_transition(actionfct, self.S_INIT)
 
 class GenericInitiator(ConversationRole):
     factory = GenericFSMFactory()
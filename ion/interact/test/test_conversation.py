@@ -6,7 +6,8 @@
 @brief test case for conversations
 """
 
-from twisted.internet import defer
+from twisted.internet import defer, task
+from twisted.trial import unittest
 
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
@@ -15,9 +16,10 @@ from ion.core import ioninit
 from ion.core.process.process import Process, ProcessDesc, ProcessFactory
 from ion.core.cc.container import Container
 from ion.core.exception import ReceivedError, ConversationError
-from ion.interact.conversation import Conversation, ConversationType, conv_mgr_instance
+from ion.interact import conversation
+from ion.interact.conversation import Conversation, ConversationType, ProcessConversationManager, conv_mgr_instance
 from ion.interact.request import RequestType, Request
-from ion.interact.rpc import RpcType, Rpc
+from ion.interact.rpc import RpcType, Rpc, GenericType
 from ion.test.iontest import IonTestCase, ReceiverProcess
 import ion.util.procutils as pu
 
@@ -73,3 +75,92 @@ class ConversationTest(IonTestCase):
         req_conv = conv_mgr.new_conversation(RequestType.CONV_TYPE_REQUEST)
         req_conv.bind_role_local(RequestType.ROLE_INITIATOR.role_id, proc1)
         req_conv.bind_role(RequestType.ROLE_PARTICIPANT.role_id, pid2)
+
+    @defer.inlineCallbacks
+    def test_shared_fsm_tables(self):
+        proc1 = Process()
+        pid1 = yield proc1.spawn()
+
+        conv_mgr = proc1.conv_manager
+        conv1 = conv_mgr.new_conversation(RpcType.CONV_TYPE_RPC)
+        conv1.bind_role_local(RpcType.ROLE_INITIATOR.role_id, proc1)
+        conv2 = conv_mgr.new_conversation(RpcType.CONV_TYPE_RPC)
+        conv2.bind_role_local(RpcType.ROLE_PARTICIPANT.role_id, proc1)
+
+        # Both roles of all rpc conversations use the same frozen table
+        fsm1 = conv1.local_fsm._StateObject__fsm
+        fsm2 = conv2.local_fsm._StateObject__fsm
+        self.assertIdentical(fsm1.table, fsm2.table)
+        self.assertTrue(fsm1.table.frozen)
+        self.assertIdentical(fsm1.target, conv1.local_fsm)
+        self.assertIdentical(fsm2.target, conv2.local_fsm)
+        self.assertNotIdentical(fsm1, fsm2)
+
+        # Conversation message logging is off by default
+        conv_mgr.log_conv_message(conv1, {'headers':{'op':'test'}}, msgtype='SENT')
+        self.assertEqual(conv1.conv_log, None)
+
+
+class GCProcess(object):
+    proc_name = 'gc_test_process'
+
+class ConversationGCTest(unittest.TestCase):
+    """
+    Tests conversation tombstones and garbage collection, without a container
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.conv_mgr = ProcessConversationManager(GCProcess(), clock=self.clock)
+
+    def test_tombstones(self):
+        conv = self.conv_mgr.new_conversation(RpcType.CONV_TYPE_RPC, 'conv#1')
+        self.assertEqual(self.conv_mgr.get_conversation('conv#1'), conv)
+        self.assertFalse(self.conv_mgr.is_tombstoned('conv#1'))
+
+        self.conv_mgr.end_conversation('conv#1', 'TIMEOUT')
+        self.assertEqual(self.conv_mgr.get_conversation('conv#1'), None)
+        self.assertTrue(self.conv_mgr.is_tombstoned('conv#1'))
+
+        self.conv_mgr.drop_late_message('conv#1', {'performative':'inform_result'})
+        self.assertEqual(self.conv_mgr.get_stats(),
+                         {'live':0, 'tombstoned':1, 'evicted':0, 'late_messages':1})
+
+        # Tombstones expire
+        self.clock.advance(conversation.CF_tombstone_ttl + 1)
+        self.conv_mgr.collect_garbage()
+        self.assertFalse(self.conv_mgr.is_tombstoned('conv#1'))
+
+    def test_tombstone_bound(self):
+        max_tombstones = conversation.CF_tombstone_max
+        conversation.CF_tombstone_max = 3
+        try:
+            for i in range(5):
+                self.conv_mgr.end_conversation('conv#%d' % i, 'DONE')
+            self.assertEqual(len(self.conv_mgr.tombstones), 3)
+            self.assertFalse(self.conv_mgr.is_tombstoned('conv#1'))
+            self.assertTrue(self.conv_mgr.is_tombstoned('conv#2'))
+        finally:
+            conversation.CF_tombstone_max = max_tombstones
+
+    def test_evict_idle(self):
+        idle = self.conv_mgr.new_conversation(GenericType.CONV_TYPE_GENERIC, 'conv#idle')
+        waiting = self.conv_mgr.new_conversation(RpcType.CONV_TYPE_RPC, 'conv#waiting')
+        waiting.blocking_deferred = defer.Deferred()
+
+        self.clock.advance(conversation.CF_conv_idle_timeout + 1)
+        active = self.conv_mgr.new_conversation(GenericType.CONV_TYPE_GENERIC, 'conv#active')
+
+        # Creating a conversation after the GC interval collected the idle one
+        self.assertEqual(self.conv_mgr.get_conversation('conv#idle'), None)
+        self.assertEqual(self.tombstone_state('conv#idle'), 'EVICTED')
+
+        # A conversation waiting for its reply is left to its timeout
+        self.assertEqual(self.conv_mgr.get_conversation('conv#waiting'), waiting)
+        self.assertEqual(self.conv_mgr.get_conversation('conv#active'), active)
+
+        self.assertEqual(self.conv_mgr.get_stats(),
+                         {'live':2, 'tombstoned':1, 'evicted':1, 'late_messages':0})
+
+    def tombstone_state(self, conv_id):
+        return self.conv_mgr.tombstones[conv_id][1]
@@ -27,6 +27,12 @@ from ion.core.messaging.message_client import MessageClient
 from types import FunctionType
 import math
 
+# NumPy is optional - without it op_extract_data falls back to copying python lists
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from ion.core.object import object_utils
 from ion.core.object import gpb_wrapper, repository
 from ion.core.object.workbench import WorkBench, WorkBenchError, PUSH_MESSAGE_TYPE, PULL_MESSAGE_TYPE, PULL_RESPONSE_MESSAGE_TYPE, BLOBS_REQUSET_MESSAGE_TYPE, BLOBS_MESSAGE_TYPE, GET_OBJECT_REQUEST_MESSAGE_TYPE, GET_OBJECT_REPLY_MESSAGE_TYPE, GPBTYPE_TYPE, DATA_REQUEST_MESSAGE_TYPE, DATA_REPLY_MESSAGE_TYPE, DATA_CHUNK_MESSAGE_TYPE, GET_LCS_REQUEST_MESSAGE_TYPE, GET_LCS_RESPONSE_MESSAGE_TYPE
@@ -54,6 +60,8 @@ from ion.services.coi.datastore_bootstrap.ion_preload_config import ION_PREDICAT
 from ion.services.coi.datastore_bootstrap.ion_preload_config import TypeMap, ANONYMOUS_USER_ID, ROOT_USER_ID, OWNED_BY_ID, ION_AIS_RESOURCES, ION_AIS_RESOURCES_CFG, OWNER_ID, HAS_ROLE_ID
 
 from ion.core import ioninit
+from ion.core.intercept.policy import broadcast_owner_changes
+from ion.services.dm.inventory.association_service import broadcast_association_changes
 CONF = ioninit.config(__name__)
 
 
@@ -70,13 +78,25 @@ RESOURCE_TYPE = object_utils.create_type_identifier(object_id=1102, version=1)
 
 CDM_BOUNDED_ARRAY_TYPE = object_utils.create_type_identifier(object_id=10021, version=1)
 
+# Message header in which the consumer of extract_data may set the size of the send window (in chunks)
+DATA_WINDOW_HEADER = 'data-window'
+
+# NumPy dtype for the value of each ndarray type - string and opaque arrays are held as python objects
+NDARRAY_DTYPES = {CDM_ARRAY_INT32_TYPE.object_id:'int32',
+                  CDM_ARRAY_UINT32_TYPE.object_id:'uint32',
+                  CDM_ARRAY_INT64_TYPE.object_id:'int64',
+                  CDM_ARRAY_UINT64_TYPE.object_id:'uint64',
+                  CDM_ARRAY_FLOAT32_TYPE.object_id:'float32',
+                  CDM_ARRAY_FLOAT64_TYPE.object_id:'float64',
+                  }
+
 class NDArrayWrap(object):
     """
     Helper object which wraps an ndarray GPB object.
     The NDArrayWrap is designed to be stored in an LRUDict, as it exposes __sizeof__, clear, and
     a property to load/retrieve the ndarray's value.
     """
-    def __init__(self, key, repo, bounds, itembytes, getblobs):
+    def __init__(self, key, repo, bounds, itembytes, getblobs, dtype=object):
         """
         Constructor. Needs references to several pieces of information to correctly get an ndarray
         and calculate its size.
@@ -86,12 +106,15 @@ class NDArrayWrap(object):
         @param  bounds      The bounds of the ndarray. Used to calc size.
         @param  itembytes   Number of bytes per item. Based on the array's data type.
         @param  getblobs    A reference to the workbench's _get_blobs callable.
+        @param  dtype       The NumPy dtype used when the ndarray is decoded with the array property.
         """
         self._key = key
         self._repo = repo
         self._getblobs = getblobs
+        self._dtype = dtype
 
         self._ndarray = None
+        self._array = None
         if len(bounds) == 0:
             self._size = itembytes      # scalar value, just one itembytes size
         else:
@@ -129,6 +152,27 @@ class NDArrayWrap(object):
 
     value = property(_get_value)
 
+    @defer.inlineCallbacks
+    def _get_array(self):
+        """
+        Loads/retrieves an ndarray decoded into a NumPy array. Once decoded the gpb object is released from the
+        repository - only the typed array is kept. Access this via the array property.
+        """
+        if self._array is None:
+            value = yield self._get_value()
+
+            if self._dtype is object:
+                self._array = numpy.array(value[:], dtype=object)
+            else:
+                self._array = numpy.fromiter(value, dtype=self._dtype, count=len(value))
+
+            self._ndarray = None
+            self.clear()
+
+        defer.returnValue(self._array)
+
+    array = property(_get_array)
+
 class NDArrayLRUDict(LRUDict):
     """
     Custom least-recently-used dictionary cache object for holding NDarrays.
@@ -162,6 +206,110 @@ class NDArrayLRUDict(LRUDict):
         value = yield ndarray.value
         defer.returnValue(value)
 
+    @defer.inlineCallbacks
+    def get_ndarray_array(self, key, bounds, itembytes, getblobs, dtype=object):
+        """
+        Gets an ndarray's value decoded into a NumPy array of the given dtype. Like get_ndarray_value, the array is
+        returned even if it is too large to store in the cache.
+        """
+        if not self.has_key(key):
+            ndarray = NDArrayWrap(key, self._repo, bounds, itembytes, getblobs, dtype)
+            self[key] = ndarray
+            log.debug("LRUDict loading, item size %d, lru now %d items %d bytes total" % (ndarray._size, len(self.keys()), self.total_size))
+        else:
+            ndarray = self.get(key)
+
+        array = yield ndarray.array
+        defer.returnValue(array)
+
+class WriteBehindQueue(object):
+    """
+    Bounded write behind queue for a store backend.
+    Rows are coalesced into batches which are written with a single put_many call. A batch is sent as soon as it
+    reaches either the row count or the byte size limit. At most max_in_flight batches are outstanding at any one
+    time - put blocks (returns an unfired deferred) until a slot is free.
+
+    Nothing is durable until flush fires - the caller must not acknowledge the write before then.
+    """
+    def __init__(self, backend, max_batch_rows=500, max_batch_bytes=4*1024*1024, max_in_flight=4, indexed=False):
+        """
+        @param  backend         The IStore or IIndexStore to write to.
+        @param  max_batch_rows  Maximum number of rows in one batch.
+        @param  max_batch_bytes Maximum size of the values in one batch.
+        @param  max_in_flight   Maximum number of batches outstanding against the backend.
+        @param  indexed         If true, rows are (key, value, index_attributes) for an IIndexStore.
+        """
+        self._backend = backend
+        self._max_batch_rows = max(int(max_batch_rows), 1)
+        self._max_batch_bytes = max(int(max_batch_bytes), 1)
+        self._indexed = indexed
+
+        self._semaphore = defer.DeferredSemaphore(max(int(max_in_flight), 1))
+
+        self._rows = []
+        self._bytes = 0
+
+        # list of (deferred, batch) for batches sent to the backend
+        self._sent = []
+
+    def put(self, key, value, index_attributes=None):
+        """
+        Add a row to the current batch, sending it if it is full.
+        @retval Deferred which fires when the row has been accepted by the queue - not when it is durable!
+        """
+        if self._indexed:
+            self._rows.append((key, value, index_attributes))
+        else:
+            self._rows.append((key, value))
+
+        self._bytes += len(value)
+
+        if len(self._rows) >= self._max_batch_rows or self._bytes >= self._max_batch_bytes:
+            return self._send_batch()
+
+        return defer.succeed(None)
+
+    @defer.inlineCallbacks
+    def _send_batch(self):
+
+        batch = self._rows
+        self._rows = []
+        self._bytes = 0
+
+        # Wait for a free slot - this is what bounds the queue
+        yield self._semaphore.acquire()
+
+        d = defer.maybeDeferred(self._backend.put_many, batch)
+
+        def release(result):
+            self._semaphore.release()
+            return result
+        d.addBoth(release)
+
+        self._sent.append((d, batch))
+
+    @defer.inlineCallbacks
+    def flush(self):
+        """
+        Send any partial batch and wait for every batch to be written to the backend.
+        @retval Deferred which fires with a list of (keys, failure) for each batch that failed.
+        """
+        if self._rows:
+            yield self._send_batch()
+
+        sent = self._sent
+        self._sent = []
+
+        dl_res = yield defer.DeferredList([x[0] for x in sent], consumeErrors=True)
+
+        failures = []
+        for (success, result), (d, batch) in zip(dl_res, sent):
+            if not success:
+                failures.append(([row[0] for row in batch], result))
+
+        defer.returnValue(failures)
+
+
 class DataStoreWorkBenchError(WorkBenchError):
     """
     An Exception class for errors in the data store workbench
@@ -170,13 +318,25 @@ class DataStoreWorkBenchError(WorkBenchError):
 class DataStoreWorkbench(WorkBench):
 
 
-    def __init__(self, process, blob_store, commit_store, cache_size=10**8):
+    def __init__(self, process, blob_store, commit_store, cache_size=10**8, blob_batch_size=1000,
+                 write_batch_rows=500, write_batch_bytes=4*1024*1024, write_batches_in_flight=4, extract_window=4):
 
         WorkBench.__init__(self, process, cache_size)
 
         self._blob_store = blob_store
         self._commit_store = commit_store
 
+        # Maximum number of keys requested from the blob store in a single get_many
+        self._blob_batch_size = max(int(blob_batch_size), 1)
+
+        # Limits for the write behind queues used in push and flush
+        self._write_batch_rows = write_batch_rows
+        self._write_batch_bytes = write_batch_bytes
+        self._write_batches_in_flight = write_batches_in_flight
+
+        # Default number of extracted data chunks which may wait to be sent in extract_data
+        self._extract_window = extract_window
+
 
     def pull(self, *args, **kwargs):
 
@@ -192,6 +352,10 @@ class DataStoreWorkbench(WorkBench):
         Common blob fetching helper method.
         Used by checkout and pull.
 
+        The DAG is walked one level at a time. All the keys which are not already in the repository are fetched from
+        the blob store with get_many - one request per batch of at most self._blob_batch_size keys - so the number of
+        round trips to the backend grows with the depth of the DAG rather than the number of blobs.
+
         @param  repo            Repository for the response.
         @param  startkeys       The keys that should start the fetching process.
         @param  filtermethod    A callable to be applied to all children of fetched items. If the callable returns true,
@@ -210,7 +374,7 @@ class DataStoreWorkbench(WorkBench):
         while len(keys_to_get) > 0:
             new_links_to_get.clear()
 
-            def_list = []
+            need_keys = []
             #@TODO - put some error checking here so that we don't overflow due to a stupid request!
             for key in keys_to_get:
                 # Short cut if we have already got it!
@@ -227,42 +391,48 @@ class DataStoreWorkbench(WorkBench):
                     # only add new items to get if they meet our criteria, meaning they are not in the excluded type list
                     new_links_to_get.update(obj.ChildLinks)
                 else:
-                    def_list.append((self._blob_store.get(key), key))
+                    need_keys.append(key)
 
+            def_list = []
+            for i in xrange(0, len(need_keys), self._blob_batch_size):
+                batch = need_keys[i:i + self._blob_batch_size]
+                def_list.append((self._blob_store.get_many(batch), batch))
 
             result_list = yield defer.DeferredList([x[0] for x in def_list])
             dl_fails = filter(lambda x: not x[1][0], enumerate(result_list))
             if len(dl_fails) > 0:
-                msg = "Errors (%s) getting link from blob store\n\n" % len(dl_fails)
+                msg = "Errors (%s) getting batches of links from blob store\n\n" % len(dl_fails)
                 for idx, d_res in dl_fails:
-                    msg += "Key: %s, Failure: %s\n" % (sha1_to_hex(def_list[idx][1]), str(d_res[1]))
+                    msg += "Keys: %s, Failure: %s\n" % (', '.join([sha1_to_hex(k) for k in def_list[idx][1]]), str(d_res[1]))
 
                 raise DataStoreWorkBenchError(msg)
 
             # now, let's check for Nones to get a summary of errors
-            dl_nones = filter(lambda x: x[1][1] is None, enumerate(result_list))
-            if len(dl_nones) > 0:
-                msg = "Blobs not found in blob store (%d)" % len(dl_nones)
-                for idx, d_res in dl_nones:
-                    msg += "Key: %s" % sha1_to_hex(def_list[idx][1])
+            missing = []
+            for result, batch_blobs in result_list:
+                missing.extend([k for k, blob in batch_blobs.iteritems() if blob is None])
+
+            if len(missing) > 0:
+                msg = "Blobs not found in blob store (%d)" % len(missing)
+                for key in missing:
+                    msg += "Key: %s" % sha1_to_hex(key)
 
                 raise DataStoreWorkBenchError(msg)
 
-            for result, blob in result_list:
-                # these should never happen becuase we check for them above, but leaving them in for now...
-                assert result==True, 'Error getting link from blob store!'
-                assert blob is not None, 'Blob not found in blob store!'
+            for result, batch_blobs in result_list:
 
-                wse = gpb_wrapper.StructureElement.parse_structure_element(blob)
-                blobs[wse.key]=wse
+                for blob in batch_blobs.itervalues():
 
-                # Add it to the repository index
-                repo.index_hash[wse.key] = wse
+                    wse = gpb_wrapper.StructureElement.parse_structure_element(blob)
+                    blobs[wse.key]=wse
+
+                    # Add it to the repository index
+                    repo.index_hash[wse.key] = wse
 
-                # load the object so we can find its children
-                obj = repo._load_element(wse)
+                    # load the object so we can find its children
+                    obj = repo._load_element(wse)
 
-                new_links_to_get.update(obj.ChildLinks)
+                    new_links_to_get.update(obj.ChildLinks)
 
             keys_to_get.clear()
             for link in new_links_to_get:
@@ -468,6 +638,12 @@ class DataStoreWorkbench(WorkBench):
         # A list of the blobs received - does not matter what repo they are in - just jam them into the store
         new_blob_keys =[]
 
+        # The resources whose ownership associations are in the push
+        owner_changes = set()
+
+        # The predicate object pairs of the associations in the push
+        association_pairs = set()
+
 
         for repostate in pushmsg.repositories:
 
@@ -562,29 +738,21 @@ class DataStoreWorkbench(WorkBench):
             # Now merge the state!
             self._update_repo_to_head(repo,new_head)
 
-        # Put any new blobs
-        def_list = []
+        # Put any new blobs - coalesced into batches by the write behind queue
+        blob_queue = self._create_write_queue(self._blob_store)
         for key in new_blob_keys:
 
             element = self._workbench_cache.get(key)
 
-            def_list.append(self._blob_store.put(key, element.serialize()))
+            yield blob_queue.put(key, element.serialize())
 
-        # we need to check problems in the put here
-        dl_res = yield defer.DeferredList(def_list)
-        dl_fails = filter(lambda x: not x[1][0], enumerate(dl_res))
-        if len(dl_fails) > 0:
-            msg = "Errors (%s) putting blob to blob store\n\n" % len(dl_fails)
-            for idx, d_res in dl_fails:
-                msg += "%s\nFailure: %s\n\n" % (str(self._workbench_cache.get(new_blob_keys[idx])), str(d_res[1]))
-
-            for repostate in pushmsg.repositories:
-                self.clear_repository_key(repostate.repository_key)
-
-            raise DataStoreWorkBenchError(msg)
+        # we need to check problems in the put here - the push is not acknowledged until the blobs are durable
+        failures = yield blob_queue.flush()
+        if len(failures) > 0:
+            self._clear_push_on_write_failure(pushmsg, failures, 'putting blob batch to blob store')
 
         # now put any new commits that are not at the head
-        def_list = []
+        commit_queue = self._create_write_queue(self._commit_store, indexed=True)
 
         # list of the keys which are no longer heads
         clear_head_list=[]
@@ -640,6 +808,11 @@ class DataStoreWorkbench(WorkBench):
                     attributes[OBJECT_BRANCH] = cref.objectroot.object.branch
                     attributes[OBJECT_COMMIT] = cref.objectroot.object.commit
 
+                    association_pairs.add((attributes[PREDICATE_KEY], attributes[OBJECT_KEY]))
+
+                    if attributes[PREDICATE_KEY] == OWNED_BY_ID:
+                        owner_changes.add(attributes[SUBJECT_KEY])
+
                 elif root_type == RESOURCE_TYPE:
 
 
@@ -656,10 +829,7 @@ class DataStoreWorkbench(WorkBench):
 
                 if key not in head_keys:
 
-                    defd = self._commit_store.put(key = key,
-                                       value = wse.serialize(),
-                                       index_attributes = attributes)
-                    def_list.append((defd, key, wse))
+                    yield commit_queue.put(key, wse.serialize(), attributes)
 
                 else:
 
@@ -675,7 +845,7 @@ class DataStoreWorkbench(WorkBench):
 
 
 
-                    new_head_list.append({'key':key, 'value':wse.serialize(), 'index_attributes':attributes})
+                    new_head_list.append((key, wse.serialize(), attributes))
 
             # Get the current head list
             q = Query()
@@ -691,37 +861,19 @@ class DataStoreWorkbench(WorkBench):
                     # Any commit which is currently a head will have the correct branch names set.
                     # Just delete the branch names for the ones that are no longer heads.
 
-        dl_res = yield defer.DeferredList([x[0] for x in def_list])
-        dl_fails = filter(lambda x: not x[1][0], enumerate(dl_res))
-        if len(dl_fails) > 0:
-            msg = "Errors (%s) putting commit to store\n\n" % len(dl_fails)
-            for idx, d_res in dl_fails:
-                _, ckey, cwse = def_list[idx]
-                msg += "Key: %s\nElement: %s\nFailure: %s" % (sha1_to_hex(ckey), str(cwse), str(d_res[1]))
-
-            for repostate in pushmsg.repositories:
-                self.clear_repository_key(repostate.repository_key)
-
-            raise DataStoreWorkBenchError(msg)
-
-        def_list = []
-        for new_head in new_head_list:
-
-            def_list.append(self._commit_store.put(**new_head))
+        failures = yield commit_queue.flush()
+        if len(failures) > 0:
+            self._clear_push_on_write_failure(pushmsg, failures, 'putting commit batch to store')
 
-        dl_res = yield defer.DeferredList(def_list)
-        dl_fails = filter(lambda x: not x[1][0], enumerate(dl_res))
-        if len(dl_fails) > 0:
-            msg = "Errors (%s) putting new_head_list commit to store\n\n" % len(dl_fails)
-            for idx, d_res in dl_fails:
-                nhlkey = new_head_list[idx]['key']
-                nhlval = new_head_list[idx]['value']
-                msg += "Key: %s\nElement: %s\nFailure: %s" % (sha1_to_hex(nhlkey), str(nhlval), str(d_res[1]))
+        # The new heads are only written once all the commits behind them are durable
+        head_queue = self._create_write_queue(self._commit_store, indexed=True)
+        for key, value, attributes in new_head_list:
 
-            for repostate in pushmsg.repositories:
-                self.clear_repository_key(repostate.repository_key)
+            yield head_queue.put(key, value, attributes)
 
-            raise DataStoreWorkBenchError(msg)
+        failures = yield head_queue.flush()
+        if len(failures) > 0:
+            self._clear_push_on_write_failure(pushmsg, failures, 'putting new_head_list commit batch to store')
 
         def_list = []
         for key in clear_head_list:
@@ -745,6 +897,21 @@ class DataStoreWorkbench(WorkBench):
         #print 'After update to heads'
         #pprint.pprint(self._commit_store.kvs)
 
+        if owner_changes:
+            # Cached policy decisions about these resources are out of date
+            try:
+                yield broadcast_owner_changes(self._process, owner_changes)
+            except Exception, ex:
+                log.warn('op_push: Could not broadcast the ownership changes of %s - %s' % (list(owner_changes), str(ex)))
+
+        changed_repositories = [repo_key for repo_key, commit_keys in new_commits.items() if commit_keys]
+        if changed_repositories:
+            # The association graph indices of the association services are out of date
+            try:
+                yield broadcast_association_changes(self._process, changed_repositories, association_pairs)
+            except Exception, ex:
+                log.warn('op_push: Could not broadcast the changes to repositories %s - %s' % (changed_repositories, str(ex)))
+
 
         response = yield self._process.message_client.create_instance(MessageContentTypeID=None)
         response.MessageResponseCode = response.ResponseCodes.OK
@@ -753,6 +920,20 @@ class DataStoreWorkbench(WorkBench):
         yield self._process.reply_ok(msg, response)
         log.info('op_push: Complete!')
 
+    def _clear_push_on_write_failure(self, pushmsg, failures, description):
+        """
+        Clear the repositories of a push which could not be written to the backend and raise an error
+        @param failures a list of (keys, failure) returned by WriteBehindQueue.flush
+        """
+        msg = "Errors (%s) %s\n\n" % (len(failures), description)
+        for keys, failure in failures:
+            msg += "Keys: %s\nFailure: %s\n\n" % (', '.join([sha1_to_hex(key) for key in keys]), str(failure))
+
+        for repostate in pushmsg.repositories:
+            self.clear_repository_key(repostate.repository_key)
+
+        raise DataStoreWorkBenchError(msg)
+
     @defer.inlineCallbacks
     def op_get_lcs(self, request, headers, msg):
         '''
@@ -871,24 +1052,23 @@ class DataStoreWorkbench(WorkBench):
         """
         Flush any repositories in the backend to the the workbench backend storage
         """
-        def_list=[]
+        blob_queue = self._create_write_queue(self._blob_store)
         for repo in self._repos.itervalues():
+            yield self._queue_repo_blobs(repo, blob_queue)
 
-            def_list.append((self.flush_repo_to_backend(repo), repo.repository_key))
-
-        # this is a deferred list of deferred lists
-        odl_res = yield defer.DeferredList([x[0] for x in def_list])
+        failures = yield blob_queue.flush()
+        # we are not concerned with comprehensive errors here, just error out on the first problem we find
+        if len(failures) > 0:
+            raise DataStoreWorkBenchError("flush_initialization_to_backend encountered an error putting blobs: %s" % str(failures[0][1]))
 
-        # odl_res should always return True for each entry - we're more concerned about them underneath having failures
-        for idx, idl_res in enumerate(odl_res):
-            repo_key = def_list[idx][1]
-            # get failures from this
-            # idl_res is: (True, [(True, bla), (True, bla)...])
-            idl_fails = filter(lambda x: not x[0], idl_res[1])
+        # Only put the commits once all the blobs they refer to are durable
+        commit_queue = self._create_write_queue(self._commit_store, indexed=True)
+        for repo in self._repos.itervalues():
+            yield self._queue_repo_commits(repo, commit_queue)
 
-            # we are not concerned with comprehensive errors here, just error out on the first problem we find
-            if len(idl_fails) > 0:
-                raise DataStoreWorkBenchError("flush_initialization_to_backend encountered an error on repository %s" % repo_key)
+        failures = yield commit_queue.flush()
+        if len(failures) > 0:
+            raise DataStoreWorkBenchError("flush_initialization_to_backend encountered an error putting commits: %s" % str(failures[0][1]))
 
         #import pprint
         #print 'After update to heads'
@@ -903,18 +1083,50 @@ class DataStoreWorkbench(WorkBench):
         self.clear()
 
 
-
+    @defer.inlineCallbacks
     def flush_repo_to_backend(self, repo):
         """
         Flush any repositories in the backend to the the workbench backend storage
         """
+        blob_queue = self._create_write_queue(self._blob_store)
+        yield self._queue_repo_blobs(repo, blob_queue)
+
+        failures = yield blob_queue.flush()
+        if len(failures) > 0:
+            raise DataStoreWorkBenchError("flush_repo_to_backend encountered an error putting blobs for repository %s: %s" % (repo.repository_key, str(failures[0][1])))
 
+        commit_queue = self._create_write_queue(self._commit_store, indexed=True)
+        yield self._queue_repo_commits(repo, commit_queue)
+
+        failures = yield commit_queue.flush()
+        if len(failures) > 0:
+            raise DataStoreWorkBenchError("flush_repo_to_backend encountered an error putting commits for repository %s: %s" % (repo.repository_key, str(failures[0][1])))
+
+    def _create_write_queue(self, backend, indexed=False):
+        """
+        Create a write behind queue for one push or flush using the workbench batch settings
+        """
+        return WriteBehindQueue(backend,
+                                max_batch_rows=self._write_batch_rows,
+                                max_batch_bytes=self._write_batch_bytes,
+                                max_in_flight=self._write_batches_in_flight,
+                                indexed=indexed)
+
+    @defer.inlineCallbacks
+    def _queue_repo_blobs(self, repo, blob_queue):
+        """
+        Queue all the blobs of a repository which is being flushed to the backend
+        """
         # This is simpler than a push - all of these are guaranteed to be new objects!
-        def_list = []
         for key, element in repo.index_hash.items():
 
-            def_list.append(self._blob_store.put(key, element.serialize()))
+            yield blob_queue.put(key, element.serialize())
 
+    @defer.inlineCallbacks
+    def _queue_repo_commits(self, repo, commit_queue):
+        """
+        Queue all the commits of a repository which is being flushed to the backend
+        """
 
         # any objects in the data structure that were transmitted have already
         # been updated now it is time to set update the commits
@@ -969,14 +1181,7 @@ class DataStoreWorkbench(WorkBench):
             wse = self._workbench_cache.get(key)
 
 
-            if key not in head_keys:
-
-                defd = self._commit_store.put(key = key,
-                                   value = wse.serialize(),
-                                   index_attributes = attributes)
-                def_list.append(defd)
-
-            else:
+            if key in head_keys:
 
                 # We know it is a head - but we need to get the branch name again
                 for branch in  repo.branches:
@@ -989,15 +1194,8 @@ class DataStoreWorkbench(WorkBench):
                             attributes[BRANCH_NAME] = ','.join([attributes[BRANCH_NAME],branch.branchkey])
 
 
-                # Now commit it!
-                defd = self._commit_store.put(key = key,
-                                   value = wse.serialize(),
-                                   index_attributes = attributes)
-                def_list.append(defd)
-
-        # this deferred list will be checked by the flush_initialization_to_backend method
-        return defer.DeferredList(def_list)
-
+            # Now commit it!
+            yield commit_queue.put(key, wse.serialize(), attributes)
 
 
 
@@ -1010,7 +1208,7 @@ class DataStoreWorkbench(WorkBench):
         q = Query()
         q.add_predicate_eq(REPOSITORY_KEY, repo_key)
 
-        rows = yield self._commit_store.query(q)
+        rows = yield self._commit_store.query(q, columns=[REPOSITORY_KEY])
 
         defer.returnValue(len(rows)>0)
 
@@ -1130,9 +1328,11 @@ class DataStoreWorkbench(WorkBench):
         # we don't actually know what to put for CDM_ARRAY_STRING_TYPE as that varies and CDM_ARRAY_OPAQUE_TYPE,
         # could be many things.
         ITEM_SIZE = 8
+        ITEM_DTYPE = object
 
         if len(bounded_includes_list) > 0:
             ndarray_type = bounded_includes_list[0][0].GetLink('ndarray').type
+            ITEM_DTYPE = NDARRAY_DTYPES.get(ndarray_type.object_id, object)
             # @TODO: cmon, the in syntax doesn't use the correct __eq__ overload or whatever? this is silly.
             if ndarray_type.object_id in [CDM_ARRAY_INT32_TYPE.object_id, CDM_ARRAY_UINT32_TYPE.object_id, CDM_ARRAY_FLOAT32_TYPE.object_id]:
                 ITEM_SIZE = 4
@@ -1160,6 +1360,11 @@ class DataStoreWorkbench(WorkBench):
         striplist = []
         strides = [x.stride or 1 for x in request.request_bounds]
 
+        if numpy is not None:
+            get_slices = self._get_slices_array
+        else:
+            get_slices = self._get_slices
+
         for batuple in bounded_includes_list:
             ba, targetranges, srcranges = batuple
 
@@ -1171,7 +1376,7 @@ class DataStoreWorkbench(WorkBench):
                 # get dims of this bounded array
                 ba_shape = [x.size for x in ba.bounds]
 
-                for targetslice, srcslice, laststridelen in self._get_slices(targetshape, ba_shape, targetranges, srcranges, strides):
+                for targetslice, srcslice, laststridelen in get_slices(targetshape, ba_shape, targetranges, srcranges, strides):
                     striplist.append((ba, targetslice, srcslice, targetslice[1]-targetslice[0], laststridelen))
 
         log.debug("Number of uncompressed strips: %d" % len(striplist))
@@ -1312,8 +1517,26 @@ class DataStoreWorkbench(WorkBench):
         # create a least-recently-used cache for ndarrays, using 5mb as the default max size
         ndarray_cache = NDArrayLRUDict(LRU_DICT_LIMIT, repo)
 
+        # Chunks are sent in order, one after the other, while the next chunk is extracted. The window is the number of
+        # extracted chunks which may be waiting to be sent - the consumer may set it in the data window header.
+        window_size = self._extract_window
+        try:
+            window_size = max(int(headers.get(DATA_WINDOW_HEADER, window_size)), 1)
+        except (TypeError, ValueError):
+            log.warn('Ignoring the invalid data window header "%s" - the send window is %d chunks' % (headers.get(DATA_WINDOW_HEADER), window_size))
+        window = defer.DeferredSemaphore(window_size)
+        last_send = defer.succeed(None)
+
+        log.debug("Extraction plan has %d steps, send window is %d chunks" % (len(extraction_plan), window_size))
+
         try:
             for exidx, exstep in enumerate(extraction_plan):
+
+                # wait for a slot in the window - stop early if sending an earlier chunk failed
+                yield window.acquire()
+                if last_send.called:
+                    yield last_send
+
                 curstrips = []
                 for sidx in exstep:
                     curstrips.append(compressed_striplist[sidx])
@@ -1321,37 +1544,15 @@ class DataStoreWorkbench(WorkBench):
                 # get the start index.. should be in the first item
                 targetstartidx = curstrips[0][1][0]
 
-                # calculate number of elements we are going to output in this chunk, create temp storage for it
+                # calculate number of elements we are going to output in this chunk
                 elemcount = reduce(lambda x, y: x+y, [x[3] for x in curstrips])
-                targetndarray = [None] * elemcount
 
                 log.debug("Extraction step %d, # strips: %d, element count: %d, start index: %d" % (exidx, len(curstrips), elemcount, targetstartidx))
 
-                # ok, now we can perform the extractions on this step
-                targetoffset = 0
-                for curstrip in curstrips:
-                    ba, targetidxs, srcidxs, leng, stride = curstrip
-
-                    # get/possibly load from ndarray_cache
-                    ndobjval = yield ndarray_cache.get_ndarray_value(ba.GetLink('ndarray').key, ba.bounds, ITEM_SIZE, self._get_blobs)
-
-                    srcslice = ndobjval[srcidxs[0]:srcidxs[1]]
-                    if stride == 1:
-                        targetslice = srcslice
-                    else:
-                        targetslice = [d for i, d in enumerate(srcslice) if i % stride == 0]
-
-                    #log.debug("SETTING TNDARRAY[%d:%d]" % (targetoffset, targetoffset+leng))
-                    targetndarray[targetoffset:targetoffset+leng] = targetslice
-
-                    # add length to target offset
-                    targetoffset += leng
-
-                # ensure we filled this chunk
-                nonelist = [i for i,d in enumerate(targetndarray) if d is None]
-                if len(nonelist) > 0:
-                    log.error("extract_data: Nones found in targetndarray prior to send: %s" % str(nonelist))
-                    raise DataStoreWorkBenchError("Data extraction did not properly fill in all members of response ndarray!")
+                if numpy is not None:
+                    targetndarray = yield self._extract_chunk_array(ndarray_cache, curstrips, elemcount, ITEM_SIZE, ITEM_DTYPE)
+                else:
+                    targetndarray = yield self._extract_chunk_list(ndarray_cache, curstrips, elemcount, ITEM_SIZE)
 
                 # SEND THIS CHUNK
 
@@ -1369,11 +1570,14 @@ class DataStoreWorkbench(WorkBench):
 
                 # these lines blow up with a TypeError if we screwed up the bounds and didn't fill in the targetarray fully,
                 # aka it contains Nones
-                chunkndarray.value[0:elemcount] = targetndarray[:]
+                chunkndarray.value[0:elemcount] = targetndarray
                 chunkmsg.ndarray = chunkndarray
 
-                # send this message to the passed in routing key
-                yield self._send_data_chunk(request.data_routing_key, chunkmsg)
+                # send this message to the passed in routing key once the previous chunk is sent
+                last_send = self._queue_data_chunk(last_send, window, request.data_routing_key, chunkmsg)
+
+            yield last_send
+
         except Exception, ex:
             class FakeMsg(object):
                 pass
@@ -1386,6 +1590,86 @@ class DataStoreWorkbench(WorkBench):
         self._process.reply_ok(message, response)
         log.info("/op_extract_data")
         
+    @defer.inlineCallbacks
+    def _extract_chunk_list(self, ndarray_cache, curstrips, elemcount, itemsize):
+        """
+        Copies the strips of one extraction step into a python list. Used by extract_data when NumPy is not available.
+        """
+        targetndarray = [None] * elemcount
+
+        targetoffset = 0
+        for curstrip in curstrips:
+            ba, targetidxs, srcidxs, leng, stride = curstrip
+
+            # get/possibly load from ndarray_cache
+            ndobjval = yield ndarray_cache.get_ndarray_value(ba.GetLink('ndarray').key, ba.bounds, itemsize, self._get_blobs)
+
+            srcslice = ndobjval[srcidxs[0]:srcidxs[1]]
+            if stride == 1:
+                targetslice = srcslice
+            else:
+                targetslice = [d for i, d in enumerate(srcslice) if i % stride == 0]
+
+            #log.debug("SETTING TNDARRAY[%d:%d]" % (targetoffset, targetoffset+leng))
+            targetndarray[targetoffset:targetoffset+leng] = targetslice
+
+            # add length to target offset
+            targetoffset += leng
+
+        # ensure we filled this chunk
+        nonelist = [i for i,d in enumerate(targetndarray) if d is None]
+        if len(nonelist) > 0:
+            log.error("extract_data: Nones found in targetndarray prior to send: %s" % str(nonelist))
+            raise DataStoreWorkBenchError("Data extraction did not properly fill in all members of response ndarray!")
+
+        defer.returnValue(targetndarray)
+
+    @defer.inlineCallbacks
+    def _extract_chunk_array(self, ndarray_cache, curstrips, elemcount, itemsize, dtype):
+        """
+        Copies the strips of one extraction step into a preallocated NumPy array of the ndarray's type. Each strip is a
+        single strided slice assignment from the decoded source array. Used by extract_data when NumPy is available.
+
+        Returns the chunk as a list of python values, ready to be set in the chunk's ndarray.
+        """
+        targetndarray = numpy.empty(elemcount, dtype=dtype)
+
+        targetoffset = 0
+        for curstrip in curstrips:
+            ba, targetidxs, srcidxs, leng, stride = curstrip
+
+            # get/possibly load from ndarray_cache
+            ndarr = yield ndarray_cache.get_ndarray_array(ba.GetLink('ndarray').key, ba.bounds, itemsize, self._get_blobs, dtype)
+
+            srcslice = ndarr[srcidxs[0]:srcidxs[1]:stride]
+            if len(srcslice) != leng:
+                log.error("extract_data: strip of %d elements does not fit target range %d:%d" % (len(srcslice), targetoffset, targetoffset+leng))
+                raise DataStoreWorkBenchError("Data extraction did not properly fill in all members of response ndarray!")
+
+            targetndarray[targetoffset:targetoffset+leng] = srcslice
+
+            # add length to target offset
+            targetoffset += leng
+
+        # ensure we filled this chunk
+        if targetoffset != elemcount:
+            log.error("extract_data: filled %d of %d elements in targetndarray prior to send" % (targetoffset, elemcount))
+            raise DataStoreWorkBenchError("Data extraction did not properly fill in all members of response ndarray!")
+
+        defer.returnValue(targetndarray.tolist())
+
+    @defer.inlineCallbacks
+    def _queue_data_chunk(self, previous, window, data_routing_key, chunkmsg):
+        """
+        Sends a data chunk message (from op_extract_data) after the previous chunk has been sent, then releases its
+        slot in the send window. A failure to send a chunk fails all the chunks queued after it.
+        """
+        try:
+            yield previous
+            yield self._send_data_chunk(data_routing_key, chunkmsg)
+        finally:
+            window.release()
+
     @defer.inlineCallbacks
     def _send_data_chunk(self, data_routing_key, chunkmsg):
         """
@@ -1509,6 +1793,54 @@ class DataStoreWorkbench(WorkBench):
                           strides[:]):
             yield x
 
+    def _get_slices_array(self, targetdimextents, srcdimextents, targetranges, srcranges, strides):
+        """
+        Returns the same list of slice ranges as _get_slices, computed with NumPy. Rather than recursing through the
+        dimensions, the index offsets of all the strips are built one dimension at a time as an outer sum of the
+        offsets so far and the (stridden) indices in the next dimension.
+
+        See _get_slices for the parameters and the format of the returned tuples.
+        """
+
+        # make sure we have sane things here
+        assert len(targetdimextents) == len(srcdimextents)
+        assert len(strides) == len(targetdimextents)
+
+        ndims = len(targetdimextents)
+
+        # reduce target dim extents to extents after applying stride
+        striddentargetextents = [int(math.ceil(targetdimextents[i]/float(strides[i]))) for i in xrange(ndims)]
+
+        # current target and source sums (index offsets) for every strip
+        cts = numpy.zeros(1, dtype='int64')
+        css = numpy.zeros(1, dtype='int64')
+
+        for dim in xrange(ndims - 1):
+            targetidxextent = reduce(lambda x,y: x*y, striddentargetextents[dim+1:])
+            srcidxextent = reduce(lambda x,y: x*y, srcdimextents[dim+1:])
+
+            # co-iterate the target and source ranges, dropping target indices which are strided out
+            length = max(min(targetranges[dim][1] - targetranges[dim][0], srcranges[dim][1] - srcranges[dim][0]), 0)
+            tv = numpy.arange(targetranges[dim][0], targetranges[dim][0] + length, dtype='int64')
+            sv = numpy.arange(srcranges[dim][0], srcranges[dim][0] + length, dtype='int64')
+
+            keep = tv % strides[dim] == 0
+            tv = tv[keep]
+            sv = sv[keep]
+
+            cts = numpy.add.outer(cts, tv * targetidxextent).ravel()
+            css = numpy.add.outer(css, sv * srcidxextent).ravel()
+
+        # the last dimension - the target range has striding applied, the source range does not
+        ts = targetranges[-1]
+        ss = srcranges[-1]
+        laststride = strides[-1]
+
+        tstart = numpy.ceil(cts + ts[0]/float(laststride)).astype('int64')
+        tend = numpy.ceil(cts + ts[1]/float(laststride)).astype('int64')
+
+        return [((t0, t1), (s0 + ss[0], s0 + ss[1]), laststride) for t0, t1, s0 in zip(tstart.tolist(), tend.tolist(), css.tolist())]
+
     @defer.inlineCallbacks
     def op_get_object(self, request, headers, message):
         log.info('op_get_object')
@@ -1625,6 +1957,11 @@ class DataStoreService(ServiceProcess):
         self._backend_cls_names[BLOB_CACHE] = self.spawn_args.get(BLOB_CACHE, CONF.getValue(BLOB_CACHE, default='ion.core.data.store.Store'))
 
         self._cache_size = self.spawn_args.get('cache_size', CONF.getValue('cache_size', default=10**8))
+        self._blob_batch_size = self.spawn_args.get('blob_batch_size', CONF.getValue('blob_batch_size', default=1000))
+        self._write_batch_rows = self.spawn_args.get('write_batch_rows', CONF.getValue('write_batch_rows', default=500))
+        self._write_batch_bytes = self.spawn_args.get('write_batch_bytes', CONF.getValue('write_batch_bytes', default=4*1024*1024))
+        self._write_batches_in_flight = self.spawn_args.get('write_batches_in_flight', CONF.getValue('write_batches_in_flight', default=4))
+        self._extract_window = self.spawn_args.get('extract_window', CONF.getValue('extract_window', default=4))
 
         self._backend_classes={}
 
@@ -1722,7 +2059,12 @@ class DataStoreService(ServiceProcess):
         log.info("Created stores")
 
         # Create a specialized workbench for the datastore which has a persistent back end.
-        self.workbench = DataStoreWorkbench(self, self.b_store, self.c_store, cache_size=self._cache_size)
+        self.workbench = DataStoreWorkbench(self, self.b_store, self.c_store, cache_size=self._cache_size,
+                                            blob_batch_size=self._blob_batch_size,
+                                            write_batch_rows=self._write_batch_rows,
+                                            write_batch_bytes=self._write_batch_bytes,
+                                            write_batches_in_flight=self._write_batches_in_flight,
+                                            extract_window=self._extract_window)
 
         # Replace the existing message client in the procss with a new one - that uses the new workbench
         # Not doing this was the source of a huge memory leak!
@@ -2106,10 +2448,17 @@ class DataStoreClient(ServiceClient):
         defer.returnValue(content)
 
     @defer.inlineCallbacks
-    def extract_data(self, content):
+    def extract_data(self, content, window=None):
+        """
+        @param window   Optional number of extracted chunks the datastore may have waiting to be sent at one time.
+        """
         yield self._check_init()
 
-        (content, headers, msg) = yield self.rpc_send('extract_data', content)
+        headers = {}
+        if window is not None:
+            headers[DATA_WINDOW_HEADER] = str(window)
+
+        (content, headers, msg) = yield self.rpc_send('extract_data', content, headers=headers)
         defer.returnValue(content)
 
 #    @defer.inlineCallbacks
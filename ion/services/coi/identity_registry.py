@@ -34,7 +34,8 @@ from ion.core.intercept.policy import subject_has_admin_role, \
                                       subject_has_marine_operator_role, \
                                       map_ooi_id_to_subject_marine_operator_role, \
                                       map_ooi_id_to_role, unmap_ooi_id_from_role, \
-                                      get_current_roles, all_roles, load_roles_from_associations
+                                      get_current_roles, all_roles, load_roles_from_associations, \
+                                      invalidate_owner_decisions, broadcast_name
 
 from ion.services.coi.datastore_bootstrap.ion_preload_config \
     import IDENTITY_RESOURCE_TYPE_ID, TYPE_OF_ID, HAS_ROLE_ID, ROLE_NAMES_BY_ID, ROLE_IDS_BY_NAME
@@ -116,8 +117,6 @@ message ResourceConfigurationResponse{
 }
 """
 
-broadcast_name = 'identity_registry_broadcast'
-
 @defer.inlineCallbacks
 def get_broadcast_receiver(receive, receive_error):
     bcr = FanoutReceiver(name=broadcast_name, scope=FanoutReceiver.SCOPE_SYSTEM,
@@ -627,6 +626,8 @@ class IdentityRegistryService(ServiceProcess):
                 map_ooi_id_to_role(content['user-id'], content['role'])
             elif op == 'unset_user_role':
                 unmap_ooi_id_from_role(content['user-id'], content['role'])
+            elif op == 'owner_changed':
+                invalidate_owner_decisions(content['resource-ids'])
 
     @defer.inlineCallbacks
     def _findUser(self, Subject):
@@ -15,7 +15,7 @@ from ion.core.object.object_utils import ARRAY_STRUCTURE_TYPE, CDM_ARRAY_FLOAT64
 import ion.util.ionlog
 
 log = ion.util.ionlog.getLogger(__name__)
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 
 from ion.core import ioninit
 CONF = ioninit.config(__name__)
@@ -34,7 +34,9 @@ from ion.core.data.storage_configuration_utility import BLOB_CACHE, COMMIT_CACHE
 
 from telephus.cassandra.ttypes import InvalidRequestException
 
-from ion.services.coi.datastore import ION_DATASETS_CFG, PRELOAD_CFG, ID_CFG, DataStoreClient, CDM_BOUNDED_ARRAY_TYPE
+from ion.services.coi.datastore import ION_DATASETS_CFG, PRELOAD_CFG, ID_CFG, DataStoreClient, CDM_BOUNDED_ARRAY_TYPE, WriteBehindQueue, DataStoreWorkbench
+from ion.services.coi import datastore
+from ion.core.data import store
 # Pick three to test existence
 from ion.services.coi.datastore_bootstrap.ion_preload_config import HAS_A_ID, DATASET_RESOURCE_TYPE_ID, ROOT_USER_ID, NAME_CFG, CONTENT_ARGS_CFG, PREDICATE_CFG, ION_RESOURCE_TYPES_CFG, ION_PREDICATES_CFG, ION_IDENTITIES_CFG, SAMPLE_PROFILE_DATA_SOURCE_ID
 
@@ -1346,6 +1348,51 @@ class DataStoreExtractDataTest(IonTestCase):
                 self.failUnlessEqual(int(data), counter)
                 counter += 1
         
+    @defer.inlineCallbacks
+    def test_full_one_ba_window(self):
+
+        # patch the send so each chunk takes a while to go out - the next chunks are extracted in the mean time
+        fake_send_chunk = self.ds1.workbench._send_data_chunk
+        def slow_send_chunk(data_routing_key, chunkmsg):
+            d = defer.Deferred()
+            d.addCallback(lambda _: fake_send_chunk(data_routing_key, chunkmsg))
+            reactor.callLater(0.01, d.callback, None)
+            return d
+
+        self.ds1.workbench._send_data_chunk = slow_send_chunk
+
+        msg = yield self.dsc.proc.message_client.create_instance(DATA_REQUEST_MESSAGE_TYPE)
+        msg.structure_array_ref = self.first_struct_as_key
+
+        bounds = msg.request_bounds.add()
+        bounds.origin = 0
+        bounds.size = 15
+
+        bounds = msg.request_bounds.add()
+        bounds.origin = 0
+        bounds.size = 40
+
+        bounds = msg.request_bounds.add()
+        bounds.origin = 0
+        bounds.size = 200
+
+        msg.data_routing_key = "data_listener"
+
+        yield self.dsc.extract_data(msg, window=2)
+        yield self._def_done
+
+        # the chunks must still arrive in order
+        self.failUnlessEquals([x['seq_number'] for x in self._recv_data], range(len(self._recv_data)))
+
+        totalelems = reduce(lambda x, y: x+y, (len(x['ndarray']) for x in self._recv_data))
+        self.failUnlessEquals(totalelems, 200*40*15)
+
+        counter = 0
+        for ndarray in (x['ndarray'] for x in self._recv_data):
+            for data in ndarray:
+                self.failUnlessEqual(int(data), counter)
+                counter += 1
+
     @defer.inlineCallbacks
     def test_partial_one_ba(self):
         msg = yield self.dsc.proc.message_client.create_instance(DATA_REQUEST_MESSAGE_TYPE)
@@ -1581,3 +1628,95 @@ class DataStoreExtractDataTest(IonTestCase):
         # now the next index in our returned array
         nextidx = 10 * 10
         self.failUnlessEquals(int(bigndarray[nextidx]), nextval)
+
+
+
+class WriteBehindQueueTest(unittest.TestCase):
+    """
+    Test the batching of the datastore write behind queue against the in memory store
+    """
+
+    def setUp(self):
+        store.Store.kvs.clear()
+        self.backend = store.Store()
+
+        self.batches = []
+        put_many = self.backend.put_many
+        def counting_put_many(items):
+            self.batches.append(len(items))
+            return put_many(items)
+        self.backend.put_many = counting_put_many
+
+    def tearDown(self):
+        store.Store.kvs.clear()
+
+    @defer.inlineCallbacks
+    def test_batch_by_rows(self):
+
+        queue = WriteBehindQueue(self.backend, max_batch_rows=3, max_batch_bytes=10**6, max_in_flight=1)
+        for i in range(7):
+            yield queue.put('key%d' % i, 'value')
+
+        # Only the full batches are sent before the flush
+        self.assertEqual(self.batches, [3,3])
+
+        failures = yield queue.flush()
+        self.assertEqual(failures, [])
+        self.assertEqual(self.batches, [3,3,1])
+        self.assertEqual(len(store.Store.kvs), 7)
+
+    @defer.inlineCallbacks
+    def test_batch_by_bytes(self):
+
+        queue = WriteBehindQueue(self.backend, max_batch_rows=100, max_batch_bytes=10, max_in_flight=2)
+        for i in range(7):
+            yield queue.put('key%d' % i, 'sixsix')
+
+        failures = yield queue.flush()
+        self.assertEqual(failures, [])
+        self.assertEqual(self.batches, [2,2,2,1])
+        self.assertEqual(store.Store.kvs['key6'], 'sixsix')
+
+    @defer.inlineCallbacks
+    def test_flush_failure(self):
+
+        def failing_put_many(items):
+            return defer.fail(RuntimeError('Backend is down'))
+        self.backend.put_many = failing_put_many
+
+        queue = WriteBehindQueue(self.backend, max_batch_rows=2)
+        for i in range(3):
+            yield queue.put('key%d' % i, 'value')
+
+        failures = yield queue.flush()
+        self.assertEqual(len(failures), 2)
+        self.assertEqual(failures[0][0], ['key0','key1'])
+        self.assertEqual(failures[1][0], ['key2'])
+        self.assertEqual(len(store.Store.kvs), 0)
+
+
+class ExtractSlicesTest(unittest.TestCase):
+    """
+    Test that the NumPy strip computation used by extract_data matches the recursive generator
+    """
+
+    def setUp(self):
+        if datastore.numpy is None:
+            raise unittest.SkipTest('NumPy is not installed')
+
+        self.wb = DataStoreWorkbench('No Process Test', None, None)
+
+    def _assert_same_slices(self, targetshape, srcshape, targetranges, srcranges, strides):
+        expected = list(self.wb._get_slices(targetshape, srcshape, targetranges, srcranges, strides))
+        result = self.wb._get_slices_array(targetshape, srcshape, targetranges, srcranges, strides)
+        self.assertEqual(result, expected)
+
+    def test_one_dimension(self):
+        self._assert_same_slices([100], [200], [(0, 100)], [(50, 150)], [1])
+        self._assert_same_slices([100], [200], [(0, 100)], [(50, 150)], [10])
+
+    def test_full_three_dimensions(self):
+        self._assert_same_slices([15, 40, 200], [15, 40, 200], [(0, 15), (0, 40), (0, 200)], [(0, 15), (0, 40), (0, 200)], [1, 1, 1])
+
+    def test_partial_strided_three_dimensions(self):
+        self._assert_same_slices([3, 10, 100], [15, 40, 200], [(0, 3), (2, 10), (0, 100)], [(2, 5), (0, 8), (50, 150)], [2, 3, 10])
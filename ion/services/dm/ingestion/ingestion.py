@@ -45,6 +45,15 @@ from ion.core import ioninit
 from ion.core.object import object_utils, gpb_wrapper
 
 import logging
+import bisect
+from ion.util.cache import LRUDict
+
+# NumPy is optional - without it the time index is searched with bisect over python lists
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 CONF = ioninit.config(__name__)
 log = ion.util.ionlog.getLogger(__name__)
 
@@ -102,6 +111,105 @@ EM_TIMESTEPS    = 'number_of_timesteps'
 EM_ERROR        = 'error_explanation'
 
 
+class TimeIndex(object):
+    """
+    The values of a time variable in index order, for finding where times lay among them.  The running maximum of
+    the values is kept, so the first value above a time is found by binary search - with numpy searchsorted when
+    NumPy is available - even where the values are not monotonic.
+    """
+
+    def __init__(self, arrays):
+        """
+        @param arrays: A list of (origin, values) tuples for the bounded arrays of the time variable, the values as
+                       returned by TimeIndex.decode.  Values repeated by more than one bounded array are all kept,
+                       each at its own index.
+        """
+        if numpy is not None:
+            if arrays:
+                indices = numpy.concatenate([numpy.arange(origin, origin + len(values)) for origin, values in arrays])
+                values = numpy.concatenate([values for origin, values in arrays])
+            else:
+                indices = numpy.zeros(0, dtype=int)
+                values = numpy.zeros(0)
+
+            # Order by index then value, as sorting the (index, value) tuples does
+            order = numpy.lexsort((values, indices))
+            self.indices = indices[order]
+            self.values = values[order]
+
+            # NaN values are never found - skip them in the running maximum
+            running_max = numpy.fmax.accumulate(self.values)
+            running_max[numpy.isnan(running_max)] = -numpy.inf
+            self.running_max = running_max
+
+        else:
+            pairs = []
+            for origin, values in arrays:
+                pairs.extend(zip(xrange(origin, origin + len(values)), values))
+            pairs.sort()
+            self.indices = [idx for idx, val in pairs]
+            self.values = [val for idx, val in pairs]
+
+            running_max = []
+            current = float('-inf')
+            for val in self.values:
+                if val > current:
+                    current = val
+                running_max.append(current)
+            self.running_max = running_max
+
+    def __len__(self):
+        return len(self.values)
+
+    @classmethod
+    def decode(cls, values):
+        """
+        Copy the values of an ndarray for a TimeIndex.
+        """
+        if numpy is not None:
+            return numpy.fromiter(values, dtype=float, count=len(values))
+        return list(values)
+
+    def find(self, search_times, threshold):
+        """
+        Find where each of the search_times lays among the values.  Returns a dict from each search time to:
+          - the index of the first value within threshold of it, or
+          - -(i + 1), where i is the position of the first value greater than it, or
+          - -(n + 1), when it is not below any of the n values.
+        These are the results of a linear search through the values in index order.
+        """
+        results = {}
+        count = len(self.values)
+        if numpy is not None:
+            positions = self.running_max.searchsorted(numpy.array(search_times, dtype=float) - threshold, side='right')
+        else:
+            positions = [bisect.bisect_right(self.running_max, search_time - threshold) for search_time in search_times]
+
+        for search_time, position in zip(search_times, positions):
+            position = int(position)
+            if position == count:
+                results[search_time] = -(count + 1)
+            elif abs(self.values[position] - search_time) < threshold:
+                results[search_time] = int(self.indices[position])
+            else:
+                results[search_time] = -(position + 1)
+
+        return results
+
+
+class TimeValues(object):
+    """
+    The decoded values of a time ndarray in the time values cache, which is limited by the number of values it holds
+    """
+    __slots__ = ('values',)
+
+    def __init__(self, values):
+        self.values = values
+
+    def __sizeof__(self):
+        return len(self.values)
+
+
 
 
 class IngestionService(ServiceProcess):
@@ -143,6 +251,10 @@ class IngestionService(ServiceProcess):
 
         self._ingestion_terminating = False
 
+        # Time indexes by the bounded arrays of the time variable, and the time values by ndarray key
+        self._time_index_cache = LRUDict(CONF.getValue('time_index_cache_size', 4))
+        self._time_values_cache = LRUDict(CONF.getValue('time_values_cache_elements', 1000000), use_size=True)
+
         self._ingestion_processing_publisher = IngestionProcessingEventPublisher(process=self)
         self.add_life_cycle_object(self._ingestion_processing_publisher)        # will move through lifecycle states as appropriate
 
@@ -1689,37 +1801,6 @@ class IngestionService(ServiceProcess):
             results.append(ba.GetLink('ndarray').key)
         return results
     
-    @classmethod
-    def _get_ndarray_vals(cls, time_variable):
-        """
-        @Brief: Retrieves all the values of all the bounded arrays in the given time_variable
-        @return: A sorted list of tuples containing the values index followed by the value at that index.
-                 Since a variable's bounded array's may contain duplicate data, this array may contain
-                 tuples which specify the same first value.  When this is the case, it is useful to
-                 ensure that the two values specified at the same index match, otherwise the variable
-                 is corrupt.  NOTE: This validation is NOT accomplished by this method.
-                 
-        @note: This method will not yet work on multidimensional variables (more than one item in the
-               bounded array's list of bounds).  This is because iteration over such a structure is
-               quite complicated and currently unnessary since this method is only used for time
-               variables (true time coordinate variables will only ever have one dimension -- time)
-               
-        @note: This method assumes all blobs for the components of the given time_variable (bounded_arrays,
-               ndarrays, etc) have been fetched.  If they have not it will fail with a KeyError.
-        """
-        results = []
-        for ba in time_variable.content.bounded_arrays:
-            if len(ba.bounds) > 1:
-                raise IngestionException('_get_ndarray_vals does not support enflating bounded arrays with more than one dimension -- yet')
-            origin = ba.bounds[0].origin
-            for i in range(len(ba.ndarray.value)):
-                val = ba.ndarray.value[i]
-                idx = origin + i
-                results.append((idx, val))
-        results.sort()
-        return results
-
-
     @defer.inlineCallbacks
     def _fetch_blobs(self, repo, fetch_keys):
         """
@@ -1770,68 +1851,59 @@ class IngestionService(ServiceProcess):
     @defer.inlineCallbacks
     def _find_time_index(self, time_var, search_times, THRESHOLD = 0.001):
         """
-        @todo: Add documentation about what negative value returns mean
+        Find where each of the search_times lays in the values of the given time variable.
+        @return: A dict from each search time to the index of the first value (in index order) within THRESHOLD of
+                 it; or if there is none, -(i + 1) where i is the position of the first value greater than the search
+                 time; or -(n + 1) when the search time is not below any of the n values.
         """
-        search_times_cpy = search_times[:]  # copy the search_times list so we can remove values
-        # Step 1: Get a handle to an array of values from the given time variable
-        # Step 1a: Gather a list of keys for blobs which need to be fetched             
-        
-        log.debug('Gathering a list of keys for blobs which need to be fetched...')
-        need_keys = IngestionService._get_ndarray_keys(time_var)
-        if log.getEffectiveLevel() <= logging.DEBUG:
-            log.debug('>>  (ndarray) need_keys = %s' % str(need_keys))
-        
-        # Step 1b: Fetch all blobs for the ndarrays in the time_var
-        log.debug('Fetching all blobs for the ndarrays in the supplement...')
-        repo = self.dataset.Repository
-        yield self._fetch_blobs(repo, need_keys)
+        time_index = yield self._get_time_index(time_var)
 
-        # Step 1c: Now, grab all the array values from the ndarrays..
-        log.debug('Grabbing all the array values from the ndarrays...')
-        values = IngestionService._get_ndarray_vals(time_var)
-        if log.getEffectiveLevel() <= logging.DEBUG:
-            log.debug('>>  ndarray values = %s' % str(values))
+        log.debug('Searching for values "%s" in the time index' % str(search_times))
+        results_dict = time_index.find(search_times, THRESHOLD)
 
+        defer.returnValue(results_dict)
 
-        # Step 2: Perform a linear search in the values array for each time in search_times
-        #         a) Binary search will most likely be performed nearer worse case (logN time) - since the
-        #            overlapping region should (on average) be fairly small
-        #            * Linear search may be optimal for average case
-        #            ** Linear search is "required" when indexing into the current data (rather than the
-        #               supplement) because we must traverse multiple bounded arrays
-        
-        
-        # Step 2a: Perform the linear search to see where in the set of values our search_times lay
-        log.debug('Searching for values "%s" in ndarray list' % str(search_times_cpy))
-        results_dict = {}
-        for i in range(len(values)):
-            idx, val = values[i]
-            # @note: this is a good place to check if two entries in the time variables bounded_arrays
-            #        contain mismatched values for the same index -- this shouldn't happen however
-            for search_time in search_times_cpy:
-                if val is search_time or abs(val - search_time) < THRESHOLD: # TODO: should change this to using some sort of near-match function
-                    results_dict[search_time] = idx
-                    search_times_cpy.remove(search_time)
-                elif search_time < val:
-                    results_dict[search_time] = -(i + 1)
-                    search_times_cpy.remove(search_time)
-                # else search_time > val: continue
-            if len(search_times_cpy) == 0:
-                break; 
-                
-        if len(search_times_cpy) > 0:
-            not_in_list_val = -(len(values) + 1)
-            for search_time in search_times_cpy:
-                results_dict[search_time] = not_in_list_val
-        # don't use the copy of the list after this point -- structure is indeterminant
-        search_times_cpy = None
-                
-            
-        # Step 2b: @todo: Make sure that we aren't experiencing a roundoff issue by checking how close
-        #           our search_start is to the values before and after it in the list (floats only)
-         
 
-        defer.returnValue(results_dict)
+    @defer.inlineCallbacks
+    def _get_time_index(self, time_var):
+        """
+        Get a TimeIndex of the values of the given time variable.  The index is cached by the origins and ndarray keys
+        of the variable's bounded arrays - which are fixed by a commit of the dataset - and the values of each ndarray
+        are cached as well, so only the ndarrays added since the last supplement are fetched and decoded.
+        """
+        bounded_arrays = []
+        for ba in time_var.content.bounded_arrays:
+            if len(ba.bounds) > 1:
+                raise IngestionError('_find_time_index does not support bounded arrays with more than one dimension -- yet')
+            bounded_arrays.append((ba.bounds[0].origin, ba.GetLink('ndarray').key, ba))
+
+        index_key = tuple([(origin, key) for origin, key, ba in bounded_arrays])
+        if index_key in self._time_index_cache:
+            defer.returnValue(self._time_index_cache[index_key])
+
+        values_by_key = {}
+        for origin, key, ba in bounded_arrays:
+            if key in self._time_values_cache:
+                values_by_key[key] = self._time_values_cache[key].values
+
+        # Fetch the blobs of the ndarrays which are not cached yet
+        need_keys = [key for origin, key, ba in bounded_arrays if key not in values_by_key]
+        if log.getEffectiveLevel() <= logging.DEBUG:
+            log.debug('>>  (ndarray) need_keys = %s' % str(need_keys))
+        yield self._fetch_blobs(self.dataset.Repository, need_keys)
+
+        arrays = []
+        for origin, key, ba in bounded_arrays:
+            values = values_by_key.get(key)
+            if values is None:
+                values = TimeIndex.decode(ba.ndarray.value)
+                self._time_values_cache[key] = TimeValues(values)
+                values_by_key[key] = values
+            arrays.append((origin, values))
+
+        time_index = TimeIndex(arrays)
+        self._time_index_cache[index_key] = time_index
+        defer.returnValue(time_index)
 
 
     @defer.inlineCallbacks
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""
+@file ion/services/dm/ingestion/test/benchmark_time_index.py
+@brief Benchmark the merge offset time lookups of ingestion against the length of the time series, with the
+    linear search ingestion used before the time index and with a cold and a cached time index.
+@test Time index benchmark - not run as part of the unit tests
+"""
+
+import time
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.trial import unittest
+
+from ion.services.dm.ingestion.ingestion import TimeIndex
+
+
+def legacy_find_time_index(arrays, search_times, THRESHOLD = 0.001):
+    """
+    The time lookup of IngestionService._find_time_index before the time index: sort the (index, value) tuples of
+    all the bounded arrays and search them linearly.
+    """
+    search_times_cpy = search_times[:]
+    values = []
+    for origin, array in arrays:
+        for i in range(len(array)):
+            values.append((origin + i, array[i]))
+    values.sort()
+
+    results_dict = {}
+    for i in range(len(values)):
+        idx, val = values[i]
+        for search_time in search_times_cpy:
+            if val is search_time or abs(val - search_time) < THRESHOLD:
+                results_dict[search_time] = idx
+                search_times_cpy.remove(search_time)
+            elif search_time < val:
+                results_dict[search_time] = -(i + 1)
+                search_times_cpy.remove(search_time)
+        if len(search_times_cpy) == 0:
+            break
+
+    for search_time in search_times_cpy:
+        results_dict[search_time] = -(len(values) + 1)
+    return results_dict
+
+
+class TimeIndexBenchmark(unittest.TestCase):
+
+    series_lengths = [1000, 10000, 100000, 1000000]
+
+    # Time steps per bounded array, as added by one supplement
+    supplement_length = 1000
+
+    timeout = 600
+
+    def test_merge_offset_latency(self):
+        results = []
+        for length in self.series_lengths:
+            # Hourly time steps; the supplement overwrites the last day
+            arrays = []
+            for origin in range(0, length, self.supplement_length):
+                arrays.append((origin, [float(h) for h in range(origin, min(origin + self.supplement_length, length))]))
+            search_times = [float(length - 24), float(length + 24)]
+
+            t1 = time.time()
+            expected = legacy_find_time_index(arrays, search_times)
+            t2 = time.time()
+            time_index = TimeIndex([(origin, TimeIndex.decode(array)) for origin, array in arrays])
+            cold = time_index.find(search_times, 0.001)
+            t3 = time.time()
+            warm = time_index.find(search_times, 0.001)
+            t4 = time.time()
+
+            self.assertEqual(cold, expected)
+            self.assertEqual(warm, expected)
+            results.append((length, (t2 - t1) * 1000, (t3 - t2) * 1000, (t4 - t3) * 1000))
+
+        output = '\nTime steps | Linear search ms | Cold time index ms | Cached time index ms\n'
+        for result in results:
+            output += '%10d | %16.2f | %18.2f | %20.3f\n' % result
+
+        log.info(output)
@@ -25,7 +25,8 @@ from ion.services.coi.datastore_bootstrap.ion_preload_config import PRELOAD_CFG,
 from ion.services.dm.distribution.events import DatasourceUnavailableEventSubscriber, DatasetSupplementAddedEventSubscriber, DATASET_STREAMING_EVENT_ID, get_events_exchange_point
 
 from ion.core.process import process
-from ion.services.dm.ingestion.ingestion import IngestionClient, IngestionError, SUPPLEMENT_MSG_TYPE, CDM_DATASET_TYPE, DAQ_COMPLETE_MSG_TYPE, PERFORM_INGEST_MSG_TYPE, CREATE_DATASET_TOPICS_MSG_TYPE, EM_URL, EM_ERROR, EM_TITLE, EM_DATASET, EM_END_DATE, EM_START_DATE, EM_TIMESTEPS, EM_DATA_SOURCE, CDM_BOUNDED_ARRAY_TYPE 
+from ion.services.dm.ingestion import ingestion
+from ion.services.dm.ingestion.ingestion import TimeIndex, IngestionClient, IngestionError, SUPPLEMENT_MSG_TYPE, CDM_DATASET_TYPE, DAQ_COMPLETE_MSG_TYPE, PERFORM_INGEST_MSG_TYPE, CREATE_DATASET_TOPICS_MSG_TYPE, EM_URL, EM_ERROR, EM_TITLE, EM_DATASET, EM_END_DATE, EM_START_DATE, EM_TIMESTEPS, EM_DATA_SOURCE, CDM_BOUNDED_ARRAY_TYPE 
 from ion.test.iontest import IonTestCase
 
 from ion.services.coi.datastore_bootstrap.dataset_bootstrap import bootstrap_profile_dataset, BOUNDED_ARRAY_TYPE, FLOAT32ARRAY_TYPE, bootstrap_byte_array_dataset
@@ -333,6 +334,42 @@ class IngestionTest(IonTestCase):
 
 
 
+    @defer.inlineCallbacks
+    def test_get_time_index_cached(self):
+        """
+        A second lookup of the time index of the same bounded arrays fetches no blobs and reuses the index
+        """
+        content = yield self.ingest.mc.create_instance(PERFORM_INGEST_MSG_TYPE)
+        content.dataset_id = SAMPLE_PROFILE_DATASET_ID
+        content.datasource_id = SAMPLE_PROFILE_DATA_SOURCE_ID
+
+        yield self.ingest._prepare_ingest(content)
+        self.ingest.timeoutcb = create_delayed_call()
+
+        fetched = []
+        fetch_blobs = self.ingest._fetch_blobs
+        def _fetch_blobs(repo, fetch_keys):
+            fetched.append(list(fetch_keys))
+            return fetch_blobs(repo, fetch_keys)
+        self.patch(self.ingest, '_fetch_blobs', _fetch_blobs)
+
+        time_var = self.ingest.dataset.root_group.FindVariableByName('time')
+
+        time_index = yield self.ingest._get_time_index(time_var)
+        self.assertEqual(len(fetched), 1)
+        self.assertTrue(len(time_index) > 0)
+
+        again = yield self.ingest._get_time_index(time_var)
+        self.assertEqual(len(fetched), 1)
+        self.assertIdentical(again, time_index)
+
+        # Without the index the cached values are used - no blobs are needed
+        self.ingest._time_index_cache.clear()
+        rebuilt = yield self.ingest._get_time_index(time_var)
+        self.assertEqual(fetched[1:], [[]])
+        self.assertEqual(list(rebuilt.values), list(time_index.values))
+
+
     @defer.inlineCallbacks
     def test_recv_chunk(self):
         """
@@ -1293,3 +1330,66 @@ class IngestionTest(IonTestCase):
         for x in xrange(100):
             self.failUnlessApproximates(x/10.0, var.GetValue(x), 0.01)  # precision may be an issue here?
             log.debug("Value %d: %f" % (x, var.GetValue(x)))
+
+
+def linear_find_time_index(arrays, search_times, threshold):
+    """
+    Where the search times lay in the values of the arrays, searching the values linearly in index order.
+    """
+    values = []
+    for origin, array in arrays:
+        values.extend(zip(range(origin, origin + len(array)), array))
+    values.sort()
+
+    results = {}
+    for search_time in search_times:
+        results[search_time] = -(len(values) + 1)
+        for i in range(len(values)):
+            idx, val = values[i]
+            if abs(val - search_time) < threshold:
+                results[search_time] = idx
+                break
+            elif search_time < val:
+                results[search_time] = -(i + 1)
+                break
+    return results
+
+
+class TimeIndexTest(unittest.TestCase):
+
+    def _check(self, arrays, search_times, threshold=0.001):
+        time_index = TimeIndex([(origin, TimeIndex.decode(array)) for origin, array in arrays])
+        self.assertEqual(time_index.find(search_times, threshold),
+                         linear_find_time_index(arrays, search_times, threshold))
+
+    def _check_all(self):
+        hours = [float(h) for h in range(0, 240, 3)]
+        # Bounded arrays out of order, overlapping at index 40
+        arrays = [(40, hours[40:]), (0, hours[:41])]
+        search_times = [-3.0, 0.0, 1.5, 60.0, 60.0005, 119.999, 120.0, 124.0, 237.0, 240.0, 1000.0]
+        for search_time in search_times:
+            self._check(arrays, [search_time])
+        self._check(arrays, search_times)
+        self._check(arrays, [])
+        self._check([], [0.0, 5.0])
+
+        # Not monotonic, with a value that is not a number
+        self._check([(0, [0.0, 5.0, 3.0, float('nan'), 4.0, 9.0, 7.0])],
+                    [-1.0, 3.0, 4.0, 4.5, 5.0, 6.0, 7.0, 9.0, 10.0])
+
+        rand = random.Random(25)
+        for i in range(20):
+            array = [rand.choice([0.0, 0.5, 1.0, 2.0]) for j in range(rand.randint(1, 30))]
+            for j in range(1, len(array)):
+                array[j] += array[j - 1]
+            search_times = [rand.uniform(-1.0, array[-1] + 1.0) for j in range(3)] + array[:3]
+            self._check([(0, array)], search_times, threshold=0.25)
+
+    def test_find(self):
+        if ingestion.numpy is None:
+            raise unittest.SkipTest('NumPy is not available')
+        self._check_all()
+
+    def test_find_without_numpy(self):
+        self.patch(ingestion, 'numpy', None)
+        self._check_all()
@@ -7,6 +7,9 @@
 @brief A service to provide indexing and search capability of objects in the datastore
 """
 
+import time
+import weakref
+
 import ion.util.ionlog
 from net.ooici.core.message.ion_message_pb2 import BAD_REQUEST
 
@@ -14,8 +17,10 @@ log = ion.util.ionlog.getLogger(__name__)
 from twisted.internet import defer
 
 from ion.core.exception import ApplicationError
+from ion.core.messaging.receiver import FanoutReceiver
 
 import ion.util.procutils as pu
+from ion.util.cache import LRUDict
 from ion.core.process.process import ProcessFactory
 from ion.core.process.service_process import ServiceProcess, ServiceClient
 
@@ -57,6 +62,135 @@ class AssociationServiceError(ApplicationError):
     """
 
 
+class AssociationGraphIndex(object):
+    """
+    An in process index of the association graph, so that searches by association do not go back to the index
+    store for every association they find:
+        the head branch names of each repository - subject key -> heads
+        the subjects of the current associations with each predicate object pair - (predicate, object) -> subjects
+
+    Entries are filled from the index store on a miss and held in bounded LRU dicts for at most ttl seconds. The
+    entries for the repositories changed by each push are dropped before the datastore replies - in the indices of
+    this container directly and in other containers by a broadcast. A max_size of 0 turns the index off.
+    """
+
+    def __init__(self, max_size=10000, ttl=60, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+
+        # repository key -> (time, tuple of the branch names of its head commits)
+        self._heads = LRUDict(max_size)
+
+        # (predicate key, object key) -> (time, tuple of (association key, subject key, subject branch))
+        self._subjects = LRUDict(max_size)
+
+        # association key -> set of the predicate object pairs it was found in
+        self._pairs_by_association = {}
+        self._max_associations = 10 * max_size
+
+        # Bumped by every change - an entry read from the index store before a change is not kept
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_heads(self, repository_key):
+        """
+        @retval the tuple of head branch names of the repository, or None if it is not in the index
+        """
+        return self._get(self._heads, repository_key)
+
+    def put_heads(self, repository_key, branches, generation):
+        if self.max_size > 0 and generation == self.generation:
+            self._heads[repository_key] = (self.clock(), tuple(branches))
+
+    def get_subjects(self, predicate_key, object_key):
+        """
+        @retval the tuple of (association key, subject key, subject branch) for the current associations with the
+        predicate and object, or None if the pair is not in the index
+        """
+        return self._get(self._subjects, (predicate_key, object_key))
+
+    def put_subjects(self, predicate_key, object_key, associations, generation):
+        if self.max_size <= 0 or generation != self.generation:
+            return
+
+        if len(self._pairs_by_association) > self._max_associations:
+            # Do not let the map for invalidation grow without bound - start over
+            self._subjects.clear()
+            self._pairs_by_association.clear()
+
+        pair = (predicate_key, object_key)
+        self._subjects[pair] = (self.clock(), tuple(associations))
+        for association in associations:
+            self._pairs_by_association.setdefault(association[0], set()).add(pair)
+
+    def invalidate(self, repository_keys, pairs=()):
+        """
+        @brief Drop the entries for repositories which have new commits
+        @param repository_keys the keys of the repositories changed - subjects or associations
+        @param pairs the (predicate, object) pairs of the new association commits
+        """
+        self.generation += 1
+
+        for key in repository_keys:
+            self._discard(self._heads, key)
+            for pair in self._pairs_by_association.pop(key, ()):
+                self._discard(self._subjects, pair)
+
+        for predicate_key, object_key in pairs:
+            self._discard(self._subjects, (predicate_key, object_key))
+
+    def clear(self):
+        self.generation += 1
+        self._heads.clear()
+        self._subjects.clear()
+        self._pairs_by_association.clear()
+
+    def _get(self, entries, key):
+        entry = entries.get(key)
+        if entry is None or self.clock() - entry[0] >= self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def _discard(self, entries, key):
+        if key in entries:
+            del entries[key]
+
+
+# The graph indices of the association services in this container
+graph_indices = weakref.WeakKeyDictionary()
+
+# The broadcast from the datastore which keeps the association graph indices of other containers current
+broadcast_name = 'association_service_broadcast'
+
+def graph_index_enabled():
+    return CONF.getValue('graph_index_size', 0) > 0
+
+def invalidate_association_graphs(repository_keys, pairs):
+    for graph_index in graph_indices.keys():
+        graph_index.invalidate(repository_keys, pairs)
+
+def broadcast_association_changes(process, repository_keys, pairs):
+    """
+    @brief Drop the association graph index entries for these repositories in this and all other containers
+    @param process the process to send the broadcast from
+    @param repository_keys the keys of the repositories with new commits
+    @param pairs the (predicate, object) key pairs of the new association commits
+    """
+    invalidate_association_graphs(repository_keys, pairs)
+    if not graph_index_enabled():
+        return defer.succeed(None)
+
+    broadcast_target = process.get_scoped_name(FanoutReceiver.SCOPE_SYSTEM, broadcast_name)
+    return process.send(broadcast_target, 'broadcast', {'op': 'repositories_changed',
+                                                         'repository-keys': list(repository_keys),
+                                                         'pairs': [list(pair) for pair in pairs]})
+
+
 class AssociationService(ServiceProcess):
     """
     The Association Service
@@ -86,6 +220,15 @@ class AssociationService(ServiceProcess):
         # Get the configuration for cassandra - may or may not be used depending on the backend class
         self._storage_conf = get_cassandra_configuration()
 
+        # Only taken from the config, never the spawn args: the datastore decides from the same setting whether
+        # to broadcast the changes which keep the index current
+        if 'graph_index_size' in self.spawn_args:
+            raise ValueError('The association graph index size can only be set in the config, not the spawn args')
+        self.graph_index = AssociationGraphIndex(CONF.getValue('graph_index_size', 0), CONF.getValue('graph_index_ttl', 60))
+        graph_indices[self.graph_index] = None
+
+        self.broadcast_count = 0
+
 
 
     @defer.inlineCallbacks
@@ -104,8 +247,89 @@ class AssociationService(ServiceProcess):
         else:
             self.index_store = self.index_store_class(self, indices=COMMIT_INDEXED_COLUMNS )
 
+        if self.graph_index.max_size > 0:
+            # Listen for the pushes in other containers which change the association graph
+            self.bc_receiver = FanoutReceiver(name=broadcast_name, scope=FanoutReceiver.SCOPE_SYSTEM,
+                                              handler=self.receive, error_handler=self.receive_error)
+            bc_name = yield self.bc_receiver.attach()
+            log.info('Listening to association service broadcasts: %s' % (bc_name))
+
         log.info('SLC_INIT Association Service: index store class - %s' % self.index_store_class)
 
+    def op_broadcast(self, content, headers, msg):
+        """
+        Service operation: the datastore broadcast of the repositories changed by a push
+        """
+        self.broadcast_count += 1
+        log.debug('op_broadcast(): Received association service broadcast #%d' % (self.broadcast_count))
+
+        if content.get('op') == 'repositories_changed':
+            self.graph_index.invalidate(content['repository-keys'], content['pairs'])
+
+    @defer.inlineCallbacks
+    def _get_heads(self, repository_keys):
+        """
+        @brief Get the head branch names of each repository - from the graph index, or for all the repositories not
+        in the index with the queries sent together rather than one after the other
+        @retval a dictionary of repository key -> tuple of branch names
+        """
+        heads = {}
+        cold_keys = []
+        for key in repository_keys:
+            branches = self.graph_index.get_heads(key)
+            if branches is None:
+                cold_keys.append(key)
+            else:
+                heads[key] = branches
+
+        if cold_keys:
+            generation = self.graph_index.generation
+
+            def_list = []
+            for key in cold_keys:
+                q = store.Query()
+                # Get only the head or get all? Hmmm not sure...
+                q.add_predicate_gt(BRANCH_NAME,'')
+                q.add_predicate_eq(REPOSITORY_KEY, key)
+                def_list.append(self.index_store.query(q, columns=[BRANCH_NAME]))
+
+            results = yield defer.DeferredList(def_list, consumeErrors=True)
+
+            for key, (success, rows) in zip(cold_keys, results):
+                if not success:
+                    rows.raiseException()
+
+                branches = tuple([row[BRANCH_NAME] for row in rows.itervalues()])
+                if branches:
+                    # A repository without heads may not be written yet - do not keep that
+                    self.graph_index.put_heads(key, branches, generation)
+                heads[key] = branches
+
+        defer.returnValue(heads)
+
+    @defer.inlineCallbacks
+    def _get_pair_subjects(self, predicate_key, object_key):
+        """
+        @brief Get the current associations with the predicate and object
+        @retval a tuple of (association key, subject key, subject branch)
+        """
+        associations = self.graph_index.get_subjects(predicate_key, object_key)
+        if associations is None:
+            generation = self.graph_index.generation
+
+            q = store.Query()
+            # Get only the latest version of the association!
+            q.add_predicate_gt(BRANCH_NAME,'')
+            q.add_predicate_eq(PREDICATE_KEY, predicate_key)
+            q.add_predicate_eq(OBJECT_KEY, object_key)
+
+            rows = yield self.index_store.query(q, columns=[REPOSITORY_KEY, SUBJECT_KEY, SUBJECT_BRANCH])
+
+            associations = tuple([(row[REPOSITORY_KEY], row[SUBJECT_KEY], row[SUBJECT_BRANCH]) for row in rows.itervalues()])
+            self.graph_index.put_subjects(predicate_key, object_key, associations, generation)
+
+        defer.returnValue(associations)
+
     @defer.inlineCallbacks
     def _get_subjects(self, predicate_pairs):
         life_cycle_pair = None
@@ -120,11 +344,6 @@ class AssociationService(ServiceProcess):
 
         for pair in predicate_pairs:
 
-
-            q = store.Query()
-            # Get only the latest version of the association!
-            q.add_predicate_gt(BRANCH_NAME,'')
-
             # Build a query for the predicate of the search
             if pair.predicate.ObjectType != PREDICATE_REFERENCE_TYPE:
                 raise AssociationServiceError('Invalid predicate type in _get_subjects.', BAD_REQUEST)
@@ -153,47 +372,39 @@ class AssociationService(ServiceProcess):
                     raise AssociationServiceError('Invalid search by type - two predicate object pairs in the query specify type_of. There can be only One!', BAD_REQUEST)
                 continue
 
-            q.add_predicate_eq(PREDICATE_KEY, pair.predicate.key)
+            associations = yield self._get_pair_subjects(pair.predicate.key, pair.object.key)
 
-            q.add_predicate_eq(OBJECT_KEY, pair.object.key)
+            if not first_pair:
+                # The result we are looking for is an intersection operation. Drop the keys which are not here!
+                associations = [association for association in associations if association[1] in subject_keys]
 
-            rows = yield self.index_store.query(q)
+            # Get the latest commits for all the subjects at once
+            subject_heads = yield self._get_heads(set([association[1] for association in associations]))
 
             # subject_pointers is the resulting set of pointers to the current state of the association subject
             subjects_pointers = set()
 
             current_keys = set()
-            for key, row in rows.items():
-
+            for association_key, subject_key, subject_branch in associations:
 
                 #@TODO - check for divergence and branches in the association and in the object - not just the subject
 
-                if not first_pair and row[SUBJECT_KEY] not in subject_keys:
-                    # The result we are looking for is an intersection operation. If this key is not here escape!
-                    continue
-                current_keys.add(row[SUBJECT_KEY])
-
-                # Get the latest commits for the Subject_Key
-                subject_query = store.Query()
-                # Get only the head or get all? Hmmm not sure...
-                subject_query.add_predicate_gt(BRANCH_NAME,'')
-                subject_query.add_predicate_eq(REPOSITORY_KEY,row[SUBJECT_KEY])
-                subject_heads = yield self.index_store.query(subject_query)
+                current_keys.add(subject_key)
 
                 branches = []
-                for commit_key, commit_row in subject_heads.items():
+                for branch_name in subject_heads[subject_key]:
 
-                    if commit_row[BRANCH_NAME] in branches:
+                    if branch_name in branches:
                         raise NotImplementedError('Dealing with divergence in an associated Subject is not yet supported')
 
                     else:
-                        branches.append(commit_row[BRANCH_NAME])
+                        branches.append(branch_name)
 
-                    if commit_row[BRANCH_NAME] == row[SUBJECT_BRANCH]:
+                    if branch_name == subject_branch:
                         # We do not need to determine ancestry - the branch name is the same!
 
                         # return the pointer to this commit - this is the latest version of the associated subject!
-                        totalkey = (row[SUBJECT_KEY] , row[SUBJECT_BRANCH])
+                        totalkey = (subject_key , subject_branch)
 
                         # Check to make sure we did not hit an inconsistent state where there appear to be two head commits on the association!
                         subjects_pointers.add(totalkey)
@@ -231,15 +442,16 @@ class AssociationService(ServiceProcess):
                 q.add_predicate_eq(RESOURCE_LIFE_CYCLE_STATE, str(life_cycle_pair.object.lcs))
 
 
-            # Get all the results that meet the type / state query
-            rows = yield self.index_store.query(q)
+            # Get all the results that meet the type / state query - page through them, there may be very many!
+            for page in self.index_store.query_iter(q, columns=[REPOSITORY_KEY, BRANCH_NAME]):
+                rows = yield page
 
-            # This is a simple search - just add the results!
-            for key, row in rows.items():
+                # This is a simple search - just add the results!
+                for key, row in rows.items():
 
-                totalkey = (row[REPOSITORY_KEY] , row[BRANCH_NAME])
+                    totalkey = (row[REPOSITORY_KEY] , row[BRANCH_NAME])
 
-                subjects.add(totalkey)
+                    subjects.add(totalkey)
 
         elif len(subjects) > 0 and life_cycle_pair or type_of_pair:
             # Now apply search by type and state... if needed.
@@ -265,7 +477,7 @@ class AssociationService(ServiceProcess):
                     q.add_predicate_eq(RESOURCE_OBJECT_TYPE, type_of_pair.object.key)
 
                 # Get all the results that meet the type / state query
-                rows = yield self.index_store.query(q)
+                rows = yield self.index_store.query(q, columns=[REPOSITORY_KEY, BRANCH_NAME])
 
                 for key, row in rows.items():
 
@@ -339,32 +551,28 @@ class AssociationService(ServiceProcess):
             # subject_pointers is the resulting set of pointers to the current state of the association subject
             objects_pointers = set()
 
+            if not first_pair:
+                # The result we are looking for is an intersection operation. Drop the keys which are not here!
+                rows = dict([(key, row) for key, row in rows.items() if row[OBJECT_KEY] in object_keys])
+
+            # Get the latest commits for all the objects at once
+            object_heads = yield self._get_heads(set([row[OBJECT_KEY] for row in rows.itervalues()]))
+
             current_keys=set()
             for key, row in rows.items():
 
-                if not first_pair and row[OBJECT_KEY] not in object_keys:
-                    # The result we are looking for is an intersection operation. If this key is not her escape!
-                    continue
-
                 current_keys.add(row[OBJECT_KEY])
 
-                # Get the latest commits for the Subject_Key
-                object_query = store.Query()
-                # Get only the head or get all? Hmmm not sure...
-                object_query.add_predicate_gt(BRANCH_NAME,'')
-                object_query.add_predicate_eq(REPOSITORY_KEY,row[OBJECT_KEY])
-                object_heads = yield self.index_store.query(object_query)
-
                 branches = []
-                for commit_key, commit_row in object_heads.items():
+                for branch_name in object_heads[row[OBJECT_KEY]]:
 
-                    if commit_row[BRANCH_NAME] in branches:
+                    if branch_name in branches:
                         raise NotImplementedError('Dealing with divergence in an associated Object is not yet supported')
 
                     else:
-                        branches.append(commit_row[BRANCH_NAME])
+                        branches.append(branch_name)
 
-                    if commit_row[BRANCH_NAME] == row[OBJECT_BRANCH]:
+                    if branch_name == row[OBJECT_BRANCH]:
                         # We do not need to determine ancestry - the branch name is the same!
 
                         # return the pointer to this commit - this is the latest version of the associated subject!
@@ -674,7 +882,7 @@ class AssociationService(ServiceProcess):
 
         yield self.reply_ok(msg, response)
 
-    def association_query_from_request(self, asc_query):
+    def association_query_from_request(self, asc_query, columns=None):
         q = store.Query()
         # Get only the latest version of the association!
         q.add_predicate_gt(BRANCH_NAME,'')
@@ -683,7 +891,7 @@ class AssociationService(ServiceProcess):
         if 'predicate' in asc_query:    q.add_predicate_eq(PREDICATE_KEY, asc_query['predicate'])
         if 'object' in asc_query:       q.add_predicate_eq(OBJECT_KEY, asc_query['object'])
 
-        return self.index_store.query(q)
+        return self.index_store.query(q, columns=columns)
 
     @defer.inlineCallbacks
     def op_get_associations_map(self, asc_query, headers, msg):
@@ -710,6 +918,38 @@ class AssociationService(ServiceProcess):
                       for key,row in rows.iteritems()]
         yield self.reply_ok(msg, role_list)
 
+    @defer.inlineCallbacks
+    def op_subjects_with_association(self, asc_query, headers, msg):
+        """
+        @see AssociationServiceClient.subjects_with_association
+        """
+        log.info('op_subjects_with_association: ')
+
+        subjects = set(asc_query['subjects'])
+
+        if len(subjects) <= CONF.getValue('subject_query_limit', 10):
+            # Constrain the query for each subject - the index returns only the rows for that subject
+            def_list = []
+            for subject in subjects:
+                subject_query = {'subject': subject}
+                for name in ('predicate', 'object'):
+                    if name in asc_query:
+                        subject_query[name] = asc_query[name]
+                def_list.append(self.association_query_from_request(subject_query, columns=[SUBJECT_KEY]))
+
+            results = yield defer.DeferredList(def_list, consumeErrors=True)
+
+            rows = {}
+            for success, result in results:
+                if not success:
+                    result.raiseException()
+                rows.update(result)
+        else:
+            rows = yield self.association_query_from_request(asc_query, columns=[SUBJECT_KEY])
+
+        found = set(row[SUBJECT_KEY] for key,row in rows.iteritems() if row[SUBJECT_KEY] in subjects)
+        yield self.reply_ok(msg, list(found))
+
 
 class AssociationServiceClient(ServiceClient):
     """
@@ -839,6 +1079,19 @@ class AssociationServiceClient(ServiceClient):
         defer.returnValue(content)
 
 
+    @defer.inlineCallbacks
+    def subjects_with_association(self, msg):
+        """
+        @brief Find which of many subjects have an association with the same predicate and object - one query
+        instead of an association_exists call per subject
+        @param params msg, a dictionary with the list of 'subjects' and keys for the predicate and object
+        @retval the list of subjects which have the association
+        """
+        yield self._check_init()
+
+        (content, headers, msg) = yield self.rpc_send('subjects_with_association', msg)
+        defer.returnValue(content)
+
     @defer.inlineCallbacks
     def association_exists(self, msg):
         """
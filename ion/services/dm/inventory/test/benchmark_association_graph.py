@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+@file ion/services/dm/inventory/test/benchmark_association_graph.py
+@brief Benchmark the latency of get_subjects against the number of associations found, with the association
+    service on the in memory IndexStore.
+@test Association graph benchmark - not run as part of the unit tests
+"""
+
+import time
+
+from twisted.internet import defer
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from ion.core import ioninit
+from ion.test.iontest import IonTestCase
+from ion.core.object import object_utils
+from ion.core.process.process import Process
+
+from ion.core.data.store import IndexStore
+from ion.core.data.storage_configuration_utility import COMMIT_INDEXED_COLUMNS, REPOSITORY_KEY, BRANCH_NAME
+from ion.core.data.storage_configuration_utility import SUBJECT_KEY, SUBJECT_BRANCH, PREDICATE_KEY, OBJECT_KEY, OBJECT_BRANCH
+
+from ion.services.dm.inventory.association_service import AssociationServiceClient
+from ion.services.dm.inventory.association_service import PREDICATE_OBJECT_QUERY_TYPE, IDREF_TYPE
+
+PREDICATE_REFERENCE_TYPE = object_utils.create_type_identifier(object_id=25, version=1)
+
+PREDICATE = 'benchmark-predicate'
+
+SERVICE_CONFIG = 'ion.services.dm.inventory.association_service'
+
+
+class AssociationGraphBenchmark(IonTestCase):
+
+    services = [
+            {'name':'association_service',
+             'module':'ion.services.dm.inventory.association_service',
+             'class':'AssociationService'
+              }
+        ]
+
+    association_counts = [10, 100, 1000, 5000]
+
+    # Queries timed once the graph index is warm
+    warm_queries = 20
+
+    timeout = 600
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        # The graph index is on for the association service and the datastore broadcasts alike
+        graph_index_size = ioninit.ion_config.getValue2(SERVICE_CONFIG, 'graph_index_size', 0)
+        self.addCleanup(ioninit.ion_config.update, {SERVICE_CONFIG: {'graph_index_size': graph_index_size}})
+        ioninit.ion_config.update({SERVICE_CONFIG: {'graph_index_size': 10000}})
+
+        yield self._start_container()
+        self.sup = yield self._spawn_processes(self.services)
+
+        self.proc = Process()
+        yield self.proc.spawn()
+
+        self.asc = AssociationServiceClient(proc=self.proc)
+
+        # The in memory index store rows are shared with the association service
+        self.index_store = IndexStore(indices=COMMIT_INDEXED_COLUMNS)
+        self.row_keys = []
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        for key in self.row_keys:
+            yield self.index_store.remove(key)
+
+        yield self._shutdown_processes()
+        yield self._stop_container()
+
+    @defer.inlineCallbacks
+    def _put_associations(self, object_key, count):
+        """
+        Put the head commits of count subjects, each with an association to the object
+        """
+        rows = []
+        for i in range(count):
+            subject_key = '%s-subject-%d' % (object_key, i)
+            rows.append(('%s-commit' % subject_key, '',
+                         {REPOSITORY_KEY:subject_key, BRANCH_NAME:'master'}))
+
+            association_key = '%s-association-%d' % (object_key, i)
+            rows.append(('%s-commit' % association_key, '',
+                         {REPOSITORY_KEY:association_key, BRANCH_NAME:'master',
+                          SUBJECT_KEY:subject_key, SUBJECT_BRANCH:'master',
+                          PREDICATE_KEY:PREDICATE,
+                          OBJECT_KEY:object_key, OBJECT_BRANCH:'master'}))
+
+        yield self.index_store.put_many(rows)
+        self.row_keys.extend([row[0] for row in rows])
+
+    @defer.inlineCallbacks
+    def _get_subjects(self, object_key):
+        request = yield self.proc.message_client.create_instance(PREDICATE_OBJECT_QUERY_TYPE)
+
+        pair = request.pairs.add()
+
+        pref = request.CreateObject(PREDICATE_REFERENCE_TYPE)
+        pref.key = PREDICATE
+        pair.predicate = pref
+
+        object_ref = request.CreateObject(IDREF_TYPE)
+        object_ref.key = object_key
+        pair.object = object_ref
+
+        t1 = time.time()
+        result = yield self.asc.get_subjects(request)
+        t2 = time.time()
+
+        defer.returnValue((len(result.idrefs), t2 - t1))
+
+    @defer.inlineCallbacks
+    def test_get_subjects_latency(self):
+
+        results = []
+        for count in self.association_counts:
+            object_key = 'benchmark-object-%d' % count
+            yield self._put_associations(object_key, count)
+
+            # The first query fills the graph index from the index store
+            found, cold = yield self._get_subjects(object_key)
+            self.assertEqual(found, count)
+
+            warm = 0.0
+            for i in range(self.warm_queries):
+                found, latency = yield self._get_subjects(object_key)
+                warm += latency
+            self.assertEqual(found, count)
+
+            results.append((count, cold * 1000, warm / self.warm_queries * 1000))
+
+        output = '\nAssociations | Cold get_subjects ms | Warm get_subjects ms\n'
+        for result in results:
+            output += '%12d | %19.2f | %20.2f\n' % result
+
+        log.info(output)
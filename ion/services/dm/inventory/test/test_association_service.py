@@ -9,6 +9,7 @@
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 from twisted.internet import defer
+from twisted.trial import unittest
 
 from ion.core import ioninit
 CONF = ioninit.config(__name__)
@@ -36,6 +37,7 @@ from ion.services.coi.datastore_bootstrap.ion_preload_config import HAS_A_ID
 
 from ion.services.dm.inventory.association_service import AssociationServiceClient, ASSOCIATION_QUERY_MSG_TYPE, ASSOCIATION_GET_STAR_MSG_TYPE
 from ion.services.dm.inventory.association_service import PREDICATE_OBJECT_QUERY_TYPE, IDREF_TYPE, SUBJECT_PREDICATE_QUERY_TYPE
+from ion.services.dm.inventory.association_service import AssociationGraphIndex, graph_indices, invalidate_association_graphs
 
 
 ASSOCIATION_TYPE = object_utils.create_type_identifier(object_id=13, version=1)
@@ -754,4 +756,94 @@ class AssociationServiceTest(IonTestCase):
         stars = yield self.asc.get_star(request)
 
         self.assertEquals(len(stars.idrefs), 1)
-        self.assertEquals(stars.idrefs[0].key, SAMPLE_PROFILE_DATASET_ID)
\ No newline at end of file
+        self.assertEquals(stars.idrefs[0].key, SAMPLE_PROFILE_DATASET_ID)
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class AssociationGraphIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.index = AssociationGraphIndex(max_size=3, ttl=10, clock=self.clock)
+
+    def test_heads(self):
+        self.assertEqual(self.index.get_heads('subject1'), None)
+
+        self.index.put_heads('subject1', ['master'], self.index.generation)
+        self.assertEqual(self.index.get_heads('subject1'), ('master',))
+        self.assertEqual((self.index.hits, self.index.misses), (1, 1))
+
+        self.clock.now += 10
+        self.assertEqual(self.index.get_heads('subject1'), None)
+
+    def test_subjects(self):
+        associations = [('association1', 'subject1', 'master'), ('association2', 'subject2', 'master')]
+        self.index.put_subjects('owned_by', 'user1', associations, self.index.generation)
+        self.index.put_subjects('owned_by', 'user2', [], self.index.generation)
+
+        self.assertEqual(self.index.get_subjects('owned_by', 'user1'), tuple(associations))
+        self.assertEqual(self.index.get_subjects('owned_by', 'user2'), ())
+        self.assertEqual(self.index.get_subjects('has_a', 'user1'), None)
+
+    def test_invalidate(self):
+        self.index.put_heads('subject1', ['master'], self.index.generation)
+        self.index.put_heads('subject2', ['master'], self.index.generation)
+        self.index.put_subjects('owned_by', 'user1', [('association1', 'subject1', 'master')], self.index.generation)
+        self.index.put_subjects('owned_by', 'user2', [], self.index.generation)
+
+        # A push of the association drops the pairs it was found in
+        self.index.invalidate(['association1'])
+        self.assertEqual(self.index.get_subjects('owned_by', 'user1'), None)
+        self.assertEqual(self.index.get_subjects('owned_by', 'user2'), ())
+
+        # A push of a new association drops the pair it is for
+        self.index.invalidate(['association2'], [('owned_by', 'user2')])
+        self.assertEqual(self.index.get_subjects('owned_by', 'user2'), None)
+
+        # A push of a subject drops its heads
+        self.index.invalidate(['subject1'])
+        self.assertEqual(self.index.get_heads('subject1'), None)
+        self.assertEqual(self.index.get_heads('subject2'), ('master',))
+
+    def test_stale_fill(self):
+        # Rows read from the index store before a push are not kept
+        generation = self.index.generation
+        self.index.invalidate(['subject1'])
+        self.index.put_heads('subject1', ['master'], generation)
+        self.index.put_subjects('owned_by', 'user1', [], generation)
+        self.assertEqual(self.index.get_heads('subject1'), None)
+        self.assertEqual(self.index.get_subjects('owned_by', 'user1'), None)
+
+    def test_bounded(self):
+        for i in range(5):
+            self.index.put_heads('subject%d' % i, ['master'], self.index.generation)
+
+        self.assertEqual(self.index.get_heads('subject0'), None)
+        self.assertEqual(self.index.get_heads('subject4'), ('master',))
+
+    def test_off(self):
+        index = AssociationGraphIndex(max_size=0, clock=self.clock)
+        index.put_heads('subject1', ['master'], index.generation)
+        index.put_subjects('owned_by', 'user1', [], index.generation)
+        self.assertEqual(index.get_heads('subject1'), None)
+        self.assertEqual(index.get_subjects('owned_by', 'user1'), None)
+
+    def test_invalidate_in_container(self):
+        # The datastore drops the entries in the indices of its own container before it replies to a push
+        graph_indices[self.index] = None
+        self.addCleanup(graph_indices.pop, self.index, None)
+
+        self.index.put_heads('subject1', ['master'], self.index.generation)
+        self.index.put_subjects('owned_by', 'user1', [], self.index.generation)
+
+        invalidate_association_graphs(['subject1'], [('owned_by', 'user1')])
+        self.assertEqual(self.index.get_heads('subject1'), None)
+        self.assertEqual(self.index.get_subjects('owned_by', 'user1'), None)
@@ -8,6 +8,7 @@
 """
 import sys
 import time
+import heapq
 from ion.core.data.store import IndexStore, Query
 from ion.core.exception import ApplicationError
 from ion.core.object.gpb_wrapper import StructureElement
@@ -131,6 +132,122 @@ class SchedulerError(ApplicationError):
     pass
 
 
+class TaskHeap(object):
+    """
+    A single timer for all the tasks of the scheduler. The next fire time of each task is kept in a heap and one
+    reactor call is pending for the earliest of them. All the tasks which are due when the timer fires are handed to
+    the callback together as one batch.
+
+    Cancelled and rescheduled tasks leave stale entries in the heap - they are discarded when they reach the top.
+    """
+
+    # Tasks due within this many seconds of the tick are fired in the same batch
+    resolution = 0.01
+
+    def __init__(self, callback, clock=None):
+        """
+        @param callback is called with a list of (task_id, scheduled_time) tuples for the tasks due in a tick
+        @param clock is the reactor used for the timer and the current time
+        """
+        self._callback = callback
+        self._clock = clock or reactor
+
+        self._heap = []
+
+        # task_id -> the scheduled fire time; heap entries which do not match are stale
+        self._scheduled = {}
+
+        self._timer = None
+        self._timer_time = None
+
+        self.fired = 0
+        self.batches = 0
+        self.max_batch = 0
+        self.sum_lateness = 0.0
+        self.max_lateness = 0.0
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def __contains__(self, task_id):
+        return task_id in self._scheduled
+
+    def schedule(self, task_id, fire_time):
+        """
+        Schedule (or reschedule) a task
+        @param fire_time is the time in seconds since the epoch
+        """
+        self._scheduled[task_id] = fire_time
+        heapq.heappush(self._heap, (fire_time, task_id))
+        self._reset_timer()
+
+    def cancel(self, task_id):
+        """
+        Remove a task - returns True if it was scheduled
+        """
+        return self._scheduled.pop(task_id, None) is not None
+
+    def stop(self):
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+
+    def stats(self):
+        """
+        Lateness is the time between the scheduled fire time of a task and the tick which fired it. Tasks are
+        rescheduled from their scheduled time, so lateness does not accumulate as drift.
+        """
+        return {'pending':len(self._scheduled),
+                'heap_size':len(self._heap),
+                'fired':self.fired,
+                'batches':self.batches,
+                'max_batch':self.max_batch,
+                'mean_lateness':self.sum_lateness / max(self.fired, 1),
+                'max_lateness':self.max_lateness}
+
+    def _reset_timer(self):
+        # Discard stale entries so the timer is set for a task which is still scheduled
+        while self._heap and self._scheduled.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+        if not self._heap:
+            self.stop()
+            return
+
+        next_time = self._heap[0][0]
+        if self._timer is not None and self._timer.active():
+            if self._timer_time <= next_time:
+                return
+            self._timer.cancel()
+
+        self._timer_time = next_time
+        self._timer = self._clock.callLater(max(0, next_time - self._clock.seconds()), self._tick)
+
+    def _tick(self):
+        self._timer = None
+        now = self._clock.seconds()
+
+        due = []
+        while self._heap and self._heap[0][0] <= now + self.resolution:
+            fire_time, task_id = heapq.heappop(self._heap)
+            if self._scheduled.get(task_id) != fire_time:
+                continue
+            del self._scheduled[task_id]
+            due.append((task_id, fire_time))
+
+            lateness = max(0.0, now - fire_time)
+            self.sum_lateness += lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+
+        self._reset_timer()
+
+        if due:
+            self.fired += len(due)
+            self.batches += 1
+            self.max_batch = max(self.max_batch, len(due))
+            self._callback(due)
+
+
 class SchedulerService(ServiceProcess):
     """
     First pass at a message-based cron service, where you register a send-to address,
@@ -190,8 +307,15 @@ class SchedulerService(ServiceProcess):
 
         self.mc = MessageClient(proc=self)
 
-        # maps task_ids to IDelayedCall objects, popped off when callback is called, used to cancel tasks
-        self._callback_tasks = {}
+        # One timer for all the tasks - fires the tasks which are due together
+        self._task_heap = TaskHeap(self._send_batch)
+
+        # The task definitions by task_id - kept in step with the store by op_add_task and op_rm_task so that
+        # firing a task does not query the store
+        self._task_defs = {}
+
+        # The parsed payload structure element of each task
+        self._task_payloads = {}
 
         # will move pub through the lifecycle states with the service
         self.pub = ScheduleEventPublisher(process=self)
@@ -228,6 +352,8 @@ class SchedulerService(ServiceProcess):
         for task_id, tdef in rows.iteritems():
             log.debug("slc_activate: scheduling %s" % task_id)
 
+            self._task_defs[task_id] = tdef
+
             # could be None
             try:
                 start_time = int(tdef['start_time'])
@@ -245,11 +371,9 @@ class SchedulerService(ServiceProcess):
         foreach task in op_query:
           rm_task(task)
         """
-        for k, v in self._callback_tasks.iteritems():
-            if v.active():
-                v.cancel()
+        self._task_heap.stop()
 
-    def _schedule_event(self, starttime, interval, task_id, query_result=None):
+    def _schedule_event(self, starttime, interval, task_id):
         """
         Helper method to schedule and record a callback in the service.
         Used by op_add_task and on startup.
@@ -262,8 +386,6 @@ class SchedulerService(ServiceProcess):
                                 use the IonTime utility class.
         @param  interval        The interval to trigger scheduler events, in seconds.
         @param  task_id         The task_id to trigger.
-        @param  query_result    Internal param passed on from service activation which contains the query result already
-                                instead of making _send_and_reschedule go get it again.
         """
         assert interval and task_id and interval > 0
         curtime = IonTime().time_ms
@@ -281,8 +403,7 @@ class SchedulerService(ServiceProcess):
 
         log.debug("_schedule_event: calculated next callback time of %d" % calctime)
 
-        ccl = reactor.callLater(calctime, self._send_and_reschedule, task_id, query_result=query_result)
-        self._callback_tasks[task_id] = ccl
+        self._task_heap.schedule(task_id, reactor.seconds() + calctime)
 
     @defer.inlineCallbacks
     def op_add_task(self, content, headers, msg):
@@ -339,7 +460,10 @@ class SchedulerService(ServiceProcess):
         resp = yield self.mc.create_instance(ADDTASK_RSP_TYPE)
 
         # check to see if the task_id already exists in the store
-        existing_task = yield self.scheduled_events.get(task_id)
+        if task_id in self._task_defs:
+            existing_task = task_id
+        else:
+            existing_task = yield self.scheduled_events.get(task_id)
         if existing_task is not None:
             log.info("Already have task with id %s scheduled." % task_id)
             resp.duplicate = True
@@ -352,16 +476,20 @@ class SchedulerService(ServiceProcess):
         resp.origin     = desired_origin
 
         # extract content of message
+        tdef = {'task_id': task_id,
+                'constant': '1',    # used for being able to pull all tasks
+                'user_id': user_id,
+                'start_time': str(starttime),
+                'end_time': str(endtime),
+                'interval_seconds': str(msg_interval),
+                'desired_origin': desired_origin,
+                'payload': str(payload)}
+
         yield self.scheduled_events.put(task_id,
                                         task_id,  # ok to use for value? seems kind of silly
-                                        index_attributes={'task_id': task_id,
-                                                          'constant': '1',    # used for being able to pull all tasks
-                                                          'user_id': user_id,
-                                                          'start_time': str(starttime),
-                                                          'end_time': str(endtime),
-                                                          'interval_seconds': str(msg_interval),
-                                                          'desired_origin': desired_origin,
-                                                          'payload': str(payload)})
+                                        index_attributes=tdef)
+
+        self._task_defs[task_id] = tdef
 
         # Now that task is stored into registry, add to messaging callback
         log.debug('Adding task to scheduler')
@@ -375,8 +503,8 @@ class SchedulerService(ServiceProcess):
     @defer.inlineCallbacks
     def op_rm_task(self, content, headers, msg):
         """
-        Remove a task from the list/store. Will be dropped from the reactor
-        when the timer fires and _send_and_reschedule checks the registry.
+        Remove a task from the list/store. The task is removed from the timer
+        and the cached task definitions immediately.
         """
         task_id = content.task_id
 
@@ -387,9 +515,9 @@ class SchedulerService(ServiceProcess):
             return
 
         # if the task is active, remove it
-        if self._callback_tasks.has_key(task_id):
-            self._callback_tasks[task_id].cancel()
-            del self._callback_tasks[task_id]
+        self._task_heap.cancel(task_id)
+        self._task_defs.pop(task_id, None)
+        self._task_payloads.pop(task_id, None)
 
         log.debug('Removing task_id %s from store...' % task_id)
         yield self.scheduled_events.remove(task_id)
@@ -400,38 +528,97 @@ class SchedulerService(ServiceProcess):
         log.debug('Removal completed')
         yield self.reply_ok(msg, resp)
 
+    def op_get_stats(self, content, headers, msg):
+        """
+        Reply with the timer metrics of the scheduler - the number of pending tasks, the batches fired and the
+        lateness of the fired tasks in seconds.
+        """
+        return self.reply_ok(msg, self._task_heap.stats())
+
     ##################################################
     # Internal methods
 
     @defer.inlineCallbacks
-    def _send_and_reschedule(self, task_id, query_result=None):
+    def _send_batch(self, due):
         """
-        Check to see if we're still in the store - if not, we've been removed
-        and should abort the run.
-
-        @param  query_result    Internal param - passed in from Scheduler activation, which has already done a query.
-                                Allows us to skip making another query for the info we already have.
+        Fire the tasks which are due in one tick of the task heap together. The event messages of all the tasks are
+        built first and then published in one pass, grouped by origin - the routing key on the events exchange.
+        Each event is still a message of its own: a publish carries one message and event subscribers expect one
+        event per message.
+        @param due is a list of (task_id, scheduled_time) tuples
         """
-        log.debug('Worker activated for task %s' % task_id)
+        log.debug('Firing %d tasks' % len(due))
+
+        events = yield defer.DeferredList([self._create_task_event(task_id) for task_id, scheduled_time in due],
+                                          consumeErrors=True)
+
+        groups = {}
+        origins = []
+        for (task_id, scheduled_time), (success, result) in zip(due, events):
+            if not success:
+                self._send_failed(result, task_id)
+                continue
+            if result is None:
+                continue
+
+            tdef, msg = result
+            origin = tdef['desired_origin']
+            if origin not in groups:
+                groups[origin] = []
+                origins.append(origin)
+            groups[origin].append((task_id, scheduled_time, tdef, msg))
+
+        sent = []
+        dl = []
+        for origin in origins:
+            log.debug('Publishing %d events to "%s"' % (len(groups[origin]), origin))
+            for task_id, scheduled_time, tdef, msg in groups[origin]:
+                sent.append((task_id, scheduled_time, tdef, msg))
+                dl.append(self.pub.publish_event(msg, origin=origin))
+
+        results = yield defer.DeferredList(dl, consumeErrors=True)
+
+        for (task_id, scheduled_time, tdef, msg), (success, result) in zip(sent, results):
+            self._clear_event(msg)
+            if success:
+                self._reschedule(task_id, tdef, scheduled_time)
+            else:
+                self._send_failed(result, task_id)
 
-        if query_result is None:
+    def _send_failed(self, reason, task_id):
+        log.error('Failed to send the event for task %s: %s' % (task_id, reason.getErrorMessage()))
+
+    @defer.inlineCallbacks
+    def _get_task_def(self, task_id):
+        """
+        Get a task definition from the cache - if it is not there, get it from the store and cache it
+        """
+        tdef = self._task_defs.get(task_id)
+        if tdef is None:
             q = Query()
             q.add_predicate_eq('task_id', task_id)
 
             tdefs = yield self.scheduled_events.query(q)
             if len(tdefs) != 1:
                 log.error("Query did not find task_id: %s, expected 1, got %d" % (task_id, len(tdefs)))
-                defer.returnValue(False)
+                defer.returnValue(None)
 
             tdef = tdefs.values()[0]
-        else:
-            tdef = query_result
+            self._task_defs[task_id] = tdef
 
-        # pop callback object off of scheduled items
-        if not self._callback_tasks.has_key(task_id):
-            log.warn("task_id %s no longer in list of callbacks, aborting" % task_id)
-            defer.returnValue(False)
-        del self._callback_tasks[task_id]
+        defer.returnValue(tdef)
+
+    @defer.inlineCallbacks
+    def _create_task_event(self, task_id):
+        """
+        Build the event message for a task.
+        @retval a (task definition, event message) tuple, or None if the task is not found
+        """
+        log.debug('Worker activated for task %s' % task_id)
+
+        tdef = yield self._get_task_def(task_id)
+        if tdef is None:
+            defer.returnValue(None)
 
         # deserialize and objectify payload
         log.debug('Time to send to "%s", id "%s"' % (tdef['desired_origin'], task_id))
@@ -441,7 +628,11 @@ class SchedulerService(ServiceProcess):
                                           user_id=tdef['user_id'])
 
         try:
-            se = StructureElement.parse_structure_element(tdef['payload'])
+            se = self._task_payloads.get(task_id)
+            if se is None:
+                se = StructureElement.parse_structure_element(tdef['payload'])
+                self._task_payloads[task_id] = se
+
             payload = msg.Repository._load_element(se)
             msg.Repository.index_hash[payload.MyId]=se
 
@@ -449,10 +640,9 @@ class SchedulerService(ServiceProcess):
         except:
             log.info('No payload found or payload in incorrect format')
 
-        yield self.pub.publish_event(msg, origin=tdef['desired_origin'])
-
-        log.debug('Send completed, rescheduling %s' % task_id)
+        defer.returnValue((tdef, msg))
 
+    def _clear_event(self, msg):
         #################################################
         ## BANDAID FIX FOR 262 RE-OPEN
         ##
@@ -470,10 +660,30 @@ class SchedulerService(ServiceProcess):
             log.error("Could not clear repository: %s" % str(ex))
             pass
 
-        # start time of None is fine, we just happened so we can be sure interval_seconds is just about right
-        self._schedule_event(None, int(tdef['interval_seconds']), task_id)
+    def _reschedule(self, task_id, tdef, scheduled_time=None):
+        """
+        Schedule a task again one interval after the time it was scheduled for.
+
+        @param  scheduled_time  The time in seconds the task was due - used to reschedule without drift.
+        """
+        if task_id not in self._task_defs:
+            log.debug('Task %s was removed while it was sent - not rescheduling' % task_id)
+            return False
+
+        interval = int(tdef['interval_seconds'])
+        now = reactor.seconds()
+        if scheduled_time is None:
+            next_time = now + interval
+        else:
+            # The next interval after the scheduled time - skip any intervals which have been missed completely
+            next_time = scheduled_time + interval
+            if next_time <= now:
+                next_time += interval * int((now - next_time) / interval + 1)
 
-        log.debug('Task %s rescheduled for %s seconds OK' % (task_id, tdef['interval_seconds']))
+        self._task_heap.schedule(task_id, next_time)
+
+        log.debug('Task %s rescheduled for %s seconds OK' % (task_id, next_time - now))
+        return True
 
 class SchedulerServiceClient(ServiceClient):
     """
@@ -516,5 +726,16 @@ class SchedulerServiceClient(ServiceClient):
         (ret, heads, message) = yield self.rpc_send('rm_task', msg)
         defer.returnValue(ret)
 
+    @defer.inlineCallbacks
+    def get_stats(self):
+        """
+        @brief Get the timer metrics of the scheduler
+        @retval dictionary of pending, heap_size, fired, batches, max_batch, mean_lateness and max_lateness
+        """
+        yield self._check_init()
+
+        (ret, heads, message) = yield self.rpc_send('get_stats', {})
+        defer.returnValue(ret)
+
 # Spawn of the process using the module name
 factory = ProcessFactory(SchedulerService)
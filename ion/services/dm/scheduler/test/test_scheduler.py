@@ -8,14 +8,15 @@
 """
 import time
 
-from twisted.internet import defer
+from twisted.internet import defer, task
+from twisted.trial import unittest
 from ion.core.exception import ReceivedApplicationError
 
 from ion.core.process.process import Process
 from ion.core.object import object_utils
 from ion.core.messaging.message_client import MessageClient
 from ion.services.dm.distribution.events import ScheduleEventSubscriber
-from ion.services.dm.scheduler.scheduler_service import SchedulerServiceClient
+from ion.services.dm.scheduler.scheduler_service import SchedulerServiceClient, TaskHeap
 
 from ion.test.iontest import IonTestCase
 import ion.util.ionlog
@@ -44,6 +45,51 @@ from ion.services.dm.scheduler.scheduler_service import SCHEDULE_TYPE_PERFORM_IN
 
 
 
+class TaskHeapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.batches = []
+        self.heap = TaskHeap(self.batches.append, clock=self.clock)
+
+    def test_batch(self):
+        self.heap.schedule('a', 10)
+        self.heap.schedule('b', 10)
+        self.heap.schedule('c', 5)
+
+        # One timer for all the tasks
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+        self.clock.advance(5)
+        self.assertEqual(self.batches, [[('c', 5)]])
+
+        self.clock.advance(6)
+        self.assertEqual(sorted(self.batches[1]), [('a', 10), ('b', 10)])
+
+        stats = self.heap.stats()
+        self.assertEqual(stats['fired'], 3)
+        self.assertEqual(stats['batches'], 2)
+        self.assertEqual(stats['max_batch'], 2)
+        self.assertEqual(stats['max_lateness'], 1)
+        self.assertEqual(stats['pending'], 0)
+
+    def test_cancel_and_reschedule(self):
+        self.heap.schedule('a', 10)
+        self.heap.schedule('b', 10)
+        self.heap.cancel('b')
+
+        # Move a later - the stale entry must not fire it
+        self.heap.schedule('a', 20)
+        self.assertEqual(len(self.heap), 1)
+
+        self.clock.advance(10)
+        self.assertEqual(self.batches, [])
+
+        self.clock.advance(10)
+        self.assertEqual(self.batches, [[('a', 20)]])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
 class SchedulerTest(IonTestCase):
 
 
@@ -209,6 +255,9 @@ class SchedulerTest(IonTestCase):
         #self.failUnlessEquals(self._notices[0]['content'].additional_data.payload.datasource_id, "TWO")
         self.failUnlessEquals(self._notices[0], "TESTER")
 
+        stats = yield sc.get_stats()
+        self.failUnless(stats['fired'] >= len(self._notices))
+
 
         msg_r = yield mc.create_instance(RMTASK_REQ_TYPE)
         msg_r.task_id = resp_msg.task_id
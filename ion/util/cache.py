@@ -85,6 +85,9 @@ class LRUDict(object):
         self.use_size = use_size
         self.total_size = 0
 
+        # Number of items pushed out by the limit
+        self.evictions = 0
+
         if pairs is None: pairs = []
         for key, value in pairs:
             self[key] = value
@@ -133,6 +136,7 @@ class LRUDict(object):
                 self.last = None
                 self.total_size = 0
                 self.d.clear()
+                self.evictions += 1
                 return
 
             a = self.first
@@ -148,6 +152,7 @@ class LRUDict(object):
 
             del self.d[a.me[0]]
             del a
+            self.evictions += 1
 
     def __delitem__(self, key):
         nobj = self.d[key]
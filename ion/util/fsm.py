@@ -23,16 +23,16 @@ class ExceptionFSM(Exception):
     def __str__(self):
         return self.value
 
-class FSM(object):
-    """This is a Finite State Machine (FSM).
+class TransitionTable(object):
+    """
+    The transitions of a FSM: (input_symbol, current_state) --> (action, next_state).
+    A table can be frozen once it is complete and then be shared by any number
+    of FSM instances, each of which only keeps its own state cursor. Actions in
+    a shared table must not close over an instance - they get the FSM as
+    argument and can find their target through it.
     """
 
-    def __init__(self, initial_state, memory=None, post_action=False):
-        """
-        This creates the FSM. You set the initial state here.
-        The "memory" attribute is any object.
-        """
-
+    def __init__(self):
         # Map (input_symbol, current_state) --> (action, next_state).
         self.state_transitions = {}
         # Map (input_symbol) --> (action, next_state).
@@ -42,23 +42,29 @@ class FSM(object):
         # (action, next_state).
         self.default_transition = None
 
-        self.input_symbol = None
-        self.initial_state = initial_state
-        self.current_state = self.initial_state
-        self.next_state = None
-        self.action = None
-        self.memory = memory
-        # If True, the action will be executed after the state change
-        self.post_action = post_action
+        self.frozen = False
 
-    def reset(self):
+    def freeze(self):
         """
-        This sets the current_state to the initial_state and sets
-        input_symbol to None.
+        Marks the table complete. Adding transitions to a frozen table raises.
         """
+        self.frozen = True
+        return self
 
-        self.current_state = self.initial_state
-        self.input_symbol = None
+    def copy(self):
+        """
+        @retval a new, not frozen table with the same transitions
+        """
+        table = TransitionTable()
+        table.state_transitions.update(self.state_transitions)
+        table.state_transitions_catch.update(self.state_transitions_catch)
+        table.state_transitions_any.update(self.state_transitions_any)
+        table.default_transition = self.default_transition
+        return table
+
+    def _check_frozen(self):
+        if self.frozen:
+            raise ExceptionFSM('Transition table is frozen')
 
     def add_transition(self, input_symbol, state, action=None, next_state=None):
         """
@@ -69,6 +75,7 @@ class FSM(object):
         ignore the action and only set the next_state. The next_state may be
         set to None in which case the current state will be unchanged.
         """
+        self._check_frozen()
         if next_state is None:
             next_state = state
         self.state_transitions[(input_symbol, state)] = (action, next_state)
@@ -103,6 +110,7 @@ class FSM(object):
         ignore the action and only set the next_state. The next_state may be
         set to None in which case the current state will be unchanged.
         """
+        self._check_frozen()
         if next_state is None:
             return
         self.state_transitions_catch[input_symbol] = (action, next_state)
@@ -120,6 +128,7 @@ class FSM(object):
         ignore the action and only set the next_state. The next_state may be
         set to None in which case the current state will be unchanged.
         """
+        self._check_frozen()
         if next_state is None:
             next_state = state
         self.state_transitions_any[state] = (action, next_state)
@@ -132,17 +141,14 @@ class FSM(object):
         current_state in the transition_any list. This is useful as a final
         fall-through state for catching errors and undefined states.
 
-        The default transition can be removed by setting the attribute
-        default_transition to None.
+        The default transition can be removed by setting it to None.
         """
+        self._check_frozen()
         self.default_transition = (action, next_state)
 
     def get_transition(self, input_symbol, state):
         """
         This returns (action, next state) given an input_symbol and state.
-        This does not modify the FSM state, so calling this method has no side
-        effects. Normally you do not call this method directly. It is called by
-        process().
 
         The sequence of steps to check for a defined transition goes from the
         most specific to the least specific.
@@ -162,17 +168,101 @@ class FSM(object):
 
         5. No transition was defined. If we get here then raise an exception.
         """
-        if self.state_transitions.has_key((input_symbol, state)):
-            return self.state_transitions[(input_symbol, state)]
-        elif self.state_transitions_catch.has_key(input_symbol):
-            return self.state_transitions_catch[input_symbol]
-        elif self.state_transitions_any.has_key(state):
-            return self.state_transitions_any[state]
-        elif self.default_transition is not None:
+        transition = self.state_transitions.get((input_symbol, state), None)
+        if transition is not None:
+            return transition
+        transition = self.state_transitions_catch.get(input_symbol, None)
+        if transition is not None:
+            return transition
+        transition = self.state_transitions_any.get(state, None)
+        if transition is not None:
+            return transition
+        if self.default_transition is not None:
             return self.default_transition
-        else:
-            raise ExceptionFSM('Transition is undefined: (%s, %s).' %
-                (str(input_symbol), str(state)) )
+        raise ExceptionFSM('Transition is undefined: (%s, %s).' %
+            (str(input_symbol), str(state)) )
+
+class FSM(object):
+    """This is a Finite State Machine (FSM).
+    """
+
+    def __init__(self, initial_state, memory=None, post_action=False, table=None, target=None):
+        """
+        This creates the FSM. You set the initial state here.
+        The "memory" attribute is any object.
+        The "table" is a TransitionTable, possibly frozen and shared with other
+        FSM instances. If None, the FSM gets a table of its own.
+        The "target" is any object the actions of a shared table act upon.
+        """
+
+        self.table = table if table is not None else TransitionTable()
+        self.target = target
+
+        self.input_symbol = None
+        self.initial_state = initial_state
+        self.current_state = self.initial_state
+        self.next_state = None
+        self.action = None
+        self.memory = memory
+        # If True, the action will be executed after the state change
+        self.post_action = post_action
+
+    def reset(self):
+        """
+        This sets the current_state to the initial_state and sets
+        input_symbol to None.
+        """
+
+        self.current_state = self.initial_state
+        self.input_symbol = None
+
+    def _own_table(self):
+        """
+        Copies a frozen (shared) table before this FSM adds transitions of its own
+        """
+        if self.table.frozen:
+            self.table = self.table.copy()
+        return self.table
+
+    def add_transition(self, input_symbol, state, action=None, next_state=None):
+        """
+        @see TransitionTable.add_transition
+        """
+        self._own_table().add_transition(input_symbol, state, action, next_state)
+
+    def add_transition_list(self, list_input_symbols, state, action=None, next_state=None):
+        """
+        @see TransitionTable.add_transition_list
+        """
+        self._own_table().add_transition_list(list_input_symbols, state, action, next_state)
+
+    def add_transition_catch(self, input_symbol, action=None, next_state=None):
+        """
+        @see TransitionTable.add_transition_catch
+        """
+        self._own_table().add_transition_catch(input_symbol, action, next_state)
+
+    def add_transition_any(self, state, action=None, next_state=None):
+        """
+        @see TransitionTable.add_transition_any
+        """
+        self._own_table().add_transition_any(state, action, next_state)
+
+    def set_default_transition(self, action, next_state):
+        """
+        @see TransitionTable.set_default_transition
+        """
+        self._own_table().set_default_transition(action, next_state)
+
+    def get_transition(self, input_symbol, state):
+        """
+        This returns (action, next state) given an input_symbol and state.
+        This does not modify the FSM state, so calling this method has no side
+        effects. Normally you do not call this method directly. It is called by
+        process().
+        @see TransitionTable.get_transition
+        """
+        return self.table.get_transition(input_symbol, state)
 
     def process(self, input_symbol):
         """
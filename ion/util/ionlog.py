@@ -58,6 +58,34 @@ def getLogger(loggername=__name__):
     """
     return log_factory.get_logger(loggername)
 
+class LazyValue(object):
+    """
+    A log message argument which is only computed when a handler formats the record. Use it for arguments
+    which are expensive to build:
+        log.info('Workbench state: %s', lazy(workbench.cache_info))
+    The logging module formats the message from its arguments only if the record is emitted, so plain arguments
+    should be passed to the logger rather than formatted into the message with %. Guard a block of several log
+    statements on a hot path with a single logger.isEnabledFor(level) check.
+    """
+    __slots__ = ('func', 'args', 'kwargs')
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+    def __repr__(self):
+        return repr(self.func(*self.args, **self.kwargs))
+
+def lazy(func, *args, **kwargs):
+    """
+    Wrap a call so that it is only made if the log message it is an argument to is emitted
+    """
+    return LazyValue(func, *args, **kwargs)
+
 class ProcessInfo:
     """
     Adds extra parameters to the Python logging loggers, for process identification.
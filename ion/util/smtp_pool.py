@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+"""
+@file ion/util/smtp_pool.py
+@brief A pool of SMTP client connections which sends queued email messages
+    concurrently over a bounded number of reused connections
+"""
+
+from collections import deque
+
+from twisted.internet import defer, reactor, protocol
+from twisted.mail.smtp import SMTPClient, SMTPConnectError, SMTPDeliveryError, SUCCESS, DNSNAME
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+
+class PooledMessage(object):
+    """
+    An email message waiting in a SMTPSenderPool
+    """
+    __slots__ = ('from_addr', 'to_addrs', 'data', 'deferred')
+
+    def __init__(self, from_addr, to_addrs, data, deferred):
+        self.from_addr = from_addr
+        self.to_addrs = to_addrs
+        self.data = data
+        self.deferred = deferred
+
+
+class PooledSMTPClient(SMTPClient):
+    """
+    One connection of a SMTPSenderPool. Sends the queued messages of the pool one
+    after the other, resetting the session between messages, and waits with the
+    connection open once the queue is empty.
+
+    Keeping a connection open between messages uses SMTPClient internals - _expected,
+    _failresponse and _disconnectFromServer - as they are in Twisted 10.2.0, the version
+    pinned in setup.py. Check them when Twisted is upgraded.
+    """
+
+    # Do not keep a log of the SMTP session
+    debug = False
+
+    def __init__(self, pool, identity):
+        SMTPClient.__init__(self, identity)
+        self.pool = pool
+        self.timeout = pool.timeout
+        # The message being sent
+        self.message = None
+        # True after the greeting and HELO were accepted
+        self.ready = False
+        # True while waiting for a message with the connection open
+        self.idle = False
+
+    def connectionMade(self):
+        # The SMTP commands are short writes each waiting for a reply - do not let them sit in the send buffer
+        if hasattr(self.transport, 'setTcpNoDelay'):
+            self.transport.setTcpNoDelay(True)
+        SMTPClient.connectionMade(self)
+
+    def smtpState_from(self, code, resp):
+        if not self.ready:
+            self.ready = True
+            self.pool._connection_ready(self)
+
+        self.message = self.pool._next_message()
+        if self.message is None:
+            self.idle = True
+            self.setTimeout(self.pool.idle_timeout)
+            # Anything the server says while idle (e.g. 421) ends the connection
+            self._expected = []
+            self._failresponse = self.smtpState_disconnect
+            self.pool._connection_idle(self)
+            return
+
+        # The base class keeps the accepted addresses of the previous message
+        self.successAddresses = []
+        SMTPClient.smtpState_from(self, code, resp)
+
+    def resume(self):
+        """
+        Sends the next queued message after having been idle
+        """
+        self.idle = False
+        self.setTimeout(self.timeout)
+        self.smtpState_from(250, None)
+
+    def getMailFrom(self):
+        return self.message.from_addr
+
+    def getMailTo(self):
+        return self.message.to_addrs
+
+    def getMailData(self):
+        return self.message.data
+
+    def sentMail(self, code, resp, numOk, addresses, log):
+        message, self.message = self.message, None
+        if numOk and code in SUCCESS:
+            self.pool.sent += 1
+            message.deferred.callback((numOk, addresses))
+        else:
+            self.pool.failed += 1
+            message.deferred.errback(SMTPDeliveryError(code, resp, log.str()))
+
+    def sendError(self, exc):
+        message, self.message = self.message, None
+        if message is not None:
+            self.pool.failed += 1
+            message.deferred.errback(exc)
+        # Disconnects - the pool opens a new connection for any queued messages
+        SMTPClient.sendError(self, exc)
+
+    def timeoutConnection(self):
+        if self.idle:
+            # Idle for too long - say goodbye and leave the pool
+            self.pool._connection_closing(self)
+            self.pool._close(self)
+        elif self.message is None and self.ready:
+            # No answer to RSET or QUIT - nothing is lost by dropping the connection
+            self.transport.loseConnection()
+        else:
+            SMTPClient.timeoutConnection(self)
+
+    def connectionLost(self, reason=protocol.connectionDone):
+        SMTPClient.connectionLost(self, reason)
+        message, self.message = self.message, None
+        if message is not None:
+            self.pool.failed += 1
+            message.deferred.errback(SMTPConnectError(-1, 'Connection lost: %s' % reason.getErrorMessage()))
+        self.pool._connection_lost(self)
+
+
+class SMTPSenderPoolFactory(protocol.ClientFactory):
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def buildProtocol(self, addr):
+        client = PooledSMTPClient(self.pool, self.pool.identity)
+        client.factory = self
+        return client
+
+    def clientConnectionFailed(self, connector, reason):
+        self.pool._connection_failed(reason)
+
+
+class SMTPSenderPool(object):
+    """
+    Sends email messages over at most max_connections concurrent SMTP connections
+    to one mail server. Connections are opened on demand, reused for the messages
+    queued while they are open and closed after idle_timeout seconds without a
+    message.
+    """
+
+    def __init__(self, host, port=25, max_connections=4, timeout=30, idle_timeout=30, identity=None, connect=None):
+        """
+        @param host the mail server
+        @param max_connections the maximum number of open connections
+        @param timeout seconds to wait for a response of the server
+        @param idle_timeout seconds to keep an unused connection open
+        @param identity the name to send with HELO - default is the name of this host
+        @param connect the function to open a connection - default is reactor.connectTCP
+        """
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.identity = identity or DNSNAME
+        self._connect = connect or reactor.connectTCP
+
+        self.factory = SMTPSenderPoolFactory(self)
+
+        # Messages waiting for a connection
+        self._queue = deque()
+        # Connections waiting for a message
+        self._idle = []
+        # Open and opening connections
+        self._connections = 0
+        # Opening connections, not yet ready to send
+        self._starting = 0
+
+        # Deferreds waiting for all connections to close after stop()
+        self._stopped = False
+        self._stop_deferreds = []
+
+        self.sent = 0
+        self.failed = 0
+
+    def send(self, from_addr, to_addrs, msg):
+        """
+        @brief Queues an email message
+        @param from_addr the envelope sender
+        @param to_addrs a list of recipient addresses, or one address as a string
+        @param msg the message, including headers, as a file or anything str() turns into the message
+        @retval Deferred, called back with (number of accepted addresses, addresses) as in
+            twisted.mail.smtp.sendmail, or with an error if the message was not sent
+        """
+        if isinstance(to_addrs, basestring):
+            to_addrs = [to_addrs]
+        if not hasattr(msg, 'read'):
+            msg = StringIO(str(msg))
+
+        d = defer.Deferred()
+        self._queue.append(PooledMessage(from_addr, to_addrs, msg, d))
+        self._dispatch()
+        return d
+
+    def stop(self):
+        """
+        @brief Closes the connections once they have sent the queued messages
+        @retval Deferred, called back when all connections are closed
+        """
+        self._stopped = True
+        idle, self._idle = self._idle, []
+        for client in idle:
+            self._close(client)
+
+        if self._connections == 0:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._stop_deferreds.append(d)
+        return d
+
+    def stats(self):
+        """
+        @retval dict of the number of queued messages, connections and sent/failed messages
+        """
+        return {'queued':len(self._queue),
+                'connections':self._connections,
+                'idle':len(self._idle),
+                'sent':self.sent,
+                'failed':self.failed}
+
+    def _dispatch(self):
+        # Hand queued messages to idle connections
+        while self._queue and self._idle:
+            self._idle.pop().resume()
+
+        # Open more connections for what is left, up to the limit
+        waiting = len(self._queue) - self._starting
+        while waiting > 0 and self._connections < self.max_connections:
+            self._connections += 1
+            self._starting += 1
+            waiting -= 1
+            self._connect(self.host, self.port, self.factory, self.timeout)
+
+    def _next_message(self):
+        if self._queue:
+            return self._queue.popleft()
+        return None
+
+    def _connection_ready(self, client):
+        self._starting -= 1
+
+    def _connection_idle(self, client):
+        if self._stopped:
+            self._close(client)
+        else:
+            self._idle.append(client)
+
+    def _close(self, client):
+        client.idle = False
+        client.setTimeout(client.timeout)
+        client._disconnectFromServer()
+
+    def _connection_closing(self, client):
+        if client in self._idle:
+            self._idle.remove(client)
+
+    def _connection_lost(self, client):
+        self._connection_closing(client)
+        self._connections -= 1
+        if not client.ready:
+            self._starting -= 1
+            if self._connections == 0:
+                # The server did not accept the connection
+                self._fail_queued(SMTPConnectError(-1, 'Connection to %s:%s refused by the server' % (self.host, self.port)))
+        self._dispatch()
+        self._check_stopped()
+
+    def _connection_failed(self, reason):
+        self._connections -= 1
+        self._starting -= 1
+        log.warn('SMTPSenderPool could not connect to %s:%s - %s', self.host, self.port, reason.getErrorMessage())
+        if self._connections == 0:
+            self._fail_queued(SMTPConnectError(-1, 'Unable to connect to %s:%s - %s' %
+                                               (self.host, self.port, reason.getErrorMessage())))
+        self._check_stopped()
+
+    def _check_stopped(self):
+        if self._connections == 0 and self._stop_deferreds:
+            stop_deferreds, self._stop_deferreds = self._stop_deferreds, []
+            for d in stop_deferreds:
+                d.callback(None)
+
+    def _fail_queued(self, exc):
+        queue, self._queue = self._queue, deque()
+        for message in queue:
+            self.failed += 1
+            message.deferred.errback(exc)
@@ -13,7 +13,7 @@ import traceback
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 
-from ion.util.fsm import FSM
+from ion.util.fsm import FSM, TransitionTable
 
 class Actionable(object):
     """
@@ -173,9 +173,29 @@ class StateObject(Actionable):
         assert self.__fsm, "FSM not set"
         return self.__fsm.current_state
 
+class TargetAction(object):
+    """
+    @brief An action of a shared transition table. Calls the action function of
+        the target of the FSM that processes the event, so that the same table
+        can drive the FSMs of many StateObjects.
+    """
+    __slots__ = ('action',)
+
+    def __init__(self, action):
+        self.action = action
+
+    def __call__(self, fsm):
+        return fsm.target._action(self.action, fsm)
+
+    def __repr__(self):
+        return "TargetAction(%s)" % self.action
+
 class FSMFactory(object):
     """
-    A factory for FSMs to be used in StateObjects
+    A factory for FSMs to be used in StateObjects.
+    Subclasses define their transitions in define_transitions(). The table is
+    built once per factory class, frozen and shared by all FSMs the factory
+    creates; each FSM only holds its own current state.
     """
 
     def _create_action_func(self, target, action):
@@ -186,16 +206,42 @@ class FSMFactory(object):
             return target(action, fsm)
         return action_target
 
+    def _create_shared_action(self, action):
+        """
+        @retval an action for a shared table, resolved against the target of the FSM
+        """
+        return TargetAction(action)
+
+    def define_transitions(self, table):
+        """
+        @brief Adds the transitions of this FSM type to the given table.
+            Use _create_shared_action() for the actions.
+        @param table a TransitionTable
+        """
+
+    def get_transition_table(self):
+        """
+        @retval the frozen TransitionTable shared by the FSMs of this factory class
+        """
+        cls = type(self)
+        table = cls.__dict__.get('_transition_table', None)
+        if table is None:
+            table = TransitionTable()
+            self.define_transitions(table)
+            table.freeze()
+            cls._transition_table = table
+        return table
+
     def create_fsm(self, target, memory=None):
         """
         @param a StateObject that is the
         @param memory a state vector. if None will be set to empty list
-        @retval basic FSM with initial state 'INIT' and no transitions, and an
-            empty list as state vector
+        @retval basic FSM with initial state 'INIT' and the shared transitions
+            of this factory, and an empty list as state vector
         """
         assert isinstance(target, Actionable)
         memory = memory or []
-        fsm = FSM('INIT', memory)
+        fsm = FSM('INIT', memory, table=self.get_transition_table(), target=target)
         return fsm
 
 class BasicStates(object):
@@ -233,30 +279,27 @@ class BasicFSMFactory(FSMFactory):
             return target("on_%s" % action, fsm)
         return action_target
 
-    def create_fsm(self, target, memory=None):
-        fsm = FSMFactory.create_fsm(self, target, memory)
-
-        actf = target._action
+    def _create_shared_action(self, action):
+        return TargetAction("on_%s" % action)
 
-        actionfct = self._create_action_func(actf, BasicStates.E_INITIALIZE)
-        fsm.add_transition(BasicStates.E_INITIALIZE, BasicStates.S_INIT, actionfct, BasicStates.S_READY)
+    def define_transitions(self, table):
+        actionfct = self._create_shared_action(BasicStates.E_INITIALIZE)
+        table.add_transition(BasicStates.E_INITIALIZE, BasicStates.S_INIT, actionfct, BasicStates.S_READY)
 
-        actionfct = self._create_action_func(actf, BasicStates.E_ACTIVATE)
-        fsm.add_transition(BasicStates.E_ACTIVATE, BasicStates.S_READY, actionfct, BasicStates.S_ACTIVE)
+        actionfct = self._create_shared_action(BasicStates.E_ACTIVATE)
+        table.add_transition(BasicStates.E_ACTIVATE, BasicStates.S_READY, actionfct, BasicStates.S_ACTIVE)
 
-        actionfct = self._create_action_func(actf, BasicStates.E_DEACTIVATE)
-        fsm.add_transition(BasicStates.E_DEACTIVATE, BasicStates.S_ACTIVE, actionfct, BasicStates.S_READY)
+        actionfct = self._create_shared_action(BasicStates.E_DEACTIVATE)
+        table.add_transition(BasicStates.E_DEACTIVATE, BasicStates.S_ACTIVE, actionfct, BasicStates.S_READY)
 
-        actionfct = self._create_action_func(actf, BasicStates.E_TERMINATE)
-        fsm.add_transition(BasicStates.E_TERMINATE, BasicStates.S_READY, actionfct, BasicStates.S_TERMINATED)
+        actionfct = self._create_shared_action(BasicStates.E_TERMINATE)
+        table.add_transition(BasicStates.E_TERMINATE, BasicStates.S_READY, actionfct, BasicStates.S_TERMINATED)
 
-        actionfct = self._create_action_func(actf, BasicStates.A_ACTIVE_TERMINATE)
-        fsm.add_transition(BasicStates.E_TERMINATE, BasicStates.S_ACTIVE, actionfct, BasicStates.S_TERMINATED)
+        actionfct = self._create_shared_action(BasicStates.A_ACTIVE_TERMINATE)
+        table.add_transition(BasicStates.E_TERMINATE, BasicStates.S_ACTIVE, actionfct, BasicStates.S_TERMINATED)
 
-        actionfct = self._create_action_func(actf, BasicStates.E_ERROR)
-        fsm.set_default_transition(actionfct, BasicStates.S_ERROR)
-
-        return fsm
+        actionfct = self._create_shared_action(BasicStates.E_ERROR)
+        table.set_default_transition(actionfct, BasicStates.S_ERROR)
 
 class BasicLifecycleObject(StateObject):
     """
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+@file ion/util/test/benchmark_ionlog.py
+@brief Benchmark the logging overhead of dispatching a message - eager string formatting against lazy log arguments
+@test Logging benchmark - not run as part of the unit tests
+"""
+
+import logging
+import time
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.trial import unittest
+
+
+class BenchmarkWorkbench(object):
+    """
+    Stands in for the workbench of a process - cache_info iterates every repository like the real one
+    """
+
+    def __init__(self, nrepos):
+        self._repos = dict([('repo_%d' % i, 'conv_%d' % (i % 3)) for i in range(nrepos)])
+
+    def cache_info(self):
+        convids = set()
+        for repo_key, convid in self._repos.iteritems():
+            convids.add(convid)
+        return 'Workbench Cache is holding %d repositories in %d conversations' % (len(self._repos), len(convids))
+
+    def __str__(self):
+        return '\n'.join(['%s: %s' % item for item in self._repos.iteritems()])
+
+
+class BenchmarkProcess(object):
+
+    proc_name = 'benchmark_process'
+
+    def __init__(self, nrepos):
+        self.workbench = BenchmarkWorkbench(nrepos)
+        self.context = dict([('key_%d' % i, 'value_%d' % i) for i in range(20)])
+
+    def __str__(self):
+        return 'Process(name=%s, context=%s)' % (self.proc_name, self.context)
+
+
+class NullHandler(logging.Handler):
+    """
+    Format the record like a real handler but discard the output
+    """
+
+    def emit(self, record):
+        self.format(record)
+
+
+class IonLogBenchmark(unittest.TestCase):
+
+    messages = 2000
+
+    repository_counts = [10, 100, 1000]
+
+    headers = ('get_object', 'sender_name', 'conv-id 1234', 'request', 'rpc')
+
+    def setUp(self):
+        self.bench_log = ion.util.ionlog.getLogger('ion.util.test.benchmark_ionlog.dispatch')
+        self.bench_log.propagate = False
+        self.handler = NullHandler()
+        self.bench_log.addHandler(self.handler)
+        self._level = self.bench_log.level
+
+    def tearDown(self):
+        self.bench_log.removeHandler(self.handler)
+        self.bench_log.setLevel(self._level)
+
+    def _dispatch_eager(self, process):
+        """
+        The log statements of one message through Receiver.receive, formatted before the level is checked
+        """
+        blog = self.bench_log
+        op, sender, convid, performative, protocol = self.headers
+        blog.info('Start Receiver.Receive on proc: %s' % str(process))
+        blog.info('Process "%s" Receiver Message Headers: OP - %s, Sender - %s, Convid - %s, Performative - %s, Protocol - %s' % (process.proc_name, op, sender, convid, performative, protocol))
+        blog.info('Setting RPC request workbench_context: %s, in Proc: %s ' % (convid, process))
+        blog.info('Receiver Context: %s' % str(process.context))
+        blog.debug("WORKBENCH STATE after incoming message is added:\n%s" % str(process.workbench))
+        blog.info('After Message Handler: Process "%s" Receiver Message Headers: OP - %s, Convid - %s, Performative - %s, Protocol - %s' % (process.proc_name, op, convid, performative, protocol))
+        blog.info('Receiver Context: %s' % str(process.context))
+        blog.info('Clearing RPC request workbench_context: %s, in Proc: %s ' % (convid, process))
+        blog.info(process.workbench.cache_info())
+        blog.info('End Receiver.Receive on proc: %s' % str(process))
+
+    def _dispatch_lazy(self, process):
+        """
+        The same log statements with the arguments passed to the logger
+        """
+        blog = self.bench_log
+        op, sender, convid, performative, protocol = self.headers
+        blog.info('Start Receiver.Receive on proc: %s', process)
+        blog.info('Process "%s" Receiver Message Headers: OP - %s, Sender - %s, Convid - %s, Performative - %s, Protocol - %s', process.proc_name, op, sender, convid, performative, protocol)
+        blog.info('Setting RPC request workbench_context: %s, in Proc: %s ', convid, process)
+        blog.info('Receiver Context: %s', process.context)
+        blog.debug("WORKBENCH STATE after incoming message is added:\n%s", process.workbench)
+        blog.info('After Message Handler: Process "%s" Receiver Message Headers: OP - %s, Convid - %s, Performative - %s, Protocol - %s', process.proc_name, op, convid, performative, protocol)
+        blog.info('Receiver Context: %s', process.context)
+        blog.info('Clearing RPC request workbench_context: %s, in Proc: %s ', convid, process)
+        blog.info('%s', ion.util.ionlog.lazy(process.workbench.cache_info))
+        blog.info('End Receiver.Receive on proc: %s', process)
+
+    def _time_dispatch(self, dispatch, process):
+        t1 = time.time()
+        for i in xrange(self.messages):
+            dispatch(process)
+        t2 = time.time()
+        return (t2 - t1) / self.messages
+
+    def test_dispatch_overhead(self):
+
+        results = []
+        for level_name, level in (('INFO', logging.INFO), ('WARN', logging.WARN)):
+            self.bench_log.setLevel(level)
+
+            for nrepos in self.repository_counts:
+                process = BenchmarkProcess(nrepos)
+
+                eager = self._time_dispatch(self._dispatch_eager, process)
+                lazy = self._time_dispatch(self._dispatch_lazy, process)
+
+                results.append((level_name, nrepos, eager * 1e6, lazy * 1e6))
+
+        output = '\nLevel | Repositories | Eager (us/message) | Lazy (us/message)\n'
+        for result in results:
+            output += '%5s | %12d | %18.2f | %17.2f\n' % result
+
+        log.info(output)
+
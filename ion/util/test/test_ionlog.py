@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+@file ion/util/test/test_ionlog.py
+@brief Test the lazy log message arguments
+"""
+
+import logging
+
+from twisted.trial import unittest
+
+from ion.util import ionlog
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class LazyLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        self.handler = RecordingHandler()
+        self.log = ionlog.getLogger('ion.util.test.test_ionlog.lazy')
+        self.log.propagate = False
+        self.log.addHandler(self.handler)
+
+    def tearDown(self):
+        self.log.removeHandler(self.handler)
+        self.log.setLevel(logging.NOTSET)
+
+    def _expensive(self, value):
+        self.calls += 1
+        return 'computed %s' % value
+
+    def test_lazy_not_emitted(self):
+        self.log.setLevel(logging.WARN)
+
+        self.log.info('Value: %s', ionlog.lazy(self._expensive, 1))
+
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(self.handler.messages, [])
+
+    def test_lazy_emitted(self):
+        self.log.setLevel(logging.INFO)
+
+        self.log.info('Value: %s', ionlog.lazy(self._expensive, 1))
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.handler.messages, ['Value: computed 1'])
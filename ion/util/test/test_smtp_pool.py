@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""
+@file ion/util/test/test_smtp_pool.py
+@brief Tests for the SMTP sender pool against a local SMTP server
+"""
+
+from zope.interface import implements
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor
+from twisted.mail import smtp
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from ion.util.smtp_pool import SMTPSenderPool
+
+
+class LocalMessage(object):
+    implements(smtp.IMessage)
+
+    def __init__(self, server, recipient):
+        self.server = server
+        self.recipient = recipient
+        self.lines = []
+
+    def lineReceived(self, line):
+        self.lines.append(line)
+
+    def eomReceived(self):
+        self.server.messages.append((str(self.recipient.dest), '\n'.join(self.lines)))
+        return defer.succeed(None)
+
+    def connectionLost(self):
+        self.lines = None
+
+
+class LocalDelivery(object):
+    """
+    Accepts every recipient except those with the local part 'bad'
+    """
+    implements(smtp.IMessageDelivery)
+
+    def __init__(self, server):
+        self.server = server
+
+    def receivedHeader(self, helo, origin, recipients):
+        return 'Received: by the local SMTP server'
+
+    def validateFrom(self, helo, origin):
+        return origin
+
+    def validateTo(self, user):
+        if user.dest.local == 'bad':
+            raise smtp.SMTPBadRcpt(user)
+        return lambda: LocalMessage(self.server, user)
+
+
+class LocalSMTP(smtp.SMTP):
+
+    def connectionMade(self):
+        self.factory.server.connections += 1
+        smtp.SMTP.connectionMade(self)
+
+
+class LocalSMTPFactory(smtp.SMTPFactory):
+    protocol = LocalSMTP
+
+    def __init__(self, server):
+        smtp.SMTPFactory.__init__(self)
+        self.server = server
+
+    def buildProtocol(self, addr):
+        p = smtp.SMTPFactory.buildProtocol(self, addr)
+        p.delivery = LocalDelivery(self.server)
+        return p
+
+
+class LocalSMTPServer(object):
+    """
+    A SMTP server on a free local port which keeps the messages it receives
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        self.port = reactor.listenTCP(0, LocalSMTPFactory(self), interface='127.0.0.1')
+        self.portnum = self.port.getHost().port
+
+    def stop(self):
+        return self.port.stopListening()
+
+
+class SMTPSenderPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalSMTPServer()
+        self.pool = SMTPSenderPool('127.0.0.1', self.server.portnum, max_connections=2, timeout=5)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.pool.stop()
+        yield self.server.stop()
+
+    @defer.inlineCallbacks
+    def test_send(self):
+        results = yield defer.gatherResults([
+            self.pool.send('alerts@example.org', 'user%d@example.org' % i, 'Subject: test %d\n\nbody %d' % (i, i))
+            for i in range(10)])
+
+        self.assertEqual([numOk for numOk, addresses in results], [1] * 10)
+        self.assertEqual(len(self.server.messages), 10)
+        self.assertEqual(sorted([to for to, msg in self.server.messages]),
+                         sorted(['user%d@example.org' % i for i in range(10)]))
+
+        # Ten messages over two connections, which stay open for the next ones
+        self.assertEqual(self.server.connections, 2)
+
+        yield self.pool.send('alerts@example.org', ['user@example.org'], 'Subject: again\n\nbody')
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(self.pool.stats()['sent'], 11)
+
+    @defer.inlineCallbacks
+    def test_refused_recipient(self):
+        d_bad = self.pool.send('alerts@example.org', 'bad@example.org', 'Subject: bad\n\nbody')
+        d_good = self.pool.send('alerts@example.org', 'good@example.org', 'Subject: good\n\nbody')
+
+        yield self.failUnlessFailure(d_bad, smtp.SMTPDeliveryError)
+        yield d_good
+
+        self.assertEqual([to for to, msg in self.server.messages], ['good@example.org'])
+        self.assertEqual(self.pool.stats()['failed'], 1)
+
+    @defer.inlineCallbacks
+    def test_connect_failure(self):
+        yield self.server.stop()
+        pool = SMTPSenderPool('127.0.0.1', self.server.portnum, max_connections=2, timeout=5)
+
+        d1 = pool.send('alerts@example.org', 'user1@example.org', 'Subject: test\n\nbody')
+        d2 = pool.send('alerts@example.org', 'user2@example.org', 'Subject: test\n\nbody')
+
+        yield self.failUnlessFailure(d1, smtp.SMTPConnectError)
+        yield self.failUnlessFailure(d2, smtp.SMTPConnectError)
+        self.assertEqual(pool.stats()['connections'], 0)
+        yield pool.stop()
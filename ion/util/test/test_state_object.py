@@ -14,6 +14,7 @@ import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 
 from ion.util.state_object import StateObject, BasicLifecycleObject, BasicFSMFactory, BasicStates
+from ion.util.fsm import ExceptionFSM
 from ion.test.iontest import IonTestCase
 import ion.util.procutils as pu
 
@@ -233,6 +234,31 @@ class StateObjectTest(IonTestCase):
         # make sure the current state of the object is still ACTIVE
         self.assertEqual(so._get_state(), BasicStates.S_ACTIVE)
 
+    def test_SO_shared_table(self):
+        so1 = TestSO()
+        so2 = TestSO()
+        fsm1 = so1._StateObject__fsm
+        fsm2 = so2._StateObject__fsm
+
+        # One frozen transition table for all FSMs of the factory, one state each
+        self.assertIdentical(fsm1.table, fsm2.table)
+        self.assertTrue(fsm1.table.frozen)
+        self.assertRaises(ExceptionFSM, fsm1.table.add_transition, 'go', BasicStates.S_INIT)
+
+        so1.initialize()
+        so1.activate()
+        self.assertEqual(so1._get_state(), BasicStates.S_ACTIVE)
+        self.assertEqual(so2._get_state(), BasicStates.S_INIT)
+        self._assertCounts(so1, 1, 1, 0, 0, 0)
+        self._assertCounts(so2, 0, 0, 0, 0, 0)
+
+        # Adding a transition to one FSM copies the table for that FSM only
+        fsm2.add_transition('go', BasicStates.S_INIT, None, BasicStates.S_READY)
+        self.assertNotIdentical(fsm1.table, fsm2.table)
+        so2._so_process('go')
+        self.assertEqual(so2._get_state(), BasicStates.S_READY)
+        self.assertEqual(fsm1.get_transition('go', BasicStates.S_INIT)[1], BasicStates.S_ERROR)
+
 
     def _assertCounts(self, so, init, act, deact, term, error, errerr=0):
         self.assertEqual(so.cnt_init, init)